@@ -3,6 +3,8 @@ from sqlmodel import Session, select
 from backend.modelos import Empresa, ConfiguracionEmpresa, AfipCredencial, Usuario, Rol
 from backend.database import get_db
 from backend.security import obtener_usuario_actual, get_password_hash
+from backend.utils import tenant_context
+from backend.utils.afipTools import invalidar_cache_credenciales_afip
 from typing import List, Optional
 from pydantic import BaseModel
 
@@ -99,6 +101,8 @@ def crear_empresa(
     db.add(nuevo_usuario)
     db.commit()
 
+    # Descarta CUITs cacheados como "sin empresa"
+    tenant_context.invalidar(nueva_empresa.id)
     return nueva_empresa
 
 # --- Endpoint: Listar empresas ---
@@ -217,6 +221,9 @@ def editar_empresa(
     
     db.commit()
     db.refresh(empresa)
+    # Puede haber cambiado el CUIT o el material: limpiar todo el cache
+    invalidar_cache_credenciales_afip()
+    tenant_context.invalidar(empresa.id)
     return empresa
 
 # --- Endpoint: Editar configuración de empresa ---
@@ -240,6 +247,8 @@ def editar_configuracion_empresa(
         setattr(conf, k, v)
     db.commit()
     db.refresh(conf)
+    invalidar_cache_credenciales_afip()
+    tenant_context.invalidar(empresa_id)
     return conf
 
 # --- Endpoint: Subir/cambiar certificado AFIP ---
@@ -286,6 +295,7 @@ def subir_certificado_afip(
         conf.cuit = cuit_emisor
 
     db.commit()
+    invalidar_cache_credenciales_afip(cuit_emisor)
     return {"ok": True}
 
 # --- Endpoint: Ver logs administrativos (placeholder) ---
@@ -10,6 +10,7 @@ from backend.utils.afip_tools_manager import (
     listar_certificados_disponibles,
     procesar_archivo_certificado_completo
 )
+from backend.utils.afipTools import invalidar_cache_credenciales_afip
 
 # Prefijo interno /afip: en main se monta como /api/afip y también en raíz /afip
 # (nginx que quita /api debe seguir resolviendo las mismas rutas).
@@ -73,6 +74,7 @@ async def subir_certificado_endpoint(request: SubirCertificadoRequest):
             cuit=request.cuit,
             certificado_pem=request.certificado_pem
         )
+        invalidar_cache_credenciales_afip(request.cuit)
         return resultado
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -90,6 +92,7 @@ async def procesar_archivo_completo_endpoint(request: SubirArchivoCompletoReques
             cuit=request.cuit,
             archivo_contenido=request.archivo_contenido
         )
+        invalidar_cache_credenciales_afip(request.cuit)
         return resultado
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -250,6 +253,8 @@ async def configurar_emisor_endpoint(request: ConfiguracionEmisorRequest, db: Se
                         )
                         db.add(config)
                     db.commit()
+                    from backend.utils import tenant_context
+                    tenant_context.invalidar(empresa.id)
             else:
                 resultado['persistido_bd'] = False
                 resultado['motivo_no_bd'] = 'Empresa con ese CUIT no encontrada en tabla empresas'
@@ -353,6 +358,7 @@ async def crear_credencial(data: AfipCredencialCreate, db: Session = Depends(get
         notas=data.notas
     )
     db.add(cred); db.commit(); db.refresh(cred)
+    invalidar_cache_credenciales_afip(cuit)
     return cred
 
 @router.get("/credenciales", response_model=List[dict], summary="Listar credenciales registradas")
@@ -415,6 +421,7 @@ async def actualizar_credencial(cuit: str, data: AfipCredencialUpdate, db: Sessi
         row.notas = data.notas; changed = True
     if changed:
         db.add(row); db.commit(); db.refresh(row)
+        invalidar_cache_credenciales_afip(row.cuit)
     return row
 
 @router.delete("/credenciales/{cuit}")
@@ -423,9 +430,17 @@ async def borrar_credencial(cuit: str, db: Session = Depends(get_db)):
     if not row:
         raise HTTPException(status_code=404, detail="No encontrada")
     db.delete(row); db.commit()
+    invalidar_cache_credenciales_afip(cuit)
     return {"detail": "eliminada"}
 
 
+@router.get("/microservicio/metricas", summary="Métricas del pool HTTP hacia el microservicio de facturación")
+async def metricas_microservicio():
+    """Conexiones abiertas vs requests servidos (handshakes ahorrados), latencias y timeouts vigentes."""
+    from backend.utils.microservicio_client import get_microservicio_client
+    return get_microservicio_client().metricas()
+
+
 @router.get("/prueba-factura-1peso")
 async def prueba_factura_un_peso(emisor_cuit: str | None = None, tipo_forzado: int | None = None, mock: bool = False):
     """Emite (o simula) un comprobante de prueba por 1.00.
@@ -435,8 +450,9 @@ async def prueba_factura_un_peso(emisor_cuit: str | None = None, tipo_forzado: i
       tipo_forzado: 1=A,6=B,11=C (opcional)
       mock: si true, no llama al microservicio y devuelve factura simulada.
     """
-    from backend.utils.afipTools import generar_factura_para_venta, preflight_afip_credentials, ReceptorData
-    pre = preflight_afip_credentials(emisor_cuit)
+    from backend.utils.afipTools import agenerar_factura_para_venta, preflight_afip_credentials, ReceptorData
+    from backend.utils.pool_bloqueante import en_hilo
+    pre = await en_hilo(preflight_afip_credentials, emisor_cuit)
     receptor = ReceptorData(cuit_o_dni='0', condicion_iva='CONSUMIDOR_FINAL', nombre_razon_social='TEST CONSUMIDOR FINAL', domicilio='S/D')
     simulated = False
     if mock:
@@ -474,7 +490,7 @@ async def prueba_factura_un_peso(emisor_cuit: str | None = None, tipo_forzado: i
         }
     else:
         try:
-            res = generar_factura_para_venta(total=1.0, cliente_data=receptor, emisor_cuit=emisor_cuit, tipo_forzado=tipo_forzado)
+            res = await agenerar_factura_para_venta(total=1.0, cliente_data=receptor, emisor_cuit=emisor_cuit, tipo_forzado=tipo_forzado)
             if res is None:
                 raise ValueError("El servicio de facturación devolvió None")
         except Exception as e:
@@ -617,6 +633,7 @@ async def diagnostico_credencial(cuit: str, update_db: bool = False, fix_escape:
             row.fingerprint_cert = hashlib.sha1(sane_cert.encode()).hexdigest()
             row.fingerprint_key = hashlib.sha1(sane_key.encode()).hexdigest()
             db.add(row); db.commit(); db.refresh(row)
+            invalidar_cache_credenciales_afip(row.cuit)
             updated = True
         return {
             'cuit': cuit,
@@ -6,7 +6,7 @@ from pydantic import BaseModel
 import logging
 
 from backend.database import get_db
-from backend.modelos import Usuario, Rol, Empresa, ConfiguracionEmpresa
+from backend.modelos import Usuario, Rol
 from backend import config
 from backend.security import (
     crear_access_token,
@@ -14,6 +14,7 @@ from backend.security import (
     verificar_password,
     obtener_usuario_actual,
 )
+from backend.utils import tenant_context
 
 router = APIRouter(prefix="/auth", tags=["Autenticación y Autorización"])
 
@@ -107,27 +108,17 @@ async def login_for_access_token(
 
 @router.get("/me", response_model=UserMeResponse, summary="Información del usuario autenticado")
 def obtener_usuario_me(user: Usuario = Depends(obtener_usuario_actual), db: Session = Depends(get_db)):
-    empresa = None
-    if user.id_empresa:
-        empresa = db.exec(select(Empresa).where(Empresa.id == user.id_empresa)).first()
-    # Cargar rol
-    rol = db.exec(select(Rol).where(Rol.id == user.id_rol)).first() if user.id_rol else None
-    desglose_77 = False
-    if user.id_empresa:
-        cfg = db.exec(
-            select(ConfiguracionEmpresa).where(ConfiguracionEmpresa.id_empresa == user.id_empresa)
-        ).first()
-        if cfg:
-            desglose_77 = bool(cfg.aplicar_desglose_77)
+    ctx = tenant_context.obtener_contexto(user.id_empresa, db) if user.id_empresa else None
+    rol = user.rol
     return UserMeResponse(
         id=user.id,
         username=user.nombre_usuario,
         role=rol.nombre if rol else "?",
         id_empresa=user.id_empresa,
-        empresa_cuit=empresa.cuit if empresa else None,
-        empresa_nombre=empresa.nombre_legal if empresa else None,
+        empresa_cuit=ctx.cuit if ctx else None,
+        empresa_nombre=ctx.nombre_legal if ctx else None,
         activo=user.activo,
-        aplicar_desglose_77=desglose_77,
+        aplicar_desglose_77=ctx.aplicar_desglose_77 if ctx else False,
     )
 
 @router.post("/logout")
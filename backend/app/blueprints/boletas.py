@@ -1,30 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, Response, Request, Query
-from datetime import datetime
+from datetime import date, datetime
 from typing import Any, Dict, List, Optional, DefaultDict, Set
 from pydantic import BaseModel
 from backend.security import obtener_usuario_actual  # migrado desde sqlite_security
 from backend.utils.mysql_handler import get_db_connection
 from backend.utils.tablasHandler import TablasHandler
 from thefuzz import fuzz  # type: ignore
+import asyncio
 import json
 import html as _html
-from backend.utils.billige_manage import process_invoice_batch_for_endpoint
+from backend.utils.billige_manage import procesar_lote_facturas
 import os
 import logging
-from io import BytesIO
+from contextlib import contextmanager
 from backend.utils import afip_tools_manager  # nuevo para debug credenciales
 from backend.utils.receptor_fields import extraer_receptor_fields
 from backend.utils.afipTools import _resolve_afip_credentials, preflight_afip_credentials  # type: ignore
 from backend.utils.afipTools import generar_factura_para_venta, ReceptorData  # para test de contrato
-from backend.modelos import ConfiguracionEmpresa, Empresa, Usuario
-try:
-    from weasyprint import HTML  # type: ignore
-    from PIL import Image  # type: ignore
-except Exception:
-    HTML = None  # type: ignore
-    Image = None  # type: ignore
+from backend.modelos import Usuario
+from backend.utils.ticket_render import formatear_numero, html_ticket, motor_activo, render_ticket
 
-import locale
 
 logger = logging.getLogger(__name__)
 
@@ -53,159 +48,104 @@ def _get_username(user) -> str:
 
 def _get_handler_for_user(user) -> TablasHandler:
     """Obtiene el handler de boletas para la empresa del usuario."""
-    from backend.database import get_db
-    from sqlmodel import select
-    
     try:
-        db = next(get_db())
-        # Obtener la configuración de la empresa del usuario
-        configuracion = db.exec(
-            select(ConfiguracionEmpresa).where(ConfiguracionEmpresa.id_empresa == user.id_empresa)
-        ).first()
-        
-        # Extraer el ID del Google Sheet del enlace (si es un enlace completo)
-        google_sheet_id = None
-        if configuracion and configuracion.link_google_sheets:
-            link = configuracion.link_google_sheets.strip()
-            # Si es un enlace completo, extraer el ID
-            if '/d/' in link and '/edit' in link:
-                google_sheet_id = link.split('/d/')[1].split('/')[0]
-            else:
-                # Asumir que es directamente el ID
-                google_sheet_id = link
-        
-        return TablasHandler(google_sheet_id=google_sheet_id)
+        ctx = tenant_context.obtener_contexto(user.id_empresa)
+        return TablasHandler(google_sheet_id=ctx.google_sheet_id if ctx else None)
     except Exception as e:
-        print(f"Error obteniendo handler para usuario {user.nombre_usuario}: {e}")
+        logger.warning(f"Error obteniendo handler para usuario {user.nombre_usuario}: {e}")
         # Fallback al handler global
         return TablasHandler()
 
-from backend.app.blueprints.sheets_boletas import _sync_sheets_to_db
+from backend.app.blueprints.sheets_boletas import _resolver_google_sheet_id, _contar_boletas_empresa
+from backend.utils.sheets_sync_scheduler import sincronizar_y_esperar
+from backend.utils.pool_bloqueante import en_hilo
+from backend.utils import facturas_listado, ingresos_espejo, render_cache, tenant_context
+
+
+@contextmanager
+def _sesion_espejo(user):
+    """Sesión de BD para leer boletas del espejo ingresos_sheets de la empresa del usuario.
+
+    Los listados ya no descargan INGRESOS en cada request: leen el espejo (ver
+    utils/ingresos_espejo.py), que se mantiene con delta-syncs programados con cooldown.
+    """
+    from backend.database import SessionLocal
+    db = SessionLocal()
+    try:
+        ingresos_espejo.asegurar_espejo(db, user.id_empresa, _resolver_google_sheet_id(db, user))
+        yield db
+    finally:
+        db.close()
+
+
+def _filtro_repartidor(username: str):
+    """Predicado: la boleta es del repartidor asociado al usuario (fuzzy > 80 o igualdad)."""
+    username_l = username.lower()
+
+    def _es_del_usuario(bo: Dict[str, Any]) -> bool:
+        repartidor = (bo.get('Repartidor') or bo.get('repartidor') or '')
+        if not repartidor:
+            return False
+        try:
+            ratio = fuzz.token_set_ratio(username, repartidor)
+        except Exception:
+            ratio = 0
+        return ratio > 80 or repartidor.strip().lower() == username_l
+    return _es_del_usuario
+
 
 @router.post("/sincronizar-sheets")
 async def sincronizar_boletas_endpoint(usuario_actual = Depends(obtener_usuario_actual)):
     """
-    Fuerza actualización síncrona DB <-> Sheets.
+    Fuerza actualización DB <-> Sheets de la empresa del usuario.
     Endpoint espejo de /sheets/sincronizar para evitar problemas de enrutamiento 404.
     """
     try:
-        # Ejecutar sync en el hilo principal (bloqueante pero seguro)
-        _sync_sheets_to_db()
-        
-        # Contar total para devolver feedback
         from backend.database import SessionLocal
-        from backend.modelos import IngresoSheets
         db = SessionLocal()
-        total = db.query(IngresoSheets).count()
-        db.close()
+        try:
+            google_sheet_id = await en_hilo(_resolver_google_sheet_id, db, usuario_actual)
+            resultado = await sincronizar_y_esperar(usuario_actual.id_empresa, google_sheet_id)
+            if resultado.get("estado") == "ERROR":
+                raise HTTPException(status_code=500, detail=f"Error sincronizando: {resultado.get('error') or resultado.get('detalle')}")
+            # Contar total para devolver feedback
+            total = await en_hilo(_contar_boletas_empresa, db, usuario_actual.id_empresa)
+        finally:
+            await en_hilo(db.close)
         
         return {
             "success": True,
             "message": "Sincronización exitosa con Base de Datos (vía boletas)",
             "total_boletas": total,
+            "resultado": resultado,
             "timestamp": str(datetime.now())
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sincronizando: {str(e)}")
 
 @router.get("")
-async def obtener_boletas_tipo(request: Request, tipo: Optional[str] = None, skip: int = 0, limit: int = 20, ver_todas: bool = False, usuario_actual = Depends(obtener_usuario_actual)):
+def obtener_boletas_tipo(request: Request, tipo: Optional[str] = None, skip: int = 0, limit: int = 20, ver_todas: bool = False, cursor: Optional[int] = None, usuario_actual = Depends(obtener_usuario_actual)):
     """
     Endpoint universal para /boletas?tipo=... que redirige a la lógica correspondiente.
     """
     try:
         if tipo == "facturadas":
-            # Usar la función existente para facturadas
-            conn = None
-            cursor = None
-            try:
-                # Obtener CUIT de la empresa del usuario
-                from backend.database import SessionLocal
-                from backend.modelos import Empresa
-                
-                db = SessionLocal()
-                cuit_empresa = None
-                try:
-                    empresa = db.get(Empresa, usuario_actual.id_empresa)
-                    if empresa:
-                        cuit_empresa = empresa.cuit
-                finally:
-                    db.close()
-
-                conn = get_db_connection()
-                if not conn:
-                    raise HTTPException(status_code=503, detail="No se pudo establecer conexión con la base de datos.")
-                cursor = conn.cursor(dictionary=True)
-                
-                # Filtrar por CUIT de la empresa
-                query = """
-                    SELECT * 
-                    FROM facturas_electronicas 
-                    WHERE cuit_emisor = %s
-                    ORDER BY id DESC 
-                    LIMIT %s OFFSET %s
-                """
-                cursor.execute(query, (cuit_empresa, limit, skip))
-                facturas_guardadas = cursor.fetchall()
-                return facturas_guardadas
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al consultar la base de datos: {e}")
-            finally:
-                if conn and conn.is_connected():
-                    if cursor is not None:
-                        try:
-                            cursor.close()
-                        except Exception:
-                            pass
-                    conn.close()
+            # Proyección liviana (sin raw_response); `cursor` activa la paginación keyset
+            return _listar_facturadas(usuario_actual, skip=skip, limit=limit, cursor=cursor)["items"]
         elif tipo == "no-facturadas":
-            handler = _get_handler_for_user(usuario_actual)
-            todas_las_boletas = handler.cargar_ingresos()
-            # Filtrar por estado 'falta facturar' (tolerante a mayúsculas / espacios)
-            boletas_filtradas = []
-            for bo in todas_las_boletas:
-                estado_fact = str(bo.get("facturacion", "")).strip().lower()
-                if estado_fact == "falta facturar" or (
-                    "falta" in estado_fact and "facturar" in estado_fact
-                ):
-                    boletas_filtradas.append(bo)
-
-            def _fecha_key(b: Dict[str, Any]) -> int:
-                try:
-                    raw = str(b.get('Fecha') or b.get('fecha') or b.get('FECHA') or '')
-                    base = raw.strip().split(' ')[0].split('T')[0]
-                    if base and len(base) == 10 and base[4] == '-' and base[7] == '-':
-                        from datetime import datetime as _dt
-                        return int(_dt.strptime(base, '%Y-%m-%d').strftime('%Y%m%d'))
-                    if base and len(base) == 10 and base[2] == '/' and base[5] == '/':
-                        from datetime import datetime as _dt
-                        return int(_dt.strptime(base, '%d/%m/%Y').strftime('%Y%m%d'))
-                except Exception:
-                    return 0
-                return 0
-            boletas_filtradas.sort(key=_fecha_key, reverse=True)
-
+            # Espejo ingresos_sheets: filtro por estado y orden por fecha en SQL
+            filtro = None
             if not _is_admin(usuario_actual) and not ver_todas:
                 username = _get_username(usuario_actual)
                 if username:
-                    username_l = username.lower()
-                    resultado = []
-                    for bo in boletas_filtradas:
-                        repartidor = (bo.get('Repartidor') or bo.get('repartidor') or '')
-                        if not repartidor:
-                            continue
-                        try:
-                            ratio = 0
-                            try:
-                                ratio = fuzz.token_set_ratio(username, repartidor)
-                            except Exception:
-                                ratio = 0
-                            if ratio > 80 or repartidor.strip().lower() == username_l:
-                                resultado.append(bo)
-                        except Exception:
-                            continue
-                    return resultado[skip: skip + limit]
-            return boletas_filtradas[skip: skip + limit]
+                    filtro = _filtro_repartidor(username)
+            with _sesion_espejo(usuario_actual) as db:
+                return ingresos_espejo.listar_boletas(
+                    db, usuario_actual.id_empresa, solo_no_facturadas=True, ordenar_por_fecha=True,
+                    skip=skip, limit=limit, filtro=filtro,
+                )
         else:
             # Si no se reconoce el tipo, devolver error
             raise HTTPException(status_code=400, detail="Parámetro 'tipo' inválido o no soportado.")
@@ -213,12 +153,11 @@ async def obtener_boletas_tipo(request: Request, tipo: Optional[str] = None, ski
         raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al obtener boletas: {e}")
 
 @router.get("/obtener-todas", response_model=List[Dict[str, Any]])
-def traer_todas_las_boletas(skip: int = 0, limit: int = 20):
+def traer_todas_las_boletas(skip: int = 0, limit: int = 20, usuario_actual = Depends(obtener_usuario_actual)):
 
     try:
-        todas_las_boletas = handler.cargar_ingresos()
-
-        return todas_las_boletas[skip : skip + limit]
+        with _sesion_espejo(usuario_actual) as db:
+            return ingresos_espejo.listar_boletas(db, usuario_actual.id_empresa, skip=skip, limit=limit)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al cargar todas las boletas: {e}")
@@ -236,93 +175,76 @@ def traer_boletas_no_facturadas(
     por repartidor asociado al usuario (fuzzy match o comparación case-insensitive).
     """
     try:
-        handler = _get_handler_for_user(usuario_actual)
-        todas_las_boletas = handler.cargar_ingresos()
-        boletas_filtradas = []
-        for bo in todas_las_boletas:
-            estado_fact = str(bo.get("facturacion", "")).strip().lower()
-            if estado_fact == "falta facturar" or ("falta" in estado_fact and "facturar" in estado_fact):
-                boletas_filtradas.append(bo)
-
+        filtro = None
         if not _is_admin(usuario_actual) and not ver_todas:
             username = _get_username(usuario_actual)
             if username:
-                username_l = username.lower()
-                resultado = []
-                for bo in boletas_filtradas:
-                    repartidor = (bo.get('Repartidor') or bo.get('repartidor') or '')
-                    if not repartidor:
-                        continue
-                    try:
-                        ratio = 0
-                        try:
-                            ratio = fuzz.token_set_ratio(username, repartidor)
-                        except Exception:
-                            ratio = 0
-                        if ratio > 80 or repartidor.strip().lower() == username_l:
-                            resultado.append(bo)
-                    except Exception:
-                        continue
-                return resultado[skip: skip + limit]
-
-        return boletas_filtradas[skip : skip + limit]
+                filtro = _filtro_repartidor(username)
+        with _sesion_espejo(usuario_actual) as db:
+            return ingresos_espejo.listar_boletas(
+                db, usuario_actual.id_empresa, solo_no_facturadas=True, skip=skip, limit=limit, filtro=filtro
+            )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al cargar boletas no facturadas: {e}")
 
 
+def _cuit_empresa(usuario) -> Optional[str]:
+    ctx = tenant_context.obtener_contexto(usuario.id_empresa)
+    return ctx.cuit if ctx else None
+
+
+def _listar_facturadas(usuario, **kwargs) -> Dict[str, Any]:
+    """Página de facturas emitidas con el CUIT de la empresa del usuario (ver utils/facturas_listado).
+
+    Lee de la réplica si hay una configurada (DB_REPLICA_HOST).
+    """
+    from backend.database import SessionLectura
+    cuit_empresa = _cuit_empresa(usuario)
+    if not cuit_empresa:
+        logger.warning(
+            f"Usuario {usuario.nombre_usuario} (Empresa {usuario.id_empresa}) no tiene CUIT configurado."
+        )
+        return {"items": [], "siguiente_cursor": None, "limit": kwargs.get("limit")}
+    with SessionLectura() as db:
+        return facturas_listado.listar_facturas(db, cuit_empresa, **kwargs)
+
+
+@router.get("/facturadas")
+def listar_facturadas(
+    limit: int = Query(50, ge=1, le=facturas_listado.LIMITE_MAXIMO),
+    cursor: Optional[int] = Query(None, description="siguiente_cursor de la página anterior"),
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    tipo_comprobante: Optional[int] = None,
+    anulada: Optional[bool] = None,
+    usuario_actual: Usuario = Depends(obtener_usuario_actual)
+):
+    """Facturas emitidas, paginadas por cursor y sin raw_response.
+
+    Devuelve {items, siguiente_cursor, limit}; siguiente_cursor es null en la última página.
+    """
+    try:
+        return _listar_facturadas(
+            usuario_actual, limit=limit, cursor=cursor, fecha_desde=fecha_desde,
+            fecha_hasta=fecha_hasta, tipo_comprobante=tipo_comprobante, anulada=anulada,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al consultar la base de datos: {e}")
+
+
 @router.get("/obtener-facturadas", response_model=List[Dict[str, Any]])
 def traer_boletas_facturadas_desde_db(
     skip: int = 0, 
     limit: int = 20,
+    cursor: Optional[int] = None,
     usuario_actual: Usuario = Depends(obtener_usuario_actual)
 ):
-
-    conn = None
-    cursor = None
     try:
-        cuit_empresa = None
-        from backend.database import SessionLocal
-        with SessionLocal() as db_session:
-            empresa = db_session.get(Empresa, usuario_actual.id_empresa)
-            if empresa:
-                cuit_empresa = empresa.cuit
-
-        if not cuit_empresa:
-            logger.warning(
-                f"Usuario {usuario_actual.nombre_usuario} (Empresa {usuario_actual.id_empresa}) no tiene CUIT configurado."
-            )
-            return []
-
-        conn = get_db_connection()
-        if not conn:
-            raise HTTPException(status_code=503, detail="No se pudo establecer conexión con la base de datos.")
-        cursor = conn.cursor(dictionary=True)
-
-        query = """
-            SELECT * 
-            FROM facturas_electronicas 
-            WHERE cuit_emisor = %s
-            ORDER BY id DESC 
-            LIMIT %s OFFSET %s
-        """
-
-        cursor.execute(query, (cuit_empresa, limit, skip))
-        facturas_guardadas = cursor.fetchall()
-        return facturas_guardadas
-
+        return _listar_facturadas(usuario_actual, skip=skip, limit=limit, cursor=cursor)["items"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al consultar la base de datos: {e}")
 
-    finally:
-        if conn and conn.is_connected():
-            if cursor is not None:
-                try:
-                    cursor.close()
-                except Exception:
-                    pass
-            conn.close()
-
 
 @router.get("/obtener-por-repartidor", response_model=List[Dict[str, Any]])
 def traer_todas_por_repartidor(
@@ -334,10 +256,8 @@ def traer_todas_por_repartidor(
         username = _get_username(usuario_actual)
         if _is_admin(usuario_actual):   # si es admin le mando todas
             try:
-                handler = _get_handler_for_user(usuario_actual)
-                todas_las_boletas = handler.cargar_ingresos()
-
-                return todas_las_boletas[skip : skip + limit]
+                with _sesion_espejo(usuario_actual) as db:
+                    return ingresos_espejo.listar_boletas(db, usuario_actual.id_empresa, skip=skip, limit=limit)
 
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al cargar todas las boletas: {e}")
@@ -346,20 +266,14 @@ def traer_todas_por_repartidor(
         if not username:
             raise HTTPException(status_code=400, detail="No se pudo obtener el nombre de usuario.")
 
-        handler = _get_handler_for_user(usuario_actual)
-        todas_las_boletas = handler.cargar_ingresos()
-        boletas_del_repartidor = []
-
-        for boleta in todas_las_boletas:
+        def _es_del_repartidor(boleta: Dict[str, Any]) -> bool:
             nombre_repartidor_excel = boleta.get("Repartidor", "")
-            
-            if nombre_repartidor_excel:
-                ratio = fuzz.token_set_ratio(username, nombre_repartidor_excel)
-
-                if ratio > 80:
-                    boletas_del_repartidor.append(boleta)
+            return bool(nombre_repartidor_excel) and fuzz.token_set_ratio(username, nombre_repartidor_excel) > 80
 
-        return boletas_del_repartidor[skip : skip + limit]
+        with _sesion_espejo(usuario_actual) as db:
+            return ingresos_espejo.listar_boletas(
+                db, usuario_actual.id_empresa, skip=skip, limit=limit, filtro=_es_del_repartidor
+            )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al cargar las boletas: {e}")
@@ -380,9 +294,8 @@ def traer_todas_por_razon_social(
     try:
         if _is_admin(usuario_actual):
             try:
-                handler = _get_handler_for_user(usuario_actual)
-                todas_las_boletas = handler.cargar_ingresos()
-                return todas_las_boletas[skip : skip + limit]
+                with _sesion_espejo(usuario_actual) as db:
+                    return ingresos_espejo.listar_boletas(db, usuario_actual.id_empresa, skip=skip, limit=limit)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Ocurrió un error al cargar todas las boletas para el admin: {e}")
 
@@ -390,20 +303,14 @@ def traer_todas_por_razon_social(
         if not razon_social_buscada:
             raise HTTPException(status_code=400, detail="La razón social no puede estar vacía.")
 
-        handler = _get_handler_for_user(usuario_actual)
-        todas_las_boletas = handler.cargar_ingresos()
-        boletas_encontradas = []
-
-        for boleta in todas_las_boletas:
+        def _coincide_razon_social(boleta: Dict[str, Any]) -> bool:
             razon_social_excel = boleta.get("Razon Social", "")
-            
-            if razon_social_excel:
-                ratio = fuzz.token_set_ratio(razon_social_buscada, razon_social_excel)
-
-                if ratio > 80:
-                    boletas_encontradas.append(boleta)
+            return bool(razon_social_excel) and fuzz.token_set_ratio(razon_social_buscada, razon_social_excel) > 80
 
-        return boletas_encontradas[skip : skip + limit]
+        with _sesion_espejo(usuario_actual) as db:
+            return ingresos_espejo.listar_boletas(
+                db, usuario_actual.id_empresa, skip=skip, limit=limit, filtro=_coincide_razon_social
+            )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al buscar boletas por razón social: {e}")
@@ -424,9 +331,8 @@ def traer_todas_por_dia(
     try:
         if _is_admin(usuario_actual):
             try:
-                handler = _get_handler_for_user(usuario_actual)
-                todas_las_boletas = handler.cargar_ingresos()
-                return todas_las_boletas[skip : skip + limit]
+                with _sesion_espejo(usuario_actual) as db:
+                    return ingresos_espejo.listar_boletas(db, usuario_actual.id_empresa, skip=skip, limit=limit)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Ocurrió un error al cargar todas las boletas para el admin: {e}")
 
@@ -440,32 +346,11 @@ def traer_todas_por_dia(
         except ValueError:
             raise HTTPException(status_code=400, detail="El formato de fecha es inválido. Por favor, usa AAAA-MM-DD.")
 
-        handler = _get_handler_for_user(usuario_actual)
-        todas_las_boletas = handler.cargar_ingresos()
-        boletas_del_dia = []
-
-        for boleta in todas_las_boletas:
-
-            fecha_excel_raw = boleta.get("Fecha", "")
-            
-            if not fecha_excel_raw:
-                continue 
-
-            try:
-                fecha_excel_obj = None
-                if isinstance(fecha_excel_raw, datetime):
-                    fecha_excel_obj = fecha_excel_raw.date()
-                elif isinstance(fecha_excel_raw, str):
-                    fecha_sin_hora = fecha_excel_raw.split(" ")[0]
-                    fecha_excel_obj = datetime.strptime(fecha_sin_hora, "%d/%m/%Y").date()
-
-                if fecha_excel_obj and fecha_excel_obj == fecha_buscada_obj:
-                    boletas_del_dia.append(boleta)
-
-            except (ValueError, TypeError):
-                continue
-
-        return boletas_del_dia[skip : skip + limit]
+        # La fecha ya está parseada en el espejo (columna fecha indexada)
+        with _sesion_espejo(usuario_actual) as db:
+            return ingresos_espejo.listar_boletas(
+                db, usuario_actual.id_empresa, fecha=fecha_buscada_obj, skip=skip, limit=limit
+            )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ocurrió un error inesperado al buscar boletas por día: {e}")
@@ -489,25 +374,24 @@ def listar_repartidores(
     try:
         # Aseguramos obtener el nombre de usuario sin asumir que es un dict
         username = _get_username(usuario_actual)
-        handler = _get_handler_for_user(usuario_actual)
-        todas_las_boletas = handler.cargar_ingresos()
 
         # Construir mapping repartidor -> set(razon social)
         mapping: Dict[str, set] = {}
-        for boleta in todas_las_boletas:
-            repartidor = boleta.get("Repartidor") or boleta.get("repartidor") or ""
-            razon = (
-                boleta.get("Razon Social")
-                or boleta.get("razon_social")
-                or boleta.get("Razon social")
-                or ""
-            )
-            if not repartidor:
-                continue
-            if repartidor not in mapping:
-                mapping[repartidor] = set()
-            if razon:
-                mapping[repartidor].add(razon)
+        with _sesion_espejo(usuario_actual) as db:
+            for boleta in ingresos_espejo.iterar_boletas(db, usuario_actual.id_empresa):
+                repartidor = boleta.get("Repartidor") or boleta.get("repartidor") or ""
+                razon = (
+                    boleta.get("Razon Social")
+                    or boleta.get("razon_social")
+                    or boleta.get("Razon social")
+                    or ""
+                )
+                if not repartidor:
+                    continue
+                if repartidor not in mapping:
+                    mapping[repartidor] = set()
+                if razon:
+                    mapping[repartidor].add(razon)
 
         results: List[Dict[str, Any]] = []
 
@@ -541,24 +425,15 @@ def debug_no_facturadas(usuario_actual = Depends(obtener_usuario_actual)):
     No dejar en producción permanente; usar para verificar por qué front no recibe datos.
     """
     try:
-        handler = _get_handler_for_user(usuario_actual)
-        todas = handler.cargar_ingresos()
-        estados = []
-        no_fact = []
-        for b in todas:
-            estado_fact = str(b.get("facturacion", "")).strip().lower()
-            if estado_fact:
-                estados.append(estado_fact)
-            if estado_fact == "falta facturar" or ("falta" in estado_fact and "facturar" in estado_fact):
-                no_fact.append(b)
-        # Contar ocurrencias de cada estado
-        from collections import Counter
-        top_estados = Counter(estados).most_common(20)
+        with _sesion_espejo(usuario_actual) as db:
+            total, estados = ingresos_espejo.contar_por_estado(db, usuario_actual.id_empresa)
+            total_no_fact = dict(estados).get(ingresos_espejo.ESTADO_PENDIENTE, 0)
+            muestra = ingresos_espejo.listar_boletas(db, usuario_actual.id_empresa, solo_no_facturadas=True, limit=5)
         return {
-            "total_boletas": len(todas),
-            "total_no_facturadas_detectadas": len(no_fact),
-            "primeros_estados": top_estados,
-            "muestra_no_facturadas": no_fact[:5],
+            "total_boletas": total,
+            "total_no_facturadas_detectadas": total_no_fact,
+            "primeros_estados": estados[:20],
+            "muestra_no_facturadas": muestra,
             "es_admin": _is_admin(usuario_actual)
         }
     except Exception as e:
@@ -578,14 +453,9 @@ def resumen_no_facturadas(usuario_actual = Depends(obtener_usuario_actual)):
     - No admin: sólo su repartidor (fuzzy) como en la lógica previa.
     """
     try:
-        handler = _get_handler_for_user(usuario_actual)
-        todas = handler.cargar_ingresos()
-        # Filtrar no facturadas
-        no_fact = []
-        for b in todas:
-            estado_fact = str(b.get("facturacion", "")).strip().lower()
-            if estado_fact == "falta facturar" or ("falta" in estado_fact and "facturar" in estado_fact):
-                no_fact.append(b)
+        # Filtrar no facturadas (en SQL, sobre el espejo ingresos_sheets)
+        with _sesion_espejo(usuario_actual) as db:
+            no_fact = list(ingresos_espejo.iterar_boletas(db, usuario_actual.id_empresa, solo_no_facturadas=True))
 
         es_admin = _is_admin(usuario_actual)
         username = _get_username(usuario_actual) if not es_admin else ""
@@ -640,43 +510,14 @@ def resumen_no_facturadas(usuario_actual = Depends(obtener_usuario_actual)):
         raise HTTPException(status_code=500, detail=f"Error en resumen no-facturadas: {e}")
 
 
-def build_imprimible_html(boleta: Dict[str, Any], afip_result: Optional[Dict[str, Any]] = None) -> str:
-    """Construye un HTML imprimible a partir de una boleta (dict).
-    Escapa campos y parsea raw_response si está presente para obtener CAE u otros datos.
+def datos_ticket(boleta: Dict[str, Any], afip_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Contenido del ticket (sin formato) a partir de una boleta (dict) y la factura AFIP si existe.
+    Lo consumen los dos motores de utils/ticket_render.py (raster y HTML/WeasyPrint).
     """
-    # Configurar locale para formato argentino (coma decimal, punto miles)
-    try:
-        locale.setlocale(locale.LC_NUMERIC, 'es_AR.UTF-8')
-    except locale.Error:
-        try:
-            locale.setlocale(locale.LC_NUMERIC, 'es_AR')
-        except locale.Error:
-            # Fallback sin locale
-            pass
-
-    # Función para formatear números
-    def format_number(value):
-        if isinstance(value, (int, float)):
-            # Formato argentino: punto miles, coma decimal
-            s = "{:.2f}".format(value).replace('.', ',')
-            if ',' in s:
-                int_part, dec_part = s.split(',')
-            else:
-                int_part = s
-                dec_part = '00'
-            # Agregar puntos cada 3 dígitos en la parte entera
-            rev = int_part[::-1]
-            with_dots = '.'.join([rev[i:i+3] for i in range(0, len(rev), 3)])
-            final_int = with_dots[::-1]
-            return final_int + ',' + dec_part
-        return str(value)
-
     # Extraer campos con múltiples aliases
     fecha = boleta.get('fecha_comprobante') or boleta.get('created_at') or boleta.get('Fecha') or boleta.get('fecha') or ''
     nro = boleta.get('Nro Comprobante') or boleta.get('numero_comprobante') or boleta.get('numero') or ''
-    razon = boleta.get('Razon Social') or boleta.get('razon_social') or boleta.get('Cliente') or boleta.get('cliente') or ''
     total = boleta.get('importe_total') or boleta.get('total') or boleta.get('INGRESOS') or ''
-    ingreso = boleta.get('ingreso_id') or boleta.get('ID Ingresos') or boleta.get('id') or ''
 
     # intentar obtener CAE y QR desde afip_result o raw_response
     cae = ''
@@ -703,18 +544,6 @@ def build_imprimible_html(boleta: Dict[str, Any], afip_result: Optional[Dict[str
             except Exception:
                 cae = ''
 
-    # Escapar valores para incluir en HTML
-    def esc(v: Any) -> str:
-        return _html.escape(str(v)) if v is not None else ''
-
-    # qr_html: si existe el contenido de QR lo representamos; sino queda vacío
-    qr_html = ''
-    if qr_data_url:
-        if str(qr_data_url).startswith('data:'):
-            qr_html = f"<div style='margin-top:12px'><img src='{_html.escape(str(qr_data_url))}' alt='QR' style='max-width:220px'/></div>"
-        else:
-            qr_html = f"<div style='margin-top:12px'><a href='{_html.escape(str(qr_data_url))}' target='_blank' rel='noopener noreferrer'>Ver QR</a></div>"
-
     # Emisor: primero boleta, luego env, luego intentar leer configuración de bóveda si tenemos CUIT.
     emisor_cuit = boleta.get('emisor_cuit') or boleta.get('CUIT') or os.environ.get('AFIP_CUIT') or os.environ.get('EMISOR_CUIT', '')
     emisor_razon = boleta.get('emisor_razon_social') or boleta.get('Emisor') or os.environ.get('EMISOR_RAZON_SOCIAL', '')
@@ -756,39 +585,31 @@ def build_imprimible_html(boleta: Dict[str, Any], afip_result: Optional[Dict[str
         pv_int = None
 
     tipo_labels = {1: 'Factura A', 6: 'Factura B', 11: 'Factura C'}
-    tipo_label = tipo_labels.get(tipo_int, f"Comprobante {esc(tipo_comprobante)}") if tipo_int is not None else f"Comprobante {esc(tipo_comprobante)}"
-    nro_fmt = f"{nro_int:08d}" if nro_int is not None else esc(nro_comprobante)
-    pv_fmt = f"{pv_int:04d}" if pv_int is not None else esc(punto_venta)
+    tipo_label = tipo_labels.get(tipo_int, f"Comprobante {tipo_comprobante}") if tipo_int is not None else f"Comprobante {tipo_comprobante}"
+    nro_fmt = f"{nro_int:08d}" if nro_int is not None else str(nro_comprobante)
+    pv_fmt = f"{pv_int:04d}" if pv_int is not None else str(punto_venta)
     encabezado_linea2 = f"Pto Vta {pv_fmt} - Nº {nro_fmt}" if (pv_fmt and nro_fmt) else f"Nº {nro_fmt}" if nro_fmt else ''
-    fecha_emision = fecha
 
     receptor_nombre, receptor_doc, receptor_iva = extraer_receptor_fields(boleta, afip_result)
 
     # Items: buscar una lista en boleta['items'] o boleta['detalle'] (si existe)
     items = boleta.get('items') or boleta.get('detalle') or []
-
-    # Leyendas obligatorias
-    leyendas = []
-    leyendas.append('Comprobante autorizado por AFIP')
-    # Añadir información del régimen si se tiene
-    regimen = boleta.get('regimen_emision') or boleta.get('regimen') or 'Factura Electrónica'
-    leyendas.append(regimen)
-
-    # Preparar tabla de items (si hay list)
-    items_html = ''
+    items_norm: List[Dict[str, str]] = []
+    detalle_text = ''
     if isinstance(items, list) and len(items) > 0:
-        rows = []
         for it in items:
-            desc = _html.escape(str(it.get('descripcion') or it.get('descripcion_producto') or it.get('detalle') or ''))
-            qty = _html.escape(str(it.get('cantidad') or it.get('qty') or ''))
-            price = _html.escape(str(it.get('precio_unitario') or it.get('precio') or it.get('unit_price') or ''))
-            subtotal = _html.escape(str(it.get('subtotal') or it.get('importe') or ''))
-            rows.append(f"<tr><td>{desc}</td><td style='text-align:right'>{qty}</td><td style='text-align:right'>{price}</td><td style='text-align:right'>{subtotal}</td></tr>")
-        items_html = f"<table style='width:100%; border-collapse:collapse; margin-top:8px'><thead><tr><th style='text-align:left'>Descripción</th><th style='text-align:right'>Cant.</th><th style='text-align:right'>P.Unit</th><th style='text-align:right'>Subtotal</th></tr></thead><tbody>{''.join(rows)}</tbody></table>"
+            items_norm.append({
+                'descripcion': str(it.get('descripcion') or it.get('descripcion_producto') or it.get('detalle') or ''),
+                'cantidad': str(it.get('cantidad') or it.get('qty') or ''),
+                'precio': str(it.get('precio_unitario') or it.get('precio') or it.get('unit_price') or ''),
+                'subtotal': str(it.get('subtotal') or it.get('importe') or ''),
+            })
     else:
-        detalle_text = _html.escape(str(boleta.get('descripcion') or boleta.get('detalle_text') or boleta.get('detalle') or ''))
-        if detalle_text:
-            items_html = f"<div style='margin-top:8px'>{detalle_text}</div>"
+        detalle_text = str(boleta.get('descripcion') or boleta.get('detalle_text') or boleta.get('detalle') or '')
+
+    # Leyendas obligatorias (más el régimen si se tiene)
+    regimen = boleta.get('regimen_emision') or boleta.get('regimen') or 'Factura Electrónica'
+    leyendas = ['Comprobante autorizado por AFIP', regimen]
 
     cae_vto = ''
     if afip_result:
@@ -798,7 +619,7 @@ def build_imprimible_html(boleta: Dict[str, Any], afip_result: Optional[Dict[str
             cae_vto = ''
 
     # Anotación de mismatch si existe
-    mismatch_html = ''
+    mismatch = ''
     try:
         tipo_forzado_intentado = None
         tipo_mismatch = None
@@ -816,70 +637,40 @@ def build_imprimible_html(boleta: Dict[str, Any], afip_result: Optional[Dict[str
         if tipo_forzado_intentado is not None and (tipo_mismatch or (tipo_final and int(tipo_forzado_intentado)!=int(tipo_final))):
             solicitado_lbl = label_map.get(int(tipo_forzado_intentado), str(tipo_forzado_intentado))
             emitido_lbl = label_map.get(int(tipo_final) if tipo_final is not None else -1, str(tipo_final))
-            mismatch_html = f"<div style='margin-top:6px;color:#b00;font-size:10px'><strong>Advertencia:</strong> Se solicitó Tipo {solicitado_lbl} pero se emitió {emitido_lbl}. Verifique configuración del microservicio.</div>"
+            mismatch = f"Se solicitó Tipo {solicitado_lbl} pero se emitió {emitido_lbl}. Verifique configuración del microservicio."
     except Exception:
-        mismatch_html = ''
-
-    # Construir HTML con layout más cercano a un ticket
-    html = f"""<!doctype html>
-<html>
-<head>
-    <meta charset='utf-8'/>
-    <title>Comprobante {esc(nro_comprobante)}</title>
-    <style>
-        body {{ font-family: Arial, Helvetica, sans-serif; padding:8px; color:#111; font-size:12px }}
-        .card {{ border:0; padding:0; max-width:320px; margin:0 auto }}
-        .header {{ text-align:center }}
-        .small {{ color:#666; font-size:0.9em }}
-        .meta {{ margin-top:8px; font-size:11px }}
-        .totals {{ margin-top:10px; font-weight:bold }}
-        table.items td, table.items th {{ border-bottom:1px solid #eee; padding:4px 0 }}
-        .qr {{ margin-top:10px; text-align:center }}
-        .leyendas {{ margin-top:8px; font-size:10px; color:#333 }}
-        pre {{ white-space:pre-wrap; background:#f8f8f8; padding:8px; border-radius:6px; font-size:10px }}
-    </style>
-</head>
-<body>
-    <div class='card'>
-        <div class='header'>
-            <div style='font-weight:bold'>{_html.escape(str(emisor_razon))}</div>
-            <div class='small'>CUIT: {_html.escape(str(emisor_cuit))} · { _html.escape(str(emisor_iva)) }</div>
-            <div class='small'>{_html.escape(str(emisor_domicilio))}</div>
-            <hr/>
-            <h3 style='margin:4px 0'>{tipo_label}</h3>
-            <div class='small'>{encabezado_linea2}</div>
-            <div class='small'>Fecha: {esc(fecha_emision)}</div>
-        </div>
-
-        <div class='meta'>
-            { f"<div><strong>Cliente Final</strong></div>" if receptor_iva.upper() == 'CONSUMIDOR_FINAL' else f"<div><strong>Receptor:</strong> { _html.escape(str(receptor_nombre)) }</div>" }
-            { f"<div class='small'>Doc: { _html.escape(str(receptor_doc)) } · Cond. IVA: { _html.escape(str(receptor_iva)) }</div>" if receptor_iva.upper() != 'CONSUMIDOR_FINAL' else '' }
-        </div>
-
-        {items_html}
-
-        <div class='totals'>
-            <div>Total: {format_number(total)}</div>
-            <div class='small'>CAE: {esc(cae)} { ('(Vto: ' + _html.escape(str(cae_vto)) + ')') if cae_vto else '' }</div>
-            <div class='small'>CUIT Emisor: {_html.escape(str(emisor_cuit))}</div>
-        </div>
-
-        <div class='qr'>
-            {qr_html}
-        </div>
-
-    {mismatch_html}
-    <div class='leyendas'>
-            { '<br/>'.join(_html.escape(l) for l in leyendas) }
-        </div>
-
-        <hr/>
-        <pre>{_html.escape(json.dumps(boleta.get('raw_response') or {}, indent=2, ensure_ascii=False))}</pre>
-    </div>
-</body>
-</html>
-"""
-    return html
+        mismatch = ''
+
+    return {
+        'nro_comprobante': nro_comprobante,
+        'emisor_razon': emisor_razon,
+        'emisor_cuit': emisor_cuit,
+        'emisor_iva': emisor_iva,
+        'emisor_domicilio': emisor_domicilio,
+        'tipo_label': tipo_label,
+        'encabezado': encabezado_linea2,
+        'fecha': fecha,
+        'consumidor_final': receptor_iva.upper() == 'CONSUMIDOR_FINAL',
+        'receptor_nombre': receptor_nombre,
+        'receptor_doc': receptor_doc,
+        'receptor_iva': receptor_iva,
+        'items': items_norm,
+        'detalle_text': detalle_text,
+        'total': formatear_numero(total),
+        'cae': cae,
+        'cae_vto': cae_vto,
+        'qr': qr_data_url,
+        'mismatch': mismatch,
+        'leyendas': leyendas,
+        'raw_response': boleta.get('raw_response') or {},
+    }
+
+
+def build_imprimible_html(boleta: Dict[str, Any], afip_result: Optional[Dict[str, Any]] = None) -> str:
+    """Construye un HTML imprimible a partir de una boleta (dict).
+    Escapa campos y parsea raw_response si está presente para obtener CAE u otros datos.
+    """
+    return html_ticket(datos_ticket(boleta, afip_result))
 
 
 @router.get("/{ingreso_id}/imprimir-html")
@@ -888,12 +679,13 @@ def imprimir_html_por_ingreso(
     usuario_actual = Depends(obtener_usuario_actual)
 ):
     """Devuelve un HTML imprimible para la boleta identificada por `ingreso_id`.
-    Busca en los ingresos cargados por `TablasHandler` y, si no lo encuentra, devuelve 404.
+    Busca en el espejo ingresos_sheets de la empresa y, si no lo encuentra, devuelve 404.
     """
     try:
-        handler = _get_handler_for_user(usuario_actual)
-        todas = handler.cargar_ingresos()
-        target = None
+        with _sesion_espejo(usuario_actual) as db:
+            target = ingresos_espejo.buscar_boleta(db, usuario_actual.id_empresa, ingreso_id)
+            # Sin coincidencia exacta por índice: recorrer para el matching tolerante de abajo
+            todas = [] if target else list(ingresos_espejo.iterar_boletas(db, usuario_actual.id_empresa))
         # Normalizar función para comparaciones tolerantes
         def norm(x: object) -> str:
             try:
@@ -980,21 +772,71 @@ def imprimir_html_por_ingreso_post(
 
 # ===================== FUNCIONES PARA GENERAR IMAGEN (PNG / JPG) =====================
 
-def _buscar_boleta_por_ingreso(ingreso_id: str, handler: TablasHandler) -> Optional[Dict[str, Any]]:
+def _buscar_boleta_por_ingreso(ingreso_id: str, user) -> Optional[Dict[str, Any]]:
+    """Boleta por ID Ingresos desde el espejo ingresos_sheets (búsqueda indexada).
+
+    Si no está puede ser una fila recién cargada en la hoja que el espejo todavía no trajo (los
+    syncs automáticos tienen cooldown): se sincroniza a pedido y se busca una vez más.
+    Los errores de BD se propagan (500), no se confunden con "Boleta no encontrada".
+    """
+    with _sesion_espejo(user) as db:
+        boleta = ingresos_espejo.buscar_boleta(db, user.id_empresa, ingreso_id)
+        if boleta is not None:
+            return boleta
+        google_sheet_id = _resolver_google_sheet_id(db, user)
+    if not google_sheet_id:
+        return None
+    # Se llama desde endpoints sync (hilo sin event loop)
+    resultado = asyncio.run(sincronizar_y_esperar(user.id_empresa, google_sheet_id))
+    if resultado.get("estado") == "ERROR":
+        logger.warning(f"Sync a pedido por ingreso {ingreso_id} falló: {resultado.get('error') or resultado.get('detalle')}")
+    with _sesion_espejo(user) as db:
+        return ingresos_espejo.buscar_boleta(db, user.id_empresa, ingreso_id)
+
+
+def _buscar_boletas_por_ingreso(ingreso_ids: List[str], user) -> Dict[str, Dict[str, Any]]:
+    """Varias boletas del espejo en una sola búsqueda indexada ({id_ingreso: boleta})."""
     try:
-        todas = handler.cargar_ingresos()
+        with _sesion_espejo(user) as db:
+            return ingresos_espejo.buscar_boletas(db, user.id_empresa, ingreso_ids)
     except Exception:
-        return None
-    for b in todas:
-        for c in [b.get('ID Ingresos'), b.get('ingreso_id'), b.get('id'), b.get('ID')]:
-            if c is None:
-                continue
+        return {}
+
+
+def _buscar_facturas_db(ingreso_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Última factura de cada ingreso_id ({ingreso_id: fila}), en consultas por tanda."""
+    ids = list(dict.fromkeys(str(i) for i in ingreso_ids))
+    resultado: Dict[str, Dict[str, Any]] = {}
+    conn = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return resultado
+        cur = conn.cursor(dictionary=True)
+        for pos in range(0, len(ids), 500):
+            lote = ids[pos:pos + 500]
+            marcas = ",".join(["%s"] * len(lote))
+            cur.execute(f"SELECT * FROM facturas_electronicas WHERE ingreso_id IN ({marcas}) ORDER BY id DESC", tuple(lote))
+            for row in cur.fetchall():
+                clave = str(row.get('ingreso_id'))
+                if clave in resultado:
+                    continue
+                if isinstance(row.get('raw_response'), str):
+                    try:
+                        row['raw_response'] = json.loads(row['raw_response'])
+                    except Exception:
+                        pass
+                resultado[clave] = row
+        cur.close()
+    except Exception:
+        pass
+    finally:
+        if conn is not None:
             try:
-                if str(c) == str(ingreso_id):
-                    return b
+                conn.close()
             except Exception:
-                continue
-    return None
+                pass
+    return resultado
 
 
 def _buscar_factura_db(ingreso_id: str) -> Optional[Dict[str, Any]]:
@@ -1016,44 +858,50 @@ def _buscar_factura_db(ingreso_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def _render_ticket_image(html: str, formato: str = 'jpg') -> bytes:
-    if HTML is None:
-        raise RuntimeError('WeasyPrint no disponible en el entorno')
-    formato_l = formato.lower()
-    if formato_l not in ('jpg', 'jpeg', 'png'):
-        formato_l = 'jpg'
-    png_buf = BytesIO()
-    HTML(string=html, base_url=os.getcwd()).write_png(png_buf)
-    png_buf.seek(0)
-    if formato_l == 'png' or Image is None:
-        return png_buf.getvalue()
-    with Image.open(png_buf) as im:
-        rgb = im.convert('RGB')
-        out = BytesIO()
-        rgb.save(out, format='JPEG', quality=90, optimize=True)
-        return out.getvalue()
+# Subir cuando cambie datos_ticket o el layout de ticket_render: invalida la caché de renders
+TICKET_TEMPLATE_VERSION = f"ticket-58mm-3-{motor_activo()}"
+
+
+def _render_ticket_cacheado(boleta: Dict[str, Any], afip_row: Optional[Dict[str, Any]], formato: str = 'jpg') -> bytes:
+    """Imagen del ticket; si la factura ya tiene CAE se sirve desde render_cache."""
+    ext = 'png' if formato.lower() == 'png' else 'jpg'
+    row = afip_row if isinstance(afip_row, dict) else {}
+    # Las anuladas no se cachean (la anulación además invalida lo que hubiera)
+    cacheable = bool(row.get('id') and row.get('cae')) and not row.get('anulada')
+    if cacheable:
+        cacheada = render_cache.obtener(row['id'], row['cae'], ext, TICKET_TEMPLATE_VERSION)
+        if cacheada is not None:
+            return cacheada
+    img_bytes = render_ticket(datos_ticket(boleta, afip_row), ext)
+    if cacheable:
+        render_cache.guardar(row['id'], row['cae'], ext, TICKET_TEMPLATE_VERSION, img_bytes)
+    return img_bytes
+
+
+def _autorizado_para_boleta(usuario_actual, boleta: Dict[str, Any]) -> bool:
+    """Admin ve todo; el resto solo las boletas de su repartidor (match difuso por nombre)."""
+    if _is_admin(usuario_actual):
+        return True
+    usuario = _get_username(usuario_actual).lower().strip()
+    repart = (boleta.get('Repartidor') or boleta.get('repartidor') or '').lower().strip()
+    if not repart:
+        return True
+    try:
+        ratio = fuzz.token_set_ratio(usuario, repart)
+    except Exception:
+        ratio = 0
+    return ratio > 80 or repart == usuario
 
 
 def imprimir_imagen_por_ingreso(ingreso_id: str, usuario_actual, formato: str = 'jpg'):
-    handler = _get_handler_for_user(usuario_actual)
-    boleta = _buscar_boleta_por_ingreso(ingreso_id, handler)
+    boleta = _buscar_boleta_por_ingreso(ingreso_id, usuario_actual)
     if not boleta:
         raise HTTPException(status_code=404, detail='Boleta no encontrada')
-    # Autorización si no es admin
-    if not _is_admin(usuario_actual):
-        usuario = _get_username(usuario_actual).lower().strip()
-        repart = (boleta.get('Repartidor') or boleta.get('repartidor') or '').lower().strip()
-        if repart:
-            try:
-                ratio = fuzz.token_set_ratio(usuario, repart)
-            except Exception:
-                ratio = 0
-            if ratio <= 80 and repart != usuario:
-                raise HTTPException(status_code=403, detail='No autorizado')
+    if not _autorizado_para_boleta(usuario_actual, boleta):
+        raise HTTPException(status_code=403, detail='No autorizado')
     afip_row = _buscar_factura_db(ingreso_id)
-    html = build_imprimible_html(boleta, afip_row)
     try:
-        img_bytes = _render_ticket_image(html, formato)
+        img_bytes = _render_ticket_cacheado(boleta, afip_row, formato)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error generando imagen: {e}')
     ext = 'png' if formato.lower() == 'png' else 'jpg'
@@ -1062,8 +910,7 @@ def imprimir_imagen_por_ingreso(ingreso_id: str, usuario_actual, formato: str =
 
 
 def facturar_e_imprimir_img(ingreso_id: str, usuario_actual, formato: str = 'jpg', tipo_forzado: int | None = None, punto_venta_override: int | None = None):
-    handler = _get_handler_for_user(usuario_actual)
-    boleta = _buscar_boleta_por_ingreso(ingreso_id, handler)
+    boleta = _buscar_boleta_por_ingreso(ingreso_id, usuario_actual)
     if not boleta:
         raise HTTPException(status_code=404, detail='Boleta no encontrada')
     
@@ -1165,7 +1012,7 @@ def facturar_e_imprimir_img(ingreso_id: str, usuario_actual, formato: str = 'jpg
             except Exception:
                 pass
         try:
-            batch_res = process_invoice_batch_for_endpoint(payload, max_workers=1)
+            batch_res = procesar_lote_facturas(payload, max_workers=1)
             if batch_res and batch_res[0].get('status') == 'SUCCESS':
                 afip_row = batch_res[0].get('result')
             else:
@@ -1174,9 +1021,8 @@ def facturar_e_imprimir_img(ingreso_id: str, usuario_actual, formato: str = 'jpg
             raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f'Error facturando: {e}')
-    html = build_imprimible_html(boleta, afip_row)
     try:
-        img_bytes = _render_ticket_image(html, formato)
+        img_bytes = _render_ticket_cacheado(boleta, afip_row, formato)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error generando imagen: {e}')
     ext = 'png' if formato.lower() == 'png' else 'jpg'
@@ -1206,8 +1052,7 @@ def preview_facturacion(ingreso_id: str, tipo_forzado: int | None = None, punto_
     """Devuelve el payload que se intentaría facturar (sin llamar AFIP) para diagnóstico.
     Permite revisar: total, documento, condicion IVA, emisor_cuit, overrides.
     """
-    handler = _get_handler_for_user(usuario_actual)
-    boleta = _buscar_boleta_por_ingreso(ingreso_id, handler)
+    boleta = _buscar_boleta_por_ingreso(ingreso_id, usuario_actual)
     if not boleta:
         raise HTTPException(status_code=404, detail='Boleta no encontrada')
     # Reutilizamos lógica de parsing (duplicada mínima para no ejecutar facturación)
@@ -1532,7 +1377,7 @@ def listar_boletas_hoy(usuario_actual = Depends(obtener_usuario_actual)):
     conn = None
     cur = None
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(lectura=True)
         if not conn:
             raise HTTPException(status_code=503, detail="DB no disponible")
         cur = conn.cursor(dictionary=True)
@@ -1568,37 +1413,20 @@ def listar_boletas_hoy(usuario_actual = Depends(obtener_usuario_actual)):
             if conn: conn.close()
         except Exception:
             pass
-    # Pendientes (Sheets)
+    # Pendientes (espejo de Sheets: fecha y estado filtrados en SQL)
     try:
-        handler = _get_handler_for_user(usuario_actual)
-        todas = handler.cargar_ingresos()
-        for b in todas:
+        with _sesion_espejo(usuario_actual) as db:
+            pendientes = list(ingresos_espejo.iterar_boletas(db, usuario_actual.id_empresa, solo_no_facturadas=True, fecha=hoy))
+        for b in pendientes:
             fecha_raw = b.get('Fecha') or b.get('fecha') or b.get('FECHA')
-            if not fecha_raw:
-                continue
-            try:
-                fecha_sin_hora = str(fecha_raw).split(' ')[0]
-                fecha_obj = None
-                if '/' in fecha_sin_hora:
-                    fecha_obj = datetime.strptime(fecha_sin_hora, '%d/%m/%Y').date()
-                elif '-' in fecha_sin_hora:
-                    fecha_obj = datetime.strptime(fecha_sin_hora, '%Y-%m-%d').date()
-                else:
-                    continue
-                if fecha_obj != hoy:
-                    continue
-            except Exception:
-                continue
-            estado_fact = str(b.get('facturacion') or b.get('Facturacion') or '').strip().lower()
-            if estado_fact == 'falta facturar' or ('falta' in estado_fact and 'facturar' in estado_fact):
-                resultados.append({
-                    'categoria': 'pendiente',
-                    'numero_boleta': b.get('Nro Comprobante') or b.get('numero_comprobante') or None,
-                    'fecha_hora': str(fecha_raw),
-                    'monto_total': b.get('importe_total') or b.get('INGRESOS') or b.get('total'),
-                    'estado': 'PENDIENTE',
-                    'cliente': b.get('Razon Social') or b.get('razon_social') or b.get('Cliente') or b.get('cliente'),
-                })
+            resultados.append({
+                'categoria': 'pendiente',
+                'numero_boleta': b.get('Nro Comprobante') or b.get('numero_comprobante') or None,
+                'fecha_hora': str(fecha_raw),
+                'monto_total': b.get('importe_total') or b.get('INGRESOS') or b.get('total'),
+                'estado': 'PENDIENTE',
+                'cliente': b.get('Razon Social') or b.get('razon_social') or b.get('Cliente') or b.get('cliente'),
+            })
     except Exception:
         # no interrumpir por errores de Sheets
         pass
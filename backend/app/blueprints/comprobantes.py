@@ -2,14 +2,24 @@
 Endpoint para generar comprobante PDF con todos los datos obligatorios de AFIP
 """
 from fastapi import APIRouter, HTTPException, Depends, Response
-from fastapi.responses import FileResponse
-from typing import Dict, Any, Optional
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
+from sqlmodel import select, func
+from typing import TYPE_CHECKING, Dict, Any, Iterator, List, Optional
+import json
 import logging
-from datetime import datetime
+import os
+import zipfile
+from datetime import date, datetime
 from io import BytesIO
 from backend.security import obtener_usuario_actual
-from backend.modelos import Usuario, FacturaElectronica, ConfiguracionEmpresa
+from backend.modelos import Usuario, FacturaElectronica, IngresoSheets
 from backend.database import SessionLocal
+from backend.utils import ingresos_espejo, qr_render, render_cache, tenant_context
+from backend.utils.zip_stream import ZipStream
+
+if TYPE_CHECKING:
+    from backend.utils.tablasHandler import TablasHandler
 
 # Reportlab para generar PDF
 try:
@@ -25,9 +35,8 @@ except ImportError:
 
 # QR Code para generar imagen del código QR
 try:
-    import qrcode
     from reportlab.lib.utils import ImageReader
-    QR_AVAILABLE = True
+    QR_AVAILABLE = qr_render.disponible()
 except ImportError:
     QR_AVAILABLE = False
 
@@ -35,17 +44,14 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/comprobantes", tags=["comprobantes"])
 
+# Subir cuando cambie generar_pdf_comprobante: invalida los PDFs cacheados en render_cache
+PDF_TEMPLATE_VERSION = "comprobante-pdf-1"
+
 def _get_tablas_handler_for_user(usuario: Usuario, db) -> "TablasHandler":
     from backend.utils.tablasHandler import TablasHandler
-    google_sheet_id = None
     try:
-        config = db.query(ConfiguracionEmpresa).filter(ConfiguracionEmpresa.id_empresa == usuario.id_empresa).first()
-        link = (config.link_google_sheets or "").strip() if config else ""
-        if link:
-            if "/d/" in link and "/edit" in link:
-                google_sheet_id = link.split("/d/")[1].split("/")[0]
-            else:
-                google_sheet_id = link
+        ctx = tenant_context.obtener_contexto(usuario.id_empresa, db)
+        google_sheet_id = ctx.google_sheet_id if ctx else None
     except Exception:
         google_sheet_id = None
     return TablasHandler(google_sheet_id=google_sheet_id)
@@ -130,13 +136,133 @@ async def test_sheets_cliente(
     
     return resultado
 
-def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None, sheets_handler: Optional["TablasHandler"] = None) -> bytes:
+# Datos del emisor por defecto cuando no hay emisor_<cuit>.json en la bóveda
+_EMISOR_DEFAULT = {
+    "nombre_fantasia": "SKAL FAM",
+    "razon_social": "SKAL FAM DISTRIBUCIONES S. A. S.",
+    "direccion": "Las Chacritas, San Juan",
+    "fecha_inicio": "01/01/2024",
+    "nro_ingresos_brutos": "30718331680",
+    "telefono": "+54 264 5704748"
+}
+
+_BOVEDA_PATH = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'boveda_afip_temporal')
+
+
+class ContextoComprobantes:
+    """
+    Datos compartidos entre comprobantes de un mismo pedido: emisor de la bóveda y
+    ConfiguracionEmpresa por CUIT, y filas de INGRESOS por ingreso_id. Cada dato se carga una
+    sola vez; en lotes, `precargar_ingresos` trae todas las filas del espejo en una consulta.
+    """
+
+    def __init__(self, id_empresa: Optional[int] = None, sheets_handler: Optional["TablasHandler"] = None):
+        self.id_empresa = id_empresa
+        self.sheets_handler = sheets_handler
+        self._emisores: Dict[str, Dict[str, Any]] = {}
+        self._configs: Dict[str, Dict[str, Any]] = {}
+        self._ingresos: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._hoja_cargada = False
+
+    def emisor(self, cuit: Any) -> Dict[str, Any]:
+        clave = str(cuit or "").strip()
+        if clave not in self._emisores:
+            emisor_data = dict(_EMISOR_DEFAULT)
+            try:
+                emisor_file = os.path.join(_BOVEDA_PATH, f'emisor_{clave}.json')
+                if os.path.exists(emisor_file):
+                    with open(emisor_file, 'r', encoding='utf-8') as f:
+                        file_data = json.load(f)
+                    if file_data:
+                        emisor_data.update({
+                            "nombre_fantasia": file_data.get('nombre_fantasia', emisor_data["nombre_fantasia"]),
+                            "razon_social": file_data.get('razon_social', emisor_data["razon_social"]),
+                            "direccion": file_data.get('direccion', emisor_data["direccion"]),
+                            "fecha_inicio": file_data.get('Fecha Inicio', emisor_data["fecha_inicio"]),
+                            "nro_ingresos_brutos": file_data.get('Nro Ingresos Brutos', emisor_data["nro_ingresos_brutos"]),
+                            "telefono": file_data.get('telefono', emisor_data["telefono"])
+                        })
+            except Exception as e:
+                logger.warning(f"No se pudo cargar datos del emisor: {e}")
+            self._emisores[clave] = emisor_data
+        return self._emisores[clave]
+
+    def config_empresa(self, cuit: Any) -> Dict[str, Any]:
+        """Desglose 77/21 y texto de detalle de la empresa dueña del CUIT emisor."""
+        clave = str(cuit or "").strip()
+        if clave not in self._configs:
+            conf_data = {"aplicar_desglose_77": False, "detalle_empresa_text": None}
+            try:
+                ctx = tenant_context.contexto_por_cuit(clave)
+                if ctx and ctx.tiene_configuracion:
+                    conf_data = {
+                        "aplicar_desglose_77": ctx.aplicar_desglose_77,
+                        "detalle_empresa_text": ctx.detalle_empresa_text,
+                    }
+            except Exception as e:
+                logger.warning(f"No se pudo leer la configuración de la empresa {clave}: {e}")
+            self._configs[clave] = conf_data
+        return self._configs[clave]
+
+    def precargar_ingresos(self, db, ingreso_ids: List[str]) -> None:
+        if self.id_empresa is None:
+            return
+        encontrados = ingresos_espejo.buscar_boletas(db, self.id_empresa, ingreso_ids)
+        for ingreso_id in ingreso_ids:
+            self._ingresos[str(ingreso_id)] = encontrados.get(str(ingreso_id))
+
+    def ingreso(self, ingreso_id: Any) -> Optional[Dict[str, Any]]:
+        """Fila de INGRESOS: espejo ingresos_sheets y, si no está, la hoja (descargada una sola vez)."""
+        clave = str(ingreso_id or "").strip()
+        if not clave:
+            return None
+        if clave not in self._ingresos and self.id_empresa is not None:
+            try:
+                db = SessionLocal()
+                try:
+                    self._ingresos[clave] = ingresos_espejo.buscar_boleta(db, self.id_empresa, clave)
+                finally:
+                    db.close()
+            except Exception as e:
+                logger.warning(f"Error buscando ingreso {clave} en el espejo: {e}")
+        if self._ingresos.get(clave) is None and not self._hoja_cargada and self.sheets_handler is not None:
+            self._hoja_cargada = True
+            try:
+                for ingreso in self.sheets_handler.cargar_ingresos() or []:
+                    id_hoja = str(ingreso.get('ID Ingresos', '')).strip()
+                    if id_hoja and self._ingresos.get(id_hoja) is None:
+                        self._ingresos[id_hoja] = ingreso
+            except Exception as sheet_error:
+                logger.warning(f"Error buscando cliente en Google Sheets: {sheet_error}")
+        return self._ingresos.get(clave)
+
+
+def _nuevo_canvas_ticket(buffer: BytesIO):
+    # Tamaño ticket: 50mm de ancho (142 puntos), altura variable (A4 height como máximo)
+    return canvas.Canvas(buffer, pagesize=(50 * mm, 297 * mm))
+
+
+def generar_pdf_comprobante(
+    factura: FacturaElectronica,
+    conceptos: list = None,
+    sheets_handler: Optional["TablasHandler"] = None,
+    contexto: Optional[ContextoComprobantes] = None,
+) -> bytes:
     """
     Genera un PDF del comprobante fiscal estilo ticket térmico de 50mm
     """
     if not REPORTLAB_AVAILABLE:
         raise RuntimeError("ReportLab no está instalado. Ejecute: pip install reportlab")
-    
+    buffer = BytesIO()
+    c = _nuevo_canvas_ticket(buffer)
+    _dibujar_comprobante(c, factura, conceptos, contexto or ContextoComprobantes(sheets_handler=sheets_handler))
+    c.save()
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def _dibujar_comprobante(c, factura: FacturaElectronica, conceptos: Optional[list], ctx: ContextoComprobantes) -> None:
+    """Dibuja un comprobante en una página del canvas (los lotes agregan una página por factura)."""
     # Función para formatear números en formato argentino (coma decimal, punto miles)
     def format_number(value):
         if isinstance(value, (int, float)):
@@ -153,14 +279,9 @@ def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None,
             return final_int + ',' + dec_part
         return str(value)
     
-    buffer = BytesIO()
-    
-    # Tamaño ticket: 50mm de ancho (142 puntos), altura variable
     ticket_width = 50 * mm  # 50mm ≈ 142 puntos
     ticket_height = 297 * mm  # A4 height como máximo
     
-    c = canvas.Canvas(buffer, pagesize=(ticket_width, ticket_height))
-    
     # Márgenes
     margin_left = 3 * mm
     margin_right = 3 * mm
@@ -189,36 +310,8 @@ def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None,
         return y_pos - 2 * mm
     
     # ===== CARGAR DATOS DEL EMISOR =====
-    # Intentar cargar datos desde el archivo de configuración del emisor
-    emisor_data = {
-        "nombre_fantasia": "SKAL FAM",
-        "razon_social": "SKAL FAM DISTRIBUCIONES S. A. S.",
-        "direccion": "Las Chacritas, San Juan",
-        "fecha_inicio": "01/01/2024",
-        "nro_ingresos_brutos": "30718331680",
-        "telefono": "+54 264 5704748"
-    }
-    
-    # Intentar cargar desde archivo JSON si existe
-    try:
-        import json
-        import os
-        boveda_path = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'boveda_afip_temporal')
-        emisor_file = os.path.join(boveda_path, f'emisor_{factura.cuit_emisor.strip()}.json')
-        if os.path.exists(emisor_file):
-            with open(emisor_file, 'r', encoding='utf-8') as f:
-                file_data = json.load(f)
-                if file_data:
-                    emisor_data.update({
-                        "nombre_fantasia": file_data.get('nombre_fantasia', emisor_data["nombre_fantasia"]),
-                        "razon_social": file_data.get('razon_social', emisor_data["razon_social"]),
-                        "direccion": file_data.get('direccion', emisor_data["direccion"]),
-                        "fecha_inicio": file_data.get('Fecha Inicio', emisor_data["fecha_inicio"]),
-                        "nro_ingresos_brutos": file_data.get('Nro Ingresos Brutos', emisor_data["nro_ingresos_brutos"]),
-                        "telefono": file_data.get('telefono', emisor_data["telefono"])
-                    })
-    except Exception as e:
-        logger.warning(f"No se pudo cargar datos del emisor: {e}")
+    # Bóveda emisor_<cuit>.json (cacheada por CUIT en el contexto)
+    emisor_data = ctx.emisor(factura.cuit_emisor)
     
     # ===== ENCABEZADO =====
     y = draw_centered(emisor_data["nombre_fantasia"], y, "Helvetica-Bold", 10)
@@ -335,40 +428,21 @@ def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None,
                                 raw_data.get('razon_social') or
                                 raw_data.get('cliente_data', {}).get('nombre_razon_social'))
             
-            # 2. Si no se encontró, buscar en Google Sheets usando ingreso_id
+            # 2. Si no se encontró, buscar la fila de INGRESOS (espejo / hoja) por ingreso_id
             if not nombre_cliente and factura.ingreso_id:
-                try:
-                    if not sheets_handler:
-                        from backend.utils.tablasHandler import TablasHandler
-                        sheets_handler = TablasHandler()
-                    
-                    # Obtener datos del ingreso desde Google Sheets
-                    ingresos_data = sheets_handler.cargar_ingresos() if sheets_handler else []
-                    if ingresos_data:
-                        # Buscar el ingreso por ID
-                        ingreso_encontrado = None
-                        for ingreso in ingresos_data:
-                            if str(ingreso.get('ID Ingresos', '')) == str(factura.ingreso_id):
-                                ingreso_encontrado = ingreso
-                                break
-                        
-                        if ingreso_encontrado:
-                            # Extraer nombre del cliente desde diferentes campos posibles
-                            nombre_cliente = (ingreso_encontrado.get('Razon Social') or 
-                                            ingreso_encontrado.get('cliente') or
-                                            ingreso_encontrado.get('nombre') or
-                                            ingreso_encontrado.get('Cliente'))
-                            
-                            # Extraer CUIT del cliente si está disponible
-                            cuit_cliente = (ingreso_encontrado.get('CUIT') or
-                                          ingreso_encontrado.get('cuit') or
-                                          ingreso_encontrado.get('Cuit') or
-                                          ingreso_encontrado.get('cuit_cliente'))
-                            
-                            logger.info(f"Cliente encontrado en Sheets para ingreso {factura.ingreso_id}: {nombre_cliente}, CUIT: {cuit_cliente}")
+                ingreso_encontrado = ctx.ingreso(factura.ingreso_id)
+                if ingreso_encontrado:
+                    # Extraer nombre del cliente desde diferentes campos posibles
+                    nombre_cliente = (ingreso_encontrado.get('Razon Social') or 
+                                    ingreso_encontrado.get('cliente') or
+                                    ingreso_encontrado.get('nombre') or
+                                    ingreso_encontrado.get('Cliente'))
                     
-                except Exception as sheet_error:
-                    logger.warning(f"Error buscando cliente en Google Sheets: {sheet_error}")
+                    # Extraer CUIT del cliente si está disponible
+                    cuit_cliente = (ingreso_encontrado.get('CUIT') or
+                                  ingreso_encontrado.get('cuit') or
+                                  ingreso_encontrado.get('Cuit') or
+                                  ingreso_encontrado.get('cuit_cliente'))
                     
         except Exception as e:
             logger.warning(f"Error obteniendo datos del cliente: {e}")
@@ -409,20 +483,7 @@ def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None,
         aplicar_especial = False
 
     if not aplicar_especial:
-        try:
-            from sqlmodel import select
-            from backend.database import SessionLocal
-            from backend.modelos import Empresa, ConfiguracionEmpresa
-            db = SessionLocal()
-            try:
-                empresa = db.exec(select(Empresa).where(Empresa.cuit == str(factura.cuit_emisor))).first()
-                if empresa:
-                    conf = db.exec(select(ConfiguracionEmpresa).where(ConfiguracionEmpresa.id_empresa == empresa.id)).first()
-                    aplicar_especial = bool(conf and conf.aplicar_desglose_77)
-            finally:
-                db.close()
-        except Exception:
-            aplicar_especial = False
+        aplicar_especial = ctx.config_empresa(factura.cuit_emisor)["aplicar_desglose_77"]
 
     if aplicar_especial:
         total_val = float(factura.importe_total)
@@ -434,18 +495,7 @@ def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None,
                 raw = _json.loads(factura.raw_response)
                 detalle_empresa_txt = raw.get('detalle_empresa') or raw.get('datos_factura', {}).get('detalle_empresa')
             if not detalle_empresa_txt:
-                from sqlmodel import select
-                from backend.database import SessionLocal
-                from backend.modelos import Empresa, ConfiguracionEmpresa
-                db = SessionLocal()
-                try:
-                    empresa = db.exec(select(Empresa).where(Empresa.cuit == str(factura.cuit_emisor))).first()
-                    if empresa:
-                        conf = db.exec(select(ConfiguracionEmpresa).where(ConfiguracionEmpresa.id_empresa == empresa.id)).first()
-                        if conf and conf.detalle_empresa_text:
-                            titulo_detalle = conf.detalle_empresa_text
-                finally:
-                    db.close()
+                titulo_detalle = ctx.config_empresa(factura.cuit_emisor)["detalle_empresa_text"] or titulo_detalle
             else:
                 titulo_detalle = detalle_empresa_txt
         except Exception:
@@ -520,23 +570,8 @@ def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None,
     # ===== CÓDIGO QR =====
     if factura.qr_url_afip and QR_AVAILABLE:
         try:
-            # Generar código QR
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=2,
-                border=1,
-            )
-            qr.add_data(factura.qr_url_afip)
-            qr.make(fit=True)
-            
-            # Crear imagen del QR
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convertir a formato que ReportLab puede usar
-            qr_buffer = BytesIO()
-            qr_img.save(qr_buffer, format='PNG')
-            qr_buffer.seek(0)
+            # PNG del QR desde la caché de qr_render (misma URL => mismo PNG)
+            qr_buffer = BytesIO(qr_render.qr_png(factura.qr_url_afip, 2, 1))
             
             # Dimensiones del QR (25mm x 25mm centrado)
             qr_size = 25 * mm
@@ -578,30 +613,14 @@ def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None,
                            raw_data.get('repartidor') or
                            raw_data.get('operador'))
         
-        # 2. Si no se encontró, buscar en Google Sheets usando ingreso_id
+        # 2. Si no se encontró, buscar el repartidor en la fila de INGRESOS
         if not cajero_nombre and factura.ingreso_id:
-            try:
-                from backend.utils.tablasHandler import TablasHandler
-                sheets_handler = TablasHandler()
-                
-                # Obtener datos del ingreso desde Google Sheets
-                ingresos_data = sheets_handler.cargar_ingresos()
-                if ingresos_data:
-                    # Buscar el ingreso por ID
-                    for ingreso in ingresos_data:
-                        if str(ingreso.get('ID Ingresos', '')) == str(factura.ingreso_id):
-                            # Buscar repartidor/cajero en diferentes campos
-                            cajero_nombre = (ingreso.get('Repartidor') or
-                                           ingreso.get('repartidor') or
-                                           ingreso.get('cajero') or
-                                           ingreso.get('vendedor') or
-                                           ingreso.get('operador'))
-                            
-                            if cajero_nombre:
-                                logger.info(f"Cajero encontrado en Sheets para ingreso {factura.ingreso_id}: {cajero_nombre}")
-                            break
-            except Exception as sheet_error:
-                logger.warning(f"Error buscando cajero en Google Sheets: {sheet_error}")
+            ingreso = ctx.ingreso(factura.ingreso_id) or {}
+            cajero_nombre = (ingreso.get('Repartidor') or
+                           ingreso.get('repartidor') or
+                           ingreso.get('cajero') or
+                           ingreso.get('vendedor') or
+                           ingreso.get('operador'))
                 
     except Exception as e:
         logger.warning(f"Error obteniendo datos del cajero: {e}")
@@ -636,12 +655,45 @@ def generar_pdf_comprobante(factura: FacturaElectronica, conceptos: list = None,
     y -= 4 * mm
 
     
-    # Finalizar PDF
+    # Finalizar página
     c.showPage()
-    c.save()
-    
-    buffer.seek(0)
-    return buffer.getvalue()
+
+
+def _es_api_key_sistema(usuario: Usuario) -> bool:
+    return usuario.id == 999 and usuario.nombre_usuario == "sistema_api_key"
+
+
+def _cuits_empresa(db, usuario: Usuario) -> Optional[List[str]]:
+    """CUITs (solo dígitos) con los que emite la empresa del usuario. None para la API key interna:
+    ve los comprobantes de todas las empresas."""
+    if _es_api_key_sistema(usuario):
+        return None
+    ctx = tenant_context.obtener_contexto(usuario.id_empresa, db)
+    return sorted({
+        "".join(ch for ch in str(c) if ch.isdigit())
+        for c in ((ctx.cuit, ctx.cuit_configuracion) if ctx else ())
+        if c and any(ch.isdigit() for ch in str(c))
+    })
+
+
+def _buscar_factura(db, factura_id: str, cuits: Optional[List[str]] = None) -> Optional[FacturaElectronica]:
+    """Busca por ID numérico, después por ingreso_id (código del frontend) y por último por CAE.
+
+    Con `cuits` (ver _cuits_empresa) solo encuentra las emitidas con alguno de esos CUITs.
+    """
+    if cuits is not None and not cuits:
+        return None
+    base = db.query(FacturaElectronica)
+    if cuits is not None:
+        base = base.filter(FacturaElectronica.cuit_emisor.in_(cuits))
+    factura = None
+    if factura_id.isdigit():
+        factura = base.filter(FacturaElectronica.id == int(factura_id)).first()
+    if not factura:
+        factura = base.filter(FacturaElectronica.ingreso_id == factura_id).first()
+    if not factura:
+        factura = base.filter(FacturaElectronica.cae == factura_id).first()
+    return factura
 
 
 @router.get("/{factura_id}/pdf")
@@ -654,21 +706,7 @@ async def descargar_comprobante_pdf(
     """
     db = SessionLocal()
     try:
-        # Intentar buscar por ID (si es numérico) o por ingreso_id/cae (si es alfanumérico)
-        factura = None
-        
-        # 1. Intentar buscar por ID numérico si factura_id parece un entero
-        if factura_id.isdigit():
-            factura = db.query(FacturaElectronica).filter(FacturaElectronica.id == int(factura_id)).first()
-        
-        # 2. Si no se encontró por ID, intentar buscar por ingreso_id (el código alfanumérico del frontend)
-        if not factura:
-            factura = db.query(FacturaElectronica).filter(FacturaElectronica.ingreso_id == factura_id).first()
-            
-        # 3. Como último recurso, intentar por CAE
-        if not factura:
-            factura = db.query(FacturaElectronica).filter(FacturaElectronica.cae == factura_id).first()
-        
+        factura = _buscar_factura(db, factura_id)
         if not factura:
             raise HTTPException(status_code=404, detail=f"Factura no encontrada (ID/Código: {factura_id})")
         
@@ -676,8 +714,15 @@ async def descargar_comprobante_pdf(
         conceptos = []
         # TODO: Obtener conceptos de la venta original si están disponibles
         
-        sheets_handler = _get_tablas_handler_for_user(usuario, db)
-        pdf_bytes = generar_pdf_comprobante(factura, conceptos, sheets_handler=sheets_handler)
+        # Comprobante con CAE: no cambia, la reimpresión se sirve desde la caché de renders
+        cacheable = bool(factura.cae) and not getattr(factura, "anulada", False)
+        pdf_bytes = render_cache.obtener(factura.id, factura.cae, "pdf", PDF_TEMPLATE_VERSION) if cacheable else None
+        if pdf_bytes is None:
+            sheets_handler = _get_tablas_handler_for_user(usuario, db)
+            contexto = ContextoComprobantes(id_empresa=usuario.id_empresa, sheets_handler=sheets_handler)
+            pdf_bytes = generar_pdf_comprobante(factura, conceptos, contexto=contexto)
+            if cacheable:
+                render_cache.guardar(factura.id, factura.cae, "pdf", PDF_TEMPLATE_VERSION, pdf_bytes)
         
         # Nombre del archivo
         filename = f"comprobante_{factura.punto_venta}_{factura.numero_comprobante}.pdf"
@@ -696,6 +741,206 @@ async def descargar_comprobante_pdf(
     finally:
         db.close()
 
+
+def _url_qr_factura(factura: FacturaElectronica) -> Optional[str]:
+    """qr_url_afip guardada o, para filas viejas sin ella, armada desde las columnas de la factura."""
+    if factura.qr_url_afip:
+        return factura.qr_url_afip
+    return qr_render.url_qr_afip({
+        "fecha_comprobante": factura.fecha_comprobante,
+        "cuit_emisor": factura.cuit_emisor,
+        "punto_venta": factura.punto_venta,
+        "tipo_comprobante": factura.tipo_comprobante,
+        "numero_comprobante": factura.numero_comprobante,
+        "importe_total": factura.importe_total,
+        "tipo_doc_receptor": factura.tipo_doc_receptor,
+        "nro_doc_receptor": factura.nro_doc_receptor,
+        "cae": factura.cae,
+    })
+
+
+@router.get("/{factura_id}/qr")
+def descargar_comprobante_qr(
+    factura_id: str,
+    formato: str = "png",
+    tam: int = 6,
+    usuario: Usuario = Depends(obtener_usuario_actual)
+):
+    """
+    Imagen del QR de AFIP (PNG o SVG), generada a pedido y cacheada en memoria.
+    `tam` es el tamaño de módulo del PNG en píxeles (1-20).
+    """
+    formato = (formato or "png").lower()
+    if formato not in ("png", "svg"):
+        raise HTTPException(status_code=400, detail="formato debe ser 'png' o 'svg'")
+    if not qr_render.disponible():
+        raise HTTPException(status_code=503, detail="Generación de QR no disponible (falta qrcode)")
+    tam = max(1, min(int(tam), 20))
+
+    db = SessionLocal()
+    try:
+        # El QR lleva CUIT emisor, importe y documento del receptor: solo facturas de la empresa
+        factura = _buscar_factura(db, factura_id, _cuits_empresa(db, usuario))
+        if not factura:
+            raise HTTPException(status_code=404, detail=f"Factura no encontrada (ID/Código: {factura_id})")
+        url = _url_qr_factura(factura)
+    finally:
+        db.close()
+    if not url:
+        raise HTTPException(status_code=404, detail="La factura no tiene datos suficientes para el QR")
+
+    if formato == "svg":
+        contenido, media_type = qr_render.qr_svg(url), "image/svg+xml"
+    else:
+        contenido, media_type = qr_render.qr_png(url, tam), "image/png"
+    # El QR de una factura con CAE no cambia: el navegador puede reusarlo
+    return Response(content=contenido, media_type=media_type, headers={"Cache-Control": "private, max-age=86400"})
+
+# Tope de facturas por pedido de /comprobantes/pdf/lote
+LOTE_PDF_MAX = int(os.getenv("COMPROBANTES_LOTE_MAX", "500"))
+
+
+class LotePDFRequest(BaseModel):
+    """Facturas a incluir: por id, por ingreso_id, por rango de fechas y/o por repartidor."""
+    ids: Optional[List[int]] = None
+    ingreso_ids: Optional[List[str]] = None
+    fecha_desde: Optional[date] = None
+    fecha_hasta: Optional[date] = None
+    repartidor: Optional[str] = None
+    incluir_anuladas: bool = False
+    formato: str = "pdf"  # "pdf": un PDF con una página por factura; "zip": un PDF por factura
+
+
+def _facturas_lote(db, payload: LotePDFRequest, usuario: Usuario) -> List[FacturaElectronica]:
+    if not (payload.ids or payload.ingreso_ids or payload.fecha_desde or payload.fecha_hasta or payload.repartidor):
+        raise HTTPException(status_code=400, detail="Indicar ids, ingreso_ids, fechas o repartidor")
+
+    # Alcance de la empresa: emitidas con alguno de sus CUITs (un ingreso_id puede repetirse entre
+    # empresas, así que el espejo solo no alcanza) y, con repartidor, además de sus ingresos
+    cuits_empresa = _cuits_empresa(db, usuario)
+    if cuits_empresa == []:
+        return []
+
+    q = select(FacturaElectronica)
+    if cuits_empresa is not None:
+        q = q.where(FacturaElectronica.cuit_emisor.in_(cuits_empresa))
+    if payload.repartidor:
+        ingresos_repartidor = select(IngresoSheets.id_ingreso).where(
+            IngresoSheets.id_empresa == usuario.id_empresa,
+            func.lower(IngresoSheets.repartidor) == payload.repartidor.strip().lower(),
+        )
+        q = q.where(FacturaElectronica.ingreso_id.in_(ingresos_repartidor))
+    if payload.ids:
+        q = q.where(FacturaElectronica.id.in_(payload.ids))
+    if payload.ingreso_ids:
+        q = q.where(FacturaElectronica.ingreso_id.in_([str(i).strip() for i in payload.ingreso_ids]))
+    if payload.fecha_desde:
+        q = q.where(FacturaElectronica.fecha_comprobante >= payload.fecha_desde)
+    if payload.fecha_hasta:
+        q = q.where(FacturaElectronica.fecha_comprobante <= payload.fecha_hasta)
+    if not payload.incluir_anuladas:
+        q = q.where(FacturaElectronica.anulada == False)  # noqa: E712
+    q = q.order_by(
+        FacturaElectronica.fecha_comprobante,
+        FacturaElectronica.punto_venta,
+        FacturaElectronica.numero_comprobante,
+    ).limit(LOTE_PDF_MAX + 1)
+    facturas = list(db.exec(q).all())
+    if len(facturas) > LOTE_PDF_MAX:
+        raise HTTPException(status_code=400, detail=f"El lote supera el máximo de {LOTE_PDF_MAX} comprobantes; acotar el filtro")
+    return facturas
+
+
+def _nombre_pdf(factura: FacturaElectronica) -> str:
+    return f"comprobante_{factura.punto_venta}_{factura.numero_comprobante}.pdf"
+
+
+def _pdf_cacheado(factura: FacturaElectronica, ctx: ContextoComprobantes) -> bytes:
+    cacheable = bool(factura.cae) and not getattr(factura, "anulada", False)
+    pdf_bytes = render_cache.obtener(factura.id, factura.cae, "pdf", PDF_TEMPLATE_VERSION) if cacheable else None
+    if pdf_bytes is None:
+        pdf_bytes = generar_pdf_comprobante(factura, [], contexto=ctx)
+        if cacheable:
+            render_cache.guardar(factura.id, factura.cae, "pdf", PDF_TEMPLATE_VERSION, pdf_bytes)
+    return pdf_bytes
+
+
+def _iterar_zip_comprobantes(facturas: List[FacturaElectronica], ctx: ContextoComprobantes) -> Iterator[bytes]:
+    destino = ZipStream()
+    manifest: List[Dict[str, Any]] = []
+    with zipfile.ZipFile(destino, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for factura in facturas:
+            nombre = _nombre_pdf(factura)
+            try:
+                zf.writestr(nombre, _pdf_cacheado(factura, ctx))
+                manifest.append({"id": factura.id, "ingreso_id": factura.ingreso_id, "ok": True, "archivo": nombre})
+            except Exception as e:
+                logger.error(f"Error generando PDF de la factura {factura.id}: {e}", exc_info=True)
+                manifest.append({"id": factura.id, "ingreso_id": factura.ingreso_id, "ok": False, "error": str(e)})
+            yield destino.vaciar()
+        zf.writestr("manifest.json", json.dumps({
+            "generado_en": datetime.now().isoformat(),
+            "incluidos": sum(1 for m in manifest if m["ok"]),
+            "errores": sum(1 for m in manifest if not m["ok"]),
+            "entradas": manifest,
+        }, ensure_ascii=False, indent=2))
+    yield destino.vaciar()
+
+
+@router.post("/pdf/lote")
+def descargar_comprobantes_lote(
+    payload: LotePDFRequest,
+    usuario: Usuario = Depends(obtener_usuario_actual)
+):
+    """
+    PDFs de varios comprobantes (un día, un repartidor, una lista de ids) en un solo pedido.
+    La configuración del emisor se carga una vez por CUIT y los datos de clientes/repartidores
+    salen del espejo ingresos_sheets en una sola consulta.
+    formato=pdf devuelve un PDF multipágina; formato=zip transmite un ZIP con un PDF por factura
+    y un manifest.json.
+    """
+    if not REPORTLAB_AVAILABLE:
+        raise HTTPException(status_code=500, detail="ReportLab no está instalado")
+    formato = (payload.formato or "pdf").lower()
+    if formato not in ("pdf", "zip"):
+        raise HTTPException(status_code=400, detail="formato debe ser 'pdf' o 'zip'")
+
+    db = SessionLocal()
+    try:
+        facturas = _facturas_lote(db, payload, usuario)
+        if not facturas:
+            raise HTTPException(status_code=404, detail="No hay comprobantes para el filtro indicado")
+        ctx = ContextoComprobantes(id_empresa=usuario.id_empresa)
+        ctx.precargar_ingresos(db, [str(f.ingreso_id) for f in facturas if f.ingreso_id])
+    finally:
+        db.close()
+
+    if formato == "zip":
+        return StreamingResponse(
+            _iterar_zip_comprobantes(facturas, ctx),
+            media_type="application/zip",
+            headers={"Content-Disposition": "attachment; filename=comprobantes.zip"},
+        )
+
+    buffer = BytesIO()
+    c = _nuevo_canvas_ticket(buffer)
+    omitidos = []
+    for factura in facturas:
+        try:
+            _dibujar_comprobante(c, factura, [], ctx)
+        except Exception as e:
+            logger.error(f"Error generando PDF de la factura {factura.id}: {e}", exc_info=True)
+            omitidos.append(str(factura.id))
+    c.save()
+    headers = {
+        "Content-Disposition": "attachment; filename=comprobantes.pdf",
+        "X-Comprobantes-Incluidos": str(len(facturas) - len(omitidos)),
+    }
+    if omitidos:
+        headers["X-Comprobantes-Omitidos"] = ",".join(omitidos)
+    return Response(content=buffer.getvalue(), media_type="application/pdf", headers=headers)
+
+
 def generar_pdf_nota_credito_ticket(factura: FacturaElectronica) -> bytes:
     if not REPORTLAB_AVAILABLE:
         raise RuntimeError("ReportLab no está instalado. Ejecute: pip install reportlab")
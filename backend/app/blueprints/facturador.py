@@ -1,14 +1,20 @@
-from fastapi import APIRouter, FastAPI, HTTPException, Request, status, Depends
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request, status, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
+import asyncio
+import json
 import logging
+import os
 
 from backend.utils.billige_manage import process_invoice_batch_for_endpoint
-from backend.database import SessionLocal, get_db
-from backend.modelos import FacturaElectronica, Usuario, Empresa
+from backend.database import SessionLocal
+from backend.modelos import FacturaElectronica, Usuario
 from backend.security import obtener_usuario_actual
 from backend.utils.afipTools import _cuit_solo_digitos
-from sqlmodel import select
+from backend.utils import coordinacion, facturacion_jobs, tenant_context
+from backend.utils.pool_bloqueante import en_hilo
+from backend import config
 from datetime import date
 import secrets
 
@@ -19,6 +25,9 @@ router = APIRouter(
     prefix="/facturador"
 )
 
+# Cada cuánto se relee el progreso de un job para GET /facturador/jobs/{id}/eventos
+_SSE_INTERVALO_SEC = float(os.getenv("FACTURACION_JOBS_SSE_INTERVALO_SEC", "1"))
+
 class ClienteDataPayload(BaseModel):
     cuit_o_dni: str = Field(..., description="CUIT o DNI del receptor. '0' para Consumidor Final.")
     nombre_razon_social: Optional[str] = Field(None, description="Nombre o Razón Social del receptor.")
@@ -61,31 +70,44 @@ async def create_batch_invoices(
     invoices: List[InvoiceItemPayload],
     max_parallel_workers: int = 5, # Permite al cliente especificar el número de workers, con un default
     usuario_actual: Usuario = Depends(obtener_usuario_actual),
-    db = Depends(get_db)
 ) -> List[Dict[str, Any]]:
     """
     endpoint para procesar facturas en lote.
     """
-    # Validar límite de 5 boletas
-    if len(invoices) > 5:
+    # Validar límite de boletas por lote (configurable, FACTURACION_MAX_BOLETAS_POR_LOTE)
+    invoices_for_processing = await _armar_lote(invoices, usuario_actual, config.FACTURACION_MAX_BOLETAS_POR_LOTE)
+
+    # Procesar (AFIP por httpx async; la BD de cada factura en el pool bloqueante)
+    results = await process_invoice_batch_for_endpoint(invoices_for_processing, max_parallel_workers)
+    
+    return results
+
+
+def _es_super_admin_api(usuario_actual: Usuario) -> bool:
+    return usuario_actual.id == 999 and usuario_actual.nombre_usuario == "sistema_api_key"
+
+
+async def _armar_lote(invoices: List[InvoiceItemPayload], usuario_actual: Usuario, max_boletas: int) -> List[Dict[str, Any]]:
+    """Valida el lote (tope, CUIT emisor de la empresa) y lo convierte a los dicts del motor de lotes."""
+    if len(invoices) > max_boletas:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, 
-            detail="Se permite facturar máximo 5 boletas por operación."
+            detail=f"Se permite facturar máximo {max_boletas} boletas por operación."
         )
 
     # --- VERIFICACIÓN DE BYPASS POR API KEY MAESTRA ---
     # Si el usuario es un "dummy" creado por API Key (id=999), saltamos la validación estricta de empresa.
-    es_super_admin_api = (usuario_actual.id == 999 and usuario_actual.nombre_usuario == "sistema_api_key")
+    es_super_admin_api = _es_super_admin_api(usuario_actual)
     
     logger.info(f"Recibida solicitud POST /bill/batch con {len(invoices)} facturas. Usuario: {usuario_actual.nombre_usuario} (SuperAdmin: {es_super_admin_api})")
 
     empresa_cuit = None
     if not es_super_admin_api:
-        # Obtener CUIT de la empresa del usuario normal
-        empresa = db.exec(select(Empresa).where(Empresa.id == usuario_actual.id_empresa)).first()
-        if not empresa:
+        # Obtener CUIT de la empresa del usuario normal (contexto cacheado; la BD fuera del event loop)
+        ctx = await en_hilo(tenant_context.obtener_contexto, usuario_actual.id_empresa)
+        if not ctx:
             raise HTTPException(status_code=500, detail="Empresa del usuario no encontrada.")
-        empresa_cuit = str(empresa.cuit)
+        empresa_cuit = str(ctx.cuit)
     
     # Convertir los modelos Pydantic a la lista de diccionarios que espera
     # process_invoice_batch_for_endpoint. Aquí también validamos la entrada.
@@ -152,10 +174,114 @@ async def create_batch_invoices(
 
         invoices_for_processing.append(item_dict)
 
-    # Procesar
-    results = await process_invoice_batch_for_endpoint(invoices_for_processing, max_parallel_workers)
-    
-    return results
+    return invoices_for_processing
+
+
+# ---------------------------------------------------------------------------
+# Jobs de facturación: el lote se encola y se procesa en segundo plano (utils/facturacion_jobs)
+# ---------------------------------------------------------------------------
+
+async def _job_visible(job_id: str, usuario_actual: Usuario) -> Dict[str, Any]:
+    """Resumen del job si existe y es de la empresa del usuario (la API Key maestra ve todos)."""
+    resumen = await en_hilo(facturacion_jobs.resumen_job, job_id)
+    if resumen is None or (not _es_super_admin_api(usuario_actual) and resumen["id_empresa"] != usuario_actual.id_empresa):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job no encontrado.")
+    return resumen
+
+
+@router.post("/jobs",
+          status_code=status.HTTP_202_ACCEPTED,
+          summary="Encola un lote de facturas y devuelve el id del job.",
+          description="Mismas validaciones que /facturar-por-cantidad. El progreso se consulta en "
+                      "GET /facturador/jobs/{job_id} o por SSE en GET /facturador/jobs/{job_id}/eventos.")
+async def crear_job_facturacion(
+    invoices: List[InvoiceItemPayload],
+    max_parallel_workers: int = 5,
+    usuario_actual: Usuario = Depends(obtener_usuario_actual),
+) -> Dict[str, Any]:
+    invoices_for_processing = await _armar_lote(invoices, usuario_actual, config.FACTURACION_MAX_BOLETAS_POR_JOB)
+    job_id = await en_hilo(
+        facturacion_jobs.crear_job, invoices_for_processing, usuario_actual.id_empresa, usuario_actual.id, max_parallel_workers
+    )
+    facturacion_jobs.notificar_jobs()
+    return {"job_id": job_id, "estado": facturacion_jobs.JOB_PENDIENTE, "total": len(invoices_for_processing)}
+
+
+@router.get("/jobs", summary="Últimos jobs de facturación de la empresa.")
+async def listar_jobs_facturacion(
+    limit: int = Query(20, ge=1, le=200),
+    usuario_actual: Usuario = Depends(obtener_usuario_actual),
+) -> List[Dict[str, Any]]:
+    id_empresa = None if _es_super_admin_api(usuario_actual) else usuario_actual.id_empresa
+    return await en_hilo(facturacion_jobs.listar_jobs, id_empresa, limit)
+
+
+@router.get("/jobs/{job_id}", summary="Estado y progreso de un job de facturación.")
+async def obtener_job_facturacion(job_id: str, usuario_actual: Usuario = Depends(obtener_usuario_actual)) -> Dict[str, Any]:
+    return await _job_visible(job_id, usuario_actual)
+
+
+@router.get("/jobs/{job_id}/items", summary="Resultado de cada boleta del job (paginado).")
+async def listar_items_job_facturacion(
+    job_id: str,
+    estado: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    usuario_actual: Usuario = Depends(obtener_usuario_actual),
+) -> List[Dict[str, Any]]:
+    await _job_visible(job_id, usuario_actual)
+    return await en_hilo(facturacion_jobs.listar_items, job_id, estado, limit, offset)
+
+
+@router.post("/jobs/{job_id}/cancelar", summary="Cancela las boletas que todavía no se enviaron a AFIP.")
+async def cancelar_job_facturacion(job_id: str, usuario_actual: Usuario = Depends(obtener_usuario_actual)) -> Dict[str, Any]:
+    resumen = await _job_visible(job_id, usuario_actual)
+    if not await en_hilo(facturacion_jobs.cancelar_job, job_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"El job ya terminó ({resumen['estado']}).")
+    return await _job_visible(job_id, usuario_actual)
+
+
+@router.get("/jobs/{job_id}/eventos", summary="Progreso del job por Server-Sent Events.")
+async def eventos_job_facturacion(
+    job_id: str,
+    request: Request,
+    usuario_actual: Usuario = Depends(obtener_usuario_actual),
+) -> StreamingResponse:
+    """Emite `progreso` cada vez que cambia el resumen y `fin` cuando el job termina.
+
+    EventSource no permite mandar el header Authorization: el frontend lo lee con fetch() y un
+    ReadableStream (o con la API Key si es una integración).
+    """
+    resumen = await _job_visible(job_id, usuario_actual)
+
+    async def _stream():
+        nonlocal resumen
+        ultimo = None
+        silencio = 0.0
+        while True:
+            datos = json.dumps(resumen, ensure_ascii=False)
+            if datos != ultimo:
+                ultimo = datos
+                silencio = 0.0
+                yield f"event: progreso\ndata: {datos}\n\n"
+            if resumen["estado"] in facturacion_jobs.JOB_TERMINALES:
+                yield f"event: fin\ndata: {datos}\n\n"
+                return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(_SSE_INTERVALO_SEC)
+            silencio += _SSE_INTERVALO_SEC
+            if silencio >= 15:
+                # Comentario SSE: mantiene viva la conexión a través de proxies
+                silencio = 0.0
+                yield ": ping\n\n"
+            resumen = await en_hilo(facturacion_jobs.resumen_job, job_id) or resumen
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 
@@ -164,159 +290,208 @@ class AnularAfipPayload(BaseModel):
     motivo: Optional[str] = None
     force: Optional[bool] = False
 
+def _buscar_factura_anular(db, factura_id: str) -> Optional[FacturaElectronica]:
+    # Intentar buscar por ID (si es numérico) o por ingreso_id/cae (si es alfanumérico)
+    row = None
+    
+    # 1. Intentar buscar por ID numérico si factura_id parece un entero
+    if factura_id.isdigit():
+        row = db.get(FacturaElectronica, int(factura_id))
+    
+    # 2. Si no se encontró por ID, intentar buscar por ingreso_id (el código alfanumérico del frontend)
+    if not row:
+        row = db.query(FacturaElectronica).filter(FacturaElectronica.ingreso_id == factura_id).first()
+        
+    # 3. Como último recurso, intentar por CAE
+    if not row:
+        row = db.query(FacturaElectronica).filter(FacturaElectronica.cae == factura_id).first()
+    return row
+
+
+def _preparar_anulacion(db, factura_id: str, body: Optional[AnularAfipPayload]):
+    """Factura a anular y payload de la NC para el microservicio (BD + credenciales, bloqueante).
+
+    Devuelve (row, payload_nc); payload_nc es None si la factura ya estaba anulada.
+    """
+    row = _buscar_factura_anular(db, factura_id)
+    if not row:
+        raise HTTPException(status_code=404, detail=f"Factura no encontrada (ID/Código: {factura_id})")
+    if getattr(row, "anulada", False) and not (body and body.force):
+        return row, None
+
+    tipo_origen = int(row.tipo_comprobante)
+    codigo_tipo = 13
+    if tipo_origen == 1:
+        codigo_tipo = 3
+    elif tipo_origen == 6:
+        codigo_tipo = 8
+
+    def _map_condicion_iva_to_id(nombre: str | None) -> int:
+        n = (nombre or '').strip().upper()
+        if n in {"RESPONSABLE_INSCRIPTO", "RI", "INSCRIPTO"}: return 1
+        if n in {"MONOTRIBUTO", "MONOTRIBUTISTA"}: return 5
+        if n in {"CONSUMIDOR_FINAL", "CF"}: return 5
+        if n in {"EXENTO"}: return 4
+        return 5
+    # Resolver id_condicion_iva desde configuración de empresa si disponible
+    id_cond_iva = 5
+    try:
+        ctx = tenant_context.contexto_por_cuit(row.cuit_emisor, db)
+        if ctx and ctx.afip_condicion_iva:
+            id_cond_iva = _map_condicion_iva_to_id(ctx.afip_condicion_iva)
+    except Exception:
+        id_cond_iva = 5
+    # Construir payload según guía del microservicio (multi-CUIT)
+    datos_factura = {
+        "tipo_afip": codigo_tipo,
+        "punto_venta": row.punto_venta,
+        "tipo_documento": row.tipo_doc_receptor,
+        "documento": str(row.nro_doc_receptor),
+        "total": float(row.importe_total),
+        "neto": float(row.importe_neto) if codigo_tipo in (3, 8) else float(row.importe_total),
+        "iva": float(row.importe_iva) if codigo_tipo in (3, 8) else 0.0,
+        "id_condicion_iva": id_cond_iva,
+        "asociado_tipo_afip": int(row.tipo_comprobante),
+        "asociado_punto_venta": int(row.punto_venta),
+        "asociado_numero_comprobante": int(row.numero_comprobante),
+        "asociado_fecha_comprobante": str(row.fecha_comprobante),
+    }
+    # Resolver credenciales del emisor (multi-tenant)
+    from backend.utils.afipTools import _resolve_afip_credentials, _sanitize_pem
+    
+    cuit_res, cert_res, key_res, fuente = _resolve_afip_credentials(str(row.cuit_emisor))
+    
+    if not (cuit_res and cert_res and key_res):
+         # Fallback: si no devolvió nada, intentar sin CUIT específico si se permite (aunque para NC debería ser el mismo emisor)
+         if not row.cuit_emisor:
+             cuit_res, cert_res, key_res, fuente = _resolve_afip_credentials(None)
+    
+    if not (cuit_res and cert_res and key_res):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Credenciales AFIP no disponibles para el CUIT emisor {row.cuit_emisor}")
+
+    credenciales = {
+        "cuit": str(cuit_res),
+        "certificado": _sanitize_pem(cert_res, 'cert'),
+        "clave_privada": _sanitize_pem(key_res, 'key'),
+    }
+    return row, {"credenciales": credenciales, "datos_factura": datos_factura}
+
+
+async def _solicitar_cae_nc(payload_nc: Dict[str, Any]) -> str:
+    """Pide la NC al microservicio con el cliente async (el event loop sigue atendiendo)."""
+    try:
+        import os
+        from backend.utils.microservicio_client import get_microservicio_client
+        client = get_microservicio_client()
+        bases = [
+            os.getenv("FACTURACION_API_URL", ""),
+            "https://facturador-ima.sistemataup.online/afipws/facturador",
+        ]
+        bases = [b for b in bases if b]
+        last_error: Optional[str] = None
+        cae_nc: Optional[str] = None
+        for base in bases:
+            base = base.rstrip("/")
+            url = f"{base}"
+            try:
+                logger.info(f"Llamando microservicio NC url={url}")
+                resp = await client.apost(url, json=payload_nc, headers={"Content-Type": "application/json"}, read_timeout=40)
+                ct = resp.headers.get("Content-Type", "")
+                text = resp.text
+                data = resp.json() if ct.startswith("application/json") else {}
+                if resp.status_code != 200:
+                    last_error = f"{resp.status_code} {str(data or text)[:500]}"
+                    logger.error(f"Microservicio respondió error: {last_error}")
+                    continue
+                cae_nc = str(data.get("cae") or data.get("CAE") or "").strip()
+                if cae_nc:
+                    break
+                last_error = "Respuesta sin CAE"
+                logger.error("Microservicio respondió sin CAE en JSON")
+            except Exception as e:
+                last_error = str(e)
+                logger.error(f"Falla al llamar microservicio: {e}", exc_info=True)
+                continue
+        if not cae_nc:
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"No se pudo obtener CAE de NC: {last_error}")
+        return cae_nc
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error llamando microservicio NC: {e}")
+
+
+def _registrar_anulacion(db, row: FacturaElectronica, cae_nc: str, body: Optional[AnularAfipPayload]) -> None:
+    # Persistir anulación con código NC emitido por AFIP
+    row.anulada = True
+    row.fecha_anulacion = date.today()
+    row.codigo_nota_credito = cae_nc
+    if body and body.motivo:
+        row.motivo_anulacion = body.motivo
+    db.add(row)
+    # Espejo IngresoSheets + marca "Anulada" pendiente para Sheets en la misma transacción
+    # (la envía el worker de sheets_outbox; la respuesta no espera a Google).
+    try:
+        from backend.utils.billige_manage import _resolver_sheet_emisor
+        from backend.utils.sheets_outbox import ACCION_ANULADO, actualizar_espejo_ingreso, encolar_marca_sheets
+        sheet_id, id_empresa = _resolver_sheet_emisor(str(row.cuit_emisor) if row.cuit_emisor else None)
+        with db.begin_nested():
+            actualizar_espejo_ingreso(db, str(row.ingreso_id), ACCION_ANULADO, id_empresa=id_empresa)
+            encolar_marca_sheets(db, str(row.ingreso_id), ACCION_ANULADO, sheet_id, id_empresa=id_empresa, factura_id=row.id)
+    except Exception as se:
+        logger.warning(f"Sheets: no se pudo encolar marca Anulada para ingreso_id={row.ingreso_id}: {se}")
+    db.commit()
+    try:
+        from backend.utils.sheets_outbox import notificar_outbox
+        notificar_outbox()
+    except Exception:
+        pass
+    try:
+        from backend.utils import render_cache
+        render_cache.invalidar_factura(row.id)
+    except Exception as ce:
+        logger.warning(f"No se pudo invalidar la caché de renders de la factura {row.id}: {ce}")
+
+
+def _releer_factura(db, row: FacturaElectronica) -> None:
+    db.rollback()
+    db.refresh(row)
+
+
 @router.post("/anular-afip/{factura_id}", status_code=status.HTTP_200_OK)
 async def anular_afip(factura_id: str, body: AnularAfipPayload | None = None) -> Dict[str, Any]:
     db = SessionLocal()
     try:
         logger.info(f"Inicio anulación AFIP factura_id={factura_id} force={bool(body and body.force)}")
-        
-        # Intentar buscar por ID (si es numérico) o por ingreso_id/cae (si es alfanumérico)
-        row = None
-        
-        # 1. Intentar buscar por ID numérico si factura_id parece un entero
-        if factura_id.isdigit():
-            row = db.get(FacturaElectronica, int(factura_id))
-        
-        # 2. Si no se encontró por ID, intentar buscar por ingreso_id (el código alfanumérico del frontend)
-        if not row:
-            row = db.query(FacturaElectronica).filter(FacturaElectronica.ingreso_id == factura_id).first()
-            
-        # 3. Como último recurso, intentar por CAE
-        if not row:
-            row = db.query(FacturaElectronica).filter(FacturaElectronica.cae == factura_id).first()
-            
-        if not row:
-            raise HTTPException(status_code=404, detail=f"Factura no encontrada (ID/Código: {factura_id})")
-        if getattr(row, "anulada", False) and not (body and body.force):
+        row, payload_nc = await en_hilo(_preparar_anulacion, db, factura_id, body)
+        if payload_nc is None:
             return {"status": "ALREADY", "factura_id": factura_id, "codigo_nota_credito": row.codigo_nota_credito}
-
-        tipo_origen = int(row.tipo_comprobante)
-        codigo_tipo = 13
-        if tipo_origen == 1:
-            codigo_tipo = 3
-        elif tipo_origen == 6:
-            codigo_tipo = 8
-
-        def _map_condicion_iva_to_id(nombre: str | None) -> int:
-            n = (nombre or '').strip().upper()
-            if n in {"RESPONSABLE_INSCRIPTO", "RI", "INSCRIPTO"}: return 1
-            if n in {"MONOTRIBUTO", "MONOTRIBUTISTA"}: return 5
-            if n in {"CONSUMIDOR_FINAL", "CF"}: return 5
-            if n in {"EXENTO"}: return 4
-            return 5
-        # Resolver id_condicion_iva desde configuración de empresa si disponible
-        id_cond_iva = 5
-        try:
-            from sqlmodel import select
-            from backend.modelos import Empresa, ConfiguracionEmpresa
-            empresa = db.exec(select(Empresa).where(Empresa.cuit == str(row.cuit_emisor))).first()
-            if empresa:
-                conf = db.exec(select(ConfiguracionEmpresa).where(ConfiguracionEmpresa.id_empresa == empresa.id)).first()
-                if conf and conf.afip_condicion_iva:
-                    id_cond_iva = _map_condicion_iva_to_id(conf.afip_condicion_iva)
-        except Exception:
-            id_cond_iva = 5
-        # Construir payload según guía del microservicio (multi-CUIT)
-        datos_factura = {
-            "tipo_afip": codigo_tipo,
-            "punto_venta": row.punto_venta,
-            "tipo_documento": row.tipo_doc_receptor,
-            "documento": str(row.nro_doc_receptor),
-            "total": float(row.importe_total),
-            "neto": float(row.importe_neto) if codigo_tipo in (3, 8) else float(row.importe_total),
-            "iva": float(row.importe_iva) if codigo_tipo in (3, 8) else 0.0,
-            "id_condicion_iva": id_cond_iva,
-            "asociado_tipo_afip": int(row.tipo_comprobante),
-            "asociado_punto_venta": int(row.punto_venta),
-            "asociado_numero_comprobante": int(row.numero_comprobante),
-            "asociado_fecha_comprobante": str(row.fecha_comprobante),
-        }
-        # Resolver credenciales del emisor (multi-tenant)
-        from backend.utils.afipTools import _resolve_afip_credentials, _sanitize_pem
-        
-        cuit_res, cert_res, key_res, fuente = _resolve_afip_credentials(str(row.cuit_emisor))
-        
-        if not (cuit_res and cert_res and key_res):
-             # Fallback: si no devolvió nada, intentar sin CUIT específico si se permite (aunque para NC debería ser el mismo emisor)
-             if not row.cuit_emisor:
-                 cuit_res, cert_res, key_res, fuente = _resolve_afip_credentials(None)
-        
-        if not (cuit_res and cert_res and key_res):
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Credenciales AFIP no disponibles para el CUIT emisor {row.cuit_emisor}")
-
-        credenciales = {
-            "cuit": str(cuit_res),
-            "certificado": _sanitize_pem(cert_res, 'cert'),
-            "clave_privada": _sanitize_pem(key_res, 'key'),
-        }
-        payload_nc = {"credenciales": credenciales, "datos_factura": datos_factura}
-        try:
-            import os, requests
-            bases = [
-                os.getenv("FACTURACION_API_URL", ""),
-                "https://facturador-ima.sistemataup.online/afipws/facturador",
-            ]
-            bases = [b for b in bases if b]
-            last_error: Optional[str] = None
-            cae_nc: Optional[str] = None
-            for base in bases:
-                base = base.rstrip("/")
-                url = f"{base}"
-                try:
-                    logger.info(f"Llamando microservicio NC url={url}")
-                    resp = requests.post(url, json=payload_nc, timeout=40, headers={"Content-Type": "application/json"})
-                    ct = resp.headers.get("Content-Type", "")
-                    text = resp.text
-                    data = resp.json() if ct.startswith("application/json") else {}
-                    if resp.status_code != 200:
-                        last_error = f"{resp.status_code} {str(data or text)[:500]}"
-                        logger.error(f"Microservicio respondió error: {last_error}")
-                        continue
-                    cae_nc = str(data.get("cae") or data.get("CAE") or "").strip()
-                    if cae_nc:
-                        break
-                    last_error = "Respuesta sin CAE"
-                    logger.error("Microservicio respondió sin CAE en JSON")
-                except Exception as e:
-                    last_error = str(e)
-                    logger.error(f"Falla al llamar microservicio: {e}", exc_info=True)
-                    continue
-            if not cae_nc:
-                raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"No se pudo obtener CAE de NC: {last_error}")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error llamando microservicio NC: {e}")
-
-        # Persistir anulación con código NC emitido por AFIP
-        from datetime import date
-        row.anulada = True
-        row.fecha_anulacion = date.today()
-        row.codigo_nota_credito = cae_nc
-        if body and body.motivo:
-            row.motivo_anulacion = body.motivo
-        db.add(row)
-        db.commit()
+        # Una sola NC a la vez por factura, también entre workers
+        nombre_lease = f"anulacion:{row.id}"
+        token_lease = await en_hilo(coordinacion.tomar_lease, nombre_lease, config.FACTURACION_LEASE_SEC)
+        if token_lease is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="La factura se está anulando en otro pedido")
         try:
-            from backend.utils.tablasHandler import TablasHandler
-            h = TablasHandler()
-            h.refrescar_drive()
-            _ok = h.marcar_boleta_anulada(str(row.ingreso_id))
-            if not _ok:
-                logger.warning(f"Sheets: no se pudo marcar Anulada para ingreso_id={row.ingreso_id}")
-        except Exception as se:
-            logger.warning(f"Sheets: error marcando Anulada: {se}")
+            # Otro pedido pudo terminar la anulación entre la lectura y el lease. Se cierra la
+            # transacción de _preparar_anulacion: en REPEATABLE READ el refresh vería la foto vieja.
+            await en_hilo(_releer_factura, db, row)
+            if getattr(row, "anulada", False) and not (body and body.force):
+                return {"status": "ALREADY", "factura_id": factura_id, "codigo_nota_credito": row.codigo_nota_credito}
+            cae_nc = await _solicitar_cae_nc(payload_nc)
+            await en_hilo(_registrar_anulacion, db, row, cae_nc, body)
+        finally:
+            await en_hilo(coordinacion.liberar_lease, nombre_lease, token_lease)
         return {"status": "OK", "factura_id": factura_id, "codigo_nota_credito": cae_nc}
     except HTTPException as he:
-        db.rollback()
+        await en_hilo(db.rollback)
         logger.error(f"Anulación AFIP error HTTP {he.status_code}: {he.detail}")
         raise
     except Exception as e:
-        db.rollback()
+        await en_hilo(db.rollback)
         logger.error(f"Error inesperado en anular_afip: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error interno procesando anulación")
     finally:
-        db.close()
+        await en_hilo(db.close)
 
 class AnularLotePayload(BaseModel):
     ids: List[str]
@@ -1,11 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, Response, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from backend.security import obtener_usuario_actual
 from backend.app.blueprints import boletas
-from typing import List
-from io import BytesIO
+from backend.utils import qr_render, render_cache
+from backend.utils.ticket_render import get_pool_render, render_ticket, detener_pool_render
+from backend.utils.zip_stream import ZipStream
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List
+import json
+import logging
+import os
 import zipfile
 
+logger = logging.getLogger(__name__)
+
+# Renders del pack en vuelo a la vez: acota la memoria (cada uno es un JPEG de ~50-150 KB)
+PACK_EN_VUELO = int(os.getenv('PACK_IMAGENES_EN_VUELO', '8'))
+
 router = APIRouter(prefix="/impresion")
 
 
@@ -39,46 +53,122 @@ def facturar_e_imprimir_img(ingreso_id: str, formato: str = Query('jpg', pattern
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/cache")
+def estado_cache_renders(usuario_actual = Depends(obtener_usuario_actual)):
+    """Métricas de la caché de renders (hits, misses, desalojos, bytes en disco) y del LRU de QRs."""
+    return {**render_cache.estadisticas(), "qr": qr_render.estadisticas()}
+
+
 class PackRequest(BaseModel):
     pass
 
 
+def _iterar_pack_imagenes(ingreso_ids: List[str], usuario_actual) -> Iterator[bytes]:
+    """Arma el ZIP a medida que terminan los renders y lo entrega por partes.
+
+    Boletas y facturas se resuelven en una búsqueda por lote; los tickets con CAE salen de
+    render_cache y el resto se renderiza en el pool de procesos de ticket_render (a lo sumo
+    PACK_EN_VUELO a la vez). manifest.json al final detalla el resultado de cada ID.
+    """
+    ids = list(dict.fromkeys(str(i).strip() for i in ingreso_ids if str(i).strip()))
+    boletas_por_id = boletas._buscar_boletas_por_ingreso(ids, usuario_actual)
+    facturas = boletas._buscar_facturas_db([i for i in ids if i in boletas_por_id])
+    manifest: List[Dict[str, Any]] = []
+    destino = ZipStream()
+    en_vuelo: Dict[Any, Dict[str, Any]] = {}
+
+    def _agregar(zf, ingreso, contenido, origen):
+        nombre = f"comprobante_{ingreso}.jpg"
+        # JPEG ya viene comprimido: se guarda sin deflate
+        zf.writestr(nombre, contenido, compress_type=zipfile.ZIP_STORED)
+        manifest.append({"id": ingreso, "ok": True, "archivo": nombre, "bytes": len(contenido), "origen": origen})
+
+    def _completar(zf, fut):
+        tarea = en_vuelo.pop(fut)
+        try:
+            contenido = fut.result()
+        except BrokenProcessPool:
+            # El pool murió (p. ej. un hijo sin memoria): se reinicia y este ticket se renderiza acá
+            detener_pool_render()
+            try:
+                contenido = render_ticket(tarea["datos"], "jpg")
+            except Exception as e:
+                manifest.append({"id": tarea["id"], "ok": False, "error": f"Error generando imagen: {e}"})
+                return
+        except Exception as e:
+            manifest.append({"id": tarea["id"], "ok": False, "error": f"Error generando imagen: {e}"})
+            return
+        if tarea["cacheable"]:
+            render_cache.guardar(tarea["factura_id"], tarea["cae"], "jpg", boletas.TICKET_TEMPLATE_VERSION, contenido)
+        _agregar(zf, tarea["id"], contenido, "render")
+
+    with zipfile.ZipFile(destino, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for ingreso in ids:
+            boleta = boletas_por_id.get(ingreso)
+            if boleta is None:
+                manifest.append({"id": ingreso, "ok": False, "status_code": 404, "error": "Boleta no encontrada"})
+                continue
+            if not boletas._autorizado_para_boleta(usuario_actual, boleta):
+                manifest.append({"id": ingreso, "ok": False, "status_code": 403, "error": "No autorizado"})
+                continue
+            afip_row = facturas.get(ingreso) or {}
+            cacheable = bool(afip_row.get('id') and afip_row.get('cae')) and not afip_row.get('anulada')
+            if cacheable:
+                cacheada = render_cache.obtener(afip_row['id'], afip_row['cae'], "jpg", boletas.TICKET_TEMPLATE_VERSION)
+                if cacheada is not None:
+                    _agregar(zf, ingreso, cacheada, "cache")
+                    yield destino.vaciar()
+                    continue
+            try:
+                datos = boletas.datos_ticket(boleta, afip_row or None)
+                fut = get_pool_render().submit(render_ticket, datos, "jpg")
+            except Exception as e:
+                manifest.append({"id": ingreso, "ok": False, "error": f"Error generando imagen: {e}"})
+                continue
+            en_vuelo[fut] = {
+                "id": ingreso,
+                "datos": datos,
+                "cacheable": cacheable,
+                "factura_id": afip_row.get('id'),
+                "cae": afip_row.get('cae'),
+            }
+            while len(en_vuelo) >= max(1, PACK_EN_VUELO):
+                listos, _ = wait(list(en_vuelo), return_when=FIRST_COMPLETED)
+                for fut_listo in listos:
+                    _completar(zf, fut_listo)
+                yield destino.vaciar()
+        while en_vuelo:
+            listos, _ = wait(list(en_vuelo), return_when=FIRST_COMPLETED)
+            for fut_listo in listos:
+                _completar(zf, fut_listo)
+            yield destino.vaciar()
+
+        resumen = {
+            "generado_en": datetime.now(timezone.utc).isoformat(),
+            "solicitados": len(ids),
+            "incluidos": sum(1 for m in manifest if m["ok"]),
+            "errores": sum(1 for m in manifest if not m["ok"]),
+            "entradas": manifest,
+        }
+        zf.writestr("manifest.json", json.dumps(resumen, ensure_ascii=False, indent=2))
+    yield destino.vaciar()
+
+
 @router.post("/pack-imagenes")
 def generar_pack_imagenes(ingreso_ids: List[str], usuario_actual = Depends(obtener_usuario_actual)):
     """Genera un ZIP con las imágenes JPEG (58mm) para una lista de ingreso_ids.
     Sólo incluirá boletas a las que el usuario tenga acceso (si no es admin, sólo su repartidor).
+    El ZIP se transmite a medida que se renderizan los tickets; manifest.json informa
+    el resultado de cada ID (incluido, no encontrado, no autorizado o error de render).
     """
-    try:
-        # Validación simple de la lista
-        if not isinstance(ingreso_ids, list) or len(ingreso_ids) == 0:
-            raise HTTPException(status_code=400, detail='Se requiere una lista de ingreso_ids')
-
-        zip_io = BytesIO()
-        with zipfile.ZipFile(zip_io, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
-            for ingreso in ingreso_ids:
-                try:
-                    # Llamar a la función que devuelve la imagen JPEG
-                    resp = boletas.imprimir_imagen_por_ingreso(ingreso, usuario_actual)
-                    if not isinstance(resp, Response):
-                        continue
-                    content = resp.body if hasattr(resp, 'body') else resp.content
-                    # Nombre de archivo dentro del zip
-                    filename = f"comprobante_{ingreso}.jpg"
-                    zf.writestr(filename, content)
-                except HTTPException:
-                    # Saltar boletas no encontradas o no autorizadas
-                    continue
-                except Exception:
-                    continue
-
-        zip_io.seek(0)
-        return Response(content=zip_io.read(), media_type='application/zip', headers={
-            'Content-Disposition': 'attachment; filename="boletas_imagenes.zip"'
-        })
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Validación simple de la lista
+    if not isinstance(ingreso_ids, list) or len(ingreso_ids) == 0:
+        raise HTTPException(status_code=400, detail='Se requiere una lista de ingreso_ids')
+    return StreamingResponse(
+        _iterar_pack_imagenes(ingreso_ids, usuario_actual),
+        media_type='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="boletas_imagenes.zip"'},
+    )
 
 
 @router.post("/test-imagenes")
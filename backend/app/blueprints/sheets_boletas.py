@@ -1,19 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query
 from datetime import datetime, date, timezone
 import time
 import os
 import json
 import logging
-import asyncio
 import re
+import hashlib
 from typing import Dict, Any, List, Optional
 
 from sqlmodel import select, desc, or_, func, Float
 from sqlalchemy import text
-from backend.database import get_db, SessionLocal
+from backend.database import get_db, SessionLocal, engine
 from backend.security import obtener_usuario_actual
-from backend.modelos import Usuario, IngresoSheets, FacturaElectronica, Empresa, ConfiguracionEmpresa
-from backend.utils.tablasHandler import TablasHandler
+from backend.modelos import Usuario, IngresoSheets, FacturaElectronica, SheetsSyncEstado
+from backend.utils.tablasHandler import TablasHandler, normalizar_fila_ingresos
+from backend.utils import ingresos_espejo, ingresos_stats, tenant_context
+from backend.utils.pool_bloqueante import en_hilo
+from backend.utils.sheets_sync_scheduler import (
+    ESTADO_PROGRAMADO,
+    estado_scheduler,
+    programar_sync,
+    sincronizar_y_esperar,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +31,13 @@ router = APIRouter(prefix="/sheets", tags=["sheets"])
 # Aumentado a 5 minutos para evitar error 429 (Quota Exceeded) de Google API
 SYNC_COOLDOWN_SEC = 300
 
+# Delta-sync de INGRESOS: en cada sync incremental se releen solo las últimas N filas ya
+# conocidas (donde suelen cambiar los estados) + las filas nuevas. Cada SYNC_FULL_CADA_HORAS
+# se hace una lectura completa para reconciliar ediciones en filas viejas.
+SYNC_VENTANA_FILAS = int(os.getenv('SHEETS_SYNC_VENTANA_FILAS', '300'))
+SYNC_FULL_CADA_HORAS = float(os.getenv('SHEETS_SYNC_FULL_CADA_HORAS', '24'))
+SYNC_LOTE_IDS = 1000
+
 def _parse_fecha_key(raw: Any) -> date | None:
     if not raw: return None
     if isinstance(raw, datetime): return raw.date()
@@ -72,9 +87,6 @@ def _parse_fecha_key(raw: Any) -> date | None:
         
     return None
 
-# Flag global para evitar múltiples sincronizaciones simultáneas
-_sync_in_progress = False
-
 def _extract_sheet_id(url: str) -> Optional[str]:
     if not url: return None
     # Match patterns like /d/1BxiMVs0XRA5nFMdKvBdBZjGMUUqptlbs74OgvE2upms/
@@ -159,106 +171,273 @@ def _ensure_ingresos_sheets_unique_index(db) -> bool:
 
     return True
 
+# Columnas agregadas a ingresos_sheets después de su creación (delta-sync y campos materializados)
+_COLUMNAS_INGRESOS_SHEETS = [
+    ("row_hash", "VARCHAR(40) NULL"),
+    ("repartidor", "VARCHAR(128) NULL"),
+    ("razon_social", "VARCHAR(255) NULL"),
+    ("cuit", "VARCHAR(20) NULL"),
+    ("total", "DECIMAL(14,2) NULL"),
+    ("estado", "VARCHAR(16) NULL"),
+]
+_INDICES_INGRESOS_SHEETS = [
+    ("ix_ingresos_sheets_empresa_estado_fecha", "(id_empresa, estado, fecha)"),
+    ("ix_ingresos_sheets_empresa_repartidor", "(id_empresa, repartidor)"),
+    ("ix_ingresos_sheets_empresa_cuit", "(id_empresa, cuit)"),
+]
+# FULLTEXT opcional (solo MySQL) para la búsqueda libre de /sheets/boletas
+SHEETS_FULLTEXT = os.getenv('SHEETS_FULLTEXT', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+_FULLTEXT_NOMBRE = "ft_ingresos_sheets_busqueda"
+_fulltext_disponible: Optional[bool] = None
+_columnas_aseguradas = False
+
+def _ensure_ingresos_sheets_columnas(db) -> bool:
+    """Agrega columnas / índices nuevos de ingresos_sheets si faltan (la migración formal está en scripts/)."""
+    global _fulltext_disponible, _columnas_aseguradas
+    if _columnas_aseguradas:
+        return True
+    try:
+        existentes = {str(r[0]) for r in db.exec(text("SHOW COLUMNS FROM ingresos_sheets")).all()}
+        indices = {str(r.Key_name) for r in db.exec(text("SHOW INDEX FROM ingresos_sheets")).all()}
+    except Exception:
+        return False
+
+    ok = True
+    for col, ddl in _COLUMNAS_INGRESOS_SHEETS:
+        if col in existentes:
+            continue
+        try:
+            db.exec(text(f"ALTER TABLE ingresos_sheets ADD COLUMN {col} {ddl}"))
+            db.commit()
+        except Exception as e:
+            try:
+                db.rollback()
+            except Exception:
+                pass
+            if "duplicate column" not in str(e).lower():
+                ok = False
+    for nombre, cols in _INDICES_INGRESOS_SHEETS:
+        if nombre in indices:
+            continue
+        try:
+            db.exec(text(f"CREATE INDEX {nombre} ON ingresos_sheets {cols}"))
+            db.commit()
+        except Exception:
+            try:
+                db.rollback()
+            except Exception:
+                pass
+    if SHEETS_FULLTEXT and _FULLTEXT_NOMBRE not in indices:
+        try:
+            db.exec(text(f"ALTER TABLE ingresos_sheets ADD FULLTEXT INDEX {_FULLTEXT_NOMBRE} (razon_social, repartidor)"))
+            db.commit()
+            indices.add(_FULLTEXT_NOMBRE)
+        except Exception as e:
+            try:
+                db.rollback()
+            except Exception:
+                pass
+            logger.warning(f"No se pudo crear el índice FULLTEXT de ingresos_sheets: {e}")
+    _fulltext_disponible = SHEETS_FULLTEXT and _FULLTEXT_NOMBRE in indices
+    _columnas_aseguradas = ok
+    return ok
+
+def _ensure_sheets_sync_estado() -> bool:
+    try:
+        SheetsSyncEstado.__table__.create(bind=engine, checkfirst=True)
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudo asegurar la tabla sheets_sync_estado: {e}")
+        return False
+
+def _es_error_cuota(e: Exception) -> bool:
+    msg = str(e).lower()
+    return "429" in msg or "quota" in msg or "rate limit" in msg or "resource exhausted" in msg
+
+def _sha1(texto: str) -> str:
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+def _hash_fila(headers_hash: str, fila: List[Any]) -> str:
+    # Hash de los valores crudos: detectar cambios sin armar el dict ni hacer json.dumps
+    return _sha1(headers_hash + "\x1e" + "\x1f".join(str(c) for c in fila))
+
+def _indice_columna_id(headers: List[str]) -> Optional[int]:
+    if "ID Ingresos" in headers:
+        return headers.index("ID Ingresos")
+    for i, h in enumerate(headers):
+        if str(h).lower().replace(' ', '').replace('_', '') in ('idingresos', 'idingreso', 'id'):
+            return i
+    return None
+
+def _fila_a_registro(headers: List[str], fila: List[Any]) -> Dict[str, Any]:
+    d: Dict[str, Any] = {}
+    for i, h in enumerate(headers):
+        if i < len(fila):
+            d[h] = fila[i]
+    return normalizar_fila_ingresos(d)
+
+def _id_de_registro(b: Dict[str, Any]) -> str:
+    return str(b.get('ID Ingresos') or b.get('id_ingreso') or b.get('id', '')).strip()
+
+def _leer_ingresos_para_sync(sheets_handler: TablasHandler, estado: Optional[SheetsSyncEstado], full_sync: bool) -> Dict[str, Any]:
+    """
+    Decide qué leer de INGRESOS y lo lee:
+    - SIN_CAMBIOS: lastUpdateTime de Drive igual al del último sync -> no se lee nada.
+    - DELTA: solo las últimas SYNC_VENTANA_FILAS filas ya conocidas + las filas nuevas (un rango).
+    - COMPLETA: toda la hoja (primer sync, full_sync, reconciliación periódica o ancla inválida).
+    - CSV: sin cliente gspread, fallback al CSV público vía cargar_ingresos().
+    """
+    if not sheets_handler.client:
+        return {"modo": "CSV", "registros": sheets_handler.cargar_ingresos() or [], "modificado": None}
+
+    modificado = sheets_handler.ultima_modificacion_ingresos()
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    completa = (
+        full_sync
+        or estado is None
+        or not estado.ultima_fila
+        or estado.ultima_full_at is None
+        or (ahora - estado.ultima_full_at).total_seconds() > SYNC_FULL_CADA_HORAS * 3600
+    )
+
+    if not completa and modificado and estado.modificado_en_sheets == modificado:
+        return {"modo": "SIN_CAMBIOS", "modificado": modificado}
+
+    if not completa:
+        desde = max(2, estado.ultima_fila - SYNC_VENTANA_FILAS + 1)
+        headers, filas = sheets_handler.leer_ingresos_desde(desde)
+        headers_hash = _sha1("\x1f".join(headers))
+        id_col = _indice_columna_id(headers)
+        ancla = dict(filas).get(estado.ultima_fila)
+        id_ancla = str(ancla[id_col]).strip() if ancla is not None and id_col is not None and id_col < len(ancla) else None
+        if headers_hash == estado.headers_hash and ancla is not None and id_ancla == (estado.ultima_id_ingreso or ""):
+            return {"modo": "DELTA", "headers": headers, "filas": filas, "modificado": modificado}
+        logger.info("🔀 DB-Sync: la hoja cambió por encima de la marca de agua (encabezados/borrados/reorden). Lectura completa.")
+
+    headers, filas = sheets_handler.leer_ingresos_desde(2)
+    return {"modo": "COMPLETA", "headers": headers, "filas": filas, "modificado": modificado}
+
 def _sync_sheets_to_db(full_sync: bool = False, id_empresa: int = 1, google_sheet_id: Optional[str] = None):
     """
     Función síncrona que descarga de Sheets y actualiza la tabla SQL 'ingresos_sheets'.
-    full_sync: Si es True, trae todo el histórico. Si es False, solo últimos 30 días.
+    full_sync: Si es True, relee toda la hoja. Si es False, delta-sync (ver _leer_ingresos_para_sync):
+        solo se leen las filas nuevas y una ventana de las últimas filas, y cada fila se compara por
+        su hash crudo (row_hash) sin re-serializarla.
     id_empresa: ID de la empresa para la que se sincroniza.
     google_sheet_id: ID del Google Sheet específico de la empresa.
+    Devuelve un resumen (modo, filas leídas, nuevos, actualizados) para las métricas del scheduler.
+    La exclusión por empresa la maneja utils/sheets_sync_scheduler.py: no llamar en paralelo
+    para la misma empresa por fuera del scheduler.
     """
-    global _sync_in_progress
-    if _sync_in_progress:
-        logger.info("⏭️ DB-Sync: Ya hay una sincronización en curso. Saltando.")
-        return
-
-    _sync_in_progress = True
-    sync_type = "COMPLETA" if full_sync else "INCREMENTAL (30 días)"
-    logger.info(f"🔄 DB-Sync ({sync_type}) Empresa {id_empresa}: Iniciando descarga desde Sheets...")
+    sync_type = "COMPLETA" if full_sync else "DELTA"
+    logger.info(f"🔄 DB-Sync ({sync_type}) Empresa {id_empresa}: Iniciando lectura desde Sheets...")
 
     # Variable para rastrear si actualizamos algo
     any_update_performed = False
 
     try:
         sheets_handler = TablasHandler(google_sheet_id=google_sheet_id)
-        try:
-            # En sync incremental, podríamos intentar traer menos datos si la librería lo permite,
-            # pero por ahora filtramos en Python para mantener la DB limpia de duplicados 
-            # y procesar solo lo necesario.
-            boletas = sheets_handler.cargar_ingresos() or []
-        except Exception as e:
-            es_cuota = (
-                "429" in str(e)
-                or "quota" in str(e).lower()
-                or "rate limit" in str(e).lower()
-                or "resource exhausted" in str(e).lower()
-            )
-            if es_cuota:
-                logger.warning(
-                    "⚠️ DB-Sync omitido: Google Sheets devolvió límite de lecturas (429/cuota). "
-                    "Se mantiene la copia en BD; reintentar en unos minutos o ampliar cuota en Google Cloud."
-                )
-                return
-            raise e
-
-        if not boletas:
-            logger.warning(
-                "⚠️ DB-Sync: INGRESOS devolvió 0 filas (hoja vacía o sin datos útiles). No se actualiza DB."
-            )
-            return
+        sheet_key = str(sheets_handler.google_sheet_id or "")
 
         db = SessionLocal()
         try:
             multi_empresa_enabled = _ensure_ingresos_sheets_id_empresa(db)
             if multi_empresa_enabled:
                 _ensure_ingresos_sheets_unique_index(db)
-            count_new = 0
-            count_updated = 0
-            
-            # Si no es full_sync, filtramos las boletas de los últimos 30 días
-            if not full_sync:
-                hoy = date.today()
-                from datetime import timedelta
-                hace_30_dias = hoy - timedelta(days=30)
-                
-                boletas_original_count = len(boletas)
-                boletas = [
-                    b for b in boletas 
-                    if _parse_fecha_key(b.get('Fecha') or b.get('fecha') or b.get('FECHA')) is None or 
-                       _parse_fecha_key(b.get('Fecha') or b.get('fecha') or b.get('FECHA')) >= hace_30_dias
-                ]
-                logger.info(f"📉 Sync Incremental: Procesando {len(boletas)} de {boletas_original_count} boletas (últimos 30 días).")
-
-            if not full_sync and boletas:
-                ids_a_procesar = [str(b.get('ID Ingresos') or b.get('id_ingreso') or b.get('id', '')).strip() for b in boletas]
-                ids_a_procesar = [id for id in ids_a_procesar if id]
-                q = select(IngresoSheets).where(IngresoSheets.id_ingreso.in_(ids_a_procesar))
+            _ensure_ingresos_sheets_columnas(db)
+            estado = None
+            if _ensure_sheets_sync_estado():
+                estado = db.exec(
+                    select(SheetsSyncEstado)
+                    .where(SheetsSyncEstado.id_empresa == id_empresa)
+                    .where(SheetsSyncEstado.google_sheet_id == sheet_key)
+                ).first()
+
+            try:
+                lectura = _leer_ingresos_para_sync(sheets_handler, estado, full_sync)
+            except Exception as e:
+                if _es_error_cuota(e):
+                    logger.warning(
+                        "⚠️ DB-Sync omitido: Google Sheets devolvió límite de lecturas (429/cuota). "
+                        "Se mantiene la copia en BD; reintentar en unos minutos o ampliar cuota en Google Cloud."
+                    )
+                    return {"estado": "CUOTA", "error": str(e)[:240]}
+                raise e
+
+            modo = lectura["modo"]
+            sync_time = datetime.now(timezone.utc)
+
+            # (id_ingreso, row_hash, fila cruda | None, registro normalizado | None)
+            items: List[tuple] = []
+            headers: List[str] = []
+            if modo == "CSV":
+                for b in lectura["registros"]:
+                    id_ingreso = _id_de_registro(b)
+                    if id_ingreso:
+                        items.append((id_ingreso, _sha1(json.dumps(b, ensure_ascii=False, sort_keys=True)), None, b))
+            elif modo != "SIN_CAMBIOS":
+                headers = lectura["headers"]
+                headers_hash = _sha1("\x1f".join(headers))
+                id_col = _indice_columna_id(headers)
+                for _, fila in lectura["filas"]:
+                    if not any(str(c or '').strip() for c in fila):
+                        continue
+                    if id_col is not None:
+                        id_ingreso = str(fila[id_col]).strip() if id_col < len(fila) else ""
+                        b = None
+                    else:
+                        b = _fila_a_registro(headers, fila)
+                        id_ingreso = _id_de_registro(b)
+                    if id_ingreso:
+                        items.append((id_ingreso, _hash_fila(headers_hash, fila), fila, b))
+
+            if modo in ("COMPLETA", "CSV") and not items:
+                logger.warning(
+                    "⚠️ DB-Sync: INGRESOS devolvió 0 filas (hoja vacía o sin datos útiles). No se actualiza DB."
+                )
+                return {"estado": "VACIA", "modo": modo, "filas_leidas": 0}
+
+            # Hashes guardados (consulta liviana, sin traer data_json)
+            hashes_db: Dict[str, Optional[str]] = {}
+            ids_leidos = list(dict.fromkeys(i[0] for i in items))
+            for pos in range(0, len(ids_leidos), SYNC_LOTE_IDS):
+                q = select(IngresoSheets.id_ingreso, IngresoSheets.row_hash).where(
+                    IngresoSheets.id_ingreso.in_(ids_leidos[pos:pos + SYNC_LOTE_IDS])
+                )
                 if multi_empresa_enabled:
                     q = q.where(IngresoSheets.id_empresa == id_empresa)
-                existing_objs = {obj.id_ingreso: obj for obj in db.exec(q).all()}
-            else:
-                q = select(IngresoSheets)
+                for id_ing, h in db.exec(q).all():
+                    hashes_db[id_ing] = h
+
+            cambiados = [i for i in items if hashes_db.get(i[0]) != i[1]]
+            existing_objs: Dict[str, IngresoSheets] = {}
+            ids_cambiados = [i[0] for i in cambiados if i[0] in hashes_db]
+            for pos in range(0, len(ids_cambiados), SYNC_LOTE_IDS):
+                q = select(IngresoSheets).where(IngresoSheets.id_ingreso.in_(ids_cambiados[pos:pos + SYNC_LOTE_IDS]))
                 if multi_empresa_enabled:
                     q = q.where(IngresoSheets.id_empresa == id_empresa)
-                existing_objs = {obj.id_ingreso: obj for obj in db.exec(q).all()}
-
-            # Fecha de sincronización de este lote
-            sync_time = datetime.now(timezone.utc)
+                for obj in db.exec(q).all():
+                    existing_objs[obj.id_ingreso] = obj
 
-            last_obj_processed = None # Guardamos el último objeto procesado
-
-            for b in boletas:
-                id_ingreso = str(b.get('ID Ingresos') or b.get('id_ingreso') or b.get('id', '')).strip()
-                if not id_ingreso: continue
+            count_new = 0
+            count_updated = 0
+            # Meses del resumen mensual a recalcular (fecha anterior y nueva de cada fila tocada)
+            periodos_tocados = set()
+            for id_ingreso, row_hash, fila, b in cambiados:
+                if b is None:
+                    b = _fila_a_registro(headers, fila)
+                    id_ingreso = _id_de_registro(b) or id_ingreso
 
                 fecha_val = _parse_fecha_key(b.get('Fecha') or b.get('fecha') or b.get('FECHA'))
                 facturacion_val = str(b.get('facturacion') or b.get('Facturacion', '')).strip()
                 data_json_val = json.dumps(b, ensure_ascii=False)
 
+                periodos_tocados.add(ingresos_stats.periodo_de(fecha_val))
                 if id_ingreso in existing_objs:
                     obj = existing_objs[id_ingreso]
-                    last_obj_processed = obj
+                    periodos_tocados.add(ingresos_stats.periodo_de(obj.fecha))
 
-                    # Verificamos si los datos REALES cambiaron
+                    # Verificamos si los datos REALES cambiaron (filas sin row_hash previo caen acá)
                     datos_cambiaron = (
                         obj.facturacion != facturacion_val or
                         obj.fecha != fecha_val or
@@ -270,9 +449,11 @@ def _sync_sheets_to_db(full_sync: bool = False, id_empresa: int = 1, google_shee
                         obj.facturacion = facturacion_val
                         obj.data_json = data_json_val
                         obj.last_synced_at = sync_time # Actualizamos fecha
-                        db.add(obj)
                         count_updated += 1
                         any_update_performed = True
+                    obj.row_hash = row_hash
+                    ingresos_espejo.aplicar_campos_materializados(obj, b)
+                    db.add(obj)
                 else:
                     new_obj_kwargs = dict(
                         id_ingreso=id_ingreso,
@@ -280,82 +461,155 @@ def _sync_sheets_to_db(full_sync: bool = False, id_empresa: int = 1, google_shee
                         facturacion=facturacion_val,
                         data_json=data_json_val,
                         last_synced_at=sync_time,
+                        row_hash=row_hash,
+                        **ingresos_espejo.campos_materializados(b),
                     )
                     if multi_empresa_enabled:
                         new_obj_kwargs["id_empresa"] = id_empresa
                     new_obj = IngresoSheets(**new_obj_kwargs)
                     db.add(new_obj)
                     existing_objs[id_ingreso] = new_obj
-                    last_obj_processed = new_obj
                     count_new += 1
                     any_update_performed = True
 
             # === EL FIX (Anti-Loop) ===
             # Si no hubo actualizaciones de datos (porque el sheet no cambió),
             # forzamos actualizar la fecha del último objeto para avisar que "ya revisamos".
-            if not any_update_performed and last_obj_processed:
-                last_obj_processed.last_synced_at = sync_time
-                db.add(last_obj_processed)
-                logger.info("⏱️ Sync sin cambios de datos: Actualizando timestamp para resetear cooldown.")
+            if not any_update_performed:
+                q = select(IngresoSheets)
+                if multi_empresa_enabled:
+                    q = q.where(IngresoSheets.id_empresa == id_empresa)
+                last_obj_processed = db.exec(q.order_by(desc(IngresoSheets.last_synced_at)).limit(1)).first()
+                if last_obj_processed:
+                    last_obj_processed.last_synced_at = sync_time
+                    db.add(last_obj_processed)
+                    logger.info("⏱️ Sync sin cambios de datos: Actualizando timestamp para resetear cooldown.")
+
+            # Marca de agua para el próximo delta
+            if modo != "CSV" and sheet_key and _ensure_sheets_sync_estado():
+                if estado is None:
+                    estado = SheetsSyncEstado(id_empresa=id_empresa, google_sheet_id=sheet_key)
+                ahora_naive = sync_time.replace(tzinfo=None)
+                if modo in ("DELTA", "COMPLETA"):
+                    filas = lectura["filas"]
+                    id_col = _indice_columna_id(headers)
+                    if filas:
+                        ultima_idx, ultima = filas[-1]
+                        estado.ultima_fila = ultima_idx
+                        estado.ultima_id_ingreso = (
+                            str(ultima[id_col]).strip() if id_col is not None and id_col < len(ultima) else ""
+                        )
+                    estado.headers_hash = _sha1("\x1f".join(headers))
+                if modo == "COMPLETA":
+                    estado.ultima_full_at = ahora_naive
+                estado.modificado_en_sheets = lectura.get("modificado")
+                estado.ultima_sync_at = ahora_naive
+                db.add(estado)
 
             db.commit()
-            logger.info(f"✅ DB-Sync: Completado. Nuevos: {count_new}, Actualizados: {count_updated}")
+            # Filas sincronizadas antes de existir las columnas materializadas (acotado por sync)
+            rellenadas = ingresos_espejo.rellenar_campos_materializados(
+                db, id_empresa if multi_empresa_enabled else None
+            )
+            if rellenadas:
+                logger.info(f"🧱 DB-Sync: {rellenadas} filas con columnas materializadas completadas.")
+            if multi_empresa_enabled:
+                try:
+                    # Lectura completa o totales recién rellenados: se recalculan todos los meses
+                    completo = modo in ("COMPLETA", "CSV") or rellenadas
+                    ingresos_stats.recalcular_resumen_mensual(
+                        db, id_empresa, None if completo else periodos_tocados
+                    )
+                except Exception as e:
+                    db.rollback()
+                    logger.warning(f"⚠️ DB-Sync: no se pudo actualizar el resumen mensual: {e}")
+            logger.info(
+                f"✅ DB-Sync ({modo}): Completado. Filas leídas: {len(items)}, "
+                f"sin cambios: {len(items) - len(cambiados)}, Nuevos: {count_new}, Actualizados: {count_updated}"
+            )
+            return {
+                "estado": "OK",
+                "modo": modo,
+                "filas_leidas": len(items),
+                "sin_cambios": len(items) - len(cambiados),
+                "nuevos": count_new,
+                "actualizados": count_updated,
+            }
 
         except Exception as e:
             db.rollback()
             logger.error(f"❌ DB-Sync Error insertando en BD: {e}")
+            return {"estado": "ERROR", "error": f"Error insertando en BD: {e}"}
         finally:
             db.close()
 
     except Exception as e:
         logger.error(f"❌ DB-Sync Error general: {e}")
-    finally:
-        _sync_in_progress = False
+        return {"estado": "ERROR", "error": str(e)}
 
-async def refresh_sheets_data_background(id_empresa: int, google_sheet_id: Optional[str]):
-    """Wrapper async para correr en background task"""
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, _sync_sheets_to_db, False, id_empresa, google_sheet_id)
+def _resolver_google_sheet_id(db, usuario: Usuario) -> Optional[str]:
+    """Google Sheet de la empresa del usuario (link_google_sheets o hotfix, ver utils/tenant_context)."""
+    try:
+        ctx = tenant_context.obtener_contexto(usuario.id_empresa, db)
+        return ctx.google_sheet_id if ctx else None
+    except Exception as e:
+        logger.error(f"Error obteniendo config empresa para usuario {usuario.nombre_usuario}: {e}")
+        return None
 
-@router.get("/boletas")
-async def obtener_boletas_desde_db(
-    background_tasks: BackgroundTasks,
-    db = Depends(get_db),
-    usuario: Usuario = Depends(obtener_usuario_actual),
-    tipo: Optional[str] = Query(None, description="Filtro: 'no-facturadas', 'facturadas', o None para todas"),
-    limit: int = Query(50, description="Tamaño de página"),
-    offset: int = Query(0, description="Cuántos saltar (para paginación)"),
-    search: Optional[str] = Query(None, description="Búsqueda por cliente, ID o repartidor"),
-    nocache: Optional[int] = Query(None, description="1 para forzar recarga síncrona"),
-    fecha_desde: Optional[str] = Query(None, description="YYYY-MM-DD"),
-    fecha_hasta: Optional[str] = Query(None, description="YYYY-MM-DD"),
-    status: Optional[str] = Query(None, description="Filtro para facturadas: 'activas' o 'anuladas'")
-) -> Dict[str, Any]:
-    """
-    Obtiene boletas directamente desde la Base de Datos (espejo de Sheets).
-    Dispara sincronización en background si es necesario.
+def _es_admin(usuario: Usuario) -> bool:
+    try:
+        return bool(usuario.rol and usuario.rol.nombre.lower() in ["admin", "administrador", "superadmin"])
+    except Exception:
+        return False
+
+def _contar_boletas_empresa(db, id_empresa: int) -> int:
+    q = select(func.count()).select_from(IngresoSheets)
+    if _ensure_ingresos_sheets_id_empresa(db):
+        q = q.where(IngresoSheets.id_empresa == id_empresa)
+    return int(db.exec(q).one() or 0)
+
+def _condicion_busqueda(search: str):
+    """Búsqueda libre: ID, CUIT, razón social y repartidor (columnas materializadas).
+
+    Con SHEETS_FULLTEXT=1 (MySQL) razón social / repartidor usan MATCH ... AGAINST; si no, LIKE
+    sobre columnas VARCHAR acotadas por el índice de empresa en lugar del TEXT data_json.
     """
+    termino = search.strip()
+    like = f"%{termino}%"
+    condiciones = [IngresoSheets.id_ingreso.like(like)]
+    digitos = re.sub(r"\D", "", termino)
+    if digitos and len(digitos) >= 3:
+        condiciones.append(IngresoSheets.cuit.like(f"%{digitos}%"))
+    palabras = [w for w in re.split(r"\s+", termino) if len(w) >= 3]
+    if _fulltext_disponible and palabras:
+        booleano = " ".join(f"+{re.sub(r'[^0-9A-Za-zÁÉÍÓÚÜÑáéíóúüñ]', '', w)}*" for w in palabras)
+        condiciones.append(
+            text("MATCH (ingresos_sheets.razon_social, ingresos_sheets.repartidor) AGAINST (:ft_q IN BOOLEAN MODE)")
+            .bindparams(ft_q=booleano)
+        )
+    else:
+        condiciones.append(IngresoSheets.razon_social.like(like))
+        condiciones.append(IngresoSheets.repartidor.like(like))
+    return or_(*condiciones)
 
+def _item_resumen(obj: IngresoSheets) -> Dict[str, Any]:
+    return {
+        "ID Ingresos": obj.id_ingreso,
+        "fecha": obj.fecha.isoformat() if obj.fecha else None,
+        "facturacion": obj.facturacion,
+        "estado": obj.estado,
+        "repartidor": obj.repartidor,
+        "razon_social": obj.razon_social,
+        "cuit": obj.cuit,
+        "total": float(obj.total) if obj.total is not None else None,
+    }
+
+def _estado_refresco_boletas(db, usuario: Usuario):
+    """(multi_empresa_enabled, google_sheet_id, should_refresh) para el listado de /boletas."""
     multi_empresa_enabled = _ensure_ingresos_sheets_id_empresa(db)
     if multi_empresa_enabled:
         _ensure_ingresos_sheets_unique_index(db)
-    google_sheet_id = None
-    try:
-        configuracion = db.exec(
-            select(ConfiguracionEmpresa).where(ConfiguracionEmpresa.id_empresa == usuario.id_empresa)
-        ).first()
-        if configuracion and configuracion.link_google_sheets:
-            google_sheet_id = _extract_sheet_id(configuracion.link_google_sheets)
-        
-        # Hotfix Swing Jugos: Si no hay config, verificar CUIT empresa
-        if not google_sheet_id:
-            empresa_obj = db.exec(select(Empresa).where(Empresa.id == usuario.id_empresa)).first()
-            if empresa_obj and str(empresa_obj.cuit) == "20364237740":
-                 google_sheet_id = "1yNrBzxXga0TpFOpMcAQw6xvQ2dSa0TC9P7F88eOLveM"
-                 logger.info(f"Aplicando Hotfix Sheet ID Swing Jugos para usuario {usuario.nombre_usuario}")
-
-    except Exception as e:
-        logger.error(f"Error obteniendo config empresa para usuario {usuario.nombre_usuario}: {e}")
+    google_sheet_id = _resolver_google_sheet_id(db, usuario)
 
     if multi_empresa_enabled:
         last_sync = db.exec(
@@ -379,36 +633,46 @@ async def obtener_boletas_desde_db(
         delta = datetime.now(timezone.utc) - last_sync_aware
         if delta.total_seconds() > SYNC_COOLDOWN_SEC:
             should_refresh = True
-            
-    if nocache == 1:
-        logger.info(f"⏳ Forzando sincronización síncrona (nocache=1) para Empresa {usuario.id_empresa}")
-        _sync_sheets_to_db(full_sync=False, id_empresa=usuario.id_empresa, google_sheet_id=google_sheet_id)
-    elif should_refresh:
-        logger.info(f"🕒 Datos antiguos (Empresa {usuario.id_empresa}), disparando sync en background")
-        background_tasks.add_task(refresh_sheets_data_background, usuario.id_empresa, google_sheet_id)
-        
+    return multi_empresa_enabled, google_sheet_id, should_refresh
+
+
+def _listar_boletas(
+    db,
+    usuario: Usuario,
+    multi_empresa_enabled: bool,
+    tipo: Optional[str],
+    limit: int,
+    offset: int,
+    search: Optional[str],
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str],
+    status: Optional[str],
+    campos: Optional[str],
+) -> Dict[str, Any]:
     query = select(IngresoSheets)
     
     if multi_empresa_enabled:
         query = query.where(IngresoSheets.id_empresa == usuario.id_empresa)
 
-    # Filtros base
-    query = query.where(IngresoSheets.facturacion != "")
+    # Filtros base sobre el estado materializado (índice id_empresa, estado, fecha).
+    # estado es NULL cuando la columna Facturacion está vacía.
+    query = query.where(IngresoSheets.estado.is_not(None))
     
     if tipo == "no-facturadas":
-        query = query.where(IngresoSheets.facturacion.notin_(['Facturado', 'Facturada', 'Anulada', 'Anulado', 'No falta facturar', 'No falta']))
+        query = query.where(IngresoSheets.estado.in_([ingresos_espejo.ESTADO_PENDIENTE, ingresos_espejo.ESTADO_OTRO]))
     elif tipo == "facturadas":
-        query = query.where(IngresoSheets.facturacion.in_(['Facturado', 'Facturada', 'Anulada', 'Anulado']))
+        if status == "activas":
+            query = query.where(IngresoSheets.estado == ingresos_espejo.ESTADO_FACTURADO)
+        elif status == "anuladas":
+            query = query.where(IngresoSheets.estado == ingresos_espejo.ESTADO_ANULADO)
+        else:
+            query = query.where(IngresoSheets.estado.in_([ingresos_espejo.ESTADO_FACTURADO, ingresos_espejo.ESTADO_ANULADO]))
     
     logger.info(f"Filtros recibidos: tipo={tipo}, limit={limit}, offset={offset}, search={search}, fecha_desde={fecha_desde}, fecha_hasta={fecha_hasta}, status={status}")
     
-    # --- NUEVO: Filtro de Búsqueda SQL (Case Insensitive) ---
+    # --- Filtro de Búsqueda SQL (Case Insensitive) sobre columnas materializadas ---
     if search:
-        search_term = f"%{search}%"
-        query = query.where(or_(
-            IngresoSheets.id_ingreso.like(search_term),
-            IngresoSheets.data_json.like(search_term)
-        ))
+        query = query.where(_condicion_busqueda(search))
 
     # Filtro Fechas
     d_desde = _parse_fecha_key(fecha_desde) if fecha_desde else None
@@ -443,6 +707,9 @@ async def obtener_boletas_desde_db(
     # 5. Respuesta
     items = []
     for obj in results:
+        if campos == "resumen":
+            items.append(_item_resumen(obj))
+            continue
         try:
             item = json.loads(obj.data_json)
             item['ID Ingresos'] = obj.id_ingreso
@@ -456,106 +723,136 @@ async def obtener_boletas_desde_db(
         "limit": limit
     }
 
+@router.get("/boletas")
+async def obtener_boletas_desde_db(
+    db = Depends(get_db),
+    usuario: Usuario = Depends(obtener_usuario_actual),
+    tipo: Optional[str] = Query(None, description="Filtro: 'no-facturadas', 'facturadas', o None para todas"),
+    limit: int = Query(50, description="Tamaño de página"),
+    offset: int = Query(0, description="Cuántos saltar (para paginación)"),
+    search: Optional[str] = Query(None, description="Búsqueda por cliente, ID o repartidor"),
+    nocache: Optional[int] = Query(None, description="1 para forzar recarga síncrona"),
+    fecha_desde: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    fecha_hasta: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    status: Optional[str] = Query(None, description="Filtro para facturadas: 'activas' o 'anuladas'"),
+    campos: Optional[str] = Query(None, description="'resumen' devuelve solo las columnas materializadas (sin decodificar data_json)")
+) -> Dict[str, Any]:
+    """
+    Obtiene boletas directamente desde la Base de Datos (espejo de Sheets).
+    Dispara sincronización en background si es necesario.
+    """
+
+    # Las consultas van al pool bloqueante: el handler es async (espera el sync) y no debe
+    # frenar el event loop mientras MySQL responde.
+    multi_empresa_enabled, google_sheet_id, should_refresh = await en_hilo(_estado_refresco_boletas, db, usuario)
+
+    if nocache == 1:
+        logger.info(f"⏳ Forzando sincronización (nocache=1) para Empresa {usuario.id_empresa}")
+        await sincronizar_y_esperar(usuario.id_empresa, google_sheet_id)
+    elif should_refresh:
+        # programar_sync puede consultar el lease de cooldown compartido (BD): fuera del event loop
+        estado_sync, _ = await en_hilo(programar_sync, usuario.id_empresa, google_sheet_id)
+        if estado_sync == ESTADO_PROGRAMADO:
+            logger.info(f"🕒 Datos antiguos (Empresa {usuario.id_empresa}), sync programado en background")
+        
+    return await en_hilo(
+        _listar_boletas, db, usuario, multi_empresa_enabled,
+        tipo, limit, offset, search, fecha_desde, fecha_hasta, status, campos,
+    )
+
 @router.post("/sincronizar")
 async def sincronizar_boletas(
+    db = Depends(get_db),
     usuario: Usuario = Depends(obtener_usuario_actual)
 ) -> Dict[str, Any]:
     """
-    Fuerza actualización síncrona DB <-> Sheets (Incremental - 30 días).
+    Fuerza actualización DB <-> Sheets (delta) de la empresa del usuario.
     """
     try:
-        # Ejecutar sync en el hilo principal (bloqueante pero seguro)
-        _sync_sheets_to_db(full_sync=False)
-        
-        # Contar total
-        db = SessionLocal()
-        total = db.query(IngresoSheets).count()
-        db.close()
+        google_sheet_id = await en_hilo(_resolver_google_sheet_id, db, usuario)
+        resultado = await sincronizar_y_esperar(usuario.id_empresa, google_sheet_id)
+        if resultado.get("estado") == "ERROR":
+            raise HTTPException(status_code=500, detail=f"Error sincronizando: {resultado.get('error') or resultado.get('detalle')}")
         
         return {
             "success": True,
             "message": "Sincronización incremental exitosa",
-            "total_boletas": total,
+            "total_boletas": await en_hilo(_contar_boletas_empresa, db, usuario.id_empresa),
+            "resultado": resultado,
             "timestamp": str(datetime.now())
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error en sincronización: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error sincronizando: {str(e)}")
 
 @router.post("/full-sync")
 async def sincronizar_completa(
+    db = Depends(get_db),
     usuario: Usuario = Depends(obtener_usuario_actual)
 ) -> Dict[str, Any]:
     """
-    Fuerza actualización síncrona DB <-> Sheets (Completa - Todo el histórico).
+    Fuerza actualización DB <-> Sheets (Completa - Todo el histórico) de la empresa del usuario.
     """
     # Solo permitir a administradores (opcional, dependiendo de la política)
-    if usuario.rol != "admin":
+    if not _es_admin(usuario):
         raise HTTPException(status_code=403, detail="No tiene permisos para realizar una sincronización completa.")
 
     try:
-        logger.info(f"🚀 Iniciando sincronización COMPLETA solicitada por {usuario.username}")
-        _sync_sheets_to_db(full_sync=True)
-        
-        db = SessionLocal()
-        total = db.query(IngresoSheets).count()
-        db.close()
+        logger.info(f"🚀 Iniciando sincronización COMPLETA (Empresa {usuario.id_empresa}) solicitada por {usuario.nombre_usuario}")
+        google_sheet_id = await en_hilo(_resolver_google_sheet_id, db, usuario)
+        resultado = await sincronizar_y_esperar(usuario.id_empresa, google_sheet_id, full_sync=True)
+        if resultado.get("estado") == "ERROR":
+            raise HTTPException(status_code=500, detail=f"Error sincronizando: {resultado.get('error') or resultado.get('detalle')}")
         
         return {
             "success": True,
             "message": "Sincronización completa exitosa",
-            "total_boletas": total,
+            "total_boletas": await en_hilo(_contar_boletas_empresa, db, usuario.id_empresa),
+            "resultado": resultado,
             "timestamp": str(datetime.now())
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error en sincronización completa: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error sincronizando: {str(e)}")
 
+@router.get("/sync/estado")
+async def estado_sincronizacion(
+    usuario: Usuario = Depends(obtener_usuario_actual)
+) -> Dict[str, Any]:
+    """
+    Estado del scheduler de sincronización: cola, syncs en curso y métricas del último sync
+    (duración, filas procesadas) por empresa. Los administradores ven todas las empresas.
+    """
+    return estado_scheduler(id_empresa=None if _es_admin(usuario) else usuario.id_empresa)
+
+@router.get("/outbox")
+def estado_outbox_sheets(
+    usuario: Usuario = Depends(obtener_usuario_actual)
+) -> Dict[str, Any]:
+    """
+    Estado de la cola de marcas Facturado/Anulada pendientes de escribir en Google Sheets.
+    """
+    try:
+        from backend.utils.sheets_outbox import resumen_outbox
+        return resumen_outbox(id_empresa=usuario.id_empresa)
+    except Exception as e:
+        logger.error(f"Error leyendo sheets_outbox: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error leyendo outbox: {str(e)}")
+
 @router.get("/stats/mensuales")
-async def obtener_stats_mensuales(
+def obtener_stats_mensuales(
     db = Depends(get_db),
     usuario: Usuario = Depends(obtener_usuario_actual)
 ) -> List[Dict[str, Any]]:
     """
-    Obtiene totales de registros agrupados por mes y año (Versión segura para formatos de moneda).
+    Cantidad de boletas y total de ingresos por mes (últimos 12) de la empresa del usuario.
+    Se lee del resumen mensual que mantiene el sync (ver utils/ingresos_stats.py).
     """
-    # Traemos fecha y el JSON crudo para procesar en Python (más seguro con formatos de moneda)
-    query = select(IngresoSheets.fecha, IngresoSheets.data_json).where(IngresoSheets.fecha != None)
-    results = db.exec(query).all()
-    
-    stats_dict = {}
-    
-    for row in results:
-        if not row.fecha:
-            continue
-            
-        # Clave Mes: "2024-05"
-        mes_key = row.fecha.strftime("%Y-%m")
-        if mes_key not in stats_dict:
-            year, month = mes_key.split('-')
-            stats_dict[mes_key] = {
-                "periodo": mes_key,
-                "year": int(year),
-                "month": int(month),
-                "cantidad": 0,
-                "total_ingresos": 0.0
-            }
-            
-        # Parseo seguro del dinero desde el JSON
-        try:
-            data = json.loads(row.data_json)
-            # Buscamos 'INGRESOS' o 'ingresos'
-            raw_ingreso = str(data.get('INGRESOS') or data.get('ingresos') or '0')
-            
-            # Limpiar símbolos de moneda y convertir formato latino (1.500,00) a SQL float (1500.00)
-            # Primero quitamos el símbolo $, luego los puntos de miles, y finalmente cambiamos la coma decimal por punto.
-            clean_ingreso = raw_ingreso.replace('$', '').replace('.', '').replace(',', '.').strip()
-            monto = float(clean_ingreso)
-        except Exception:
-            monto = 0.0
-            
-        stats_dict[mes_key]["cantidad"] += 1
-        stats_dict[mes_key]["total_ingresos"] += monto
-
-    # Ordenar por periodo descendente y devolver los últimos 12 meses
-    return sorted(stats_dict.values(), key=lambda x: x['periodo'], reverse=True)[:12]
+    if not _ensure_ingresos_sheets_id_empresa(db):
+        raise HTTPException(status_code=503, detail="ingresos_sheets sin columna id_empresa; ejecutar la migración")
+    _ensure_ingresos_sheets_columnas(db)
+    return ingresos_stats.stats_mensuales(db, usuario.id_empresa)
@@ -5,7 +5,7 @@ from sqlmodel import Session, select
 
 from backend.database import get_db
 from backend.modelos import Usuario, Rol, Empresa
-from backend.security import obtener_usuario_actual, get_password_hash
+from backend.security import obtener_usuario_actual, get_password_hash, invalidar_usuario_cache
 
 router = APIRouter(prefix="/usuarios", tags=["Usuarios (MySQL)"])
 
@@ -99,6 +99,9 @@ def actualizar_usuario(username: str, data: UsuarioUpdate, db: Session = Depends
         db.add(u)
         db.commit()
         db.refresh(u)
+        # Rol, clave, estado o nombre cambiaron: las sesiones cacheadas no valen más
+        invalidar_usuario_cache(username)
+        invalidar_usuario_cache(u.nombre_usuario)
     return {"detail": "ok"}
 
 
@@ -110,6 +113,7 @@ def desactivar_usuario(username: str, db: Session = Depends(get_db), usuario_act
     u.activo = False
     db.add(u)
     db.commit()
+    invalidar_usuario_cache(username)
     return {"detail": "desactivado"}
 
 
@@ -141,6 +145,7 @@ def rename_batch(payload: List[dict] = Body(...), db: Session = Depends(get_db),
         u.activo = True
         db.add(u)
         db.commit()
+        invalidar_usuario_cache(origen)
         resultados.append({"origen": origen, "ok": True})
     return {"resultados": resultados}
 
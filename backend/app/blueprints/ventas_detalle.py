@@ -3,24 +3,15 @@ Endpoint para obtener el detalle de conceptos/productos de una venta
 """
 from fastapi import APIRouter, HTTPException, Depends
 from typing import List, Dict, Any
-import pymysql
 import logging
 from backend.security import obtener_usuario_actual
 from backend.modelos import Usuario
+from backend.utils.mysql_handler import get_ventas_connection
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/ventas", tags=["ventas"])
 
-# Configuración de conexión a la BD gestion_ima_db
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'gestion_user',
-    'password': 'SistemaIMA123.',
-    'database': 'gestion_ima_db',
-    'charset': 'utf8mb4',
-    'cursorclass': pymysql.cursors.DictCursor
-}
 
 @router.get("/{venta_id}/conceptos")
 async def get_venta_conceptos(
@@ -33,9 +24,12 @@ async def get_venta_conceptos(
     Retorna lista de conceptos con: descripcion, cantidad, precio_unitario, subtotal
     """
     try:
-        connection = pymysql.connect(**DB_CONFIG)
+        # Conexión del pool de la base de ventas (VENTAS_DB_*), sin handshake por request
+        connection = get_ventas_connection()
+        if connection is None:
+            raise HTTPException(status_code=503, detail="Base de ventas no disponible")
         try:
-            with connection.cursor() as cursor:
+            with connection.cursor(dictionary=True) as cursor:
                 # Intentar primero por ID numérico, luego por ingreso_id
                 # Determinar si es un número o string
                 try:
@@ -95,6 +89,8 @@ async def get_venta_conceptos(
         finally:
             connection.close()
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo conceptos de venta {venta_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error obteniendo conceptos: {str(e)}")
@@ -110,9 +106,12 @@ async def marcar_venta_facturada(
     Acepta tanto ID numérico como ingreso_id (string).
     """
     try:
-        connection = pymysql.connect(**DB_CONFIG)
+        # Conexión del pool de la base de ventas (VENTAS_DB_*), sin handshake por request
+        connection = get_ventas_connection()
+        if connection is None:
+            raise HTTPException(status_code=503, detail="Base de ventas no disponible")
         try:
-            with connection.cursor() as cursor:
+            with connection.cursor(dictionary=True) as cursor:
                 # Buscar la venta por ID o ingreso_id
                 try:
                     venta_id_num = int(venta_id)
@@ -113,6 +113,27 @@ AFIP_PUNTO_VENTA : str | None = os.getenv("AFIP_PUNTO_VENTA")
     # URL del microservicio de facturación
 FACTURACION_API_URL: str = os.getenv("FACTURACION_API_URL", "http://localhost:8002/afipws/facturador")
 
+# Cliente HTTP compartido hacia el microservicio (utils/microservicio_client.py)
+FACTURACION_HTTP_CONNECT_TIMEOUT: float = float(os.getenv("FACTURACION_HTTP_CONNECT_TIMEOUT", "5"))
+FACTURACION_HTTP_READ_TIMEOUT: float = float(os.getenv("FACTURACION_HTTP_READ_TIMEOUT", "20"))
+FACTURACION_HTTP_POOL_MAXSIZE: int = int(os.getenv("FACTURACION_HTTP_POOL_MAXSIZE", "20"))
+# HTTP/2 para el cliente async (requiere el paquete opcional 'h2')
+FACTURACION_HTTP2: bool = _parse_bool(os.getenv("FACTURACION_HTTP2"), False)
+
+# Concurrencia del motor de lotes (billige_manage.process_invoice_batch_for_endpoint)
+# - FACTURACION_MAX_BOLETAS_POR_LOTE: tope de boletas por request a /facturador/facturar-por-cantidad
+# - FACTURACION_BATCH_MAX_WORKERS: techo de hilos por lote (el cliente puede pedir menos, nunca más)
+# - FACTURACION_MAX_CONCURRENCIA_POR_EMISOR: llamadas simultáneas al microservicio por CUIT emisor
+FACTURACION_MAX_BOLETAS_POR_LOTE: int = int(os.getenv("FACTURACION_MAX_BOLETAS_POR_LOTE", "200"))
+FACTURACION_BATCH_MAX_WORKERS: int = int(os.getenv("FACTURACION_BATCH_MAX_WORKERS", "10"))
+FACTURACION_MAX_CONCURRENCIA_POR_EMISOR: int = int(os.getenv("FACTURACION_MAX_CONCURRENCIA_POR_EMISOR", "4"))
+# - FACTURACION_LEASE_SEC: lease por ingreso mientras se factura (utils/coordinacion); cubre los
+#   reintentos de tenacity. Con varios workers es lo que impide mandar dos veces el mismo ingreso a AFIP.
+FACTURACION_LEASE_SEC: float = float(os.getenv("FACTURACION_LEASE_SEC", "300"))
+# - FACTURACION_MAX_BOLETAS_POR_JOB: tope de boletas por job de POST /facturador/jobs (no mantiene
+#   el request abierto, por eso admite lotes más grandes; ver utils/facturacion_jobs)
+FACTURACION_MAX_BOLETAS_POR_JOB: int = int(os.getenv("FACTURACION_MAX_BOLETAS_POR_JOB", "2000"))
+
 #===========================FIN FACTURADOR=========================================
 
 
@@ -2,7 +2,9 @@
 # VERSIÓN CORREGIDA Y COMPATIBLE
 
 import os
+from typing import Any, Dict
 from sqlmodel import create_engine, Session, SQLModel
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
@@ -36,19 +38,85 @@ if not all([DB_USER, DB_PASSWORD, DB_HOST, DB_NAME]):
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 print(f"[DB] DATABASE_URL destino (ocultando password): mysql+pymysql://{DB_USER}:***@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 
-# Aumentamos el pool de conexiones para evitar QueuePool limit errors en procesos de fondo (DB-Sync)
-engine = create_engine(
-    DATABASE_URL, 
-    echo=False, # Reducimos verbosidad en producción si es posible, o mantenemos True si prefieres debug
-    pool_size=20, 
-    max_overflow=40,
-    pool_recycle=3600,
-    pool_pre_ping=True
-)
+# Pool único por proceso: lo usan las sesiones SQLModel, mysql_handler.get_db_connection y
+# ventas_detalle. Los tamaños son por worker (con N workers de uvicorn/gunicorn el total de
+# conexiones es N * (DB_POOL_SIZE + DB_MAX_OVERFLOW)).
+DB_POOL_SIZE = int(_get("DB_POOL_SIZE") or "20")
+DB_MAX_OVERFLOW = int(_get("DB_MAX_OVERFLOW") or "40")
+DB_POOL_RECYCLE = int(_get("DB_POOL_RECYCLE") or "3600")
+DB_POOL_TIMEOUT = int(_get("DB_POOL_TIMEOUT") or "30")
+
+_metricas_pool: Dict[str, Dict[str, int]] = {}
+_engines: Dict[str, Any] = {}
+
+
+def _registrar_metricas(nombre: str, eng) -> None:
+    m = _metricas_pool.setdefault(nombre, {"conexiones_nuevas": 0, "checkouts": 0, "invalidadas": 0})
+
+    @event.listens_for(eng, "connect")
+    def _on_connect(dbapi_conn, conn_record):
+        m["conexiones_nuevas"] += 1
+
+    @event.listens_for(eng, "checkout")
+    def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+        m["checkouts"] += 1
+
+    @event.listens_for(eng, "invalidate")
+    def _on_invalidate(dbapi_conn, conn_record, exception):
+        m["invalidadas"] += 1
+
+
+def crear_engine(nombre: str, url: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+    """Engine con pool y métricas; queda registrado en pool_metricas() bajo `nombre`."""
+    eng = create_engine(
+        url,
+        echo=False,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True
+    )
+    _registrar_metricas(nombre, eng)
+    _engines[nombre] = eng
+    return eng
+
+
+engine = crear_engine("principal", DATABASE_URL)
+
+
+def _descartar_pools_heredados() -> None:
+    # Con fork después de importar (gunicorn --preload) el hijo no debe reusar las conexiones del
+    # padre: se olvidan sin cerrarlas (el padre sigue usándolas) y cada worker abre las suyas.
+    for eng in _engines.values():
+        eng.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_descartar_pools_heredados)
+
+# Réplica de lectura opcional para listados (DB_REPLICA_HOST; usuario/clave/base/puerto caen en los
+# del primario). Sin réplica, engine_lectura es el mismo engine principal.
+DB_REPLICA_HOST = _get("DB_REPLICA_HOST")
+if DB_REPLICA_HOST:
+    _replica_url = (
+        f"mysql+pymysql://{_get('DB_REPLICA_USER') or DB_USER}:{_get('DB_REPLICA_PASSWORD') or DB_PASSWORD}"
+        f"@{DB_REPLICA_HOST}:{_get('DB_REPLICA_PORT') or DB_PORT}/{_get('DB_REPLICA_NAME') or DB_NAME}"
+    )
+    print(f"[DB] Réplica de lectura: {DB_REPLICA_HOST}")
+    engine_lectura = crear_engine(
+        "replica", _replica_url,
+        pool_size=int(_get("DB_REPLICA_POOL_SIZE") or DB_POOL_SIZE),
+        max_overflow=int(_get("DB_REPLICA_MAX_OVERFLOW") or DB_MAX_OVERFLOW),
+    )
+else:
+    engine_lectura = engine
 
 # --- ESTA ES LA ADICIÓN CLAVE ---
 # Creamos una "Fábrica de Sesiones" que puede ser importada y usada por scripts externos.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=Session) # <--- 2. AÑADIMOS ESTA LÍNEA
+# Sesiones de solo lectura para listados (réplica si DB_REPLICA_HOST está configurado)
+SessionLectura = sessionmaker(autocommit=False, autoflush=False, bind=engine_lectura, class_=Session)
 
 # --- TU CÓDIGO ORIGINAL SE MANTIENE ---
 # Esta función sigue siendo perfecta para la inyección de dependencias de FastAPI.
@@ -59,6 +127,21 @@ def get_db():
     finally:
         db.close()
 
+def pool_metricas() -> Dict[str, Dict[str, Any]]:
+    """Estado de cada pool: tamaño, conexiones en uso/libres, overflow y contadores acumulados."""
+    resultado: Dict[str, Dict[str, Any]] = {}
+    for nombre, eng in _engines.items():
+        pool = eng.pool
+        info: Dict[str, Any] = dict(_metricas_pool.get(nombre, {}))
+        for clave, metodo in (("tamano", "size"), ("en_uso", "checkedout"), ("libres", "checkedin"), ("overflow", "overflow")):
+            try:
+                info[clave] = getattr(pool, metodo)()
+            except Exception:
+                info[clave] = None
+        info["max_overflow"] = getattr(pool, "_max_overflow", None)
+        resultado[nombre] = info
+    return resultado
+
 def create_db_and_tables():
     # Para evitar importaciones circulares, importamos los modelos aquí dentro
     from backend import modelos 
@@ -148,6 +148,23 @@ def startup_event():
     if conn:
         print("✅ Conexión a la base de datos MySQL verificada exitosamente.")
         conn.close()
+        # Columnas nuevas del espejo ingresos_sheets (delta-sync, campos materializados); la migración formal está en scripts/
+        try:
+            from backend.database import SessionLocal
+            from backend.app.blueprints.sheets_boletas import _ensure_ingresos_sheets_columnas
+            _db = SessionLocal()
+            try:
+                _ensure_ingresos_sheets_columnas(_db)
+            finally:
+                _db.close()
+        except Exception as e:
+            print(f"⚠️  No se pudo verificar las columnas de ingresos_sheets: {e}")
+        # Leases y generaciones de caché compartidos entre workers (la migración formal está en scripts/)
+        try:
+            from backend.utils.coordinacion import asegurar_tablas_coordinacion
+            asegurar_tablas_coordinacion()
+        except Exception as e:
+            print(f"⚠️  No se pudo verificar las tablas de coordinación: {e}")
     else:
         dev_mode = os.getenv('DEV_MODE', '0') == '1'
         if dev_mode:
@@ -156,9 +173,28 @@ def startup_event():
             print("❌ ERROR CRÍTICO: No se pudo conectar a la base de datos MySQL.")
             # En producción podrías decidir cerrar la app; aquí solo lo registramos.
     
+    # Con varios workers la coordinación tiene que ser compartida (ver utils/coordinacion.py)
+    try:
+        from backend.utils import coordinacion
+        workers = int(os.getenv("WEB_CONCURRENCY", "1") or "1")
+        print(f"ℹ️  Worker pid={os.getpid()} de {workers} | coordinación: {coordinacion.backend_activo()}")
+        if workers > 1 and coordinacion.backend_activo() == "local":
+            print("⚠️  WEB_CONCURRENCY > 1 con COORDINACION_BACKEND=local: leases y cachés no se comparten entre workers.")
+    except Exception:
+        pass
+
     if config.GOOGLE_SHEET_ID:
         print(f"ℹ️  Google Sheets configurado para reportes (ID: {config.GOOGLE_SHEET_ID[:10]}...).")
 
+    # Worker que drena sheets_outbox (marcas Facturado/Anulada pendientes en Google Sheets)
+    if os.getenv('SHEETS_OUTBOX_WORKER', '1').strip().lower() in ('1', 'true', 'yes', 'on'):
+        try:
+            from backend.utils.sheets_outbox import iniciar_worker_outbox
+            if iniciar_worker_outbox():
+                print("✅ Worker de sheets_outbox iniciado.")
+        except Exception as e:
+            print(f"⚠️  No se pudo iniciar el worker de sheets_outbox: {e}")
+
     # Listar rutas para depuración
     try:
         print("--- Rutas registradas ---")
@@ -173,6 +209,54 @@ def startup_event():
         pass
 
 
+@app.on_event("startup")
+async def startup_jobs_event():
+    # Worker de jobs de facturación (POST /facturador/jobs). Son tareas asyncio: tienen que
+    # arrancar dentro del event loop de uvicorn, por eso no van en startup_event.
+    if os.getenv('FACTURACION_JOBS_WORKER', '1').strip().lower() in ('1', 'true', 'yes', 'on'):
+        try:
+            from backend.utils.facturacion_jobs import JOBS_WORKERS, iniciar_worker_jobs
+            if iniciar_worker_jobs():
+                print(f"✅ Worker de jobs de facturación iniciado ({JOBS_WORKERS} jobs simultáneos).")
+        except Exception as e:
+            print(f"⚠️  No se pudo iniciar el worker de jobs de facturación: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Detiene el worker de jobs, el de sheets_outbox, el scheduler de syncs, el pool de render y cierra el pool HTTP hacia el microservicio."""
+    try:
+        # Primero: sus boletas en vuelo todavía usan el cliente HTTP y el pool bloqueante
+        from backend.utils.facturacion_jobs import detener_worker_jobs
+        await detener_worker_jobs()
+    except Exception as e:
+        print(f"⚠️  No se pudo detener el worker de jobs de facturación: {e}")
+    try:
+        from backend.utils.sheets_sync_scheduler import detener_scheduler
+        detener_scheduler()
+    except Exception as e:
+        print(f"⚠️  No se pudo detener el scheduler de sincronización: {e}")
+    try:
+        from backend.utils.sheets_outbox import detener_worker_outbox
+        detener_worker_outbox()
+    except Exception as e:
+        print(f"⚠️  No se pudo detener el worker de sheets_outbox: {e}")
+    try:
+        from backend.utils.ticket_render import detener_pool_render
+        detener_pool_render()
+    except Exception as e:
+        print(f"⚠️  No se pudo detener el pool de render de tickets: {e}")
+    try:
+        from backend.utils.microservicio_client import cerrar_microservicio_client
+        await cerrar_microservicio_client()
+    except Exception as e:
+        print(f"⚠️  No se pudo cerrar el cliente del microservicio: {e}")
+    try:
+        from backend.utils.pool_bloqueante import detener_pool_bloqueante
+        detener_pool_bloqueante()
+    except Exception as e:
+        print(f"⚠️  No se pudo detener el pool de hilos bloqueantes: {e}")
+
 
 @app.get("/saludo")
 def read_root():
@@ -205,6 +289,23 @@ def healthz():
         "google_sheets": bool(config.GOOGLE_SHEET_ID),
     }
 
+
+@app.get("/healthz/db-pool", tags=["infra"], summary="Métricas de los pools de conexiones")
+def healthz_db_pool():
+    """Estado de los pools de este worker (principal, réplica y ventas si ya se usaron) y del pool
+    de hilos donde los endpoints async hacen su trabajo de BD."""
+    from backend.database import pool_metricas
+    from backend.utils import pool_bloqueante
+    return {"pid": os.getpid(), "pools": pool_metricas(), "hilos_bloqueantes": pool_bloqueante.estadisticas()}
+
+
+@app.get("/metrics", tags=["infra"], summary="Métricas de facturación en formato Prometheus")
+def metrics():
+    """Histogramas por etapa, reintentos, errores y colas de este worker (texto de Prometheus)."""
+    from fastapi.responses import Response
+    from backend.utils import metricas
+    return Response(metricas.exposicion(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Al final del montaje de routers:
 if admin_empresa:
     app.include_router(admin_empresa.router)
\ No newline at end of file
@@ -4,7 +4,7 @@ from datetime import datetime, date, timezone
 from decimal import Decimal
 from typing import Any, Dict, List, Optional
 from sqlmodel import Field, Relationship, SQLModel, JSON, Column
-from sqlalchemy import DECIMAL, TIMESTAMP, BigInteger, Date, UniqueConstraint, func, Text
+from sqlalchemy import DECIMAL, TIMESTAMP, BigInteger, Date, Index, UniqueConstraint, func, Text
 from sqlmodel import Column  # Importante
 from sqlalchemy import String   # Importante
 # ===================================================================
@@ -400,6 +400,8 @@ class ArticuloProveedor(SQLModel, table=True):
 
 class FacturaElectronica(SQLModel, table=True):
     __tablename__ = "facturas_electronicas"
+    # Listado por emisor paginado por cursor (ver utils/facturas_listado.py)
+    __table_args__ = (Index("ix_facturas_cuit_emisor_id", "cuit_emisor", "id"),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
     # --- CAMBIO AQUÍ: El índice se define de forma estándar en el Field ---
@@ -485,6 +487,12 @@ class IngresoSheets(SQLModel, table=True):
     Se actualiza mediante sincronización (background o manual).
     """
     __tablename__ = "ingresos_sheets"
+    # Listados por empresa + estado + rango de fechas (/sheets/boletas, utils/ingresos_espejo.py)
+    __table_args__ = (
+        Index("ix_ingresos_sheets_empresa_estado_fecha", "id_empresa", "estado", "fecha"),
+        Index("ix_ingresos_sheets_empresa_repartidor", "id_empresa", "repartidor"),
+        Index("ix_ingresos_sheets_empresa_cuit", "id_empresa", "cuit"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     id_ingreso: str = Field(index=True, description="ID en Google Sheets (ID Ingresos)")
@@ -496,10 +504,138 @@ class IngresoSheets(SQLModel, table=True):
     # Datos adicionales (serializados o columnas individuales según necesidad de búsqueda)
     # Para simplicidad y flexibilidad, guardamos todo el objeto JSON crudo, pero extraemos lo vital.
     data_json: str = Field(sa_column=Column(Text), description="JSON completo de la fila de Sheets")
+
+    # Campos calientes extraídos de data_json en el sync (búsquedas sin LIKE sobre el TEXT)
+    repartidor: Optional[str] = Field(default=None, max_length=128)
+    razon_social: Optional[str] = Field(default=None, max_length=255)
+    cuit: Optional[str] = Field(default=None, max_length=20, description="CUIT/DNI del receptor (solo dígitos)")
+    total: Optional[Decimal] = Field(default=None, sa_column=Column(DECIMAL(14, 2)))
+    estado: Optional[str] = Field(default=None, max_length=16, description="PENDIENTE | FACTURADO | ANULADO | NO_FACTURAR | OTRO")
     
     # Metadatos de sincronización
     last_synced_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # sha1 de la fila cruda de Sheets: el delta-sync saltea filas sin cambios sin re-serializarlas
+    row_hash: Optional[str] = Field(default=None, max_length=40)
     
     # --- MULTI-EMPRESA ---
     id_empresa: int = Field(default=1, index=True) # Default 1 para compatibilidad temporal
 
+
+
+class SheetsOutbox(SQLModel, table=True):
+    """
+    Cola durable de marcas pendientes en Google Sheets (pestaña INGRESOS).
+    La facturación / anulación inserta aquí en la misma transacción que la factura y el espejo
+    IngresoSheets; un worker en segundo plano (utils/sheets_outbox.py) la drena en lotes.
+    """
+    __tablename__ = "sheets_outbox"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    id_empresa: Optional[int] = Field(default=None, index=True)
+    google_sheet_id: str = Field(max_length=128, index=True)
+    id_ingreso: str = Field(max_length=64, index=True)
+    accion: str = Field(max_length=16, description="FACTURADO | ANULADO")
+    estado: str = Field(default="PENDIENTE", max_length=16, index=True, description="PENDIENTE | PROCESANDO | ENVIADO | ERROR")
+    intentos: int = Field(default=0)
+    proximo_intento_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None), index=True)
+    ultimo_error: Optional[str] = Field(default=None, sa_column=Column(Text))
+    factura_id: Optional[int] = Field(default=None)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+
+
+class SheetsSyncEstado(SQLModel, table=True):
+    """
+    Marca de agua del delta-sync INGRESOS -> ingresos_sheets, por empresa y hoja.
+    `ultima_fila` / `ultima_id_ingreso` anclan la última fila leída: si la fila ancla cambió
+    (borrados, reordenamientos) el próximo sync vuelve a leer la hoja completa.
+    """
+    __tablename__ = "sheets_sync_estado"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    id_empresa: int = Field(default=1, index=True)
+    google_sheet_id: str = Field(max_length=128, index=True)
+    ultima_fila: int = Field(default=0, description="Última fila (1-based) leída de INGRESOS")
+    ultima_id_ingreso: Optional[str] = Field(default=None, max_length=64)
+    headers_hash: Optional[str] = Field(default=None, max_length=40)
+    modificado_en_sheets: Optional[str] = Field(default=None, max_length=64, description="lastUpdateTime de Drive en el último sync")
+    ultima_sync_at: Optional[datetime] = Field(default=None)
+    ultima_full_at: Optional[datetime] = Field(default=None)
+
+
+class IngresoResumenMensual(SQLModel, table=True):
+    """
+    Totales mensuales del espejo ingresos_sheets por empresa (dashboard /sheets/stats/mensuales).
+    Lo mantiene el sync: solo se recalculan los meses tocados por las filas nuevas o modificadas.
+    """
+    __tablename__ = "ingresos_resumen_mensual"
+    __table_args__ = (UniqueConstraint("id_empresa", "periodo", name="uq_resumen_mensual_empresa_periodo"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    id_empresa: int = Field(index=True)
+    periodo: str = Field(max_length=7, description="YYYY-MM")
+    cantidad: int = Field(default=0)
+    total_ingresos: Decimal = Field(default=Decimal("0"), sa_column=Column(DECIMAL(16, 2)))
+    actualizado_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+
+
+class CoordinacionLease(SQLModel, table=True):
+    """
+    Leases con vencimiento entre workers (utils/coordinacion.py): ingreso que se está facturando,
+    factura que se está anulando, cooldown de syncs de Sheets. Si el proceso dueño muere, vence solo.
+    """
+    __tablename__ = "coordinacion_leases"
+
+    nombre: str = Field(primary_key=True, max_length=191)
+    dueno: str = Field(max_length=64, description="pid:token del worker que lo tomó")
+    vence_at: datetime = Field(index=True)
+
+
+class CoordinacionGeneracion(SQLModel, table=True):
+    """Contador por caché (credenciales AFIP, contexto de empresa, usuarios): al incrementarlo los
+    demás workers descartan su copia en memoria."""
+    __tablename__ = "coordinacion_generaciones"
+
+    espacio: str = Field(primary_key=True, max_length=64)
+    generacion: int = Field(default=0)
+    actualizado_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+
+
+class FacturacionJob(SQLModel, table=True):
+    """
+    Lote de facturación asíncrono (POST /facturador/jobs). Lo procesa en segundo plano el worker de
+    utils/facturacion_jobs.py; `dueno` / `lease_hasta` indican qué proceso lo tiene tomado y, si
+    ese proceso muere, otro lo retoma desde los ítems pendientes.
+    """
+    __tablename__ = "facturacion_jobs"
+
+    id: str = Field(primary_key=True, max_length=32)
+    id_empresa: Optional[int] = Field(default=None, index=True)
+    id_usuario: Optional[int] = Field(default=None)
+    estado: str = Field(default="PENDIENTE", max_length=24, index=True, description="PENDIENTE | EN_CURSO | COMPLETADO | COMPLETADO_CON_ERRORES | CANCELADO")
+    total_items: int = Field(default=0)
+    max_workers: int = Field(default=5)
+    dueno: Optional[str] = Field(default=None, max_length=64)
+    lease_hasta: Optional[datetime] = Field(default=None, index=True)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None), index=True)
+    started_at: Optional[datetime] = Field(default=None)
+    finished_at: Optional[datetime] = Field(default=None)
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+
+
+class FacturacionJobItem(SQLModel, table=True):
+    """Una boleta de un FacturacionJob: payload tal como lo arma el endpoint y resultado del pipeline."""
+    __tablename__ = "facturacion_job_items"
+    __table_args__ = (Index("ix_facturacion_job_items_job_estado", "job_id", "estado"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: str = Field(max_length=32, index=True)
+    posicion: int = Field(default=0)
+    ingreso_id: Optional[str] = Field(default=None, max_length=64, index=True)
+    estado: str = Field(default="PENDIENTE", max_length=16, description="PENDIENTE | PROCESANDO | OK | DUPLICADA | ERROR | ERROR_DB | CANCELADA")
+    intentos: int = Field(default=0)
+    proximo_intento_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+    payload: str = Field(sa_column=Column(Text, nullable=False))
+    resultado: Optional[str] = Field(default=None, sa_column=Column(Text))
+    error: Optional[str] = Field(default=None, sa_column=Column(Text))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
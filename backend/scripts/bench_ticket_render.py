@@ -0,0 +1,84 @@
+"""
+Benchmark del render de tickets: tiempo por ticket de cada motor de utils/ticket_render.py.
+
+  python backend/scripts/bench_ticket_render.py [--n 50] [--formato jpg]
+
+- weasyprint: HTML (plantilla) + layout WeasyPrint + PNG -> JPEG (camino anterior).
+- raster: dibujo directo con Pillow (motor por defecto).
+Usa una boleta sintética con CAE y QR; no toca BD ni Google Sheets.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from backend.utils import ticket_render
+
+DATOS = {
+    'nro_comprobante': 1234,
+    'emisor_razon': 'DISTRIBUIDORA EJEMPLO S.A.',
+    'emisor_cuit': '30712345678',
+    'emisor_iva': 'RESPONSABLE_INSCRIPTO',
+    'emisor_domicilio': 'Av. Siempre Viva 742 - Córdoba',
+    'tipo_label': 'Factura B',
+    'encabezado': 'Pto Vta 0003 - Nº 00001234',
+    'fecha': '2026-05-01',
+    'consumidor_final': False,
+    'receptor_nombre': 'Juan Pérez',
+    'receptor_doc': '20111222333',
+    'receptor_iva': 'MONOTRIBUTO',
+    'items': [
+        {'descripcion': f'Producto {i}', 'cantidad': '2', 'precio': '1.500,00', 'subtotal': '3.000,00'}
+        for i in range(6)
+    ],
+    'detalle_text': '',
+    'total': '18.000,00',
+    'cae': '74112233445566',
+    'cae_vto': '2026-05-11',
+    'qr': 'https://www.afip.gob.ar/fe/qr/?p=eyJ2ZXIiOjEsImZlY2hhIjoiMjAyNi0wNS0wMSJ9',
+    'mismatch': '',
+    'leyendas': ['Comprobante autorizado por AFIP', 'Factura Electrónica'],
+    'raw_response': {},
+}
+
+
+def medir(nombre, fn, n):
+    try:
+        fn()  # calentamiento: fuentes, QR y plantilla quedan cacheados
+    except Exception as e:
+        print(f"SKIP {nombre}: {e}")
+        return None
+    tiempos = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - t0) * 1000.0)
+    tiempos.sort()
+    res = {
+        'media_ms': round(statistics.mean(tiempos), 2),
+        'p50_ms': round(tiempos[len(tiempos) // 2], 2),
+        'p95_ms': round(tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))], 2),
+    }
+    print(f"{nombre:<12} media {res['media_ms']:>8} ms  p50 {res['p50_ms']:>8} ms  p95 {res['p95_ms']:>8} ms")
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de motores de render de tickets')
+    parser.add_argument('--n', type=int, default=50)
+    parser.add_argument('--formato', default='jpg', choices=['jpg', 'png'])
+    args = parser.parse_args()
+
+    print(f"Tickets por motor: {args.n} ({args.formato})")
+    antes = medir('weasyprint', lambda: ticket_render.render_ticket_image(ticket_render.html_ticket(DATOS), args.formato), args.n)
+    despues = medir('raster', lambda: ticket_render.render_ticket_raster(DATOS, args.formato), args.n)
+    if antes and despues and despues['media_ms'] > 0:
+        print(f"Aceleración: x{antes['media_ms'] / despues['media_ms']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import sys
+from sqlalchemy import text as sa_text
+from backend.database import SessionLocal
+
+def table_exists(db, table):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """)
+    return bool(db.execute(q, {"table": table}).scalar())
+
+def main():
+    db = SessionLocal()
+    try:
+        # Leases entre workers (utils/coordinacion.py)
+        if not table_exists(db, "coordinacion_leases"):
+            db.execute(sa_text("""
+                CREATE TABLE coordinacion_leases (
+                    nombre VARCHAR(191) NOT NULL PRIMARY KEY,
+                    dueno VARCHAR(64) NOT NULL,
+                    vence_at DATETIME NOT NULL,
+                    INDEX ix_coordinacion_leases_vence_at (vence_at)
+                )
+            """))
+            print("OK: Tabla coordinacion_leases creada")
+        else:
+            print("SKIP: Tabla coordinacion_leases ya existe")
+        # Generaciones de cachés en memoria (invalidación entre workers)
+        if not table_exists(db, "coordinacion_generaciones"):
+            db.execute(sa_text("""
+                CREATE TABLE coordinacion_generaciones (
+                    espacio VARCHAR(64) NOT NULL PRIMARY KEY,
+                    generacion INTEGER NOT NULL DEFAULT 0,
+                    actualizado_at DATETIME NOT NULL
+                )
+            """))
+            print("OK: Tabla coordinacion_generaciones creada")
+        else:
+            print("SKIP: Tabla coordinacion_generaciones ya existe")
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR en migración: {e}")
+        sys.exit(2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import sys
+from sqlalchemy import text as sa_text
+from backend.database import SessionLocal
+
+def table_exists(db, table):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """)
+    return bool(db.execute(q, {"table": table}).scalar())
+
+def main():
+    db = SessionLocal()
+    try:
+        # Jobs de facturación asíncronos (utils/facturacion_jobs.py)
+        if not table_exists(db, "facturacion_jobs"):
+            db.execute(sa_text("""
+                CREATE TABLE facturacion_jobs (
+                    id VARCHAR(32) NOT NULL PRIMARY KEY,
+                    id_empresa INTEGER NULL,
+                    id_usuario INTEGER NULL,
+                    estado VARCHAR(24) NOT NULL DEFAULT 'PENDIENTE',
+                    total_items INTEGER NOT NULL DEFAULT 0,
+                    max_workers INTEGER NOT NULL DEFAULT 5,
+                    dueno VARCHAR(64) NULL,
+                    lease_hasta DATETIME NULL,
+                    created_at DATETIME NOT NULL,
+                    started_at DATETIME NULL,
+                    finished_at DATETIME NULL,
+                    updated_at DATETIME NOT NULL,
+                    INDEX ix_facturacion_jobs_id_empresa (id_empresa),
+                    INDEX ix_facturacion_jobs_estado (estado),
+                    INDEX ix_facturacion_jobs_lease_hasta (lease_hasta),
+                    INDEX ix_facturacion_jobs_created_at (created_at)
+                )
+            """))
+            print("OK: Tabla facturacion_jobs creada")
+        else:
+            print("SKIP: Tabla facturacion_jobs ya existe")
+        # Una fila por boleta del job (payload, estado, intentos y resultado)
+        if not table_exists(db, "facturacion_job_items"):
+            db.execute(sa_text("""
+                CREATE TABLE facturacion_job_items (
+                    id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    job_id VARCHAR(32) NOT NULL,
+                    posicion INTEGER NOT NULL DEFAULT 0,
+                    ingreso_id VARCHAR(64) NULL,
+                    estado VARCHAR(16) NOT NULL DEFAULT 'PENDIENTE',
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    proximo_intento_at DATETIME NOT NULL,
+                    payload TEXT NOT NULL,
+                    resultado TEXT NULL,
+                    error TEXT NULL,
+                    updated_at DATETIME NOT NULL,
+                    INDEX ix_facturacion_job_items_job_id (job_id),
+                    INDEX ix_facturacion_job_items_ingreso_id (ingreso_id),
+                    INDEX ix_facturacion_job_items_job_estado (job_id, estado)
+                )
+            """))
+            print("OK: Tabla facturacion_job_items creada")
+        else:
+            print("SKIP: Tabla facturacion_job_items ya existe")
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR en migración: {e}")
+        sys.exit(2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import sys
+from sqlalchemy import text as sa_text
+from backend.database import SessionLocal
+
+def index_exists(db, table, index):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME = :index
+    """)
+    return bool(db.execute(q, {"table": table, "index": index}).scalar())
+
+def main():
+    db = SessionLocal()
+    try:
+        # Índice del listado de facturadas por cursor: WHERE cuit_emisor = ? AND id < ? ORDER BY id DESC
+        if not index_exists(db, "facturas_electronicas", "ix_facturas_cuit_emisor_id"):
+            db.execute(sa_text("CREATE INDEX ix_facturas_cuit_emisor_id ON facturas_electronicas (cuit_emisor, id)"))
+            db.commit()
+            print("OK: Índice ix_facturas_cuit_emisor_id creado")
+        else:
+            print("SKIP: Índice ix_facturas_cuit_emisor_id ya existe")
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR en migración: {e}")
+        sys.exit(2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
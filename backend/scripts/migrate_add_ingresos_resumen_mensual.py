@@ -0,0 +1,49 @@
+import sys
+from sqlalchemy import text as sa_text
+from backend.database import SessionLocal
+from backend.utils.ingresos_stats import recalcular_resumen_mensual
+
+def table_exists(db, table):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """)
+    return bool(db.execute(q, {"table": table}).scalar())
+
+def main():
+    db = SessionLocal()
+    try:
+        if not table_exists(db, "ingresos_resumen_mensual"):
+            db.execute(sa_text("""
+                CREATE TABLE ingresos_resumen_mensual (
+                    id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    id_empresa INTEGER NOT NULL,
+                    periodo VARCHAR(7) NOT NULL,
+                    cantidad INTEGER NOT NULL DEFAULT 0,
+                    total_ingresos DECIMAL(16,2) NULL,
+                    actualizado_at DATETIME NOT NULL,
+                    INDEX ix_ingresos_resumen_mensual_id_empresa (id_empresa),
+                    UNIQUE KEY uq_resumen_mensual_empresa_periodo (id_empresa, periodo)
+                )
+            """))
+            db.commit()
+            print("OK: Tabla ingresos_resumen_mensual creada")
+        else:
+            print("SKIP: Tabla ingresos_resumen_mensual ya existe")
+
+        # Carga inicial desde el espejo (GROUP BY por empresa sobre la columna total)
+        empresas = [r[0] for r in db.execute(sa_text(
+            "SELECT DISTINCT id_empresa FROM ingresos_sheets WHERE id_empresa IS NOT NULL"
+        )).all()]
+        for id_empresa in empresas:
+            meses = recalcular_resumen_mensual(db, int(id_empresa))
+            print(f"OK: Empresa {id_empresa}: {meses} meses en el resumen")
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR en migración: {e}")
+        sys.exit(2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
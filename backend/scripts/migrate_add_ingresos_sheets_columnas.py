@@ -0,0 +1,81 @@
+import os
+import sys
+from sqlalchemy import text as sa_text
+from backend.database import SessionLocal
+from backend.utils.ingresos_espejo import rellenar_campos_materializados
+
+COLUMNAS = [
+    ("repartidor", "VARCHAR(128) NULL"),
+    ("razon_social", "VARCHAR(255) NULL"),
+    ("cuit", "VARCHAR(20) NULL"),
+    ("total", "DECIMAL(14,2) NULL"),
+    ("estado", "VARCHAR(16) NULL"),
+]
+INDICES = [
+    ("ix_ingresos_sheets_empresa_estado_fecha", "(id_empresa, estado, fecha)"),
+    ("ix_ingresos_sheets_empresa_repartidor", "(id_empresa, repartidor)"),
+    ("ix_ingresos_sheets_empresa_cuit", "(id_empresa, cuit)"),
+]
+# Reemplazado por ix_ingresos_sheets_empresa_estado_fecha (los listados filtran por estado)
+INDICES_OBSOLETOS = ["ix_ingresos_sheets_empresa_fact_fecha"]
+
+def column_exists(db, table, column):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """)
+    return bool(db.execute(q, {"table": table, "column": column}).scalar())
+
+def index_exists(db, table, index):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME = :index
+    """)
+    return bool(db.execute(q, {"table": table, "index": index}).scalar())
+
+def main():
+    # Uso: python -m backend.scripts.migrate_add_ingresos_sheets_columnas [--fulltext]
+    fulltext = "--fulltext" in sys.argv or os.getenv("SHEETS_FULLTEXT", "0").strip().lower() in ("1", "true", "yes", "on")
+    db = SessionLocal()
+    try:
+        for col, ddl in COLUMNAS:
+            if not column_exists(db, "ingresos_sheets", col):
+                db.execute(sa_text(f"ALTER TABLE ingresos_sheets ADD COLUMN {col} {ddl}"))
+                print(f"OK: Columna ingresos_sheets.{col} añadida")
+            else:
+                print(f"SKIP: Columna ingresos_sheets.{col} ya existe")
+        for nombre, cols in INDICES:
+            if not index_exists(db, "ingresos_sheets", nombre):
+                db.execute(sa_text(f"CREATE INDEX {nombre} ON ingresos_sheets {cols}"))
+                print(f"OK: Índice {nombre} creado")
+            else:
+                print(f"SKIP: Índice {nombre} ya existe")
+        for nombre in INDICES_OBSOLETOS:
+            if index_exists(db, "ingresos_sheets", nombre):
+                db.execute(sa_text(f"DROP INDEX {nombre} ON ingresos_sheets"))
+                print(f"OK: Índice obsoleto {nombre} eliminado")
+        if fulltext:
+            if not index_exists(db, "ingresos_sheets", "ft_ingresos_sheets_busqueda"):
+                db.execute(sa_text("ALTER TABLE ingresos_sheets ADD FULLTEXT INDEX ft_ingresos_sheets_busqueda (razon_social, repartidor)"))
+                print("OK: Índice FULLTEXT ft_ingresos_sheets_busqueda creado")
+            else:
+                print("SKIP: Índice FULLTEXT ft_ingresos_sheets_busqueda ya existe")
+        db.commit()
+
+        # Backfill desde data_json (por tandas, con commit por tanda)
+        total = 0
+        while True:
+            hechas = rellenar_campos_materializados(db, max_filas=5000)
+            total += hechas
+            if hechas < 5000:
+                break
+        print(f"OK: {total} filas con columnas materializadas completadas")
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR en migración: {e}")
+        sys.exit(2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import sys
+from sqlalchemy import text as sa_text
+from backend.database import SessionLocal
+
+def column_exists(db, table, column):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """)
+    return bool(db.execute(q, {"table": table, "column": column}).scalar())
+
+def table_exists(db, table):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """)
+    return bool(db.execute(q, {"table": table}).scalar())
+
+def main():
+    db = SessionLocal()
+    try:
+        if not column_exists(db, "ingresos_sheets", "row_hash"):
+            db.execute(sa_text("ALTER TABLE ingresos_sheets ADD COLUMN row_hash VARCHAR(40) NULL"))
+            print("OK: Columna ingresos_sheets.row_hash añadida")
+        else:
+            print("SKIP: Columna ingresos_sheets.row_hash ya existe")
+        if not table_exists(db, "sheets_sync_estado"):
+            db.execute(sa_text("""
+                CREATE TABLE sheets_sync_estado (
+                    id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    id_empresa INTEGER NOT NULL DEFAULT 1,
+                    google_sheet_id VARCHAR(128) NOT NULL,
+                    ultima_fila INTEGER NOT NULL DEFAULT 0,
+                    ultima_id_ingreso VARCHAR(64) NULL,
+                    headers_hash VARCHAR(40) NULL,
+                    modificado_en_sheets VARCHAR(64) NULL,
+                    ultima_sync_at DATETIME NULL,
+                    ultima_full_at DATETIME NULL,
+                    INDEX ix_sheets_sync_estado_id_empresa (id_empresa),
+                    INDEX ix_sheets_sync_estado_google_sheet_id (google_sheet_id)
+                )
+            """))
+            print("OK: Tabla sheets_sync_estado creada")
+        else:
+            print("SKIP: Tabla sheets_sync_estado ya existe")
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR en migración: {e}")
+        sys.exit(2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
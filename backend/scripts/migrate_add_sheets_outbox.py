@@ -0,0 +1,60 @@
+import sys
+from sqlalchemy import text as sa_text
+from backend.database import SessionLocal
+
+def table_exists(db, table):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """)
+    return bool(db.execute(q, {"table": table}).scalar())
+
+def index_exists(db, table, index):
+    q = sa_text("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME = :index
+    """)
+    return bool(db.execute(q, {"table": table, "index": index}).scalar())
+
+def main():
+    db = SessionLocal()
+    try:
+        if not table_exists(db, "sheets_outbox"):
+            db.execute(sa_text("""
+                CREATE TABLE sheets_outbox (
+                    id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    id_empresa INTEGER NULL,
+                    google_sheet_id VARCHAR(128) NOT NULL,
+                    id_ingreso VARCHAR(64) NOT NULL,
+                    accion VARCHAR(16) NOT NULL,
+                    estado VARCHAR(16) NOT NULL DEFAULT 'PENDIENTE',
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    proximo_intento_at DATETIME NOT NULL,
+                    ultimo_error TEXT NULL,
+                    factura_id INTEGER NULL,
+                    created_at DATETIME NOT NULL,
+                    updated_at DATETIME NOT NULL,
+                    INDEX ix_sheets_outbox_id_empresa (id_empresa),
+                    INDEX ix_sheets_outbox_google_sheet_id (google_sheet_id),
+                    INDEX ix_sheets_outbox_id_ingreso (id_ingreso),
+                    INDEX ix_sheets_outbox_estado (estado),
+                    INDEX ix_sheets_outbox_proximo_intento_at (proximo_intento_at)
+                )
+            """))
+            print("OK: Tabla sheets_outbox creada")
+        else:
+            print("SKIP: Tabla sheets_outbox ya existe")
+        # Índice compuesto para la consulta del worker (estado + próximo intento)
+        if not index_exists(db, "sheets_outbox", "ix_sheets_outbox_estado_proximo"):
+            db.execute(sa_text("CREATE INDEX ix_sheets_outbox_estado_proximo ON sheets_outbox (estado, proximo_intento_at)"))
+            print("OK: Índice ix_sheets_outbox_estado_proximo creado")
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR en migración: {e}")
+        sys.exit(2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Quita de facturas_electronicas.raw_response las imágenes incrustadas (QR como data URL).
+
+Las facturas emitidas antes de mover el QR a GET /comprobantes/{id}/qr guardaban el PNG en
+base64 dentro del JSON. Este script lo borra por lotes (ordenado por id) y, si la fila no tenía
+qr_url_afip, la completa desde los datos del comprobante. Es idempotente.
+
+Uso: python -m backend.scripts.migrate_strip_qr_raw_response [--lote 500] [--dry-run]
+"""
+import argparse
+import json
+import sys
+from sqlalchemy import text as sa_text
+from backend.database import SessionLocal
+from backend.utils import qr_render
+
+
+def _sin_imagenes(valor):
+    """Copia del JSON sin strings 'data:image...'. Devuelve (valor, cantidad quitada)."""
+    if isinstance(valor, dict):
+        limpio, quitadas = {}, 0
+        for k, v in valor.items():
+            if isinstance(v, str) and v.startswith("data:image"):
+                quitadas += 1
+                continue
+            v, n = _sin_imagenes(v)
+            limpio[k] = v
+            quitadas += n
+        return limpio, quitadas
+    if isinstance(valor, list):
+        limpio, quitadas = [], 0
+        for v in valor:
+            if isinstance(v, str) and v.startswith("data:image"):
+                quitadas += 1
+                continue
+            v, n = _sin_imagenes(v)
+            limpio.append(v)
+            quitadas += n
+        return limpio, quitadas
+    return valor, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lote", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    ultimo_id, filas, bytes_liberados = 0, 0, 0
+    try:
+        while True:
+            lote = db.execute(sa_text("""
+                SELECT id, raw_response, qr_url_afip FROM facturas_electronicas
+                WHERE id > :ultimo AND raw_response LIKE '%data:image%'
+                ORDER BY id LIMIT :n
+            """), {"ultimo": ultimo_id, "n": args.lote}).mappings().all()
+            if not lote:
+                break
+            for fila in lote:
+                ultimo_id = fila["id"]
+                try:
+                    raw = json.loads(fila["raw_response"])
+                except (TypeError, ValueError):
+                    print(f"SKIP: Factura {fila['id']}: raw_response no es JSON")
+                    continue
+                limpio, quitadas = _sin_imagenes(raw)
+                if not quitadas:
+                    continue
+                nuevo = json.dumps(limpio, ensure_ascii=False)
+                qr_url = fila["qr_url_afip"]
+                if not qr_url and isinstance(limpio, dict):
+                    qr_url = qr_render.url_qr_afip(limpio)
+                filas += 1
+                bytes_liberados += len(fila["raw_response"]) - len(nuevo)
+                if not args.dry_run:
+                    db.execute(
+                        sa_text("UPDATE facturas_electronicas SET raw_response = :raw, qr_url_afip = :qr WHERE id = :id"),
+                        {"raw": nuevo, "qr": qr_url, "id": fila["id"]},
+                    )
+            if not args.dry_run:
+                db.commit()
+            print(f"OK: Lote hasta id {ultimo_id} procesado ({filas} facturas limpias)")
+
+        accion = "a limpiar (dry-run)" if args.dry_run else "limpiadas"
+        if filas:
+            print(f"OK: {filas} facturas {accion}, ~{bytes_liberados // 1024} KB menos en raw_response")
+        else:
+            print("SKIP: Ninguna factura tiene imágenes en raw_response")
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR en migración: {e}")
+        sys.exit(2)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
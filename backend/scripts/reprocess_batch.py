@@ -11,7 +11,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.insert(0, project_root)
 
-from backend.utils.billige_manage import process_invoice_batch_for_endpoint, TablasHandler
+from backend.utils.billige_manage import procesar_lote_facturas, generar_qr_afip, TablasHandler
 from backend.database import SessionLocal
 from backend.modelos import FacturaElectronica
 from sqlalchemy import text as sa_text
@@ -75,7 +75,7 @@ def save_to_db_from_json(invoice_id: str, afip_data: Dict[str, Any], original_da
             "importe_neto": float(afip_data.get("neto")) if afip_data.get("neto") else None,
             "importe_iva": float(afip_data.get("iva")) if afip_data.get("iva") else None,
             "raw_response": json.dumps(afip_data), # Guardamos lo que tenemos
-            "qr_url_afip": afip_data.get("qr_code") or afip_data.get("qr_url_afip"), # Intentar recuperar QR si existe
+            "qr_url_afip": afip_data.get("qr_url_afip") or generar_qr_afip(afip_data), # Solo la URL; la imagen se genera a pedido
         }
 
         # Insertar
@@ -134,7 +134,8 @@ def reprocess_batch(file_path: str, force_failed: bool = False):
             sheets_status = item.get("sheets_update_status")
             
             needs_db_fix = (db_status != "SUCCESS")
-            needs_sheets_fix = (sheets_status != "SUCCESS" and sheets_status != "SKIPPED")
+            # QUEUED: la marca quedó en sheets_outbox y la envía el worker en segundo plano
+            needs_sheets_fix = sheets_status not in ("SUCCESS", "SKIPPED", "QUEUED")
             
             if not needs_db_fix and not needs_sheets_fix:
                 logger.info(f"[{invoice_id}] OK. Correctamente procesada.")
@@ -177,7 +178,7 @@ def reprocess_batch(file_path: str, force_failed: bool = False):
         logger.info(f"=== Iniciando REINTENTO de {len(to_retry_payload)} facturas fallidas ===")
         try:
             # Llamamos a la función principal de facturación
-            new_results = process_invoice_batch_for_endpoint(to_retry_payload)
+            new_results = procesar_lote_facturas(to_retry_payload)
             logger.info("=== Reintento finalizado ===")
             
             # Analizar resultados del reintento
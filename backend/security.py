@@ -1,8 +1,12 @@
 # back/security.py
 # VERSIÓN FINAL CON CORRECCIÓN DE LÓGICA EN `obtener_usuario_actual`
 
+import logging
+import os
+import threading
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Tuple
 from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
@@ -15,6 +19,9 @@ from backend.modelos import LlaveMaestra # Asumimos que este modelo existe
 from backend import config
 from backend.database import get_db # Asegúrate que la ruta de importación sea la correcta
 from backend.modelos import Usuario, Rol
+from backend.utils import coordinacion
+
+logger = logging.getLogger(__name__)
 
 # --- Configuración de Seguridad ---
 SECRET_KEY = config.SECRET_KEY_SEC
@@ -36,8 +43,10 @@ def get_password_hash(password: str) -> str:
 
 def crear_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    ahora = datetime.now(timezone.utc)
+    expire = ahora + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    # iat distingue cada login en la caché de usuarios autenticados
+    to_encode.update({"exp": expire, "iat": ahora})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def crear_token_para_usuario_minimo(username: str) -> str:
@@ -62,6 +71,66 @@ def validar_api_key(x_api_key: Optional[str] = Header(None, alias="X-API-KEY"))
         return True
     return False
 
+# --- Caché de usuarios autenticados ---
+# Los dashboards consultan varios endpoints por segundo por usuario: sin caché cada request hacía
+# dos consultas (usuario + rol). Se guarda una foto de las columnas de Usuario y Rol por
+# (username, iat del token) durante AUTH_USER_CACHE_TTL segundos; cada hit arma un Usuario nuevo
+# (transitorio) para que un handler no pueda modificar el objeto de otro request. /usuarios
+# invalida al editar o desactivar; los otros workers se enteran por utils/coordinacion.
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "30"))
+AUTH_USER_CACHE_MAX = int(os.getenv("AUTH_USER_CACHE_MAX", "5000"))
+
+_cache_usuarios: Dict[Tuple[str, Any], Tuple[float, Dict[str, Any], Dict[str, Any]]] = {}
+_cache_usuarios_lock = threading.Lock()
+_vigilante_usuarios = coordinacion.VigilanteCache("usuarios")
+
+
+def _columnas(obj) -> Dict[str, Any]:
+    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
+
+
+def _usuario_desde_cache(clave: Tuple[str, Any]) -> Optional[Usuario]:
+    if AUTH_USER_CACHE_TTL <= 0:
+        return None
+    if _vigilante_usuarios.cambio():
+        with _cache_usuarios_lock:
+            _cache_usuarios.clear()
+    with _cache_usuarios_lock:
+        entrada = _cache_usuarios.get(clave)
+        if entrada is None:
+            return None
+        if entrada[0] < time.monotonic():
+            _cache_usuarios.pop(clave, None)
+            return None
+        _, campos_usuario, campos_rol = entrada
+    return Usuario(**campos_usuario, rol=Rol(**campos_rol))
+
+
+def _guardar_usuario_cache(clave: Tuple[str, Any], usuario: Usuario) -> None:
+    if AUTH_USER_CACHE_TTL <= 0:
+        return
+    entrada = (time.monotonic() + AUTH_USER_CACHE_TTL, _columnas(usuario), _columnas(usuario.rol))
+    with _cache_usuarios_lock:
+        if len(_cache_usuarios) >= AUTH_USER_CACHE_MAX:
+            ahora = time.monotonic()
+            for k in [k for k, v in _cache_usuarios.items() if v[0] < ahora]:
+                del _cache_usuarios[k]
+            if len(_cache_usuarios) >= AUTH_USER_CACHE_MAX:
+                _cache_usuarios.clear()
+        _cache_usuarios[clave] = entrada
+
+
+def invalidar_usuario_cache(username: Optional[str] = None) -> None:
+    """Descarta la caché de `username` (todas sus sesiones) o toda la caché si es None."""
+    coordinacion.publicar_invalidacion("usuarios")
+    with _cache_usuarios_lock:
+        if username is None:
+            _cache_usuarios.clear()
+            return
+        for k in [k for k in _cache_usuarios if k[0] == username]:
+            del _cache_usuarios[k]
+
+
 def obtener_usuario_actual(
     x_api_key: Optional[str] = Header(None, alias="X-API-KEY"),
     token: Optional[str] = Depends(oauth2_scheme), 
@@ -69,14 +138,12 @@ def obtener_usuario_actual(
 ) -> Usuario:
     """
     Función central de seguridad. Valida el token o API Key y devuelve el objeto Usuario
-    completo desde la base de datos con su rol actualizado en tiempo real.
+    con su rol. Usuario y rol salen de una caché de TTL corto (ver AUTH_USER_CACHE_TTL);
+    la sesión `db` solo toma conexión del pool si hay que ir a la base.
     """
-    print("\n--- [RASTREO DE SEGURIDAD] ---")
-    print(f"1. Iniciando 'obtener_usuario_actual'.")
-    
     # 0. Bypass por API Key Maestra
     if INTERNAL_API_KEY and x_api_key == INTERNAL_API_KEY:
-         print(f"2a. API Key Maestra detectada y válida. Devolviendo usuario sistema.")
+         logger.debug("API Key maestra válida: usuario sistema")
          # PARA BYPASS COMPLETO EN facturador.py NECESITAMOS RETORNAR EL USUARIO DUMMY (ID 999)
          # Si retornamos el usuario 'admin' de la DB, facturador.py aplicará validaciones de empresa estrictas.
          
@@ -93,51 +160,44 @@ def obtener_usuario_actual(
          return dummy_user
 
     if not token:
-         print("   -> ERROR: No se proporcionó Token ni API Key válida.")
+         logger.debug("Sin token ni API Key válida")
          raise CREDENTIALS_EXCEPTION
 
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        print(f"2. Token decodificado. Username extraído: '{username}'")
         if username is None:
-            print("   -> ERROR: 'sub' (username) no encontrado en el payload del token.")
+            logger.debug("Token sin 'sub'")
             raise CREDENTIALS_EXCEPTION
     except JWTError as e:
-        print(f"   -> ERROR: El token JWT es inválido o ha expirado. Error: {e}")
+        logger.debug(f"Token JWT inválido o expirado: {e}")
         raise CREDENTIALS_EXCEPTION
-    
-    print(f"3. Buscando al usuario '{username}' en la base de datos (con carga de rol)...")
-    
+
+    # Tokens viejos no traen iat: el exp identifica igual la sesión
+    clave = (username, payload.get("iat") or payload.get("exp"))
+    usuario = _usuario_desde_cache(clave)
+    if usuario is not None:
+        return usuario
+
     consulta = select(Usuario).where(Usuario.nombre_usuario == username).options(selectinload(Usuario.rol))
     usuario = db.exec(consulta).first()
-    
-    # --- INICIO DE LA CORRECCIÓN ---
-    # Reemplazamos la línea insegura 'if usuario is None or not usuario.activo:'
-    # por un bloque de validaciones separadas y seguras.
 
     # 1. Validar si el usuario EXISTE. Esto previene el error 'AttributeError'
     if usuario is None:
-        print(f"   -> ERROR: Usuario '{username}' NO ENCONTRADO en la base de datos.")
+        logger.debug(f"Usuario '{username}' no encontrado")
         raise CREDENTIALS_EXCEPTION
 
     # 2. Solo si existe, validar si está ACTIVO.
     if not usuario.activo:
-        print(f"   -> ERROR: El usuario '{username}' (ID: {usuario.id}) no está activo.")
+        logger.debug(f"Usuario '{username}' (ID: {usuario.id}) inactivo")
         raise CREDENTIALS_EXCEPTION
-    
-    # --- FIN DE LA CORRECCIÓN ---
-    
-    print(f"4. Usuario encontrado en la DB. ID: {usuario.id}, Nombre: {usuario.nombre_usuario}, Activo: {usuario.activo}")
 
-    # Esta validación también es importante y está bien aquí.
     if not usuario.rol:
-        print(f"   -> ¡ADVERTENCIA CRÍTICA! El usuario '{username}' (ID: {usuario.id}) NO TIENE UN ROL ASIGNADO.")
+        logger.warning(f"El usuario '{username}' (ID: {usuario.id}) no tiene un rol asignado")
         raise CREDENTIALS_EXCEPTION
-        
-    print(f"5. Rol del usuario cargado correctamente: '{usuario.rol.nombre}' (ID: {usuario.rol.id})")
-    print("6. Autenticación exitosa. Devolviendo objeto Usuario completo.")
-    print("--- [FIN DEL RASTREO] ---\n")
+
+    logger.debug(f"Usuario '{username}' autenticado (ID: {usuario.id}, rol: {usuario.rol.nombre})")
+    _guardar_usuario_cache(clave, usuario)
     return usuario
 
 
@@ -146,22 +206,13 @@ def es_rol(roles_requeridos: List[str]):
     Factoría de dependencias que crea un "guardián" de roles.
     """
     def chequear_rol(current_user: Usuario = Depends(obtener_usuario_actual)) -> Usuario:
-        print("\n--- [RASTREO DE ROL] ---")
-        print(f"A. Verificando si el usuario '{current_user.nombre_usuario}' tiene uno de los roles: {roles_requeridos}")
-        
         user_rol = current_user.rol.nombre
-        print(f"B. Rol actual del usuario: '{user_rol}'")
-        
         if user_rol not in roles_requeridos:
-            print(f"   -> ¡ACCESO DENEGADO! El rol '{user_rol}' no está en la lista de roles permitidos.")
-            print("--- [FIN DEL RASTREO DE ROL] ---\n")
+            logger.debug(f"Acceso denegado a '{current_user.nombre_usuario}': rol '{user_rol}' no está en {roles_requeridos}")
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Acceso denegado. Se requiere uno de los siguientes roles: {', '.join(roles_requeridos)}.",
             )
-            
-        print("C. ¡ACCESO PERMITIDO! El rol es correcto.")
-        print("--- [FIN DEL RASTREO DE ROL] ---\n")
         return current_user
     
     return chequear_rol
@@ -15,3 +15,49 @@ from backend.main import app  # noqa: E402
 @pytest.fixture(scope="session")
 def client():
     return TestClient(app)
+
+
+
+def _bd_sqlite(ruta, monkeypatch, foto_por_transaccion: bool):
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from sqlmodel import Session
+    import backend.database as database
+
+    eng = create_engine(f"sqlite:///{ruta}", connect_args={"check_same_thread": False, "timeout": 30})
+    if foto_por_transaccion:
+        @event.listens_for(eng, "connect")
+        def _connect(dbapi_conn, _):
+            dbapi_conn.isolation_level = None
+            dbapi_conn.execute("PRAGMA journal_mode=WAL")
+
+        @event.listens_for(eng, "begin")
+        def _begin(conn):
+            conn.exec_driver_sql("BEGIN")
+
+    fabrica = sessionmaker(autocommit=False, autoflush=False, bind=eng, class_=Session)
+    for nombre, valor in (("engine", eng), ("engine_lectura", eng), ("SessionLocal", fabrica), ("SessionLectura", fabrica)):
+        monkeypatch.setattr(database, nombre, valor, raising=False)
+    monkeypatch.setattr(database, "_engines", {"principal": eng}, raising=False)
+    return eng
+
+
+@pytest.fixture
+def bd_sqlite(tmp_path, monkeypatch):
+    """Base SQLite en archivo que reemplaza a la de MySQL (engine y sesiones de backend.database).
+
+    Cada sentencia ve lo último confirmado, como los UPDATE condicionales en InnoDB: sirve para los
+    reclamos por lease. Los módulos que importan engine/SessionLocal por nombre se parchean en el test.
+    """
+    eng = _bd_sqlite(tmp_path / "test.db", monkeypatch, foto_por_transaccion=False)
+    yield eng
+    eng.dispose()
+
+
+@pytest.fixture
+def bd_sqlite_foto(tmp_path, monkeypatch):
+    """Como bd_sqlite, pero cada transacción lee su propia foto (WAL + BEGIN explícito), como las
+    lecturas en REPEATABLE READ: sirve para probar carreras de lectura-y-después-decidir."""
+    eng = _bd_sqlite(tmp_path / "test.db", monkeypatch, foto_por_transaccion=True)
+    yield eng
+    eng.dispose()
@@ -0,0 +1,155 @@
+"""
+Google Sheets falso para los tests y los benchmarks: un cliente con la interfaz de gspread que usa
+TablasHandler (planillas por key, pestaña INGRESOS en memoria, lastUpdateTime que avanza con cada
+escritura) y el generador de una INGRESOS sintética.
+
+    cliente = ClienteGspreadFalso(latencia_ms=0)
+    cliente.agregar("KEY", generar_ingresos(1, 500, random.Random(7)))
+    monkeypatch.setattr(tablasHandler, "gspread_client", cliente)
+"""
+import random
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+try:
+    import gspread
+except ImportError:  # el fake no necesita gspread; solo sus excepciones si está
+    gspread = None
+
+ENCABEZADOS = [
+    "ID Ingresos", "Fecha", "Repartidor", "Razon Social", "CUIT", "Condicion IVA",
+    "Domicilio", "Tipo Pago", "INGRESOS", "facturacion",
+]
+
+
+def _indice_columna(letras: str) -> int:
+    col = 0
+    for ch in letras:
+        col = col * 26 + (ord(ch) - 64)
+    return col
+
+
+class HojaFalsa:
+    """Worksheet en memoria con la interfaz que usa TablasHandler."""
+
+    def __init__(self, planilla: "PlanillaFalsa", titulo: str, valores: List[List[str]]):
+        self.spreadsheet = planilla
+        self.title = titulo
+        self._valores = valores
+        self._lock = threading.Lock()
+
+    @property
+    def row_count(self) -> int:
+        return len(self._valores)
+
+    def _filas(self, desde: int, hasta: Optional[int] = None) -> List[List[str]]:
+        with self._lock:
+            return [list(r) for r in self._valores[desde - 1:hasta]]
+
+    def get_all_values(self) -> List[List[str]]:
+        self.spreadsheet.cliente.esperar("lecturas")
+        return self._filas(1)
+
+    def get_values(self, rango: str) -> List[List[str]]:
+        self.spreadsheet.cliente.esperar("lecturas")
+        m = re.match(r"^[A-Z]*(\d+)(?::[A-Z]*(\d*))?$", rango)
+        desde = int(m.group(1))
+        hasta = int(m.group(2)) if m.group(2) else None
+        return self._filas(desde, hasta)
+
+    def batch_get(self, rangos: List[str]) -> List[List[List[str]]]:
+        self.spreadsheet.cliente.esperar("lecturas")
+        salida = []
+        for rango in rangos:
+            desde, _, hasta = rango.partition(":")
+            salida.append(self._filas(int(desde), int(hasta) if hasta else None))
+        return salida
+
+    def batch_update(self, payload: List[Dict[str, Any]], value_input_option: str = "RAW"):
+        self.spreadsheet.cliente.esperar("escrituras")
+        with self._lock:
+            for celda in payload:
+                m = re.match(r"^([A-Z]+)(\d+)$", celda["range"])
+                fila, col = int(m.group(2)) - 1, _indice_columna(m.group(1)) - 1
+                while len(self._valores) <= fila:
+                    self._valores.append([])
+                destino = self._valores[fila]
+                while len(destino) <= col:
+                    destino.append("")
+                destino[col] = str(celda["values"][0][0])
+        self.spreadsheet.tocar()
+        return {"updatedCells": len(payload)}
+
+
+class PlanillaFalsa:
+    def __init__(self, cliente: "ClienteGspreadFalso", key: str, filas: List[List[str]]):
+        self.cliente = cliente
+        self.id = key
+        self.title = f"PERF {key}"
+        self._hojas = {"INGRESOS": HojaFalsa(self, "INGRESOS", filas)}
+        self._modificado = datetime.now(timezone.utc)
+
+    def tocar(self):
+        self._modificado = datetime.now(timezone.utc)
+
+    def get_lastUpdateTime(self) -> str:
+        return self._modificado.isoformat().replace("+00:00", "Z")
+
+    def worksheet(self, titulo: str) -> HojaFalsa:
+        if titulo not in self._hojas:
+            if gspread is not None:
+                raise gspread.exceptions.WorksheetNotFound(titulo)
+            raise KeyError(titulo)
+        return self._hojas[titulo]
+
+
+class ClienteGspreadFalso:
+    """Reemplaza a gspread.service_account(): planillas por key, con latencia y contadores de API."""
+
+    def __init__(self, latencia_ms: float):
+        self.latencia_ms = latencia_ms
+        self._planillas: Dict[str, PlanillaFalsa] = {}
+        self.contadores = {"lecturas": 0, "escrituras": 0}
+        self._lock = threading.Lock()
+
+    def esperar(self, tipo: str):
+        with self._lock:
+            self.contadores[tipo] += 1
+        if self.latencia_ms > 0:
+            time.sleep(self.latencia_ms / 1000.0)
+
+    def agregar(self, key: str, filas: List[List[str]]):
+        self._planillas[key] = PlanillaFalsa(self, key, filas)
+
+    def open_by_key(self, key: str) -> PlanillaFalsa:
+        self.esperar("lecturas")
+        if key not in self._planillas:
+            if gspread is not None:
+                raise gspread.exceptions.SpreadsheetNotFound(key)
+            raise KeyError(key)
+        return self._planillas[key]
+
+
+def generar_ingresos(empresa: int, filas: int, rnd: random.Random) -> List[List[str]]:
+    """INGRESOS sintética: encabezados + `filas` boletas pendientes de los últimos 90 días."""
+    hoy = date.today()
+    valores = [list(ENCABEZADOS)]
+    for i in range(1, filas + 1):
+        fecha = hoy - timedelta(days=rnd.randrange(90))
+        total = rnd.randrange(500, 50000) + rnd.choice((0, 0.5, 0.99))
+        valores.append([
+            f"PERF{empresa}-{i:06d}",
+            fecha.strftime("%d/%m/%Y"),
+            f"Repartidor {rnd.randrange(1, 9)}",
+            f"Cliente {rnd.randrange(1, 500)}",
+            "0",
+            "CONSUMIDOR_FINAL",
+            f"Calle {rnd.randrange(1, 2000)}",
+            rnd.choice(("Efectivo", "Transferencia", "Debito")),
+            f"{total:.2f}".replace(".", ","),
+            "Falta Facturar",
+        ])
+    return valores
@@ -0,0 +1,466 @@
+"""
+Benchmark de carga de la API contra fakes locales (sin AFIP real ni Google Sheets).
+
+Levanta en el mismo proceso:
+- Un microservicio de facturación falso (FACTURACION_API_URL) que devuelve CAEs con latencia,
+  tasa de error (HTTP 500) y tasa de "reset SSL" configurables. El reset se responde como lo hace
+  el microservicio real cuando AFIP corta la conexión: 200 con ConnectionResetError/ssl.SSLError en
+  el cuerpo, que afipTools trata como error transitorio (reintento).
+- Un backend gspread falso: una pestaña INGRESOS sintética de --filas filas por cada una de las
+  --empresas empresas, con latencia por llamada y escrituras (batch_update) que actualizan
+  lastUpdateTime, así el delta-sync y el worker de sheets_outbox corren igual que en producción.
+- La app FastAPI con uvicorn, contra la base MySQL de DB_* (debe ser una base de prueba: se crean
+  las tablas y se siembran empresas, usuarios y credenciales AFIP autofirmadas "PERF").
+
+Y mide, con concurrencia controlada, los escenarios:
+  sync        POST /sheets/sincronizar (uno por empresa; llena el espejo ingresos_sheets)
+  boletas     GET  /sheets/boletas (pendientes, páginas al azar)
+  facturar    POST /facturador/facturar-por-cantidad (lotes de --lote boletas pendientes)
+  imprimir    GET  /impresion/{id}/html y /impresion/{id}/imagen de boletas facturadas
+  anular      POST /facturador/anular-afip/{id} de una parte de las facturadas
+
+Reporta por escenario p50/p95/p99, máximo, errores y throughput (y facturas/s en facturar).
+No lo recoge pytest; se corre a mano desde la raíz del repo:
+
+    DB_HOST=127.0.0.1 DB_USER=... DB_PASSWORD=... DB_NAME=facturacion_perf \\
+        python -m backend.tests.perf_test_improved --empresas 3 --filas 2000 --concurrencia 16
+
+Si DB_NAME no contiene "test" o "perf" se niega a correr (salvo --permitir-bd).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from backend.tests.fakes_sheets import ClienteGspreadFalso, generar_ingresos
+
+ESCENARIOS = ("sync", "boletas", "facturar", "imprimir", "anular")
+
+
+# ----------------------------------------------------------------------------------------------
+# Microservicio de facturación falso
+# ----------------------------------------------------------------------------------------------
+
+class MicroservicioFalso:
+    """CAEs sintéticos con latencia (uniforme ±50% de latencia_ms), errores 500 y resets SSL."""
+
+    def __init__(self, latencia_ms: float, tasa_error: float, tasa_ssl: float, semilla: int):
+        self.latencia_ms = latencia_ms
+        self.tasa_error = tasa_error
+        self.tasa_ssl = tasa_ssl
+        self._rnd = random.Random(semilla)
+        self._numeros: Dict[tuple, int] = defaultdict(int)
+        self.contadores = {"ok": 0, "error": 0, "ssl": 0}
+        self.app = FastAPI()
+        self.app.add_api_route("/afipws/facturador", self._facturar, methods=["POST"])
+
+    async def _facturar(self, request: Request):
+        body = await request.json()
+        if self.latencia_ms > 0:
+            await asyncio.sleep(self.latencia_ms * self._rnd.uniform(0.5, 1.5) / 1000.0)
+        sorteo = self._rnd.random()
+        if sorteo < self.tasa_error:
+            self.contadores["error"] += 1
+            return PlainTextResponse("Error interno simulado del microservicio", status_code=500)
+        if sorteo < self.tasa_error + self.tasa_ssl:
+            self.contadores["ssl"] += 1
+            return JSONResponse({
+                "status": "error",
+                "message": "ssl.SSLError: [SSL: UNEXPECTED_EOF_WHILE_READING] "
+                           "ConnectionResetError(104, 'Connection reset by peer')",
+            })
+        factura = body.get("datos_factura") or {}
+        clave = (
+            (body.get("credenciales") or {}).get("cuit"),
+            factura.get("punto_venta"),
+            factura.get("tipo_afip"),
+        )
+        self._numeros[clave] += 1
+        self.contadores["ok"] += 1
+        return {
+            "status": "success",
+            "resultado": "A",
+            "cae": f"{self._rnd.randrange(10**13, 10**14)}",
+            "vencimiento_cae": (date.today() + timedelta(days=10)).strftime("%Y%m%d"),
+            "numero_comprobante": self._numeros[clave],
+        }
+
+
+# ----------------------------------------------------------------------------------------------
+# Base de datos de prueba
+# ----------------------------------------------------------------------------------------------
+
+def _cuit_valido(prefijo: str, n: int) -> str:
+    base = f"{prefijo}{n:08d}"
+    suma = sum(int(d) * p for d, p in zip(base, (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)))
+    dv = 11 - suma % 11
+    return base + str({11: 0, 10: 9}.get(dv, dv))
+
+
+def _certificado_autofirmado(cuit: str):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    clave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([
+        x509.NameAttribute(NameOID.COMMON_NAME, f"perf{cuit}"),
+        x509.NameAttribute(NameOID.SERIAL_NUMBER, f"CUIT {cuit}"),
+    ])
+    ahora = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre).issuer_name(nombre)
+        .public_key(clave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora - timedelta(days=1))
+        .not_valid_after(ahora + timedelta(days=365))
+        .sign(clave, hashes.SHA256())
+    )
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM).decode()
+    clave_pem = clave.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return cert_pem, clave_pem
+
+
+def sembrar_base(n_empresas: int) -> List[Dict[str, Any]]:
+    """Crea (o reutiliza) las empresas PERF con su configuración, usuario admin y credencial AFIP,
+    y borra lo que dejaron corridas anteriores (facturas, espejo, outbox, marcas de sync)."""
+    from sqlmodel import select, delete
+    from backend import database
+    from backend.modelos import (
+        AfipCredencial, ConfiguracionEmpresa, Empresa, FacturaElectronica, IngresoResumenMensual,
+        IngresoSheets, Rol, SheetsOutbox, SheetsSyncEstado, Usuario,
+    )
+    from backend.security import get_password_hash
+
+    database.create_db_and_tables()
+    tenants = []
+    with database.SessionLocal() as db:
+        rol = db.exec(select(Rol).where(Rol.nombre == "Admin")).first()
+        if rol is None:
+            rol = Rol(nombre="Admin")
+            db.add(rol)
+            db.commit()
+            db.refresh(rol)
+        for m in range(1, n_empresas + 1):
+            cuit = _cuit_valido("30", 70000000 + m)
+            sheet_id = f"PERF-SHEET-{m}"
+            emp = db.exec(select(Empresa).where(Empresa.cuit == cuit)).first()
+            if emp is None:
+                emp = Empresa(nombre_legal=f"PERF Empresa {m}", nombre_fantasia=f"Perf {m}", cuit=cuit)
+                db.add(emp)
+                db.commit()
+                db.refresh(emp)
+            if db.get(ConfiguracionEmpresa, emp.id) is None:
+                db.add(ConfiguracionEmpresa(
+                    id_empresa=emp.id, cuit=cuit, link_google_sheets=sheet_id,
+                    nombre_negocio=f"Perf {m}", afip_condicion_iva="RESPONSABLE_INSCRIPTO",
+                    afip_punto_venta_predeterminado=1,
+                ))
+            if db.exec(select(AfipCredencial).where(AfipCredencial.cuit == cuit)).first() is None:
+                cert_pem, clave_pem = _certificado_autofirmado(cuit)
+                db.add(AfipCredencial(cuit=cuit, certificado_pem=cert_pem, clave_privada_pem=clave_pem, notas="perf_test"))
+            usuario = f"perf_admin_{m}"
+            if db.exec(select(Usuario).where(Usuario.nombre_usuario == usuario)).first() is None:
+                db.add(Usuario(nombre_usuario=usuario, password_hash=get_password_hash("perf"), id_rol=rol.id, id_empresa=emp.id))
+            db.commit()
+            tenants.append({"id_empresa": emp.id, "cuit": cuit, "sheet_id": sheet_id, "usuario": usuario})
+
+        ids = [t["id_empresa"] for t in tenants]
+        cuits = [t["cuit"] for t in tenants]
+        db.exec(delete(FacturaElectronica).where(FacturaElectronica.cuit_emisor.in_(cuits)))
+        for modelo in (IngresoSheets, SheetsOutbox, SheetsSyncEstado, IngresoResumenMensual):
+            db.exec(delete(modelo).where(modelo.id_empresa.in_(ids)))
+        db.commit()
+    return tenants
+
+
+# ----------------------------------------------------------------------------------------------
+# Servidores y medición
+# ----------------------------------------------------------------------------------------------
+
+def _levantar(app, puerto: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=puerto, log_level="warning", lifespan="on"))
+    threading.Thread(target=server.run, name=f"uvicorn-{puerto}", daemon=True).start()
+    limite = time.monotonic() + 60
+    while not server.started:
+        if time.monotonic() > limite:
+            raise RuntimeError(f"El servidor en el puerto {puerto} no arrancó")
+        time.sleep(0.05)
+    return server
+
+
+def _puerto_libre() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Medicion:
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.latencias: List[float] = []
+        self.estados: Dict[int, int] = defaultdict(int)
+        self.errores_red = 0
+        self.unidades = 0  # facturas emitidas (facturar) o ítems procesados
+        self.duracion = 0.0
+
+    def resumen(self) -> Dict[str, Any]:
+        lat = sorted(self.latencias)
+        if len(lat) >= 2:
+            q = statistics.quantiles(lat, n=100, method="inclusive")
+            p50, p95, p99 = q[49], q[94], q[98]
+        else:
+            p50 = p95 = p99 = lat[0] if lat else 0.0
+        n = len(lat)
+        ok = sum(c for s, c in self.estados.items() if 200 <= s < 300)
+        return {
+            "escenario": self.nombre,
+            "peticiones": n,
+            "ok": ok,
+            "errores": n - ok,
+            "estados": dict(self.estados),
+            "p50_ms": round(p50 * 1000, 1),
+            "p95_ms": round(p95 * 1000, 1),
+            "p99_ms": round(p99 * 1000, 1),
+            "max_ms": round((lat[-1] if lat else 0.0) * 1000, 1),
+            "req_s": round(n / self.duracion, 2) if self.duracion else 0.0,
+            "unidades": self.unidades,
+            "unidades_s": round(self.unidades / self.duracion, 2) if self.duracion else 0.0,
+        }
+
+
+async def correr(cliente: httpx.AsyncClient, nombre: str, trabajos: List[Dict[str, Any]], concurrencia: int, al_responder=None) -> Medicion:
+    """Ejecuta `trabajos` (method/url/headers/json) con a lo sumo `concurrencia` en vuelo."""
+    medicion = Medicion(nombre)
+    cola: asyncio.Queue = asyncio.Queue()
+    for t in trabajos:
+        cola.put_nowait(t)
+
+    async def trabajador():
+        while True:
+            try:
+                t = cola.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            inicio = time.perf_counter()
+            try:
+                resp = await cliente.request(t["method"], t["url"], headers=t.get("headers"), json=t.get("json"), params=t.get("params"))
+            except httpx.HTTPError:
+                medicion.errores_red += 1
+                medicion.estados[0] += 1
+                medicion.latencias.append(time.perf_counter() - inicio)
+                continue
+            medicion.latencias.append(time.perf_counter() - inicio)
+            medicion.estados[resp.status_code] += 1
+            if al_responder is not None:
+                al_responder(t, resp, medicion)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(max(1, concurrencia))))
+    medicion.duracion = time.perf_counter() - inicio
+    return medicion
+
+
+async def benchmark(args, base: str, tenants: List[Dict[str, Any]], pendientes: Dict[int, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    from backend.security import crear_access_token
+
+    rnd = random.Random(args.semilla)
+    headers = {t["id_empresa"]: {"Authorization": f"Bearer {crear_access_token({'sub': t['usuario']})}"} for t in tenants}
+    facturadas: List[Dict[str, Any]] = []
+    resultados = []
+    limites = httpx.Limits(max_connections=args.concurrencia * 2, max_keepalive_connections=args.concurrencia * 2)
+    async with httpx.AsyncClient(base_url=base, timeout=args.timeout, limits=limites) as cliente:
+
+        if "sync" in args.escenarios:
+            trabajos = [{"method": "POST", "url": "/sheets/sincronizar", "headers": headers[t["id_empresa"]]} for t in tenants]
+            resultados.append(await correr(cliente, "sync", trabajos, args.concurrencia))
+
+        if "boletas" in args.escenarios:
+            trabajos = []
+            for _ in range(args.peticiones):
+                t = rnd.choice(tenants)
+                trabajos.append({
+                    "method": "GET", "url": "/sheets/boletas", "headers": headers[t["id_empresa"]],
+                    "params": {"tipo": "no-facturadas", "limit": 50, "offset": rnd.randrange(0, max(1, args.filas - 50)), "campos": "resumen"},
+                })
+            resultados.append(await correr(cliente, "boletas", trabajos, args.concurrencia))
+
+        if "facturar" in args.escenarios:
+            trabajos = []
+            for t in tenants:
+                filas = pendientes[t["id_empresa"]][: args.lotes * args.lote]
+                for i in range(0, len(filas), args.lote):
+                    items = [{
+                        "id": f["id"],
+                        "total": f["total"],
+                        "cliente_data": {"cuit_o_dni": "0", "nombre_razon_social": f["razon_social"], "condicion_iva": "CONSUMIDOR_FINAL"},
+                    } for f in filas[i:i + args.lote]]
+                    trabajos.append({
+                        "method": "POST", "url": "/facturador/facturar-por-cantidad", "headers": headers[t["id_empresa"]],
+                        "params": {"max_parallel_workers": args.workers_lote}, "json": items, "id_empresa": t["id_empresa"],
+                    })
+            rnd.shuffle(trabajos)
+
+            def _contar(t, resp, medicion):
+                if resp.status_code != 200:
+                    return
+                for r in resp.json():
+                    if r.get("status") == "SUCCESS":
+                        medicion.unidades += 1
+                        facturadas.append({"id": r.get("id"), "id_empresa": t["id_empresa"]})
+
+            resultados.append(await correr(cliente, "facturar", trabajos, args.concurrencia, _contar))
+
+        if "imprimir" in args.escenarios and facturadas:
+            trabajos = []
+            for _ in range(args.peticiones):
+                f = rnd.choice(facturadas)
+                formato = "imagen" if rnd.random() < args.proporcion_imagen else "html"
+                trabajos.append({"method": "GET", "url": f"/impresion/{f['id']}/{formato}", "headers": headers[f["id_empresa"]]})
+            resultados.append(await correr(cliente, "imprimir", trabajos, args.concurrencia))
+
+        if "anular" in args.escenarios and facturadas:
+            elegidas = rnd.sample(facturadas, max(1, int(len(facturadas) * args.proporcion_anular)))
+            trabajos = [{
+                "method": "POST", "url": f"/facturador/anular-afip/{f['id']}", "json": {"motivo": "perf_test"},
+            } for f in elegidas]
+
+            def _anuladas(t, resp, medicion):
+                if resp.status_code == 200 and resp.json().get("status") == "OK":
+                    medicion.unidades += 1
+
+            resultados.append(await correr(cliente, "anular", trabajos, args.concurrencia, _anuladas))
+
+    return [m.resumen() for m in resultados]
+
+
+def imprimir_reporte(resumenes: List[Dict[str, Any]], micro: MicroservicioFalso, sheets: ClienteGspreadFalso) -> None:
+    print()
+    print(f"{'escenario':<10} {'n':>6} {'ok':>6} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8} {'unid/s':>8}")
+    for r in resumenes:
+        print(
+            f"{r['escenario']:<10} {r['peticiones']:>6} {r['ok']:>6} {r['errores']:>5} "
+            f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9} {r['req_s']:>8} {r['unidades_s']:>8}"
+        )
+    print(f"\nMicroservicio falso: {micro.contadores}")
+    print(f"Sheets falso (llamadas a la API): {sheets.contadores}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark de carga de la API contra fakes de AFIP y Google Sheets.")
+    p.add_argument("--empresas", type=int, default=3, help="Empresas (tenants) sintéticas")
+    p.add_argument("--filas", type=int, default=1000, help="Filas de INGRESOS por empresa")
+    p.add_argument("--concurrencia", type=int, default=8, help="Peticiones HTTP en vuelo")
+    p.add_argument("--peticiones", type=int, default=200, help="Peticiones por escenario de lectura (boletas, imprimir)")
+    p.add_argument("--lote", type=int, default=20, help="Boletas por POST a facturar-por-cantidad")
+    p.add_argument("--lotes", type=int, default=5, help="Lotes a facturar por empresa")
+    p.add_argument("--workers-lote", type=int, default=5, help="max_parallel_workers de cada lote")
+    p.add_argument("--proporcion-anular", type=float, default=0.2, help="Fracción de las facturadas que se anula")
+    p.add_argument("--proporcion-imagen", type=float, default=0.3, help="Fracción de impresiones como imagen (el resto HTML)")
+    p.add_argument("--latencia-afip-ms", type=float, default=300.0, help="Latencia media del microservicio falso")
+    p.add_argument("--tasa-error", type=float, default=0.02, help="Fracción de respuestas 500 del microservicio")
+    p.add_argument("--tasa-ssl", type=float, default=0.03, help="Fracción de resets SSL (transitorios, se reintentan)")
+    p.add_argument("--latencia-sheets-ms", type=float, default=80.0, help="Latencia por llamada a la API de Sheets falsa")
+    p.add_argument("--escenarios", default=",".join(ESCENARIOS), help=f"Subconjunto separado por comas de {','.join(ESCENARIOS)}")
+    p.add_argument("--timeout", type=float, default=300.0, help="Timeout por petición (s)")
+    p.add_argument("--semilla", type=int, default=1234)
+    p.add_argument("--json", dest="salida_json", help="Guardar los resultados en este archivo JSON")
+    p.add_argument("--permitir-bd", action="store_true", help="Correr aunque DB_NAME no parezca una base de prueba")
+    args = p.parse_args(argv)
+    args.escenarios = [e.strip() for e in args.escenarios.split(",") if e.strip()]
+    desconocidos = set(args.escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        p.error(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    db_name = os.getenv("DB_NAME") or ""
+    if not args.permitir_bd and not re.search(r"test|perf", db_name, re.I):
+        print(f"DB_NAME='{db_name}' no parece una base de prueba; este benchmark crea tablas y siembra datos. Usar --permitir-bd para forzar.")
+        return 2
+
+    micro = MicroservicioFalso(args.latencia_afip_ms, args.tasa_error, args.tasa_ssl, args.semilla)
+    puerto_micro = _puerto_libre()
+    _levantar(micro.app, puerto_micro)
+
+    # Configuración que los módulos del backend leen al importarse
+    os.environ["FACTURACION_API_URL"] = f"http://127.0.0.1:{puerto_micro}/afipws/facturador"
+    os.environ.setdefault("DEV_MODE", "1")
+    os.environ.setdefault("SECRET_KEY_SEGURIDAD", "perf-test-secret")
+    os.environ.setdefault("AFIP_COND_EMISOR", "RESPONSABLE_INSCRIPTO")
+    os.environ.setdefault("AFIP_PUNTO_VENTA", "1")
+    os.environ.setdefault("API_PREFIX", "")
+    # Una línea de log por request HTTP taparía el reporte
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    from backend.utils import tablasHandler
+
+    rnd = random.Random(args.semilla)
+    sheets = ClienteGspreadFalso(args.latencia_sheets_ms)
+    tablasHandler.gspread_client = sheets
+    if tablasHandler.gspread is not None:
+        # refrescar_drive() vuelve a crear el cliente: que siga siendo el falso
+        tablasHandler.gspread.service_account = lambda *a, **kw: sheets
+
+    tenants = sembrar_base(args.empresas)
+    pendientes: Dict[int, List[Dict[str, Any]]] = {}
+    for t in tenants:
+        filas = generar_ingresos(t["id_empresa"], args.filas, rnd)
+        sheets.agregar(t["sheet_id"], filas)
+        pendientes[t["id_empresa"]] = [
+            {"id": f[0], "razon_social": f[3], "total": float(f[8].replace(",", "."))} for f in filas[1:]
+        ]
+
+    from backend.main import app
+
+    puerto_app = _puerto_libre()
+    server = _levantar(app, puerto_app)
+    print(f"App en http://127.0.0.1:{puerto_app} | microservicio falso en el puerto {puerto_micro} | "
+          f"{args.empresas} empresas x {args.filas} filas | concurrencia {args.concurrencia}")
+    try:
+        resumenes = asyncio.run(benchmark(args, f"http://127.0.0.1:{puerto_app}", tenants, pendientes))
+    finally:
+        server.should_exit = True
+
+    imprimir_reporte(resumenes, micro, sheets)
+    if args.salida_json:
+        Path(args.salida_json).write_text(json.dumps({
+            "fecha": datetime.now().isoformat(),
+            "parametros": {k: v for k, v in vars(args).items() if k != "salida_json"},
+            "resultados": resumenes,
+            "microservicio": micro.contadores,
+            "sheets": sheets.contadores,
+        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Resultados guardados en {args.salida_json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -56,15 +56,16 @@ class RespFail:
 def test_ok():
     row = FakeRow()
     mod.SessionLocal = lambda: FakeSession(row)
-    def fake_post(url, json=None, timeout=None, headers=None):
+    async def fake_apost(url, json=None, headers=None, read_timeout=None):
         return RespOK()
     import backend.app.blueprints.facturador as f
     import builtins
     import types
-    # monkeypatch requests.post
-    import requests
-    real_post = requests.post
-    requests.post = fake_post
+    # monkeypatch del cliente compartido del microservicio (la NC usa el cliente async)
+    from backend.utils.microservicio_client import get_microservicio_client
+    client = get_microservicio_client()
+    real_apost = client.apost
+    client.apost = fake_apost
     try:
         res = mod.anular_afip.__wrapped__(73, mod.AnularAfipPayload(motivo="prueba", force=True)) if hasattr(mod.anular_afip, "__wrapped__") else None
         if res is None:
@@ -75,17 +76,18 @@ def test_ok():
         assert str(res.get("codigo_nota_credito")) == "CAE-NC-OK"
         print("PASS ok")
     finally:
-        requests.post = real_post
+        client.apost = real_apost
 
 
 def test_fail():
     row = FakeRow()
     mod.SessionLocal = lambda: FakeSession(row)
-    def fake_post(url, json=None, timeout=None, headers=None):
+    async def fake_apost(url, json=None, headers=None, read_timeout=None):
         return RespFail()
-    import requests
-    real_post = requests.post
-    requests.post = fake_post
+    from backend.utils.microservicio_client import get_microservicio_client
+    client = get_microservicio_client()
+    real_apost = client.apost
+    client.apost = fake_apost
     try:
         import asyncio
         try:
@@ -95,7 +97,7 @@ def test_fail():
             assert he.status_code == 502
             print("PASS fail→HTTP 502")
     finally:
-        requests.post = real_post
+        client.apost = real_apost
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+"""
+Anulación concurrente: el lease `anulacion:<id>` solo sirve si, una vez tomado, se relee la factura
+fuera de la transacción de _preparar_anulacion (en REPEATABLE READ el refresh vería la foto vieja).
+"""
+import asyncio
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import DefaultClause
+
+from backend.app.blueprints import facturador
+from backend.modelos import FacturaElectronica
+
+
+@pytest.fixture
+def factura(bd_sqlite_foto, monkeypatch):
+    import backend.database as database
+
+    tabla = FacturaElectronica.__table__
+    monkeypatch.setattr(tabla.c.anulada, "server_default", DefaultClause("0"))
+    tabla.create(bind=bd_sqlite_foto)
+    monkeypatch.setattr(facturador, "SessionLocal", database.SessionLocal)
+    with database.SessionLocal() as db:
+        row = FacturaElectronica(
+            ingreso_id="ING-1", cae="75120000000001", numero_comprobante=1, punto_venta=3,
+            tipo_comprobante=6, fecha_comprobante=date(2025, 6, 1), vencimiento_cae=date(2025, 6, 11),
+            resultado_afip="A", cuit_emisor="30700000017", tipo_doc_receptor=99, nro_doc_receptor="0",
+            importe_total=Decimal("121.00"), importe_neto=Decimal("100.00"), importe_iva=Decimal("21.00"),
+        )
+        db.add(row)
+        db.commit()
+        return row.id
+
+
+def test_segundo_pedido_ve_la_anulacion_confirmada_antes_del_lease(factura, monkeypatch):
+    import backend.database as database
+
+    def preparar(db, factura_id, body):
+        # Lectura del segundo pedido: abre su transacción con la factura todavía sin anular
+        return facturador._buscar_factura_anular(db, factura_id), {"payload": "nc"}
+
+    def tomar_lease_tras_commit_ajeno(nombre, segundos):
+        # El primer pedido termina y confirma su NC mientras el segundo espera el lease
+        with database.SessionLocal() as otra:
+            row = otra.get(FacturaElectronica, factura)
+            row.anulada = True
+            row.codigo_nota_credito = "NC-PRIMERO"
+            otra.commit()
+        return "token"
+
+    async def cae_nc(_payload):
+        raise AssertionError("se pidió una segunda NC para la misma factura")
+
+    monkeypatch.setattr(facturador, "_preparar_anulacion", preparar)
+    monkeypatch.setattr(facturador.coordinacion, "tomar_lease", tomar_lease_tras_commit_ajeno)
+    monkeypatch.setattr(facturador.coordinacion, "liberar_lease", lambda nombre, token: None)
+    monkeypatch.setattr(facturador, "_solicitar_cae_nc", cae_nc)
+
+    res = asyncio.run(facturador.anular_afip(str(factura)))
+
+    assert res == {"status": "ALREADY", "factura_id": str(factura), "codigo_nota_credito": "NC-PRIMERO"}
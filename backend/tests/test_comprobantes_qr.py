@@ -0,0 +1,70 @@
+"""
+GET /comprobantes/{factura_id}/qr solo encuentra facturas emitidas con un CUIT de la empresa del
+usuario (el QR lleva CUIT emisor, importe y documento del receptor); la API key interna ve todas.
+"""
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import DefaultClause
+
+from backend.app.blueprints import comprobantes
+from backend.modelos import FacturaElectronica
+
+CUIT_PROPIO = "30700000017"
+CUIT_AJENO = "20111111112"
+USUARIO = SimpleNamespace(id=5, nombre_usuario="ana", id_empresa=1)
+API_KEY = SimpleNamespace(id=999, nombre_usuario="sistema_api_key", id_empresa=1)
+
+
+@pytest.fixture
+def facturas(bd_sqlite, monkeypatch):
+    import backend.database as database
+
+    if not comprobantes.qr_render.disponible():
+        pytest.skip("qrcode no está instalado")
+    tabla = FacturaElectronica.__table__
+    monkeypatch.setattr(tabla.c.anulada, "server_default", DefaultClause("0"))
+    tabla.create(bind=bd_sqlite)
+    monkeypatch.setattr(comprobantes, "SessionLocal", database.SessionLocal)
+    monkeypatch.setattr(
+        comprobantes.tenant_context, "obtener_contexto",
+        lambda id_empresa, db=None: SimpleNamespace(cuit="30-70000001-7", cuit_configuracion=None),
+    )
+    with database.SessionLocal() as db:
+        # Mismo ingreso_id en las dos empresas
+        filas = [
+            FacturaElectronica(
+                ingreso_id="ING-1", cae=f"7512000000000{n}", numero_comprobante=n, punto_venta=3,
+                tipo_comprobante=6, fecha_comprobante=date(2025, 6, 1), resultado_afip="A", cuit_emisor=cuit,
+                tipo_doc_receptor=96, nro_doc_receptor="30111222", importe_total=Decimal("121.00"),
+                importe_neto=Decimal("100.00"), importe_iva=Decimal("21.00"),
+            )
+            for n, cuit in ((1, CUIT_AJENO), (2, CUIT_PROPIO))
+        ]
+        db.add_all(filas)
+        db.commit()
+        return {f.cuit_emisor: f for f in filas}
+
+
+def _qr(factura_id, usuario=USUARIO):
+    return comprobantes.descargar_comprobante_qr(factura_id, formato="svg", tam=6, usuario=usuario)
+
+
+@pytest.mark.parametrize("clave", ["id", "cae"])
+def test_factura_de_otra_empresa_da_404(facturas, clave):
+    with pytest.raises(HTTPException) as exc:
+        _qr(str(getattr(facturas[CUIT_AJENO], clave)))
+    assert exc.value.status_code == 404
+
+
+def test_factura_propia_por_id_e_ingreso(facturas):
+    assert _qr(str(facturas[CUIT_PROPIO].id)).status_code == 200
+    # El ingreso_id repetido resuelve a la factura de la empresa del usuario
+    assert _qr("ING-1").body == _qr(str(facturas[CUIT_PROPIO].id)).body
+
+
+def test_api_key_interna_ve_todas(facturas):
+    assert _qr(str(facturas[CUIT_AJENO].id), usuario=API_KEY).status_code == 200
@@ -0,0 +1,92 @@
+"""
+Coordinación entre workers (utils/coordinacion.py) con el backend `bd` sobre SQLite: leases
+(UPDATE del vencido y si no INSERT) y generaciones de caché vistas desde otro worker.
+"""
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import text
+
+from backend.utils import coordinacion
+
+
+@pytest.fixture
+def coord(bd_sqlite, monkeypatch):
+    monkeypatch.setattr(coordinacion, "_backend", coordinacion.CoordinacionBD())
+    monkeypatch.setattr(coordinacion, "_local", coordinacion.CoordinacionLocal())
+    monkeypatch.setattr(coordinacion, "COORDINACION_POLL_SEC", 1e-9)
+    monkeypatch.setattr(coordinacion, "_gen_valores", {})
+    monkeypatch.setattr(coordinacion, "_gen_leidas_en", float("-inf"))
+    return bd_sqlite
+
+
+def _vencer(engine, nombre):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE coordinacion_leases SET vence_at = :v WHERE nombre = :n"),
+                     {"v": coordinacion._utcnow() - timedelta(seconds=1), "n": nombre})
+
+
+def _dueno(engine, nombre):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT dueno FROM coordinacion_leases WHERE nombre = :n"), {"n": nombre}).scalar()
+
+
+def test_lease_tomado_se_rechaza(coord):
+    token = coordinacion.tomar_lease("anulacion:1", 60)
+
+    assert token
+    assert coordinacion.tomar_lease("anulacion:1", 60) is None
+    # Otro worker (sin el lock del proceso) también lo ve ocupado
+    assert not coordinacion.CoordinacionBD().tomar_lease("anulacion:1", 60, "otro")
+    assert coordinacion.tomar_lease("anulacion:2", 60)
+
+
+def test_lease_vencido_lo_toma_otro_worker(coord):
+    viejo = coordinacion.tomar_lease("sync:1", 60)
+    _vencer(coord, "sync:1")
+
+    assert coordinacion.CoordinacionBD().tomar_lease("sync:1", 60, "otro")
+    assert _dueno(coord, "sync:1") == "otro"
+    # El dueño anterior libera tarde: no le borra el lease al nuevo
+    coordinacion.liberar_lease("sync:1", viejo)
+    assert _dueno(coord, "sync:1") == "otro"
+
+
+def test_liberar_con_token_ajeno_no_libera(coord):
+    token = coordinacion.tomar_lease("ingreso:ING-1", 60)
+
+    coordinacion.liberar_lease("ingreso:ING-1", "otro-token")
+    assert coordinacion.tomar_lease("ingreso:ING-1", 60) is None
+
+    coordinacion.liberar_lease("ingreso:ING-1", token)
+    assert _dueno(coord, "ingreso:ING-1") is None
+    assert coordinacion.tomar_lease("ingreso:ING-1", 60)
+
+
+def test_invalidacion_publicada_por_otro_worker(coord):
+    vigilante = coordinacion.VigilanteCache("afip_credenciales")
+    assert not vigilante.cambio()
+
+    otro_worker = coordinacion.CoordinacionBD()
+    otro_worker.publicar("afip_credenciales")
+    assert vigilante.cambio()
+    # Una vez por generación
+    assert not vigilante.cambio()
+
+    otro_worker.publicar("contexto_empresa")
+    assert not vigilante.cambio()
+    coordinacion.publicar_invalidacion("afip_credenciales")
+    assert vigilante.cambio()
+    assert coordinacion.generacion("afip_credenciales") == 2
+
+
+def test_generaciones_se_releen_cada_poll(coord, monkeypatch):
+    monkeypatch.setattr(coordinacion, "COORDINACION_POLL_SEC", 3600)
+    vigilante = coordinacion.VigilanteCache("usuarios")
+    assert not vigilante.cambio()
+
+    coordinacion.CoordinacionBD().publicar("usuarios")
+    # Dentro del intervalo de poll se usa la última lectura
+    assert not vigilante.cambio()
+    monkeypatch.setattr(coordinacion, "_gen_leidas_en", float("-inf"))
+    assert vigilante.cambio()
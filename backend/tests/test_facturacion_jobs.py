@@ -0,0 +1,151 @@
+"""
+Transiciones de estado de los jobs de facturación (utils/facturacion_jobs.py) contra SQLite:
+reclamo con lease, retoma tras la caída del dueño, backoff y tope de intentos, cierre y cancelación.
+"""
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlmodel import select
+
+from backend.modelos import FacturacionJob, FacturacionJobItem
+from backend.utils import facturacion_jobs as fj
+
+
+@pytest.fixture
+def jobs(bd_sqlite, monkeypatch):
+    import backend.database as database
+
+    monkeypatch.setattr(fj, "engine", bd_sqlite)
+    monkeypatch.setattr(fj, "SessionLocal", database.SessionLocal)
+    assert fj.asegurar_tablas_jobs()
+    return bd_sqlite
+
+
+def _boleta(i):
+    return {"id": f"ING-{i}", "total": 100 + i, "emisor_cuit": "30700000017", "cliente_data": {"cuit_o_dni": "0"}}
+
+
+def _fallo_recuperable(i):
+    return {"id": f"ING-{i}", "status": "FAILED", "error": "timeout", "original_data": _boleta(i)}
+
+
+def _ok(i):
+    return {"id": f"ING-{i}", "status": "SUCCESS", "db_save_status": "SUCCESS", "original_data": _boleta(i)}
+
+
+def _item(job_id, posicion):
+    with fj.SessionLocal() as db:
+        return db.exec(
+            select(FacturacionJobItem)
+            .where(FacturacionJobItem.job_id == job_id, FacturacionJobItem.posicion == posicion)
+        ).first()
+
+
+def _estado_job(job_id):
+    with fj.SessionLocal() as db:
+        return db.get(FacturacionJob, job_id).estado
+
+
+def test_un_solo_worker_reclama_el_job(jobs):
+    job_id = fj.crear_job([_boleta(i) for i in range(3)], 1, 5, max_workers=2)
+
+    primero = fj._reclamar_job("w1")
+    segundo = fj._reclamar_job("w2")
+
+    assert primero == {"id": job_id, "max_workers": 2, "id_empresa": 1}
+    assert segundo is None
+    assert _estado_job(job_id) == fj.JOB_EN_CURSO
+
+
+def test_reclamo_de_lease_vencido_reencola_los_items_en_vuelo(jobs):
+    job_id = fj.crear_job([_boleta(i) for i in range(3)], 1, 5)
+    assert fj._reclamar_job("muerto")
+    tomados = fj._tomar_items_listos(job_id, 2)
+    assert [intento for _, _, intento in tomados] == [1, 1]
+    with jobs.begin() as conn:
+        conn.execute(text("UPDATE facturacion_jobs SET lease_hasta = :v WHERE id = :id"),
+                     {"v": fj._utcnow() - timedelta(seconds=1), "id": job_id})
+
+    assert fj._reclamar_job("w2")["id"] == job_id
+
+    assert [_item(job_id, p).estado for p in range(3)] == [fj.ITEM_PENDIENTE] * 3
+    assert not fj._renovar_lease(job_id, "muerto")
+    assert fj._renovar_lease(job_id, "w2")
+
+
+def test_fallo_recuperable_vuelve_a_pendiente_con_backoff_hasta_el_tope(jobs, monkeypatch):
+    monkeypatch.setattr(fj, "JOB_MAX_INTENTOS", 2)
+    monkeypatch.setattr(fj, "JOB_BACKOFF_SEC", 30)
+    job_id = fj.crear_job([_boleta(0)], 1, 5)
+    fj._reclamar_job("w1")
+
+    (item_id, _, intento), = fj._tomar_items_listos(job_id, 10)
+    assert fj._guardar_item(item_id, _fallo_recuperable(0), intento) == fj.ITEM_PENDIENTE
+    espera = fj._espera_siguiente(job_id)
+    assert 25 < espera <= 30
+    # Con el backoff pendiente no hay ítems listos
+    assert fj._tomar_items_listos(job_id, 10) == []
+
+    with jobs.begin() as conn:
+        conn.execute(text("UPDATE facturacion_job_items SET proximo_intento_at = :v"), {"v": fj._utcnow()})
+    (item_id, _, intento), = fj._tomar_items_listos(job_id, 10)
+    assert intento == 2
+    assert fj._guardar_item(item_id, _fallo_recuperable(0), intento) == fj.ITEM_ERROR
+    assert _item(job_id, 0).error == "timeout"
+
+
+def test_fallo_en_job_cancelado_no_se_reencola(jobs):
+    job_id = fj.crear_job([_boleta(0), _boleta(1)], 1, 5)
+    fj._reclamar_job("w1")
+    (item_id, _, intento), = fj._tomar_items_listos(job_id, 1)
+
+    assert fj.cancelar_job(job_id)
+    assert fj._guardar_item(item_id, _fallo_recuperable(0), intento) == fj.ITEM_ERROR
+
+    resumen = fj.resumen_job(job_id)
+    assert resumen["estado"] == fj.JOB_CANCELADO
+    assert resumen["pendientes"] == 0
+    assert resumen["por_estado"] == {fj.ITEM_ERROR: 1, fj.ITEM_CANCELADA: 1}
+    assert not fj._renovar_lease(job_id, "w1")
+
+
+def test_finalizar_job(jobs):
+    job_id = fj.crear_job([_boleta(0), _boleta(1)], 1, 5)
+    fj._reclamar_job("w1")
+    tomados = fj._tomar_items_listos(job_id, 10)
+
+    fj._guardar_item(tomados[0][0], _ok(0), 1)
+    # Un ítem sigue en PROCESANDO (no se pudo guardar su resultado): vuelve a PENDIENTE, el job sigue abierto
+    assert not fj._finalizar_job(job_id, "w1")
+    assert _item(job_id, 1).estado == fj.ITEM_PENDIENTE
+    assert not fj._finalizar_job(job_id, "w1")
+
+    (item_id, _, intento), = fj._tomar_items_listos(job_id, 10)
+    assert fj._guardar_item(item_id, {"id": "ING-1", "status": "FAILED", "error": "Ya facturada"}, intento) == fj.ITEM_DUPLICADA
+    assert fj._finalizar_job(job_id, "w1")
+    assert fj.resumen_job(job_id)["estado"] == fj.JOB_COMPLETADO
+
+
+def test_finalizar_job_con_errores(jobs, monkeypatch):
+    monkeypatch.setattr(fj, "JOB_MAX_INTENTOS", 1)
+    job_id = fj.crear_job([_boleta(0), _boleta(1)], 1, 5)
+    fj._reclamar_job("w1")
+    (a, _, _), (b, _, _) = fj._tomar_items_listos(job_id, 10)
+    fj._guardar_item(a, _ok(0), 1)
+    fj._guardar_item(b, _fallo_recuperable(1), 1)
+
+    assert fj._finalizar_job(job_id, "w1")
+    with fj.SessionLocal() as db:
+        job = db.get(FacturacionJob, job_id)
+        assert (job.estado, job.dueno, job.lease_hasta) == (fj.JOB_COMPLETADO_CON_ERRORES, None, None)
+        assert job.finished_at is not None
+
+
+def test_cancelar_job(jobs):
+    job_id = fj.crear_job([_boleta(i) for i in range(3)], 1, 5)
+
+    assert fj.cancelar_job(job_id)
+    assert not fj.cancelar_job(job_id)
+    assert fj.resumen_job(job_id)["por_estado"] == {fj.ITEM_CANCELADA: 3}
+    assert fj._reclamar_job("w1") is None
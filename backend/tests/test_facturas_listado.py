@@ -0,0 +1,21 @@
+"""
+Contrato del listado de facturadas (utils/facturas_listado.py): la proyección liviana devuelve las
+mismas columnas que el `SELECT *` anterior salvo raw_response y los campos de diagnóstico.
+"""
+from backend.modelos import FacturaElectronica
+from backend.utils.facturas_listado import COLUMNAS_LISTADO
+
+EXCLUIDAS = {
+    "raw_response",
+    "tipo_forzado_intentado",
+    "tipo_mismatch",
+    "tipo_comprobante_microservicio",
+    "debug_cuit_usado",
+    "debug_fuente_credenciales",
+}
+
+
+def test_proyeccion_es_select_asterisco_sin_blob_ni_diagnostico():
+    columnas = {c.name for c in FacturaElectronica.__table__.columns}
+    assert set(COLUMNAS_LISTADO) == columnas - EXCLUIDAS
+    assert len(COLUMNAS_LISTADO) == len(set(COLUMNAS_LISTADO))
@@ -0,0 +1,140 @@
+"""
+Outbox de marcas en Google Sheets (utils/sheets_outbox.py) contra SQLite: reclamo condicional entre
+procesos, coalescencia por ingreso y backoff hasta ERROR.
+"""
+from datetime import timedelta
+
+import pytest
+
+from backend.modelos import SheetsOutbox
+from backend.utils import sheets_outbox as so
+
+
+@pytest.fixture
+def outbox(bd_sqlite, monkeypatch):
+    import backend.database as database
+
+    monkeypatch.setattr(so, "engine", bd_sqlite)
+    monkeypatch.setattr(so, "SessionLocal", database.SessionLocal)
+    monkeypatch.setattr(so.tenant_context, "obtener_contexto", lambda id_empresa, db=None: None)
+    assert so.asegurar_tabla_outbox()
+    return bd_sqlite
+
+
+def _encolar(*marcas, sheet="SHEET-1"):
+    with so.SessionLocal() as db:
+        filas = [so.encolar_marca_sheets(db, ingreso, accion, sheet, id_empresa=1) for ingreso, accion in marcas]
+        db.commit()
+        return [f.id for f in filas]
+
+
+def _fila(outbox_id):
+    with so.SessionLocal() as db:
+        return db.get(SheetsOutbox, outbox_id)
+
+
+class HandlerFalso:
+    """TablasHandler mínimo: registra las marcas y confirma todas en confirmar_lote_escrituras."""
+
+    llamadas = []
+
+    def __init__(self, google_sheet_id=None):
+        self.client = object()
+        self._pendientes = []
+
+    def iniciar_lote_escrituras(self):
+        pass
+
+    def marcar_boleta_facturada(self, id_ingreso):
+        HandlerFalso.llamadas.append(("Facturado", id_ingreso))
+        self._pendientes.append(id_ingreso)
+        return True
+
+    def marcar_boleta_anulada(self, id_ingreso):
+        HandlerFalso.llamadas.append(("Anulada", id_ingreso))
+        self._pendientes.append(id_ingreso)
+        return True
+
+    def confirmar_lote_escrituras(self):
+        return {i: True for i in self._pendientes}
+
+
+def test_dos_reclamadores_uno_gana(outbox):
+    ids = _encolar(("ING-1", so.ACCION_FACTURADO), ("ING-2", so.ACCION_FACTURADO))
+    db_a = so.SessionLocal()
+    ganados_b = []
+    execute_original = db_a.execute
+
+    def execute_con_carrera(*args, **kwargs):
+        # A ya eligió sus candidatos; B reclama los mismos antes de que A haga su UPDATE
+        if not ganados_b:
+            with so.SessionLocal() as db_b:
+                ganados_b.extend(so._reclamar_pendientes(db_b, 10))
+        return execute_original(*args, **kwargs)
+
+    db_a.execute = execute_con_carrera
+    try:
+        ganados_a = so._reclamar_pendientes(db_a, 10)
+    finally:
+        db_a.close()
+
+    assert [f["id"] for f in ganados_b] == ids
+    assert ganados_a == []
+    assert all(_fila(i).estado == so.ESTADO_PROCESANDO for i in ids)
+
+
+def test_lease_vencido_se_vuelve_a_reclamar(outbox):
+    (outbox_id,) = _encolar(("ING-1", so.ACCION_FACTURADO))
+    with so.SessionLocal() as db:
+        assert len(so._reclamar_pendientes(db, 10)) == 1
+        assert so._reclamar_pendientes(db, 10) == []
+        row = db.get(SheetsOutbox, outbox_id)
+        row.proximo_intento_at = so._utcnow() - timedelta(seconds=1)
+        db.add(row)
+        db.commit()
+        assert [f["id"] for f in so._reclamar_pendientes(db, 10)] == [outbox_id]
+
+
+def test_coalescencia_por_ingreso(outbox, monkeypatch):
+    from backend.utils import tablasHandler
+
+    monkeypatch.setattr(tablasHandler, "TablasHandler", HandlerFalso)
+    HandlerFalso.llamadas = []
+    ids = _encolar(
+        ("ING-1", so.ACCION_FACTURADO), ("ING-2", so.ACCION_FACTURADO), ("ING-1", so.ACCION_ANULADO),
+    )
+
+    stats = so.drenar_outbox()
+
+    # Una sola escritura por ingreso: vale la última acción encolada
+    assert sorted(HandlerFalso.llamadas) == [("Anulada", "ING-1"), ("Facturado", "ING-2")]
+    assert stats == {"reclamados": 3, "enviados": 3, "reintentar": 0, "error": 0}
+    assert all(_fila(i).estado == so.ESTADO_ENVIADO for i in ids)
+
+
+def test_backoff_y_error_tras_max_intentos(outbox, monkeypatch):
+    monkeypatch.setattr(so, "OUTBOX_MAX_INTENTOS", 2)
+    monkeypatch.setattr(so, "OUTBOX_BACKOFF_BASE_SEC", 60)
+    monkeypatch.setattr(so, "_enviar_grupo", lambda sheet, filas: {f["id"]: "429 quota" for f in filas})
+    (outbox_id,) = _encolar(("ING-1", so.ACCION_FACTURADO))
+
+    assert so.drenar_outbox()["reintentar"] == 1
+    fila = _fila(outbox_id)
+    assert (fila.estado, fila.intentos, fila.ultimo_error) == (so.ESTADO_PENDIENTE, 1, "429 quota")
+    assert fila.proximo_intento_at - so._utcnow() > timedelta(seconds=55)
+    # Con el backoff pendiente no se reclama
+    assert so.drenar_outbox()["reclamados"] == 0
+
+    with so.SessionLocal() as db:
+        row = db.get(SheetsOutbox, outbox_id)
+        row.proximo_intento_at = so._utcnow()
+        db.add(row)
+        db.commit()
+    assert so.drenar_outbox()["error"] == 1
+    assert _fila(outbox_id).estado == so.ESTADO_ERROR
+
+
+def test_backoff_exponencial_con_tope(monkeypatch):
+    monkeypatch.setattr(so, "OUTBOX_BACKOFF_BASE_SEC", 10)
+    monkeypatch.setattr(so, "OUTBOX_BACKOFF_MAX_SEC", 100)
+    assert [so._backoff(n).total_seconds() for n in (1, 2, 3, 4, 5)] == [10, 20, 40, 80, 100]
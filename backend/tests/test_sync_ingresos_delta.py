@@ -0,0 +1,128 @@
+"""
+Decisión de lectura del sync de INGRESOS (sheets_boletas._leer_ingresos_para_sync) sobre una hoja
+en memoria: SIN_CAMBIOS, DELTA y los casos que obligan a releer todo (ancla movida, encabezados
+distintos, reconciliación cada SHEETS_SYNC_FULL_CADA_HORAS). Un DELTA con el ancla equivocada
+perdería filas sin error.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from backend.app.blueprints import sheets_boletas
+from backend.modelos import SheetsSyncEstado
+from backend.tests.fakes_sheets import ClienteGspreadFalso, generar_ingresos
+from backend.utils import tablasHandler
+
+SHEET = "SYNC-SHEET"
+FILAS = 20
+VENTANA = 5
+
+
+@pytest.fixture
+def hoja(monkeypatch):
+    cliente = ClienteGspreadFalso(latencia_ms=0)
+    cliente.agregar(SHEET, generar_ingresos(1, FILAS, random.Random(7)))
+    monkeypatch.setattr(tablasHandler, "gspread_client", cliente)
+    monkeypatch.setattr(sheets_boletas, "SYNC_VENTANA_FILAS", VENTANA)
+    planilla = cliente.open_by_key(SHEET)
+    return planilla, planilla.worksheet("INGRESOS")
+
+
+def _estado_al_dia(planilla, worksheet, **cambios) -> SheetsSyncEstado:
+    """Estado como lo deja un sync completo de la hoja tal como está ahora."""
+    valores = worksheet.get_all_values()
+    estado = SheetsSyncEstado(
+        google_sheet_id=SHEET,
+        ultima_fila=len(valores),
+        ultima_id_ingreso=valores[-1][0],
+        headers_hash=sheets_boletas._sha1("\x1f".join(valores[0])),
+        modificado_en_sheets=planilla.get_lastUpdateTime(),
+        ultima_full_at=datetime.now(timezone.utc).replace(tzinfo=None),
+    )
+    for k, v in cambios.items():
+        setattr(estado, k, v)
+    return estado
+
+
+def _leer(estado, full_sync=False):
+    return sheets_boletas._leer_ingresos_para_sync(tablasHandler.TablasHandler(SHEET), estado, full_sync)
+
+
+def _agregar_fila(planilla, worksheet, id_ingreso):
+    fila = list(worksheet._valores[-1])
+    fila[0] = id_ingreso
+    worksheet._valores.append(fila)
+    planilla._modificado += timedelta(seconds=1)
+
+
+def test_sin_cambios_no_lee_filas(hoja):
+    planilla, worksheet = hoja
+    lectura = _leer(_estado_al_dia(planilla, worksheet))
+    assert lectura["modo"] == "SIN_CAMBIOS"
+    assert "filas" not in lectura
+
+
+def test_delta_lee_la_ventana_y_las_filas_nuevas(hoja):
+    planilla, worksheet = hoja
+    estado = _estado_al_dia(planilla, worksheet)
+    _agregar_fila(planilla, worksheet, "NUEVA-1")
+    _agregar_fila(planilla, worksheet, "NUEVA-2")
+
+    lectura = _leer(estado)
+
+    assert lectura["modo"] == "DELTA"
+    numeros = [n for n, _ in lectura["filas"]]
+    assert numeros == list(range(FILAS + 1 - VENTANA + 1, FILAS + 1 + 2 + 1))
+    assert [f[0] for _, f in lectura["filas"][-2:]] == ["NUEVA-1", "NUEVA-2"]
+
+
+def test_ancla_movida_por_un_borrado_fuerza_lectura_completa(hoja):
+    planilla, worksheet = hoja
+    estado = _estado_al_dia(planilla, worksheet)
+    # Se borra una fila por encima de la marca de agua: la fila ancla ahora tiene otro ID
+    del worksheet._valores[3]
+    _agregar_fila(planilla, worksheet, "NUEVA-1")
+
+    lectura = _leer(estado)
+
+    assert lectura["modo"] == "COMPLETA"
+    assert lectura["filas"][0][0] == 2
+    assert len(lectura["filas"]) == FILAS
+
+
+def test_ancla_fuera_de_rango_fuerza_lectura_completa(hoja):
+    planilla, worksheet = hoja
+    estado = _estado_al_dia(planilla, worksheet)
+    del worksheet._valores[-3:]
+    planilla._modificado += timedelta(seconds=1)
+
+    assert _leer(estado)["modo"] == "COMPLETA"
+
+
+def test_encabezados_distintos_fuerzan_lectura_completa(hoja):
+    planilla, worksheet = hoja
+    estado = _estado_al_dia(planilla, worksheet)
+    worksheet._valores[0] = list(worksheet._valores[0][:-1]) + ["Estado Facturacion"]
+    _agregar_fila(planilla, worksheet, "NUEVA-1")
+
+    assert _leer(estado)["modo"] == "COMPLETA"
+
+
+def test_reconciliacion_periodica_fuerza_lectura_completa(hoja):
+    planilla, worksheet = hoja
+    vieja = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=sheets_boletas.SYNC_FULL_CADA_HORAS, minutes=1)
+    # Aun sin cambios en Drive
+    lectura = _leer(_estado_al_dia(planilla, worksheet, ultima_full_at=vieja))
+    assert lectura["modo"] == "COMPLETA"
+    assert len(lectura["filas"]) == FILAS
+
+
+@pytest.mark.parametrize("estado_fn, full_sync", [
+    (lambda p, w: None, False),
+    (lambda p, w: _estado_al_dia(p, w, ultima_fila=0), False),
+    (lambda p, w: _estado_al_dia(p, w), True),
+])
+def test_sin_marca_de_agua_o_full_sync_lee_todo(hoja, estado_fn, full_sync):
+    planilla, worksheet = hoja
+    assert _leer(estado_fn(planilla, worksheet), full_sync)["modo"] == "COMPLETA"
@@ -1,9 +1,12 @@
 from dataclasses import dataclass
 from datetime import datetime
+import logging
 import os
 import requests
 import json
 import re
+import threading
+import time
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from dotenv import load_dotenv
@@ -22,11 +25,12 @@ try:
 except Exception:
     AFIP_ENABLE_ENV_CREDS = False
 
+logger = logging.getLogger(__name__)
+
 # Modo estricto: si se solicita emisor_cuit y no se pueden obtener credenciales de bóveda para ese CUIT,
 # no continuar con fallback a otro CUIT (evita confusiones). Activable via env STRICT_AFIP_CREDENTIALS=1
 STRICT_AFIP_CREDENTIALS = os.getenv('STRICT_AFIP_CREDENTIALS','0').strip() in ('1','true','on','yes')
 
-from typing import Dict, Any
 
 TASA_IVA_21 = 0.21
 # --- Carga de Configuración ---
@@ -60,6 +64,9 @@ try:
 except Exception:
     afip_tools_manager = None
 
+from backend.utils.microservicio_client import get_microservicio_client
+from backend.utils import coordinacion, metricas
+
 def _cuit_solo_digitos(s: str | None) -> str:
     return "".join(ch for ch in str(s or "") if ch.isdigit())
 
@@ -76,7 +83,101 @@ def _variantes_cuit_busqueda(emisor_cuit: str | None) -> list[str]:
     return out
 
 
+# --- Cache en proceso de credenciales AFIP ---
+# Clave: CUIT normalizado (11 dígitos, '' si no se pidió emisor). Cada entrada guarda la tupla
+# resuelta y, una vez calculados, el certificado saneado y la clave ya convertida a PKCS#8.
+# TTL configurable (AFIP_CREDENCIALES_CACHE_TTL_SEC, 0 = desactivado). Los endpoints que escriben
+# material nuevo (/afip/credenciales, admin_empresa.subir_certificado_afip, ...) deben llamar a
+# invalidar_cache_credenciales_afip(), que además avisa a los demás workers (utils/coordinacion).
+try:
+    AFIP_CREDENCIALES_CACHE_TTL_SEC = float(os.getenv('AFIP_CREDENCIALES_CACHE_TTL_SEC', '300'))
+except ValueError:
+    AFIP_CREDENCIALES_CACHE_TTL_SEC = 300.0
+_credenciales_cache: Dict[str, Dict[str, Any]] = {}
+_credenciales_cache_lock = threading.Lock()
+_vigilante_credenciales = coordinacion.VigilanteCache("credenciales_afip")
+
+
+def _clave_cache_credenciales(emisor_cuit: str | None) -> str:
+    return _cuit_solo_digitos(emisor_cuit)[:11]
+
+
+def invalidar_cache_credenciales_afip(cuit: str | None = None) -> int:
+    """Invalida el cache de credenciales. Sin CUIT limpia todo; con CUIT elimina las entradas
+    pedidas para ese CUIT y las que resolvieron a ese CUIT (p.ej. por fallback). Devuelve cuántas quitó.
+
+    No lanza: se llama después de guardar certificado/clave y un error acá no debe romper ese pedido
+    (en el peor caso la entrada vieja vence por TTL)."""
+    try:
+        coordinacion.publicar_invalidacion("credenciales_afip")
+        with _credenciales_cache_lock:
+            if not cuit:
+                n = len(_credenciales_cache)
+                _credenciales_cache.clear()
+                return n
+            objetivo = _clave_cache_credenciales(cuit)
+            borrar = [
+                k for k, entrada in _credenciales_cache.items()
+                if k == objetivo or _cuit_solo_digitos(entrada['valor'][0])[:11] == objetivo
+            ]
+            for k in borrar:
+                _credenciales_cache.pop(k, None)
+            return len(borrar)
+    except Exception as e:
+        logger.warning(f"[AFIP_CREDS] No se pudo invalidar el cache de credenciales ({cuit or 'todas'}): {e}")
+        return 0
+
+
+def _obtener_entrada_cache_credenciales(emisor_cuit: str | None) -> Dict[str, Any] | None:
+    """Devuelve la entrada vigente del cache (resolviendo y guardando si hace falta).
+    Solo se cachean resoluciones exitosas; 'none' siempre se vuelve a intentar."""
+    clave = _clave_cache_credenciales(emisor_cuit)
+    ahora = time.monotonic()
+    if AFIP_CREDENCIALES_CACHE_TTL_SEC > 0:
+        if _vigilante_credenciales.cambio():
+            with _credenciales_cache_lock:
+                _credenciales_cache.clear()
+        with _credenciales_cache_lock:
+            entrada = _credenciales_cache.get(clave)
+            if entrada and entrada['expira'] > ahora:
+                return entrada
+    valor = _resolve_afip_credentials_sin_cache(emisor_cuit)
+    cuit_res, cert_res, key_res, _fuente = valor
+    if not (cuit_res and cert_res and key_res):
+        return None
+    entrada = {'valor': valor, 'expira': ahora + AFIP_CREDENCIALES_CACHE_TTL_SEC, 'cert_sane': None, 'key_pkcs8': None}
+    if AFIP_CREDENCIALES_CACHE_TTL_SEC > 0:
+        with _credenciales_cache_lock:
+            _credenciales_cache[clave] = entrada
+    return entrada
+
+
 def _resolve_afip_credentials(emisor_cuit: str | None = None):
+    """Versión cacheada de `_resolve_afip_credentials_sin_cache` (misma firma y retorno)."""
+    entrada = _obtener_entrada_cache_credenciales(emisor_cuit)
+    if not entrada:
+        return None, None, None, 'none'
+    return entrada['valor']
+
+
+def _resolve_afip_credentials_saneadas(emisor_cuit: str | None = None):
+    """Como `_resolve_afip_credentials` pero con el certificado saneado y la clave ya en PKCS#8.
+    La conversión (parseo RSA) se hace una sola vez por entrada de cache.
+
+    Devuelve (cuit, cert_saneado, clave_pkcs8, fuente, cert_original, clave_original): el material
+    original sale de la misma entrada (para fingerprints), sin una segunda resolución.
+    Lanza ValueError si la clave privada es inválida."""
+    entrada = _obtener_entrada_cache_credenciales(emisor_cuit)
+    if not entrada:
+        return None, None, None, 'none', None, None
+    cuit_res, cert_res, key_res, fuente = entrada['valor']
+    if entrada['key_pkcs8'] is None:
+        entrada['cert_sane'] = _sanitize_pem(cert_res, 'cert')
+        entrada['key_pkcs8'] = _asegurar_pkcs8_y_validar(key_res)
+    return cuit_res, entrada['cert_sane'], entrada['key_pkcs8'], fuente, cert_res, key_res
+
+
+def _resolve_afip_credentials_sin_cache(emisor_cuit: str | None = None):
     """Devuelve (cuit, certificado_pem, clave_privada_pem, fuente)
     Fuente: 'boveda', 'env', 'none'. Prioridad:
       1) Registro activo en base de datos (afip_credenciales) para CUIT solicitado
@@ -501,7 +602,7 @@ def determinar_datos_factura_segun_iva(
 
 
 
-def generar_factura_para_venta(
+def _preparar_solicitud_factura(
     total: float,
     cliente_data: ReceptorData,
     emisor_cuit: str | None = None,
@@ -511,24 +612,24 @@ def generar_factura_para_venta(
     tributos: list[Dict[str, Any]] | None = None,
     aplicar_desglose_77: bool = False,
 ) -> Dict[str, Any]:
-    
+    """Resuelve punto de venta y credenciales (BD / bóveda) y arma el payload del microservicio.
+
+    Es la parte bloqueante de la facturación (sin HTTP): la versión async la corre en el pool
+    bloqueante. Devuelve el payload y los datos que necesita `_resultado_microservicio`.
+    """
     print(f"Iniciando proceso de facturación (emisor solicitado: {emisor_cuit}) | AFIP_ENABLE_ENV_CREDS={AFIP_ENABLE_ENV_CREDS}")
 
     # Resolver punto_venta si no se especificó y hay un CUIT emisor
     if punto_venta is None and emisor_cuit:
         try:
-            from sqlmodel import select as _select
-            from backend.database import SessionLocal as _SessionLocal
-            from backend.modelos import ConfiguracionEmpresa
-            
+            from backend.utils import tenant_context
+
             # Limpiar CUIT
             clean_cuit = ''.join(filter(str.isdigit, str(emisor_cuit)))
-            
-            with _SessionLocal() as _db:
-                cfg = _db.exec(_select(ConfiguracionEmpresa).where(ConfiguracionEmpresa.cuit == clean_cuit)).first()
-                if cfg and cfg.afip_punto_venta_predeterminado:
-                    punto_venta = cfg.afip_punto_venta_predeterminado
-                    print(f"[AFIP] Usando punto_venta {punto_venta} de DB para CUIT {clean_cuit}")
+            ctx = tenant_context.contexto_por_cuit(clean_cuit)
+            if ctx and ctx.punto_venta:
+                punto_venta = ctx.punto_venta
+                print(f"[AFIP] Usando punto_venta {punto_venta} de DB para CUIT {clean_cuit}")
         except Exception as e:
             print(f"[AFIP] Advertencia: No se pudo resolver punto_venta desde DB: {e}")
 
@@ -562,22 +663,19 @@ def generar_factura_para_venta(
          # Mejor lanzar error si no está configurado
          pass # Se validará más abajo o se enviará None (que fallará en AFIP)
 
-    # Resolver credenciales dando preferencia al emisor solicitado (si se proporcionó)
-    cuit_res, cert_res, key_res, fuente = _resolve_afip_credentials(emisor_cuit)
+    # Resolver credenciales dando preferencia al emisor solicitado (si se proporcionó).
+    # Vienen del cache: certificado ya saneado (CRLF / longitud) y clave ya convertida a PKCS#8.
+    try:
+        # cert_res / key_res: material original, para fingerprints comparables con los guardados en BD
+        cuit_res, cert_res_sane, key_res_sane, fuente, cert_res, key_res = _resolve_afip_credentials_saneadas(emisor_cuit)
+    except ValueError as ve:
+        raise RuntimeError(f"Error de credenciales (clave privada): {str(ve)}")
 
     print(f"Credenciales resueltas: cuit={cuit_res} (fuente={fuente}) | cert_fp={_fingerprint_material(cert_res)} key_fp={_fingerprint_material(key_res)}")
 
-    if not (cuit_res and cert_res and key_res):
+    if not (cuit_res and cert_res_sane and key_res_sane):
         raise ValueError("Faltan credenciales críticas de AFIP (CUIT, Certificado, o Clave Privada). Revise variables de entorno o bóveda.")
 
-    # Sanear PEM antes de enviarlo (evita errores de longitud / CRLF)
-    cert_res_sane = _sanitize_pem(cert_res, 'cert')
-    # Clave privada: sanitizar y asegurar formato PKCS#8 compatible
-    try:
-        key_res_sane = _asegurar_pkcs8_y_validar(key_res)
-    except ValueError as ve:
-        raise RuntimeError(f"Error de credenciales (clave privada): {str(ve)}")
-
     # Validaciones previas de sanidad de credenciales
     if not cert_res_sane or "-----BEGIN CERTIFICATE-----" not in cert_res_sane:
         raise ValueError(f"El certificado para el CUIT {cuit_res} no parece ser un PEM válido.")
@@ -793,31 +891,148 @@ def generar_factura_para_venta(
         "credenciales": credenciales,
         "datos_factura": datos_factura,
     }
+    return {
+        "payload": payload,
+        "datos_factura": datos_factura,
+        "total": total,
+        "cuit_res": cuit_res,
+        "cert_res": cert_res,
+        "key_res": key_res,
+        "fuente": fuente,
+        "tributos_procesados": tributos_procesados,
+        "aplicar_desglose_77": aplicar_desglose_77,
+    }
+
 
+def _url_microservicio(solicitud: Dict[str, Any]) -> str:
+    """URL del microservicio (con log seguro de las credenciales que se van a enviar)."""
+    cuit_res, cert_res, key_res = solicitud["cuit_res"], solicitud["cert_res"], solicitud["key_res"]
     print(f"Enviando petición al microservicio de facturación en: {FACTURACION_API_URL}")
+    # Log seguro de credenciales (no imprimir la clave completa)
     try:
-        # Log seguro de credenciales (no imprimir la clave completa)
+        safe_cred = {
+            'cuit': cuit_res,
+            'cert_present': bool(cert_res and len(cert_res) > 0),
+            'key_present': bool(key_res and len(key_res) > 0),
+            'cert_preview': (cert_res[:30] + '...') if cert_res and len(cert_res) > 30 else cert_res,
+            'key_preview': ('<private key hidden>' if key_res else None)
+        }
+        print(f"Credenciales (seguras): {safe_cred}")
+    except Exception:
+        print("Credenciales: <no disponible para previsualizar>")
+
+    # Asegurarnos está disponible y de tipo str para el analizador estático
+    url = FACTURACION_API_URL
+    if not url:
+        raise RuntimeError("FACTURACION_API_URL no configurado.")
+    return url
+
+
+def _verificar_status_http(response: Any) -> None:
+    """`raise_for_status` común a las respuestas de requests y de httpx (lanza requests.HTTPError)."""
+    if 400 <= response.status_code < 600:
+        motivo = getattr(response, "reason", None) or getattr(response, "reason_phrase", "")
+        raise requests.exceptions.HTTPError(
+            f"{response.status_code} Error: {motivo} for url: {response.url}", response=response
+        )
+
+
+def _resultado_http(respuesta: Any) -> str:
+    """Etiqueta de resultado de la llamada al microservicio para las métricas de la etapa afip."""
+    if isinstance(respuesta, BaseException):
+        return type(respuesta).__name__
+    return metricas.RESULTADO_OK if respuesta.status_code < 400 else f"http_{respuesta.status_code}"
+
+
+_INDICIOS_TRANSITORIOS = ("ssl", "unexpected eof", "unexpected_eof", "connectionreset", "connection reset", "timed out")
+
+
+def _interpretar_respuesta(solicitud: Dict[str, Any], respuesta: Any, emisor_cuit: str | None) -> Dict[str, Any]:
+    """`_resultado_microservicio` contando en las métricas los errores transitorios (conexión/SSL)."""
+    try:
+        return _resultado_microservicio(solicitud, respuesta)
+    except Exception as e:
+        origen = respuesta if isinstance(respuesta, BaseException) else e
+        if isinstance(origen, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)) or any(
+            x in repr(e).lower() for x in _INDICIOS_TRANSITORIOS
+        ):
+            metricas.AFIP_ERRORES_TRANSITORIOS.inc(emisor=metricas.etiqueta_emisor(emisor_cuit))
+        raise
+
+
+def generar_factura_para_venta(
+    total: float,
+    cliente_data: ReceptorData,
+    emisor_cuit: str | None = None,
+    tipo_forzado: int | None = None,
+    conceptos: list[Dict[str, Any]] | None = None,
+    punto_venta: int | None = None,
+    tributos: list[Dict[str, Any]] | None = None,
+    aplicar_desglose_77: bool = False,
+) -> Dict[str, Any]:
+    with metricas.cronometrar("credenciales", emisor_cuit):
+        solicitud = _preparar_solicitud_factura(
+            total, cliente_data, emisor_cuit, tipo_forzado, conceptos, punto_venta, tributos, aplicar_desglose_77
+        )
+    with metricas.cronometrar("afip", emisor_cuit) as cron:
         try:
-            safe_cred = {
-                'cuit': cuit_res,
-                'cert_present': bool(cert_res and len(cert_res) > 0),
-                'key_present': bool(key_res and len(key_res) > 0),
-                'cert_preview': (cert_res[:30] + '...') if cert_res and len(cert_res) > 30 else cert_res,
-                'key_preview': ('<private key hidden>' if key_res else None)
-            }
-            print(f"Credenciales (seguras): {safe_cred}")
-        except Exception:
-            print("Credenciales: <no disponible para previsualizar>")
-
-        # Asegurarnos está disponible y de tipo str para el analizador estático
-        url = FACTURACION_API_URL
-        if not url:
-            raise RuntimeError("FACTURACION_API_URL no configurado.")
-        response = requests.post(
-            url,
-            json=payload,
-            timeout=20,
+            url = _url_microservicio(solicitud)
+            # Cliente compartido con pool keep-alive (evita un handshake TCP/TLS por comprobante)
+            respuesta = get_microservicio_client().post(url, json=solicitud["payload"])
+        except Exception as e:
+            respuesta = e
+        cron.resultado = _resultado_http(respuesta)
+    return _interpretar_respuesta(solicitud, respuesta, emisor_cuit)
+
+
+async def agenerar_factura_para_venta(
+    total: float,
+    cliente_data: ReceptorData,
+    emisor_cuit: str | None = None,
+    tipo_forzado: int | None = None,
+    conceptos: list[Dict[str, Any]] | None = None,
+    punto_venta: int | None = None,
+    tributos: list[Dict[str, Any]] | None = None,
+    aplicar_desglose_77: bool = False,
+) -> Dict[str, Any]:
+    """Igual que `generar_factura_para_venta` pero sin bloquear el event loop.
+
+    La preparación (BD, bóveda) va al pool bloqueante y el POST usa el cliente httpx async.
+    Las excepciones son las mismas que en la versión síncrona (misma clasificación para tenacity).
+    """
+    from backend.utils.pool_bloqueante import en_hilo
+
+    with metricas.cronometrar("credenciales", emisor_cuit):
+        solicitud = await en_hilo(
+            _preparar_solicitud_factura,
+            total, cliente_data, emisor_cuit, tipo_forzado, conceptos, punto_venta, tributos, aplicar_desglose_77,
         )
+    with metricas.cronometrar("afip", emisor_cuit) as cron:
+        try:
+            url = _url_microservicio(solicitud)
+            respuesta = await get_microservicio_client().apost(url, json=solicitud["payload"])
+        except Exception as e:
+            respuesta = e
+        cron.resultado = _resultado_http(respuesta)
+    return _interpretar_respuesta(solicitud, respuesta, emisor_cuit)
+
+
+def _resultado_microservicio(solicitud: Dict[str, Any], respuesta: Any) -> Dict[str, Any]:
+    """Interpreta la respuesta del microservicio (o la excepción del POST) y arma el resultado.
+
+    Los errores transitorios salen como requests.exceptions.ConnectionError (reintentables);
+    el resto como RuntimeError.
+    """
+    datos_factura = solicitud["datos_factura"]
+    total = solicitud["total"]
+    cuit_res = solicitud["cuit_res"]
+    fuente = solicitud["fuente"]
+    tributos_procesados = solicitud["tributos_procesados"]
+    aplicar_desglose_77 = solicitud["aplicar_desglose_77"]
+    try:
+        if isinstance(respuesta, BaseException):
+            raise respuesta
+        response = respuesta
 
         if response.status_code == 500:
             error_msg_detected = None
@@ -831,7 +1046,7 @@ def generar_factura_para_venta(
             if error_msg_detected:
                 raise RuntimeError(error_msg_detected)
 
-        response.raise_for_status()
+        _verificar_status_http(response)
 
         resultado_afip = response.json()
         if resultado_afip is None:
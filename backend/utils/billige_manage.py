@@ -1,28 +1,35 @@
+import asyncio
 import logging
 import os
+import re
+import threading
+import time
+from contextlib import nullcontext
 from typing import List, Dict, Any
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 import json  # NUEVO
 from .json_utils import default_json
 import base64 # NUEVO
-try:
-    import qrcode  # NUEVO
-except Exception:
-    qrcode = None
-from io import BytesIO # NUEVO
+from . import coordinacion, metricas, qr_render, tenant_context
+from .pool_bloqueante import en_hilo
 from datetime import datetime, date
 from decimal import Decimal
 
 
 try:
     # --- Importaciones de tu aplicación ---
-    from .afipTools import generar_factura_para_venta, ReceptorData
+    from .afipTools import agenerar_factura_para_venta, generar_factura_para_venta, ReceptorData
     from .tablasHandler import TablasHandler
+    from .sheets_outbox import (
+        ACCION_FACTURADO,
+        actualizar_espejo_ingreso,
+        encolar_marca_sheets,
+        notificar_outbox,
+    )
     # --- NUEVO: Importaciones para la Base de Datos ---
     from backend.database import SessionLocal  # Asume que tienes un `database.py` que crea la sesión
-    from backend.modelos import FacturaElectronica, IngresoSheets, ConfiguracionEmpresa, Empresa
-    from sqlmodel import select, or_
+    from backend.modelos import FacturaElectronica
 except ImportError as e:
     # Algunos módulos son opcionales en entornos de demo; registrar y seguir adelante
     logging.critical(f"No se pudieron importar algunos módulos opcionales: {e} — continuando en modo degradado.")
@@ -31,6 +38,10 @@ except ImportError as e:
         generar_factura_para_venta
     except NameError:
         generar_factura_para_venta = None
+    try:
+        agenerar_factura_para_venta
+    except NameError:
+        agenerar_factura_para_venta = None
     try:
         ReceptorData
     except NameError:
@@ -62,115 +73,110 @@ from tenacity import (
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# --- Concurrencia del motor de lotes ---
+try:
+    from backend import config as _cfg_lote
+    _BATCH_MAX_WORKERS = max(1, int(getattr(_cfg_lote, 'FACTURACION_BATCH_MAX_WORKERS', 10)))
+    _MAX_CONCURRENCIA_POR_EMISOR = max(1, int(getattr(_cfg_lote, 'FACTURACION_MAX_CONCURRENCIA_POR_EMISOR', 4)))
+    _LEASE_FACTURA_SEC = float(getattr(_cfg_lote, 'FACTURACION_LEASE_SEC', 300))
+except Exception:
+    _BATCH_MAX_WORKERS = 10
+    _MAX_CONCURRENCIA_POR_EMISOR = 4
+    _LEASE_FACTURA_SEC = 300.0
+
+# Un semáforo por CUIT emisor (compartido entre lotes concurrentes del mismo proceso) para
+# no saturar al microservicio/AFIP con demasiadas solicitudes del mismo contribuyente.
+# Es por worker: con WEB_CONCURRENCY=N el tope efectivo por CUIT es N * el configurado.
+_emisor_semaforos: Dict[str, threading.BoundedSemaphore] = {}
+_emisor_semaforos_lock = threading.Lock()
+
+
+def _clave_emisor(emisor_cuit: Any) -> str:
+    return re.sub(r'\D', '', str(emisor_cuit or '')) or '_sin_emisor'
+
+
+def _semaforo_emisor(emisor_cuit: Any) -> threading.BoundedSemaphore:
+    """Devuelve (creándolo si hace falta) el semáforo de concurrencia del CUIT emisor."""
+    clave = _clave_emisor(emisor_cuit)
+    with _emisor_semaforos_lock:
+        sem = _emisor_semaforos.get(clave)
+        if sem is None:
+            sem = threading.BoundedSemaphore(_MAX_CONCURRENCIA_POR_EMISOR)
+            _emisor_semaforos[clave] = sem
+        return sem
+
+
+# Mismo tope para el camino async (process_invoice_batch_for_endpoint). Solo se usan desde el
+# event loop del proceso, así que no necesitan lock.
+_emisor_semaforos_async: Dict[str, asyncio.Semaphore] = {}
+
+
+def _semaforo_emisor_async(emisor_cuit: Any) -> asyncio.Semaphore:
+    clave = _clave_emisor(emisor_cuit)
+    sem = _emisor_semaforos_async.get(clave)
+    if sem is None:
+        sem = _emisor_semaforos_async[clave] = asyncio.Semaphore(_MAX_CONCURRENCIA_POR_EMISOR)
+    return sem
+
 
 # ==============================================================================
-# NUEVA FUNCIÓN PARA GENERAR EL QR
+# QR DE AFIP
 # ==============================================================================
-def generar_qr_afip(afip_data: Dict[str, Any]) -> tuple[str | None, str | None]:
+def generar_qr_afip(afip_data: Dict[str, Any]) -> str | None:
     """
-    Genera la URL de AFIP para el QR y la imagen del QR como Data URL.
-
-    Args:
-        afip_data: El diccionario con la respuesta de una facturación exitosa de AFIP.
+    Arma la URL de AFIP para el QR (la que se guarda en `qr_url_afip`).
 
-    Returns:
-        Una tupla conteniendo:
-        - La URL base para el QR (para guardar en la BD).
-        - La imagen del QR como un string Data URL (para enviar al frontend).
-        O (None, None) si faltan datos.
+    La imagen ya no se genera acá: se renderiza a pedido y cacheada en
+    GET /comprobantes/{id}/qr (ver utils/qr_render). Devuelve None si faltan datos.
     """
-    try:
-        # 1. Armar el objeto JSON con los datos requeridos por AFIP
-        # fecha_comprobante puede ser str ISO o datetime/date
-        fecha_val = afip_data.get("fecha_comprobante")
-        if isinstance(fecha_val, str):
-            try:
-                fecha_str = fecha_val.split("T")[0]
-            except Exception:
-                fecha_str = fecha_val
-        elif isinstance(fecha_val, (datetime, date)):
-            fecha_str = fecha_val.strftime("%Y-%m-%d")
-        else:
-            fecha_str = datetime.now().strftime("%Y-%m-%d")
-
-        datos_para_qr = {
-            "ver": 1,
-            "fecha": fecha_str,
-            "cuit": int(afip_data["cuit_emisor"]),
-            "ptoVta": int(afip_data["punto_venta"]),
-            "tipoCmp": int(afip_data["tipo_comprobante"]),
-            "nroCmp": int(afip_data["numero_comprobante"]),
-            "importe": float(afip_data["importe_total"]),
-            "moneda": "PES",
-            "ctz": 1,
-            "tipoDocRec": int(afip_data["tipo_doc_receptor"]),
-            "nroDocRec": int(afip_data["nro_doc_receptor"]),
-            "tipoCodAut": "E",
-            "codAut": int(afip_data["cae"])
-        }
-
-        # 2. Convertir a JSON string y luego a Base64
-        json_string = json.dumps(datos_para_qr, default=default_json)
-        datos_base64 = base64.b64encode(json_string.encode('utf-8')).decode('utf-8')
-
-        # 3. Armar la URL final de AFIP
-        url_para_qr = f"https://www.afip.gob.ar/fe/qr/?p={datos_base64}"
-
-        # 4. Generar la imagen del QR y convertirla a Data URL (si la dependencia está disponible)
-        if qrcode is not None:
-            img = qrcode.make(url_para_qr)
-            buffered = BytesIO()
-            img.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            qr_data_url = f"data:image/png;base64,{img_str}"
-            return url_para_qr, qr_data_url
-        else:
-            # qrcode no está instalado; devolver solo la URL
-            return url_para_qr, None
-
-    except (KeyError, TypeError) as e:
-        logger.error(f"Error generando QR: Faltan datos en la respuesta de AFIP. Error: {e}", exc_info=True)
-        return None, None
-    except Exception as e:
-        logger.error(f"Error inesperado al generar el QR: {e}", exc_info=True)
-        return None, None
+    return qr_render.url_qr_afip(afip_data)
 # ==============================================================================
 
 
-def _resolver_empresa_por_emisor_cuit(db, emisor_cuit: str | None):
+def _resolver_sheet_emisor(emisor_cuit: str | None) -> tuple[str | None, int | None]:
     """
-    Fila `Empresa` cuyo CUIT coincide con el emisor (guiones vs solo dígitos en BD).
-    Usado para `aplicar_desglose_77` y `link_google_sheets` vía `id_empresa`.
+    Devuelve (google_sheet_id, id_empresa) para el CUIT emisor.
+    Prioridad: link_google_sheets de la empresa -> hotfix Swing Jugos -> GOOGLE_SHEET_ID del proyecto.
     """
-    if db is None or not emisor_cuit:
-        return None
+    target_sheet_id = None
+    target_id_empresa = None
     try:
-        from backend.utils.afipTools import _cuit_solo_digitos, _variantes_cuit_busqueda
-
-        variantes = _variantes_cuit_busqueda(emisor_cuit)
-        emp = None
-        if len(variantes) == 1:
-            emp = db.exec(select(Empresa).where(Empresa.cuit == variantes[0])).first()
-        elif variantes:
-            emp = db.exec(select(Empresa).where(or_(*[Empresa.cuit == v for v in variantes]))).first()
-        if emp:
-            return emp
-        needle = _cuit_solo_digitos(emisor_cuit)[:11]
-        if not needle:
-            return None
-        for e in db.exec(select(Empresa)).all():
-            if _cuit_solo_digitos(e.cuit)[:11] == needle:
-                return e
-    except Exception as ex:
-        logger.warning(f"_resolver_empresa_por_emisor_cuit: {ex}")
-    return None
+        if emisor_cuit:
+            ctx = tenant_context.contexto_por_cuit(emisor_cuit)
+            if ctx:
+                target_id_empresa = ctx.id_empresa
+                target_sheet_id = ctx.google_sheet_id
+            if not target_sheet_id:
+                target_sheet_id = tenant_context.SHEET_HOTFIX.get(str(emisor_cuit))
+            if not target_sheet_id:
+                logger.warning(f"No se encontró configuración específica para {emisor_cuit}.")
+    except Exception as ex_config:
+        logger.warning(f"Error al intentar resolver configuración de empresa: {ex_config}")
+
+    # Mismo criterio que TablasHandler: si la empresa no tiene link, usar GOOGLE_SHEET_ID del .env.
+    # Antes se abortaba aquí con ValueError → 500 aunque existiera sheet global.
+    try:
+        from backend import config as _imap_cfg
+        if not target_sheet_id and getattr(_imap_cfg, 'GOOGLE_SHEET_ID', None):
+            target_sheet_id = _imap_cfg.GOOGLE_SHEET_ID
+            logger.info("Sin link_google_sheets en empresa; usando GOOGLE_SHEET_ID del proyecto.")
+    except Exception as ex_gid:
+        logger.warning(f"No se pudo leer GOOGLE_SHEET_ID global: {ex_gid}")
+    return target_sheet_id, target_id_empresa
+
+
+def _contar_reintento_afip(retry_state) -> None:
+    emisor = retry_state.kwargs.get("emisor_cuit")
+    metricas.REINTENTOS.inc(nivel="afip", emisor=metricas.etiqueta_emisor(emisor))
 
 
-@retry(
+# Reintentos ante errores transitorios del microservicio/AFIP (mismo criterio sync y async)
+_reintentos_afip = retry(
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=1, min=2, max=20),
     before=before_log(logger, logging.DEBUG),
     after=after_log(logger, logging.WARNING),
+    before_sleep=_contar_reintento_afip,
     retry=(
         retry_if_exception_type(requests.exceptions.ConnectionError) |
         retry_if_exception_type(requests.exceptions.Timeout) |
@@ -178,53 +184,83 @@ def _resolver_empresa_por_emisor_cuit(db, emisor_cuit: str | None):
     ),
     reraise=True
 )
-def _attempt_generate_invoice(total: float, cliente_data: ReceptorData, invoice_id: str, emisor_cuit: str | None = None, tipo_forzado: int | None = None, conceptos: List[Dict[str, Any]] | None = None, punto_venta: int | None = None, tributos: List[Dict[str, Any]] | None = None, aplicar_desglose_77: bool = False) -> Dict[str, Any]:
-    logger.debug(f"[{invoice_id}] Intentando facturar (Total: {total}, CUIT/DNI: {cliente_data.cuit_o_dni}, Conceptos: {len(conceptos) if conceptos else 0}, Tributos: {len(tributos) if tributos else 0}, Desglose77: {aplicar_desglose_77}, PV: {punto_venta})...")
-    # Prechequeo: si no hay credenciales AFIP para el CUIT solicitado, abortar antes de intentar facturación
+
+
+def _sin_credenciales_afip(total: float, cliente_data: ReceptorData, invoice_id: str, emisor_cuit: str | None, tipo_forzado: int | None, conceptos: List[Dict[str, Any]] | None, punto_venta: int | None, tributos: List[Dict[str, Any]] | None) -> Dict[str, Any] | None:
+    """Prechequeo: resultado FAILED si no hay credenciales AFIP para el CUIT (None si las hay)."""
     from backend.utils.afipTools import _resolve_afip_credentials
     cuit_res, cert_res, key_res, fuente = _resolve_afip_credentials(emisor_cuit)
-    if not (cuit_res and cert_res and key_res):
-        logger.error(f"[{invoice_id}] ABORT: No existen credenciales AFIP para el CUIT solicitado ({emisor_cuit}). No se inicia facturación.")
-        return {
-            "status": "FAILED",
-            "error": f"No existen credenciales AFIP para el CUIT solicitado ({emisor_cuit}). No se inicia facturación.",
-            "original_data": {
-                "total": total,
-                "cliente_data": cliente_data.__dict__,
-                "emisor_cuit": emisor_cuit,
-                "tipo_forzado": tipo_forzado,
-                "conceptos": conceptos,
-                "tributos": tributos,
-                "punto_venta": punto_venta
-            }
+    if cuit_res and cert_res and key_res:
+        return None
+    logger.error(f"[{invoice_id}] ABORT: No existen credenciales AFIP para el CUIT solicitado ({emisor_cuit}). No se inicia facturación.")
+    return {
+        "status": "FAILED",
+        "error": f"No existen credenciales AFIP para el CUIT solicitado ({emisor_cuit}). No se inicia facturación.",
+        "original_data": {
+            "total": total,
+            "cliente_data": cliente_data.__dict__,
+            "emisor_cuit": emisor_cuit,
+            "tipo_forzado": tipo_forzado,
+            "conceptos": conceptos,
+            "tributos": tributos,
+            "punto_venta": punto_venta
         }
+    }
+
+
+def _relanzar_error_afip(invoice_id: str, e: Exception):
+    # Si el error contiene indicios de problemas con AFIP/SSL/ConnectionReset, tratar como transitorio
+    try:
+        msg = str(e).lower()
+        if any(x in msg for x in ("error interno del servidor", "connectionreset", "connection reset", "ssl", "unexpected eof", "ssLError".lower(), "sslexception")):
+            logger.warning(f"[{invoice_id}] Error detectado como transitorio (AFIP/SSL) - provocando retry: {e}")
+            # Lanzar ConnectionError para que tenacity reintente
+            raise requests.exceptions.ConnectionError(e)
+    except Exception:
+        pass
+    # No es un error transitorio que debamos reintentar: propagar
+    logger.error(f"[{invoice_id}] Error no transitorio al facturar: {e}")
+    raise e
+
+
+@_reintentos_afip
+def _attempt_generate_invoice(total: float, cliente_data: ReceptorData, invoice_id: str, emisor_cuit: str | None = None, tipo_forzado: int | None = None, conceptos: List[Dict[str, Any]] | None = None, punto_venta: int | None = None, tributos: List[Dict[str, Any]] | None = None, aplicar_desglose_77: bool = False) -> Dict[str, Any]:
+    logger.debug(f"[{invoice_id}] Intentando facturar (Total: {total}, CUIT/DNI: {cliente_data.cuit_o_dni}, Conceptos: {len(conceptos) if conceptos else 0}, Tributos: {len(tributos) if tributos else 0}, Desglose77: {aplicar_desglose_77}, PV: {punto_venta})...")
+    # Prechequeo: si no hay credenciales AFIP para el CUIT solicitado, abortar antes de intentar facturación
+    fallo = _sin_credenciales_afip(total, cliente_data, invoice_id, emisor_cuit, tipo_forzado, conceptos, punto_venta, tributos)
+    if fallo:
+        return fallo
     try:
         afip_result = generar_factura_para_venta(total=total, cliente_data=cliente_data, emisor_cuit=emisor_cuit, tipo_forzado=tipo_forzado, conceptos=conceptos, punto_venta=punto_venta, tributos=tributos, aplicar_desglose_77=aplicar_desglose_77)
         logger.info(f"[{invoice_id}] Factura generada exitosamente. CAE: {afip_result.get('cae')}")
         return afip_result
     except Exception as e:
-        # Si el error contiene indicios de problemas con AFIP/SSL/ConnectionReset, tratar como transitorio
-        try:
-            msg = str(e).lower()
-            if any(x in msg for x in ("error interno del servidor", "connectionreset", "connection reset", "ssl", "unexpected eof", "ssLError".lower(), "sslexception")):
-                logger.warning(f"[{invoice_id}] Error detectado como transitorio (AFIP/SSL) - provocando retry: {e}")
-                # Lanzar ConnectionError para que tenacity reintente
-                raise requests.exceptions.ConnectionError(e)
-        except Exception:
-            pass
-        # No es un error transitorio que debamos reintentar: propagar
-        logger.error(f"[{invoice_id}] Error no transitorio al facturar: {e}")
-        raise
+        _relanzar_error_afip(invoice_id, e)
 
-def _process_single_invoice_full_cycle(
+
+@_reintentos_afip
+async def _attempt_generate_invoice_async(total: float, cliente_data: ReceptorData, invoice_id: str, emisor_cuit: str | None = None, tipo_forzado: int | None = None, conceptos: List[Dict[str, Any]] | None = None, punto_venta: int | None = None, tributos: List[Dict[str, Any]] | None = None, aplicar_desglose_77: bool = False) -> Dict[str, Any]:
+    """Versión async de `_attempt_generate_invoice`: HTTP con httpx, BD en el pool bloqueante y
+    las esperas entre reintentos con asyncio.sleep."""
+    logger.debug(f"[{invoice_id}] Intentando facturar (async, Total: {total}, PV: {punto_venta})...")
+    fallo = await en_hilo(_sin_credenciales_afip, total, cliente_data, invoice_id, emisor_cuit, tipo_forzado, conceptos, punto_venta, tributos)
+    if fallo:
+        return fallo
+    try:
+        afip_result = await agenerar_factura_para_venta(total=total, cliente_data=cliente_data, emisor_cuit=emisor_cuit, tipo_forzado=tipo_forzado, conceptos=conceptos, punto_venta=punto_venta, tributos=tributos, aplicar_desglose_77=aplicar_desglose_77)
+        logger.info(f"[{invoice_id}] Factura generada exitosamente. CAE: {afip_result.get('cae')}")
+        return afip_result
+    except Exception as e:
+        _relanzar_error_afip(invoice_id, e)
+
+def _preparar_factura(
     original_invoice_data: Dict[str, Any],
     db: Any,
-    sheets_handler: Any,
-    results_list: List[Dict[str, Any]]
-) -> Dict[str, Any]:
+) -> tuple[Dict[str, Any] | None, Dict[str, Any] | None]:
     """
-    Procesa una única factura completa: validación, AFIP, QR, DB y Sheets.
-    Retorna el diccionario de resultado.
+    Parte previa a AFIP: validación, desglose 77 de la empresa y chequeo de idempotencia (BD).
+    Devuelve (resultado, None) si la factura no debe ir a AFIP, o (None, solicitud) con los
+    argumentos de `_attempt_generate_invoice`.
     """
     invoice_id = original_invoice_data.get("id", f"batch_auto_{datetime.now().timestamp()}")
     total = original_invoice_data.get("total")
@@ -236,7 +272,7 @@ def _process_single_invoice_full_cycle(
             "status": "FAILED",
             "error": "Campo 'total' es requerido y faltante.",
             "original_data": original_invoice_data
-        }
+        }, None
 
     try:
         cliente_data_dict = original_invoice_data["cliente_data"]
@@ -253,7 +289,7 @@ def _process_single_invoice_full_cycle(
             "status": "FAILED",
             "error": f"Datos de cliente_data incompletos o inválidos: {e}",
             "original_data": original_invoice_data
-        }
+        }, None
 
     emisor_cuit = original_invoice_data.get('emisor_cuit') or original_invoice_data.get('cuit_empresa')
     tipo_forzado = original_invoice_data.get('tipo_forzado')
@@ -265,17 +301,13 @@ def _process_single_invoice_full_cycle(
     # Si el cliente no manda el flag, tomar `aplicar_desglose_77` de configuracion_empresa (por id_empresa, no solo por string cuit)
     if not aplicar_desglose_77 and emisor_cuit:
         try:
-            empresa_row = _resolver_empresa_por_emisor_cuit(db, str(emisor_cuit))
-            if empresa_row:
-                config_empresa = db.exec(
-                    select(ConfiguracionEmpresa).where(ConfiguracionEmpresa.id_empresa == empresa_row.id)
-                ).first()
-                if config_empresa and config_empresa.aplicar_desglose_77:
-                    aplicar_desglose_77 = True
-                    logger.info(
-                        f"[{invoice_id}] aplicar_desglose_77=True desde BD "
-                        f"(id_empresa={empresa_row.id}, cuit_tabla={empresa_row.cuit!r})"
-                    )
+            ctx = tenant_context.contexto_por_cuit(emisor_cuit, db)
+            if ctx and ctx.aplicar_desglose_77:
+                aplicar_desglose_77 = True
+                logger.info(
+                    f"[{invoice_id}] aplicar_desglose_77=True desde BD "
+                    f"(id_empresa={ctx.id_empresa}, cuit_tabla={ctx.cuit!r})"
+                )
         except Exception as e:
             logger.warning(f"[{invoice_id}] No se pudo consultar configuración empresa (desglose 77): {e}")
     
@@ -292,416 +324,548 @@ def _process_single_invoice_full_cycle(
                 "error": "Ya facturada",
                 "existing_factura_id": getattr(existing, "id", None),
                 "numero_comprobante": getattr(existing, "numero_comprobante", None)
-            }
+            }, None
     except Exception:
         pass
 
-    # Process single invoice
+    return None, {
+        "total": total,
+        "cliente_data": cliente_data,
+        "invoice_id": invoice_id,
+        "emisor_cuit": emisor_cuit,
+        "tipo_forzado": tipo_forzado,
+        "conceptos": conceptos,
+        "punto_venta": punto_venta,
+        "tributos": tributos,
+        "aplicar_desglose_77": aplicar_desglose_77,
+    }
+
+
+def _registrar_factura_emitida(
+    original_invoice_data: Dict[str, Any],
+    solicitud: Dict[str, Any],
+    afip_data: Dict[str, Any] | None,
+    db: Any,
+    google_sheet_id: str | None = None,
+    id_empresa: int | None = None,
+) -> Dict[str, Any]:
+    """
+    Parte posterior a AFIP: URL del QR, INSERT de la factura y marca "Facturado" en sheets_outbox
+    (misma transacción que el espejo IngresoSheets; Google Sheets no se toca aquí).
+    """
+    invoice_id = solicitud["invoice_id"]
+    tipo_forzado = solicitud["tipo_forzado"]
+    if not afip_data or afip_data.get("status") == "FAILED":
+        error_msg = afip_data.get("error") if afip_data else "Respuesta vacía de AFIP"
+        logger.error(f"[{invoice_id}] Error en _attempt_generate_invoice: {error_msg}")
+        return {
+            "id": invoice_id,
+            "status": "FAILED",
+            "error": error_msg,
+            "original_data": original_invoice_data
+        }
+
     single_invoice_result = {
         "id": invoice_id,
-        "original_data": original_invoice_data
+        "original_data": original_invoice_data,
+        "status": "SUCCESS",
+        "result": afip_data
     }
 
+    # Mismatch check
     try:
-        # Synchronous call to AFIP
-        afip_data = _attempt_generate_invoice(
-            total=total,
-            cliente_data=cliente_data,
-            invoice_id=invoice_id,
-            emisor_cuit=emisor_cuit,
-            tipo_forzado=tipo_forzado,
-            conceptos=conceptos,
-            punto_venta=punto_venta,
-            tributos=tributos,
-            aplicar_desglose_77=aplicar_desglose_77
-        )
-        
-        if not afip_data or afip_data.get("status") == "FAILED":
-            error_msg = afip_data.get("error") if afip_data else "Respuesta vacía de AFIP"
-            logger.error(f"[{invoice_id}] Error en _attempt_generate_invoice: {error_msg}")
-            return {
-                "id": invoice_id,
-                "status": "FAILED",
-                "error": error_msg,
-                "original_data": original_invoice_data
-            }
-
-        single_invoice_result.update({
-            "status": "SUCCESS",
-            "result": afip_data
-        })
-        
-        # Mismatch check
+        if tipo_forzado is not None:
+            if int(afip_data.get('tipo_comprobante')) != int(tipo_forzado):
+                single_invoice_result['tipo_forzado_intentado'] = int(tipo_forzado)
+                single_invoice_result['tipo_mismatch'] = True
+            else:
+                single_invoice_result['tipo_forzado_intentado'] = int(tipo_forzado)
+                single_invoice_result['tipo_mismatch'] = False
+    except Exception:
+        pass
+    logger.info(f"[{invoice_id}] Procesamiento de AFIP completado: SUCCESS")
+
+    # QR Generation
+    # Solo la URL: la imagen se genera a pedido y no se incrusta en raw_response
+    with metricas.cronometrar("qr", solicitud["emisor_cuit"]):
+        qr_url = generar_qr_afip(afip_data)
+    if qr_url:
+        single_invoice_result["result"]["qr_url_afip"] = qr_url
+    else:
+        single_invoice_result["qr_generation_status"] = "FAILED"
+
+    # --- 1. Guardar en la Base de Datos ---
+    inicio_db = time.perf_counter()
+    try:
+        # Helper serialización
+        def make_json_serializable(obj: Any) -> Any:
+            if isinstance(obj, dict):
+                return {k: make_json_serializable(v) for k, v in obj.items()}
+            if isinstance(obj, list):
+                return [make_json_serializable(x) for x in obj]
+            if isinstance(obj, (datetime, date)):
+                return obj.isoformat()
+            if isinstance(obj, Decimal):
+                try: return float(obj)
+                except: return str(obj)
+            if isinstance(obj, bytes):
+                return base64.b64encode(obj).decode('utf-8')
+            return obj
+
+        serializable_afip = make_json_serializable(afip_data)
+
+        # Detalle Empresa y Desglose 77
         try:
-            if tipo_forzado is not None:
-                if int(afip_data.get('tipo_comprobante')) != int(tipo_forzado):
-                    single_invoice_result['tipo_forzado_intentado'] = int(tipo_forzado)
-                    single_invoice_result['tipo_mismatch'] = True
+            det_emp = original_invoice_data.get('detalle_empresa')
+            if det_emp:
+                if isinstance(serializable_afip, dict):
+                    serializable_afip['detalle_empresa'] = det_emp
+                else:
+                    serializable_afip = {'result': serializable_afip, 'detalle_empresa': det_emp}
+            if bool(original_invoice_data.get('aplicar_desglose_77')):
+                if isinstance(serializable_afip, dict):
+                    serializable_afip['aplicar_desglose_77'] = True
                 else:
-                    single_invoice_result['tipo_forzado_intentado'] = int(tipo_forzado)
-                    single_invoice_result['tipo_mismatch'] = False
+                    serializable_afip = {'result': serializable_afip, 'aplicar_desglose_77': True}
+            if isinstance(serializable_afip, dict) and not serializable_afip.get('aplicar_desglose_77'):
+                # Intento recuperar config de empresa desde otra sesión si fuese necesario
+                # Para simplificar en este helper, omitimos la consulta compleja DB2 aquí o asumimos que
+                # la info viene en original_invoice_data si es crítica.
+                pass
         except Exception:
             pass
-        logger.info(f"[{invoice_id}] Procesamiento de AFIP completado: SUCCESS")
 
-        # QR Generation
-        qr_url, qr_data_url = generar_qr_afip(afip_data)
-        if qr_data_url:
-            single_invoice_result["result"]["qr_code"] = qr_data_url
-        else:
-            single_invoice_result["qr_generation_status"] = "FAILED"
-        
-        # --- 1. Guardar en la Base de Datos ---
+        # Serializar a texto
         try:
-            # Helper serialización
-            def make_json_serializable(obj: Any) -> Any:
-                if isinstance(obj, dict):
-                    return {k: make_json_serializable(v) for k, v in obj.items()}
-                if isinstance(obj, list):
-                    return [make_json_serializable(x) for x in obj]
-                if isinstance(obj, (datetime, date)):
-                    return obj.isoformat()
-                if isinstance(obj, Decimal):
-                    try: return float(obj)
-                    except: return str(obj)
-                if isinstance(obj, bytes):
-                    return base64.b64encode(obj).decode('utf-8')
-                return obj
-
-            serializable_afip = make_json_serializable(afip_data)
-            
-            # Detalle Empresa y Desglose 77
-            try:
-                det_emp = original_invoice_data.get('detalle_empresa')
-                if det_emp:
-                    if isinstance(serializable_afip, dict):
-                        serializable_afip['detalle_empresa'] = det_emp
-                    else:
-                        serializable_afip = {'result': serializable_afip, 'detalle_empresa': det_emp}
-                if bool(original_invoice_data.get('aplicar_desglose_77')):
-                    if isinstance(serializable_afip, dict):
-                        serializable_afip['aplicar_desglose_77'] = True
-                    else:
-                        serializable_afip = {'result': serializable_afip, 'aplicar_desglose_77': True}
-                if isinstance(serializable_afip, dict) and not serializable_afip.get('aplicar_desglose_77'):
-                    # Intento recuperar config de empresa desde otra sesión si fuese necesario
-                    # Para simplificar en este helper, omitimos la consulta compleja DB2 aquí o asumimos que
-                    # la info viene en original_invoice_data si es crítica.
-                    pass
-            except Exception:
-                pass
+            raw_json_text = json.dumps(serializable_afip, ensure_ascii=False, default=default_json)
+            raw_response_final = json.loads(raw_json_text)
+        except Exception as ser_err:
+            logger.error(f"[{invoice_id}] Error serializando respuesta AFIP: {ser_err}")
+            raw_response_final = {"error": str(ser_err)}
+
+        raw_response_text = json.dumps(raw_response_final, ensure_ascii=False, default=default_json)
+
+        # Normalizar fechas
+        def _normalize_date_field(value: Any):
+            if value is None: return None
+            if isinstance(value, date) and not isinstance(value, datetime): return value
+            if isinstance(value, datetime): return value.date()
+            if isinstance(value, str):
+                try: return date.fromisoformat(value)
+                except: 
+                    try: return datetime.fromisoformat(value).date()
+                    except: return None
+            return None
 
-            # Serializar a texto
-            try:
-                raw_json_text = json.dumps(serializable_afip, ensure_ascii=False, default=default_json)
-                raw_response_final = json.loads(raw_json_text)
-            except Exception as ser_err:
-                logger.error(f"[{invoice_id}] Error serializando respuesta AFIP: {ser_err}")
-                raw_response_final = {"error": str(ser_err)}
-
-            raw_response_text = json.dumps(raw_response_final, ensure_ascii=False, default=default_json)
-
-            # Normalizar fechas
-            def _normalize_date_field(value: Any):
-                if value is None: return None
-                if isinstance(value, date) and not isinstance(value, datetime): return value
-                if isinstance(value, datetime): return value.date()
-                if isinstance(value, str):
-                    try: return date.fromisoformat(value)
-                    except: 
-                        try: return datetime.fromisoformat(value).date()
-                        except: return None
-                return None
-
-            fecha_comprobante_val = _normalize_date_field(afip_data.get("fecha_comprobante"))
-            vencimiento_cae_val = _normalize_date_field(afip_data.get("vencimiento_cae"))
-
-            # Prepare Insert
-            from sqlalchemy import insert as sa_insert
-            
-            punto_venta_val = int(afip_data.get("punto_venta")) if afip_data.get("punto_venta") is not None else None
-            tipo_comprobante_val = int(afip_data.get("tipo_comprobante")) if afip_data.get("tipo_comprobante") is not None else None
-            cuit_emisor_val = str(afip_data.get("cuit_emisor")) if afip_data.get("cuit_emisor") is not None else None
-            
-            tipo_forzado_intentado = original_invoice_data.get('tipo_forzado')
-            tipo_comprobante_micro = afip_data.get('tipo_comprobante') or afip_data.get('tipo_afip')
-            tipo_mismatch = None
-            if tipo_forzado_intentado and tipo_comprobante_micro:
-                try: tipo_mismatch = int(tipo_forzado_intentado) != int(tipo_comprobante_micro)
-                except: pass
-
-            insert_values = {
-                "ingreso_id": str(invoice_id),
-                "cae": afip_data.get("cae"),
-                "numero_comprobante": afip_data.get("numero_comprobante"),
-                "punto_venta": punto_venta_val,
-                "tipo_comprobante": tipo_comprobante_val,
-                "fecha_comprobante": fecha_comprobante_val,
-                "vencimiento_cae": vencimiento_cae_val,
-                "resultado_afip": afip_data.get("resultado"),
-                "cuit_emisor": cuit_emisor_val,
-                "tipo_doc_receptor": afip_data.get("tipo_doc_receptor"),
-                "nro_doc_receptor": afip_data.get("nro_doc_receptor"),
-                "importe_total": (float(afip_data.get("importe_total")) if afip_data.get("importe_total") else None),
-                "importe_neto": (float(afip_data.get("neto")) if afip_data.get("neto") else None),
-                "importe_iva": (float(afip_data.get("iva")) if afip_data.get("iva") else None),
-                "raw_response": raw_response_text,
-                "qr_url_afip": qr_url,
-                "tipo_forzado_intentado": tipo_forzado_intentado,
-                "tipo_mismatch": tipo_mismatch,
-                "tipo_comprobante_microservicio": tipo_comprobante_micro,
-                "debug_cuit_usado": afip_data.get('debug_cuit_usado'),
-                "debug_fuente_credenciales": afip_data.get('debug_fuente_credenciales'),
-            }
-
-            from sqlalchemy import text as sa_text
-            sql = sa_text(
-                "INSERT INTO facturas_electronicas (ingreso_id, cae, numero_comprobante, punto_venta, tipo_comprobante, fecha_comprobante, vencimiento_cae, resultado_afip, cuit_emisor, tipo_doc_receptor, nro_doc_receptor, importe_total, importe_neto, importe_iva, raw_response, qr_url_afip, tipo_forzado_intentado, tipo_mismatch, tipo_comprobante_microservicio, debug_cuit_usado, debug_fuente_credenciales) VALUES (:ingreso_id, :cae, :numero_comprobante, :punto_venta, :tipo_comprobante, :fecha_comprobante, :vencimiento_cae, :resultado_afip, :cuit_emisor, :tipo_doc_receptor, :nro_doc_receptor, :importe_total, :importe_neto, :importe_iva, :raw_response, :qr_url_afip, :tipo_forzado_intentado, :tipo_mismatch, :tipo_comprobante_microservicio, :debug_cuit_usado, :debug_fuente_credenciales)"
-            )
-            
-            try:
-                result = db.execute(sql, insert_values)
-                try: new_id = int(result.lastrowid) if hasattr(result, 'lastrowid') and result.lastrowid is not None else None
-                except: new_id = None
-            except Exception:
-                # Fallback
-                table_obj = FacturaElectronica.__table__
-                stmt = sa_insert(table_obj).values(**insert_values)
-                result = db.execute(stmt)
-                new_id = None
-
-            db.commit()
-            single_invoice_result["db_save_status"] = "SUCCESS"
-            single_invoice_result["factura_id"] = new_id
-            logger.info(f"[{invoice_id}] Factura insertada en la base de datos. ID: {new_id}")
-
-        except Exception as db_error:
-            db.rollback()
-            single_invoice_result["db_save_status"] = "FAILED"
-            single_invoice_result["error_db"] = str(db_error)
-            logger.error(f"[{invoice_id}] ERROR al guardar en la base de datos: {db_error}", exc_info=True)
-
-        # --- 2. Actualizar Google Sheets y DB Local ---
-        if single_invoice_result.get("db_save_status") == "SUCCESS" and sheets_handler:
-            try:
-                # 2a. Actualizar Google Sheets
-                update_success = sheets_handler.marcar_boleta_facturada(id_ingreso=str(invoice_id))
-                single_invoice_result["sheets_update_status"] = "SUCCESS" if update_success else "FAILED"
-                
-                if update_success:
-                    logger.info(f"[{invoice_id}] Sheets actualizado.")
-                    # 2b. Actualizar Espejo Local (IngresoSheets) para que el front vea el cambio YA
-                    try:
-                        from sqlmodel import select as _select_sheets
-                        stmt = _select_sheets(IngresoSheets).where(IngresoSheets.id_ingreso == str(invoice_id))
-                        ingreso_obj = db.exec(stmt).first()
-                        if ingreso_obj:
-                            ingreso_obj.facturacion = "Facturado"
-                            # Actualizar el JSON interno también
-                            try:
-                                data = json.loads(ingreso_obj.data_json)
-                                # Actualizar tanto 'facturacion' como 'Facturacion' por si acaso
-                                if 'facturacion' in data: data['facturacion'] = "Facturado"
-                                if 'Facturacion' in data: data['Facturacion'] = "Facturado"
-                                ingreso_obj.data_json = json.dumps(data, ensure_ascii=False)
-                            except Exception:
-                                pass
-                            db.add(ingreso_obj)
-                            db.commit()
-                            logger.info(f"[{invoice_id}] Espejo local (IngresoSheets) actualizado a 'Facturado'.")
-                    except Exception as db_sync_err:
-                        logger.warning(f"[{invoice_id}] No se pudo actualizar espejo local IngresoSheets: {db_sync_err}")
-                else:
-                    logger.warning(f"[{invoice_id}] Sheets NO actualizado.")
-            except Exception as sheets_error:
-                single_invoice_result["sheets_update_status"] = "ERROR"
-                single_invoice_result["error_sheets"] = str(sheets_error)
-                logger.error(f"[{invoice_id}] Error Sheets: {sheets_error}")
-        elif not sheets_handler:
-            single_invoice_result["sheets_update_status"] = "SKIPPED"
-
-    except Exception as afip_error:
-        single_invoice_result.update({
-            "status": "FAILED",
-            "error": str(afip_error)
-        })
-        logger.warning(f"[{invoice_id}] AFIP FAILED: {afip_error}")
+        fecha_comprobante_val = _normalize_date_field(afip_data.get("fecha_comprobante"))
+        vencimiento_cae_val = _normalize_date_field(afip_data.get("vencimiento_cae"))
+
+        # Prepare Insert
+        from sqlalchemy import insert as sa_insert
+
+        punto_venta_val = int(afip_data.get("punto_venta")) if afip_data.get("punto_venta") is not None else None
+        tipo_comprobante_val = int(afip_data.get("tipo_comprobante")) if afip_data.get("tipo_comprobante") is not None else None
+        cuit_emisor_val = str(afip_data.get("cuit_emisor")) if afip_data.get("cuit_emisor") is not None else None
+
+        tipo_forzado_intentado = original_invoice_data.get('tipo_forzado')
+        tipo_comprobante_micro = afip_data.get('tipo_comprobante') or afip_data.get('tipo_afip')
+        tipo_mismatch = None
+        if tipo_forzado_intentado and tipo_comprobante_micro:
+            try: tipo_mismatch = int(tipo_forzado_intentado) != int(tipo_comprobante_micro)
+            except: pass
+
+        insert_values = {
+            "ingreso_id": str(invoice_id),
+            "cae": afip_data.get("cae"),
+            "numero_comprobante": afip_data.get("numero_comprobante"),
+            "punto_venta": punto_venta_val,
+            "tipo_comprobante": tipo_comprobante_val,
+            "fecha_comprobante": fecha_comprobante_val,
+            "vencimiento_cae": vencimiento_cae_val,
+            "resultado_afip": afip_data.get("resultado"),
+            "cuit_emisor": cuit_emisor_val,
+            "tipo_doc_receptor": afip_data.get("tipo_doc_receptor"),
+            "nro_doc_receptor": afip_data.get("nro_doc_receptor"),
+            "importe_total": (float(afip_data.get("importe_total")) if afip_data.get("importe_total") else None),
+            "importe_neto": (float(afip_data.get("neto")) if afip_data.get("neto") else None),
+            "importe_iva": (float(afip_data.get("iva")) if afip_data.get("iva") else None),
+            "raw_response": raw_response_text,
+            "qr_url_afip": qr_url,
+            "tipo_forzado_intentado": tipo_forzado_intentado,
+            "tipo_mismatch": tipo_mismatch,
+            "tipo_comprobante_microservicio": tipo_comprobante_micro,
+            "debug_cuit_usado": afip_data.get('debug_cuit_usado'),
+            "debug_fuente_credenciales": afip_data.get('debug_fuente_credenciales'),
+        }
+
+        from sqlalchemy import text as sa_text
+        sql = sa_text(
+            "INSERT INTO facturas_electronicas (ingreso_id, cae, numero_comprobante, punto_venta, tipo_comprobante, fecha_comprobante, vencimiento_cae, resultado_afip, cuit_emisor, tipo_doc_receptor, nro_doc_receptor, importe_total, importe_neto, importe_iva, raw_response, qr_url_afip, tipo_forzado_intentado, tipo_mismatch, tipo_comprobante_microservicio, debug_cuit_usado, debug_fuente_credenciales) VALUES (:ingreso_id, :cae, :numero_comprobante, :punto_venta, :tipo_comprobante, :fecha_comprobante, :vencimiento_cae, :resultado_afip, :cuit_emisor, :tipo_doc_receptor, :nro_doc_receptor, :importe_total, :importe_neto, :importe_iva, :raw_response, :qr_url_afip, :tipo_forzado_intentado, :tipo_mismatch, :tipo_comprobante_microservicio, :debug_cuit_usado, :debug_fuente_credenciales)"
+        )
+
+        try:
+            result = db.execute(sql, insert_values)
+            try: new_id = int(result.lastrowid) if hasattr(result, 'lastrowid') and result.lastrowid is not None else None
+            except: new_id = None
+        except Exception:
+            # Fallback
+            table_obj = FacturaElectronica.__table__
+            stmt = sa_insert(table_obj).values(**insert_values)
+            result = db.execute(stmt)
+            new_id = None
+
+        # --- 2. Espejo local (IngresoSheets) + marca pendiente para Google Sheets ---
+        # Misma transacción que la factura. Va en un SAVEPOINT: si falla (p.ej. tabla outbox
+        # inexistente) no debe perderse el INSERT de una factura que AFIP ya autorizó.
+        try:
+            with db.begin_nested():
+                espejo_ok = actualizar_espejo_ingreso(db, str(invoice_id), ACCION_FACTURADO, id_empresa=id_empresa)
+                outbox_row = encolar_marca_sheets(
+                    db, str(invoice_id), ACCION_FACTURADO, google_sheet_id,
+                    id_empresa=id_empresa, factura_id=new_id,
+                )
+            if outbox_row is not None:
+                single_invoice_result["sheets_update_status"] = "QUEUED"
+            else:
+                single_invoice_result["sheets_update_status"] = "SKIPPED"
+            if espejo_ok:
+                logger.info(f"[{invoice_id}] Espejo local (IngresoSheets) actualizado a 'Facturado'.")
+        except Exception as outbox_err:
+            single_invoice_result["sheets_update_status"] = "ERROR"
+            single_invoice_result["error_sheets"] = str(outbox_err)
+            logger.error(f"[{invoice_id}] No se pudo encolar la marca en Sheets / actualizar espejo: {outbox_err}")
+
+        db.commit()
+        single_invoice_result["db_save_status"] = "SUCCESS"
+        single_invoice_result["factura_id"] = new_id
+        if single_invoice_result.get("sheets_update_status") == "QUEUED":
+            single_invoice_result["sheets_outbox_id"] = getattr(outbox_row, "id", None)
+        logger.info(f"[{invoice_id}] Factura insertada en la base de datos. ID: {new_id}")
+
+    except Exception as db_error:
+        db.rollback()
+        single_invoice_result["db_save_status"] = "FAILED"
+        single_invoice_result["error_db"] = str(db_error)
+        logger.error(f"[{invoice_id}] ERROR al guardar en la base de datos: {db_error}", exc_info=True)
+        metricas.DB_INSERT_FALLIDOS.inc(emisor=metricas.etiqueta_emisor(solicitud["emisor_cuit"]))
+    metricas.observar(
+        "db", solicitud["emisor_cuit"], time.perf_counter() - inicio_db,
+        metricas.RESULTADO_OK if single_invoice_result["db_save_status"] == "SUCCESS" else metricas.RESULTADO_ERROR,
+    )
+
+    if single_invoice_result.get("db_save_status") != "SUCCESS":
+        single_invoice_result.pop("sheets_update_status", None)
 
     return single_invoice_result
 
-async def process_invoice_batch_for_endpoint(
-    invoices_payload: List[Dict[str, Any]],
-    max_workers: int = 5
+
+def _fallo_afip(original_invoice_data: Dict[str, Any], invoice_id: Any, afip_error: Exception) -> Dict[str, Any]:
+    logger.warning(f"[{invoice_id}] AFIP FAILED: {afip_error}")
+    return {
+        "id": invoice_id,
+        "original_data": original_invoice_data,
+        "status": "FAILED",
+        "error": str(afip_error)
+    }
+
+
+# El chequeo "ya facturada" de _preparar_factura y el INSERT de _registrar_factura_emitida no son
+# atómicos: dos pedidos (o dos workers) con el mismo ingreso podían mandarlo dos veces a AFIP.
+# Mientras dura el ciclo se tiene un lease por ingreso (utils/coordinacion, compartido entre workers).
+def _nombre_lease_factura(invoice_id: Any) -> str | None:
+    return f"factura:{invoice_id}" if invoice_id is not None else None
+
+
+def _lease_factura(original_invoice_data: Dict[str, Any]):
+    nombre = _nombre_lease_factura(original_invoice_data.get("id"))
+    return coordinacion.Lease(nombre, _LEASE_FACTURA_SEC) if nombre else nullcontext()
+
+
+def _factura_en_proceso(original_invoice_data: Dict[str, Any]) -> Dict[str, Any]:
+    invoice_id = original_invoice_data.get("id")
+    logger.warning(f"[{invoice_id}] Otro pedido/worker está facturando este ingreso; se omite")
+    return {
+        "id": invoice_id,
+        "status": "FAILED",
+        "error": "Factura en proceso en otro pedido",
+        "original_data": original_invoice_data
+    }
+
+
+def _process_single_invoice_full_cycle(
+    original_invoice_data: Dict[str, Any],
+    db: Any,
+    google_sheet_id: str | None = None,
+    id_empresa: int | None = None
+) -> Dict[str, Any]:
+    """
+    Procesa una única factura completa: validación, AFIP, QR, DB y Sheets.
+    Google Sheets no se toca aquí: la marca "Facturado" se encola en sheets_outbox en la misma
+    transacción que la factura y el espejo IngresoSheets (ver utils/sheets_outbox.py).
+    Retorna el diccionario de resultado.
+    """
+    emisor_cuit = original_invoice_data.get('emisor_cuit') or original_invoice_data.get('cuit_empresa')
+    with metricas.en_vuelo(), metricas.cronometrar("total", emisor_cuit) as cron_total:
+        with _lease_factura(original_invoice_data) as lease:
+            if lease is not None and not lease.adquirido:
+                resultado = _factura_en_proceso(original_invoice_data)
+            else:
+                with metricas.cronometrar("preparacion", emisor_cuit):
+                    resultado, solicitud = _preparar_factura(original_invoice_data, db)
+                if resultado is None:
+                    try:
+                        # Synchronous call to AFIP
+                        afip_data = _attempt_generate_invoice(**solicitud)
+                        resultado = _registrar_factura_emitida(original_invoice_data, solicitud, afip_data, db, google_sheet_id, id_empresa)
+                    except Exception as afip_error:
+                        resultado = _fallo_afip(original_invoice_data, solicitud["invoice_id"], afip_error)
+        cron_total.resultado = metricas.resultado_factura(resultado)
+    return resultado
+
+def _procesar_factura_en_worker(
+    original_invoice_data: Dict[str, Any],
+    contexto_sheets: Dict[str, Any],
+    ingreso_locks: Dict[str, threading.Lock],
+) -> Dict[str, Any]:
+    """
+    Ejecuta `_process_single_invoice_full_cycle` dentro de un worker del pool.
+    Cada worker abre y cierra su propia sesión (las sesiones SQLAlchemy no se comparten entre hilos),
+    respeta el tope de concurrencia del CUIT emisor y serializa ingresos repetidos dentro del lote
+    para que el chequeo de idempotencia siga siendo válido.
+    """
+    invoice_id = original_invoice_data.get("id")
+    emisor_cuit = original_invoice_data.get('emisor_cuit') or original_invoice_data.get('cuit_empresa')
+    ingreso_lock = ingreso_locks.get(str(invoice_id)) if invoice_id is not None else None
+
+    with (ingreso_lock or nullcontext()):
+        with _semaforo_emisor(emisor_cuit):
+            db = SessionLocal()
+            try:
+                return _process_single_invoice_full_cycle(
+                    original_invoice_data, db,
+                    google_sheet_id=contexto_sheets.get("google_sheet_id"),
+                    id_empresa=contexto_sheets.get("id_empresa"),
+                )
+            except Exception as e:
+                logger.error(f"[{invoice_id}] Error inesperado en worker del lote: {e}", exc_info=True)
+                return {
+                    "id": invoice_id,
+                    "status": "FAILED",
+                    "error": str(e),
+                    "original_data": original_invoice_data
+                }
+            finally:
+                db.close()
+
+
+def _ejecutar_lote_concurrente(
+    invoices: List[Dict[str, Any]],
+    contexto_sheets: Dict[str, Any],
+    max_workers: int,
 ) -> List[Dict[str, Any]]:
-    
-    logger.info(f"Endpoint: Recibido lote de {len(invoices_payload)} facturas. Iniciando procesamiento robusto con auto-healing.")
+    """
+    Procesa una lista de facturas con un pool acotado de hilos.
+    Devuelve los resultados en el MISMO orden que la entrada.
+    """
+    if not invoices:
+        return []
 
-    # Detección de Sheet ID específico por empresa
-    target_sheet_id = None
-    cuit_emisor_detected = None
-    
-    try:
-        if invoices_payload:
-            first_inv = invoices_payload[0]
-            # Intentar obtener CUIT (puede venir como cuit_emisor, cuit_empresa, etc)
-            cuit_emisor = first_inv.get('cuit_emisor') or first_inv.get('cuit_empresa') or first_inv.get('emisor_cuit')
-            cuit_emisor_detected = cuit_emisor
-            
-            if cuit_emisor:
-                logger.info(f"Buscando configuración de Sheets para emisor: {cuit_emisor}")
-                # Usar una sesión efímera para esta consulta
-                with SessionLocal() as db_session:
-                    empresa_row = _resolver_empresa_por_emisor_cuit(db_session, str(cuit_emisor))
-                    config_empresa = None
-                    if empresa_row:
-                        config_empresa = db_session.exec(
-                            select(ConfiguracionEmpresa).where(
-                                ConfiguracionEmpresa.id_empresa == empresa_row.id
-                            )
-                        ).first()
-                    if config_empresa and config_empresa.link_google_sheets:
-                        target_sheet_id = config_empresa.link_google_sheets
-                        logger.info(f"Configuración encontrada. Usando Sheet ID personalizado.")
-                    else:
-                        # FALLBACK ESPECÍFICO (HOTFIX) para Swing Jugos
-                        if str(cuit_emisor) == "20364237740":
-                            target_sheet_id = "1yNrBzxXga0TpFOpMcAQw6xvQ2dSa0TC9P7F88eOLveM"
-                            logger.info("Aplicando Hotfix Sheet ID para Swing Jugos.")
-                        else:
-                            logger.warning(f"No se encontró configuración específica para {cuit_emisor}.")
-    except Exception as ex_config:
-        logger.warning(f"Error al intentar resolver configuración de empresa: {ex_config}")
+    workers = max(1, min(int(max_workers or 1), _BATCH_MAX_WORKERS, len(invoices)))
 
-    # Mismo criterio que TablasHandler: si la empresa no tiene link, usar GOOGLE_SHEET_ID del .env.
-    # Antes se abortaba aquí con ValueError → 500 aunque existiera sheet global.
+    # Locks por ingreso_id: si el mismo ingreso viene dos veces en el lote, el segundo espera
+    # al primero y el chequeo "Ya facturada" lo detiene (evita doble CAE).
+    ingreso_locks: Dict[str, threading.Lock] = {}
+    for inv in invoices:
+        if inv.get("id") is not None:
+            ingreso_locks.setdefault(str(inv.get("id")), threading.Lock())
+
+    results: List[Dict[str, Any] | None] = [None] * len(invoices)
+    logger.info(f"Lote concurrente: {len(invoices)} facturas, {workers} workers, tope por emisor={_MAX_CONCURRENCIA_POR_EMISOR}")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="facturador") as pool:
+        futures = {
+            pool.submit(_procesar_factura_en_worker, inv, contexto_sheets, ingreso_locks): idx
+            for idx, inv in enumerate(invoices)
+        }
+        for fut in as_completed(futures):
+            idx = futures[fut]
+            try:
+                results[idx] = fut.result()
+            except Exception as e:
+                inv = invoices[idx]
+                results[idx] = {
+                    "id": inv.get("id"),
+                    "status": "FAILED",
+                    "error": str(e),
+                    "original_data": inv
+                }
+
+    return results  # type: ignore[return-value]
+
+
+def _en_sesion(fn, *args, **kwargs):
+    """Corre `fn(..., db=sesion)` con una sesión propia que se cierra al terminar."""
+    db = SessionLocal()
     try:
-        from backend import config as _imap_cfg
-        if not target_sheet_id and getattr(_imap_cfg, 'GOOGLE_SHEET_ID', None):
-            target_sheet_id = _imap_cfg.GOOGLE_SHEET_ID
-            logger.info("Sin link_google_sheets en empresa; usando GOOGLE_SHEET_ID del proyecto.")
-    except Exception as ex_gid:
-        logger.warning(f"No se pudo leer GOOGLE_SHEET_ID global: {ex_gid}")
+        return fn(*args, db=db, **kwargs)
+    finally:
+        db.close()
 
-    def _sheets_error_es_cuota_o_temporal(msg: str) -> bool:
-        """429 / cuota Google: no debe tumbar toda la facturación (AFIP + DB siguen siendo válidos)."""
-        m = (msg or "").lower()
-        return (
-            "429" in m
-            or "quota" in m
-            or "rate limit" in m
-            or "exceeded" in m
-            or "resource exhausted" in m
-            or "503" in m
-            or "try again" in m
-        )
 
-    sheets_handler = None
-    if target_sheet_id:
-        try:
-            sheets_handler = TablasHandler(google_sheet_id=target_sheet_id)
-            is_conn_ok, conn_msg = sheets_handler.check_connection()
-            if not is_conn_ok:
-                if _sheets_error_es_cuota_o_temporal(conn_msg):
-                    logger.warning(
-                        "Google Sheets no accesible por cuota o error temporal (%s). "
-                        "Se factura y guarda en BD; INGRESOS no se actualizará en esta corrida.",
-                        (conn_msg or "")[:240],
-                    )
-                    sheets_handler = None
+async def _procesar_factura_async(
+    original_invoice_data: Dict[str, Any],
+    contexto_sheets: Dict[str, Any],
+    ingreso_locks: Dict[str, asyncio.Lock],
+    cupo_lote: asyncio.Semaphore,
+) -> Dict[str, Any]:
+    """
+    Equivalente async de `_procesar_factura_en_worker`. La BD va al pool bloqueante en dos tramos
+    (antes y después de AFIP, cada uno con su sesión) y la llamada al microservicio es httpx: mientras
+    AFIP responde no se ocupa ni un hilo ni una conexión del pool de MySQL.
+    """
+    invoice_id = original_invoice_data.get("id")
+    emisor_cuit = original_invoice_data.get('emisor_cuit') or original_invoice_data.get('cuit_empresa')
+    ingreso_lock = ingreso_locks.get(str(invoice_id)) if invoice_id is not None else None
+
+    async with cupo_lote, (ingreso_lock or nullcontext()), _semaforo_emisor_async(emisor_cuit):
+        with metricas.en_vuelo(), metricas.cronometrar("total", emisor_cuit) as cron_total:
+            nombre_lease = _nombre_lease_factura(invoice_id)
+            token_lease = None
+            try:
+                if nombre_lease:
+                    token_lease = await en_hilo(coordinacion.tomar_lease, nombre_lease, _LEASE_FACTURA_SEC)
+                if nombre_lease and token_lease is None:
+                    resultado = _factura_en_proceso(original_invoice_data)
                 else:
-                    err_msg = (
-                        f"ABORTANDO: Fallo de conexión/validación con Google Sheet {target_sheet_id}. "
-                        f"Detalle: {conn_msg}"
-                    )
-                    logger.critical(err_msg)
-                    raise ValueError(err_msg)
-            else:
-                sid_preview = (target_sheet_id or "")[:8]
-                logger.info(
-                    f"Handler de Google Sheets inicializado y validado (sheet …{sid_preview}). Msg: {conn_msg}"
-                )
-        except ValueError:
-            raise
-        except Exception as e:
-            if _sheets_error_es_cuota_o_temporal(str(e)):
-                logger.warning(
-                    "Google Sheets (init/check) error temporal/cuota: %s. Continuando sin sync Sheets.",
-                    str(e)[:240],
-                )
-                sheets_handler = None
-            else:
-                logger.error(f"Error init/validación Sheets: {e}")
-                raise
-    elif cuit_emisor_detected:
+                    with metricas.cronometrar("preparacion", emisor_cuit):
+                        resultado, solicitud = await en_hilo(_en_sesion, _preparar_factura, original_invoice_data)
+                    if resultado is None:
+                        try:
+                            afip_data = await _attempt_generate_invoice_async(**solicitud)
+                            resultado = await en_hilo(
+                                _en_sesion, _registrar_factura_emitida, original_invoice_data, solicitud, afip_data,
+                                google_sheet_id=contexto_sheets.get("google_sheet_id"),
+                                id_empresa=contexto_sheets.get("id_empresa"),
+                            )
+                        except Exception as afip_error:
+                            resultado = _fallo_afip(original_invoice_data, solicitud["invoice_id"], afip_error)
+            except Exception as e:
+                logger.error(f"[{invoice_id}] Error inesperado en el lote async: {e}", exc_info=True)
+                resultado = {
+                    "id": invoice_id,
+                    "status": "FAILED",
+                    "error": str(e),
+                    "original_data": original_invoice_data
+                }
+            finally:
+                if token_lease:
+                    await en_hilo(coordinacion.liberar_lease, nombre_lease, token_lease)
+            cron_total.resultado = metricas.resultado_factura(resultado)
+        return resultado
+
+
+async def _ejecutar_lote_async(
+    invoices: List[Dict[str, Any]],
+    contexto_sheets: Dict[str, Any],
+    max_workers: int,
+) -> List[Dict[str, Any]]:
+    """
+    Igual que `_ejecutar_lote_concurrente` pero con tareas asyncio: `max_workers` facturas en vuelo
+    a la vez (mismo techo FACTURACION_BATCH_MAX_WORKERS). Resultados en el MISMO orden que la entrada.
+    """
+    if not invoices:
+        return []
+
+    workers = max(1, min(int(max_workers or 1), _BATCH_MAX_WORKERS, len(invoices)))
+    ingreso_locks: Dict[str, asyncio.Lock] = {}
+    for inv in invoices:
+        if inv.get("id") is not None:
+            ingreso_locks.setdefault(str(inv.get("id")), asyncio.Lock())
+    cupo_lote = asyncio.Semaphore(workers)
+    logger.info(f"Lote async: {len(invoices)} facturas, {workers} en vuelo, tope por emisor={_MAX_CONCURRENCIA_POR_EMISOR}")
+
+    resultados = await asyncio.gather(
+        *(_procesar_factura_async(inv, contexto_sheets, ingreso_locks, cupo_lote) for inv in invoices),
+        return_exceptions=True,
+    )
+    return [
+        res if not isinstance(res, Exception) else {
+            "id": inv.get("id"),
+            "status": "FAILED",
+            "error": str(res),
+            "original_data": inv
+        }
+        for inv, res in zip(invoices, resultados)
+    ]
+
+
+def _contexto_sheets_lote(invoices_payload: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Detección de Sheet ID específico por empresa
+    cuit_emisor_detected = None
+    if invoices_payload:
+        first_inv = invoices_payload[0]
+        # Intentar obtener CUIT (puede venir como cuit_emisor, cuit_empresa, etc)
+        cuit_emisor_detected = first_inv.get('cuit_emisor') or first_inv.get('cuit_empresa') or first_inv.get('emisor_cuit')
+    target_sheet_id, target_id_empresa = _resolver_sheet_emisor(cuit_emisor_detected)
+
+    # Sheets ya no se consulta ni se escribe durante el lote: las marcas van a sheets_outbox y
+    # las envía el worker en segundo plano. La latencia del lote depende solo de AFIP + DB.
+    if not target_sheet_id and cuit_emisor_detected:
         logger.warning(
             f"Emisor {cuit_emisor_detected} sin Sheet (ni link en BD ni GOOGLE_SHEET_ID). "
             "Se facturará y persistirá en DB; no se actualizará Google Sheets."
         )
+    return {"google_sheet_id": target_sheet_id, "id_empresa": target_id_empresa}
+
+
+def _indices_reintentables(results_for_response: List[Dict[str, Any]]) -> List[int]:
+    """FASE 2: índices de las facturas fallidas que vale la pena reintentar."""
+    failed_items = []
+    for i, res in enumerate(results_for_response):
+        # Caso 1: Fallo total (AFIP error)
+        if res.get("status") == "FAILED":
+            err_msg = str(res.get("error", "")).lower()
+            # Filtrar errores permanentes obvios para no reintentar en vano
+            if "ya facturada" in err_msg or "campo 'total' es requerido" in err_msg:
+                continue
+            failed_items.append(i)
+
+        # Caso 2: Inconsistencia (AFIP OK, DB Fail). No se re-ejecuta el ciclo completo: llamar de
+        # nuevo a AFIP podría duplicar el comprobante si el anterior dio timeout pero se emitió.
+        # Lo repara scripts/reprocess_batch.py a partir del reporte del lote.
+        elif res.get("status") == "SUCCESS" and res.get("db_save_status") == "FAILED":
+            logger.info(f"[{res.get('id')}] Factura emitida pero no guardada en DB; queda para reprocess_batch.")
+    return [idx for idx in failed_items if results_for_response[idx].get("original_data")]
+
+
+def _aplicar_reintentos(
+    results_for_response: List[Dict[str, Any]],
+    retry_indices: List[int],
+    retry_results: List[Dict[str, Any]],
+) -> None:
+    for idx, retry_res in zip(retry_indices, retry_results):
+        original_data = results_for_response[idx]["original_data"]
+        emisor = original_data.get('emisor_cuit') or original_data.get('cuit_empresa')
+        metricas.REINTENTOS.inc(nivel="lote", emisor=metricas.etiqueta_emisor(emisor))
+        # Si el reintento fue exitoso, reemplazar el resultado anterior
+        if retry_res.get("status") == "SUCCESS":
+            logger.info(f"Reintento EXITOSO para {original_data.get('id')}")
+        else:
+            logger.warning(f"Reintento FALLIDO para {original_data.get('id')}: {retry_res.get('error')}")
+        # Actualizar con el último resultado (éxito o último error)
+        results_for_response[idx] = retry_res
 
-    db = SessionLocal()
-    results_for_response: List[Dict[str, Any]] = []
 
+def _notificar_fin_lote(results_for_response: List[Dict[str, Any]]) -> None:
+    # Despertar al worker de la outbox para que envíe las marcas del lote en un solo batch_update
     try:
-        # --- FASE 1: Procesamiento Secuencial Inicial ---
-        logger.info("--- FASE 1: Procesamiento Inicial ---")
-        for original_invoice_data in invoices_payload:
-            res = _process_single_invoice_full_cycle(original_invoice_data, db, sheets_handler, results_for_response)
-            results_for_response.append(res)
+        notificar_outbox()
+    except Exception:
+        pass
+    logger.info(f"Procesamiento finalizado. Total: {len(results_for_response)}")
 
-        # --- FASE 2: Verificación y Auto-Gestión (Retry) ---
-        logger.info("--- FASE 2: Verificación y Auto-Gestión ---")
-        
-        # Identificar fallos recuperables
-        failed_items = []
-        for i, res in enumerate(results_for_response):
-            # Caso 1: Fallo total (AFIP error)
-            if res.get("status") == "FAILED":
-                err_msg = str(res.get("error", "")).lower()
-                # Filtrar errores permanentes obvios para no reintentar en vano
-                if "ya facturada" in err_msg or "campo 'total' es requerido" in err_msg:
-                    continue
-                failed_items.append(i)
-            
-            # Caso 2: Inconsistencia (AFIP OK, DB Fail) -> Intentar guardar de nuevo
-            elif res.get("status") == "SUCCESS" and res.get("db_save_status") == "FAILED":
-                logger.info(f"[{res.get('id')}] Reparando guardado en DB...")
-                # Reintentar lógica de guardado (simplificado: re-ejecutar ciclo completo sabiendo que el chequeo de duplicados lo atrapará o AFIP fallará y caerá en catch, 
-                # PERO mejor es simplemente reintentar el guardado si tuvieramos la data.
-                # Dado que _process_single_invoice_full_cycle hace todo, si lo llamamos de nuevo:
-                # 1. Chequea DB -> si falló el guardado antes, no estará.
-                # 2. Llama a AFIP -> AFIP dirá "Transacción Activa" o facturará de nuevo si no se completó.
-                # Riesgo: Duplicar en AFIP si el anterior dio timeout pero se hizo.
-                # Solución segura: Si ya tenemos result de AFIP, solo intentar guardar.
-                pass 
-
-        if failed_items:
-            logger.info(f"Detectadas {len(failed_items)} facturas fallidas recuperables. Iniciando reintento automático...")
-            import time
-            time.sleep(1.0) # Breve pausa para limpiar estado de conexión
-            
-            for idx in failed_items:
-                prev_res = results_for_response[idx]
-                original_data = prev_res.get("original_data")
-                if not original_data: continue
-                
-                logger.info(f"Reintentando factura ID: {original_data.get('id')}...")
-                retry_res = _process_single_invoice_full_cycle(original_data, db, sheets_handler, results_for_response)
-                
-                # Si el reintento fue exitoso, reemplazar el resultado anterior
-                if retry_res.get("status") == "SUCCESS":
-                    logger.info(f"Reintento EXITOSO para {original_data.get('id')}")
-                    results_for_response[idx] = retry_res
-                else:
-                    logger.warning(f"Reintento FALLIDO para {original_data.get('id')}: {retry_res.get('error')}")
-                    # Actualizar con el último error pero mantener info
-                    results_for_response[idx] = retry_res
 
-    finally:
-        db.close()
-        logger.info("Sesión de base de datos cerrada.")
-
-    logger.info(f"Procesamiento finalizado. Total: {len(results_for_response)}")
-    
+def _guardar_reporte_lote(results_for_response: List[Dict[str, Any]]) -> None:
     # --- Guardar en carpeta testing ---
     try:
         project_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -718,4 +882,63 @@ async def process_invoice_batch_for_endpoint(
     except Exception as e:
         logger.error(f"Error guardando reporte: {e}")
 
+
+def procesar_lote_facturas(
+    invoices_payload: List[Dict[str, Any]],
+    max_workers: int = 5
+) -> List[Dict[str, Any]]:
+    """
+    Lote de facturas con hilos (una sesión de DB por worker), para scripts y endpoints `def`.
+    Desde código async usar `process_invoice_batch_for_endpoint`.
+    """
+    logger.info(f"Recibido lote de {len(invoices_payload)} facturas (hilos). Iniciando procesamiento robusto con auto-healing.")
+    contexto_sheets = _contexto_sheets_lote(invoices_payload)
+    results_for_response: List[Dict[str, Any]] = []
+    try:
+        logger.info("--- FASE 1: Procesamiento Inicial ---")
+        results_for_response = _ejecutar_lote_concurrente(invoices_payload, contexto_sheets, max_workers)
+
+        logger.info("--- FASE 2: Verificación y Auto-Gestión ---")
+        retry_indices = _indices_reintentables(results_for_response)
+        if retry_indices:
+            logger.info(f"Detectadas {len(retry_indices)} facturas fallidas recuperables. Iniciando reintento automático...")
+            time.sleep(1.0) # Breve pausa para limpiar estado de conexión
+            retry_payload = [results_for_response[idx]["original_data"] for idx in retry_indices]
+            retry_results = _ejecutar_lote_concurrente(retry_payload, contexto_sheets, max_workers)
+            _aplicar_reintentos(results_for_response, retry_indices, retry_results)
+    finally:
+        _notificar_fin_lote(results_for_response)
+    _guardar_reporte_lote(results_for_response)
+    return results_for_response
+
+
+async def process_invoice_batch_for_endpoint(
+    invoices_payload: List[Dict[str, Any]],
+    max_workers: int = 5
+) -> List[Dict[str, Any]]:
+    """
+    Lote de facturas sin bloquear el event loop: AFIP por httpx async y la BD / el reporte en el
+    pool bloqueante. Mismas fases (proceso inicial + reintento de fallos recuperables) que
+    `procesar_lote_facturas`.
+    """
+    logger.info(f"Endpoint: Recibido lote de {len(invoices_payload)} facturas. Iniciando procesamiento robusto con auto-healing.")
+    contexto_sheets = await en_hilo(_contexto_sheets_lote, invoices_payload)
+    results_for_response: List[Dict[str, Any]] = []
+    try:
+        # --- FASE 1: Procesamiento Concurrente Inicial ---
+        logger.info("--- FASE 1: Procesamiento Inicial ---")
+        results_for_response = await _ejecutar_lote_async(invoices_payload, contexto_sheets, max_workers)
+
+        # --- FASE 2: Verificación y Auto-Gestión (Retry) ---
+        logger.info("--- FASE 2: Verificación y Auto-Gestión ---")
+        retry_indices = _indices_reintentables(results_for_response)
+        if retry_indices:
+            logger.info(f"Detectadas {len(retry_indices)} facturas fallidas recuperables. Iniciando reintento automático...")
+            await asyncio.sleep(1.0) # Breve pausa para limpiar estado de conexión
+            retry_payload = [results_for_response[idx]["original_data"] for idx in retry_indices]
+            retry_results = await _ejecutar_lote_async(retry_payload, contexto_sheets, max_workers)
+            _aplicar_reintentos(results_for_response, retry_indices, retry_results)
+    finally:
+        _notificar_fin_lote(results_for_response)
+    await en_hilo(_guardar_reporte_lote, results_for_response)
     return results_for_response
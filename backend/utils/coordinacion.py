@@ -0,0 +1,275 @@
+"""
+Coordinación entre workers (uvicorn --workers / gunicorn con WEB_CONCURRENCY > 1).
+
+Con un solo proceso alcanzaban los locks y cachés en memoria; con N workers cada uno tiene los
+suyos. Lo que tiene que valer para todos los procesos pasa por acá:
+
+- Leases con vencimiento (`tomar_lease` / `liberar_lease` / `Lease`): el ingreso que se está
+  facturando, la factura que se está anulando y el cooldown de los syncs automáticos de Sheets.
+  Si el worker dueño muere, el lease vence solo.
+- Generaciones de caché (`publicar_invalidacion` / `VigilanteCache`): cuando un worker invalida
+  un caché (credenciales AFIP, contexto de empresa, usuarios) los demás descartan su copia en
+  COORDINACION_POLL_SEC segundos en lugar de esperar al TTL.
+
+El backend se elige con COORDINACION_BACKEND:
+- `bd` (por defecto): tablas coordinacion_leases / coordinacion_generaciones de la base principal
+  (scripts/migrate_add_coordinacion.py; si faltan se crean al primer uso).
+- `local`: memoria del proceso. Solo sirve con un único worker (o en pruebas).
+Si la BD no responde, los leases se degradan al lock del proceso (igual que el GET_LOCK del
+scheduler de syncs) y las generaciones conservan el último valor leído.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text as sa_text
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+COORDINACION_BACKEND = os.getenv("COORDINACION_BACKEND", "bd").strip().lower()
+COORDINACION_POLL_SEC = float(os.getenv("COORDINACION_POLL_SEC", "2"))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CoordinacionLocal:
+    """Leases y generaciones en memoria: alcanza con un solo proceso."""
+
+    nombre = "local"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._generaciones: Dict[str, int] = {}
+
+    def tomar_lease(self, nombre: str, segundos: float, dueno: str) -> bool:
+        ahora = time.monotonic()
+        with self._lock:
+            actual = self._leases.get(nombre)
+            if actual is not None and actual[1] > ahora:
+                return False
+            self._leases[nombre] = (dueno, ahora + segundos)
+            return True
+
+    def liberar_lease(self, nombre: str, dueno: str) -> None:
+        with self._lock:
+            actual = self._leases.get(nombre)
+            if actual is not None and actual[0] == dueno:
+                del self._leases[nombre]
+
+    def generaciones(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._generaciones)
+
+    def publicar(self, espacio: str) -> None:
+        with self._lock:
+            self._generaciones[espacio] = self._generaciones.get(espacio, 0) + 1
+
+
+class CoordinacionBD:
+    """Leases y generaciones en la base principal (compartidos por todos los workers)."""
+
+    nombre = "bd"
+
+    def __init__(self):
+        self._tablas_ok = False
+
+    def _engine(self):
+        from backend.database import engine
+        if not self._tablas_ok:
+            asegurar_tablas_coordinacion()
+            self._tablas_ok = True
+        return engine
+
+    def tomar_lease(self, nombre: str, segundos: float, dueno: str) -> bool:
+        engine = self._engine()
+        ahora = _utcnow()
+        params = {"n": nombre, "d": dueno, "v": ahora + timedelta(seconds=segundos), "ahora": ahora}
+        # Primero reclamar uno vencido; si no existe, insertarlo (la PK decide entre dos workers)
+        with engine.begin() as conn:
+            res = conn.execute(
+                sa_text("UPDATE coordinacion_leases SET dueno = :d, vence_at = :v WHERE nombre = :n AND vence_at <= :ahora"),
+                params,
+            )
+            if res.rowcount == 1:
+                return True
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    sa_text("INSERT INTO coordinacion_leases (nombre, dueno, vence_at) VALUES (:n, :d, :v)"), params
+                )
+            return True
+        except IntegrityError:
+            return False
+
+    def liberar_lease(self, nombre: str, dueno: str) -> None:
+        with self._engine().begin() as conn:
+            conn.execute(sa_text("DELETE FROM coordinacion_leases WHERE nombre = :n AND dueno = :d"), {"n": nombre, "d": dueno})
+
+    def generaciones(self) -> Dict[str, int]:
+        with self._engine().connect() as conn:
+            filas = conn.execute(sa_text("SELECT espacio, generacion FROM coordinacion_generaciones")).all()
+        return {espacio: int(generacion) for espacio, generacion in filas}
+
+    def publicar(self, espacio: str) -> None:
+        engine = self._engine()
+        params = {"e": espacio, "ahora": _utcnow()}
+        actualizar = sa_text(
+            "UPDATE coordinacion_generaciones SET generacion = generacion + 1, actualizado_at = :ahora WHERE espacio = :e"
+        )
+        with engine.begin() as conn:
+            if conn.execute(actualizar, params).rowcount == 1:
+                return
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    sa_text("INSERT INTO coordinacion_generaciones (espacio, generacion, actualizado_at) VALUES (:e, 1, :ahora)"),
+                    params,
+                )
+        except IntegrityError:
+            with engine.begin() as conn:
+                conn.execute(actualizar, params)
+
+
+def asegurar_tablas_coordinacion() -> bool:
+    """Crea coordinacion_leases / coordinacion_generaciones si no existen (migración formal en scripts/)."""
+    from backend.database import engine
+    from backend.modelos import CoordinacionGeneracion, CoordinacionLease
+    try:
+        CoordinacionLease.__table__.create(bind=engine, checkfirst=True)
+        CoordinacionGeneracion.__table__.create(bind=engine, checkfirst=True)
+        return True
+    except Exception as e:
+        logger.warning(f"[COORD] No se pudieron asegurar las tablas de coordinación: {e}")
+        return False
+
+
+_local = CoordinacionLocal()
+_backend = CoordinacionBD() if COORDINACION_BACKEND == "bd" else _local
+
+
+def backend_activo() -> str:
+    return _backend.nombre
+
+
+# ------------------------------------------------------------------------------
+# Leases
+# ------------------------------------------------------------------------------
+
+def tomar_lease(nombre: str, segundos: float) -> Optional[str]:
+    """Toma el lease `nombre` por `segundos` si está libre o vencido.
+
+    Devuelve el token para `liberar_lease`, o None si lo tiene otro (proceso o pedido).
+    """
+    token = f"{os.getpid()}:{uuid.uuid4().hex[:16]}"
+    if _backend is not _local:
+        try:
+            return token if _backend.tomar_lease(nombre, segundos, token) else None
+        except Exception as e:
+            logger.warning(f"[COORD] Lease {nombre}: BD no disponible, se usa solo el lock del proceso ({e})")
+    return token if _local.tomar_lease(nombre, segundos, token) else None
+
+
+def liberar_lease(nombre: str, token: Optional[str]) -> None:
+    """Libera el lease si `token` sigue siendo el dueño (si venció y lo tomó otro, no hace nada)."""
+    if not token:
+        return
+    _local.liberar_lease(nombre, token)
+    if _backend is not _local:
+        try:
+            _backend.liberar_lease(nombre, token)
+        except Exception as e:
+            logger.warning(f"[COORD] No se pudo liberar el lease {nombre} (vence solo): {e}")
+
+
+class Lease:
+    """`with Lease(nombre, segundos) as lk:` — `lk.adquirido` indica si se obtuvo."""
+
+    def __init__(self, nombre: str, segundos: float):
+        self.nombre = nombre
+        self.segundos = segundos
+        self.token: Optional[str] = None
+
+    @property
+    def adquirido(self) -> bool:
+        return self.token is not None
+
+    def __enter__(self):
+        self.token = tomar_lease(self.nombre, self.segundos)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        liberar_lease(self.nombre, self.token)
+        return False
+
+
+# ------------------------------------------------------------------------------
+# Invalidación de cachés entre workers
+# ------------------------------------------------------------------------------
+
+_gen_lock = threading.Lock()
+_gen_valores: Dict[str, int] = {}
+_gen_leidas_en = float("-inf")
+
+
+def publicar_invalidacion(espacio: str) -> None:
+    """Avisa a los demás workers que descarten su caché `espacio`."""
+    if _backend is _local:
+        return
+    try:
+        _backend.publicar(espacio)
+    except Exception as e:
+        logger.warning(f"[COORD] No se pudo publicar la invalidación de '{espacio}' (los demás workers esperan el TTL): {e}")
+
+
+def generacion(espacio: str) -> int:
+    """Generación vigente de `espacio` (se relee de la BD cada COORDINACION_POLL_SEC como mucho)."""
+    global _gen_valores, _gen_leidas_en
+    if _backend is _local or COORDINACION_POLL_SEC <= 0:
+        return 0
+    ahora = time.monotonic()
+    if ahora - _gen_leidas_en >= COORDINACION_POLL_SEC:
+        with _gen_lock:
+            if ahora - _gen_leidas_en >= COORDINACION_POLL_SEC:
+                _gen_leidas_en = ahora
+                try:
+                    _gen_valores = _backend.generaciones()
+                except Exception as e:
+                    logger.debug(f"[COORD] No se pudieron leer las generaciones de caché: {e}")
+    return _gen_valores.get(espacio, 0)
+
+
+class VigilanteCache:
+    """Detecta invalidaciones de `espacio` publicadas por otro worker.
+
+    `cambio()` devuelve True una vez por cada generación nueva: el caché debe vaciarse.
+    """
+
+    def __init__(self, espacio: str):
+        self.espacio = espacio
+        self._vista: Optional[int] = None
+
+    def cambio(self) -> bool:
+        actual = generacion(self.espacio)
+        if self._vista is None:
+            self._vista = actual
+            return False
+        if actual != self._vista:
+            self._vista = actual
+            return True
+        return False
+
+
+def estadisticas() -> Dict[str, object]:
+    return {
+        "backend": _backend.nombre,
+        "poll_sec": COORDINACION_POLL_SEC,
+        "generaciones": dict(_gen_valores),
+    }
@@ -0,0 +1,507 @@
+"""
+Lotes de facturación asíncronos y durables (POST /facturador/jobs).
+
+POST /facturador/facturar-por-cantidad mantiene abierto el request durante todo el lote (FASE 1,
+pausa y FASE 2) y el resultado solo queda en la respuesta y en testing/batch_results_*.json. Acá el
+lote se guarda como un job con un ítem por boleta y el endpoint responde enseguida con el id:
+
+1. `crear_job` persiste el job y sus ítems (PENDIENTE) en la misma transacción.
+2. El worker (`iniciar_worker_jobs`: tareas asyncio en el loop de uvicorn, FACTURACION_JOBS_WORKERS
+   por proceso) reclama jobs con un UPDATE condicional + lease, igual que sheets_outbox, y procesa
+   los ítems con el mismo pipeline async del lote (`billige_manage._procesar_factura_async`).
+   Cada resultado se guarda apenas termina su boleta: el progreso se ve en vivo.
+3. Los fallos recuperables (mismo criterio que la FASE 2) vuelven a PENDIENTE con backoff en lugar
+   de la pausa fija; tras FACTURACION_JOB_MAX_INTENTOS quedan en ERROR.
+4. Si el proceso dueño muere, el lease del job vence y otro worker lo retoma: los ítems que
+   quedaron en PROCESANDO se vuelven a intentar y el lease por ingreso + el chequeo "ya facturada"
+   evitan refacturar los que alcanzaron a guardarse.
+
+Progreso: `resumen_job` (polling) y GET /facturador/jobs/{id}/eventos (Server-Sent Events).
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy import text as sa_text
+from sqlmodel import select
+
+from backend.database import SessionLocal, engine
+from backend.modelos import FacturacionJob, FacturacionJobItem
+from backend.utils import billige_manage, metricas
+from backend.utils.json_utils import default_json
+from backend.utils.pool_bloqueante import en_hilo
+from backend.utils.sheets_outbox import notificar_outbox
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDIENTE = "PENDIENTE"
+JOB_EN_CURSO = "EN_CURSO"
+JOB_COMPLETADO = "COMPLETADO"
+JOB_COMPLETADO_CON_ERRORES = "COMPLETADO_CON_ERRORES"
+JOB_CANCELADO = "CANCELADO"
+JOB_TERMINALES = (JOB_COMPLETADO, JOB_COMPLETADO_CON_ERRORES, JOB_CANCELADO)
+
+ITEM_PENDIENTE = "PENDIENTE"
+ITEM_PROCESANDO = "PROCESANDO"
+ITEM_OK = "OK"
+ITEM_DUPLICADA = "DUPLICADA"
+ITEM_ERROR = "ERROR"
+ITEM_ERROR_DB = "ERROR_DB"
+ITEM_CANCELADA = "CANCELADA"
+
+# Resultado de metricas.resultado_factura -> estado del ítem
+_ESTADO_ITEM = {
+    metricas.RESULTADO_OK: ITEM_OK,
+    "duplicada": ITEM_DUPLICADA,
+    "db_error": ITEM_ERROR_DB,
+    metricas.RESULTADO_ERROR: ITEM_ERROR,
+}
+
+JOBS_WORKERS = max(1, int(os.getenv("FACTURACION_JOBS_WORKERS", "2")))
+JOBS_INTERVALO_SEC = float(os.getenv("FACTURACION_JOBS_INTERVALO_SEC", "2"))
+# Si el proceso dueño no renueva el lease en este tiempo, otro worker retoma el job
+JOB_LEASE_SEC = float(os.getenv("FACTURACION_JOB_LEASE_SEC", "60"))
+JOB_MAX_INTENTOS = max(1, int(os.getenv("FACTURACION_JOB_MAX_INTENTOS", "3")))
+JOB_BACKOFF_SEC = float(os.getenv("FACTURACION_JOB_BACKOFF_SEC", "2"))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _iso(v: Optional[datetime]) -> Optional[str]:
+    return v.isoformat() if v is not None else None
+
+
+def asegurar_tablas_jobs() -> bool:
+    """Crea facturacion_jobs / facturacion_job_items si no existen (migración formal en scripts/)."""
+    try:
+        FacturacionJob.__table__.create(bind=engine, checkfirst=True)
+        FacturacionJobItem.__table__.create(bind=engine, checkfirst=True)
+        return True
+    except Exception as e:
+        logger.warning(f"[JOBS] No se pudieron asegurar las tablas de jobs: {e}")
+        return False
+
+
+# ---------------------------------------------------------------------------
+# API (la usan los endpoints de /facturador/jobs, siempre vía en_hilo)
+# ---------------------------------------------------------------------------
+
+def crear_job(
+    invoices: List[Dict[str, Any]],
+    id_empresa: Optional[int],
+    id_usuario: Optional[int],
+    max_workers: int = 5,
+) -> str:
+    """Guarda el job y un ítem PENDIENTE por boleta. Devuelve el id del job."""
+    job_id = uuid.uuid4().hex
+    with SessionLocal() as db:
+        db.add(FacturacionJob(
+            id=job_id, id_empresa=id_empresa, id_usuario=id_usuario,
+            total_items=len(invoices), max_workers=max(1, int(max_workers or 1)),
+        ))
+        db.add_all([
+            FacturacionJobItem(
+                job_id=job_id,
+                posicion=i,
+                ingreso_id=str(inv["id"])[:64] if inv.get("id") is not None else None,
+                payload=json.dumps(inv, ensure_ascii=False, default=default_json),
+            )
+            for i, inv in enumerate(invoices)
+        ])
+        db.commit()
+    logger.info(f"[JOBS] Job {job_id} creado con {len(invoices)} boletas (empresa={id_empresa})")
+    return job_id
+
+
+def _conteos(db, job_id: str) -> Dict[str, int]:
+    filas = db.exec(
+        select(FacturacionJobItem.estado, func.count())
+        .where(FacturacionJobItem.job_id == job_id)
+        .group_by(FacturacionJobItem.estado)
+    ).all()
+    return {estado: int(n) for estado, n in filas}
+
+
+def _resumen(job: FacturacionJob, conteos: Dict[str, int]) -> Dict[str, Any]:
+    pendientes = conteos.get(ITEM_PENDIENTE, 0) + conteos.get(ITEM_PROCESANDO, 0)
+    procesados = sum(conteos.values()) - pendientes
+    return {
+        "job_id": job.id,
+        "estado": job.estado,
+        "id_empresa": job.id_empresa,
+        "total": job.total_items,
+        "procesados": procesados,
+        "pendientes": pendientes,
+        "porcentaje": round(100.0 * procesados / job.total_items, 1) if job.total_items else 100.0,
+        "por_estado": conteos,
+        "created_at": _iso(job.created_at),
+        "started_at": _iso(job.started_at),
+        "finished_at": _iso(job.finished_at),
+    }
+
+
+def obtener_job(job_id: str) -> Optional[FacturacionJob]:
+    with SessionLocal() as db:
+        return db.get(FacturacionJob, job_id)
+
+
+def resumen_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Estado del job y cantidad de ítems por estado (None si no existe)."""
+    with SessionLocal() as db:
+        job = db.get(FacturacionJob, job_id)
+        if job is None:
+            return None
+        return _resumen(job, _conteos(db, job_id))
+
+
+def listar_jobs(id_empresa: Optional[int], limit: int = 20) -> List[Dict[str, Any]]:
+    """Últimos jobs (de la empresa si se indica), sin conteos por ítem."""
+    with SessionLocal() as db:
+        stmt = select(FacturacionJob).order_by(FacturacionJob.created_at.desc()).limit(limit)
+        if id_empresa is not None:
+            stmt = stmt.where(FacturacionJob.id_empresa == id_empresa)
+        return [
+            {
+                "job_id": j.id, "estado": j.estado, "total": j.total_items,
+                "created_at": _iso(j.created_at), "finished_at": _iso(j.finished_at),
+            }
+            for j in db.exec(stmt).all()
+        ]
+
+
+def listar_items(job_id: str, estado: Optional[str] = None, limit: int = 200, offset: int = 0) -> List[Dict[str, Any]]:
+    """Ítems del job en orden. `resultado` tiene la misma forma que cada elemento de la respuesta de
+    /facturador/facturar-por-cantidad (incluido original_data)."""
+    with SessionLocal() as db:
+        stmt = (
+            select(FacturacionJobItem)
+            .where(FacturacionJobItem.job_id == job_id)
+            .order_by(FacturacionJobItem.posicion)
+            .offset(offset)
+            .limit(limit)
+        )
+        if estado:
+            stmt = stmt.where(FacturacionJobItem.estado == estado.upper())
+        items = []
+        for it in db.exec(stmt).all():
+            resultado = json.loads(it.resultado) if it.resultado else None
+            if resultado is not None:
+                resultado["original_data"] = json.loads(it.payload)
+            items.append({
+                "posicion": it.posicion,
+                "ingreso_id": it.ingreso_id,
+                "estado": it.estado,
+                "intentos": it.intentos,
+                "error": it.error,
+                "resultado": resultado,
+                "updated_at": _iso(it.updated_at),
+            })
+        return items
+
+
+def cancelar_job(job_id: str) -> bool:
+    """Cancela un job no terminado: los ítems pendientes quedan CANCELADA (los que están en AFIP terminan)."""
+    ahora = _utcnow()
+    with engine.begin() as conn:
+        res = conn.execute(
+            sa_text(
+                "UPDATE facturacion_jobs SET estado = :cancelado, finished_at = :ahora, updated_at = :ahora "
+                "WHERE id = :id AND estado IN (:pendiente, :en_curso)"
+            ),
+            {"cancelado": JOB_CANCELADO, "ahora": ahora, "id": job_id, "pendiente": JOB_PENDIENTE, "en_curso": JOB_EN_CURSO},
+        )
+        if res.rowcount != 1:
+            return False
+        conn.execute(
+            sa_text(
+                "UPDATE facturacion_job_items SET estado = :cancelada, updated_at = :ahora "
+                "WHERE job_id = :id AND estado = :pendiente"
+            ),
+            {"cancelada": ITEM_CANCELADA, "ahora": ahora, "id": job_id, "pendiente": ITEM_PENDIENTE},
+        )
+    logger.info(f"[JOBS] Job {job_id} cancelado")
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Worker: reclamo con lease, ítems listos y guardado de resultados
+# ---------------------------------------------------------------------------
+
+def _reclamar_job(dueno: str) -> Optional[Dict[str, Any]]:
+    ahora = _utcnow()
+    with SessionLocal() as db:
+        candidatos = db.exec(
+            select(FacturacionJob.id)
+            .where(
+                FacturacionJob.estado.in_((JOB_PENDIENTE, JOB_EN_CURSO)),
+                (FacturacionJob.lease_hasta == None) | (FacturacionJob.lease_hasta <= ahora),  # noqa: E711
+            )
+            .order_by(FacturacionJob.created_at)
+            .limit(5)
+        ).all()
+    for job_id in candidatos:
+        with engine.begin() as conn:
+            res = conn.execute(
+                sa_text(
+                    "UPDATE facturacion_jobs SET estado = :en_curso, dueno = :dueno, lease_hasta = :lease, "
+                    "started_at = COALESCE(started_at, :ahora), updated_at = :ahora "
+                    "WHERE id = :id AND estado IN (:pendiente, :en_curso) AND (lease_hasta IS NULL OR lease_hasta <= :ahora)"
+                ),
+                {"en_curso": JOB_EN_CURSO, "pendiente": JOB_PENDIENTE, "dueno": dueno, "id": job_id,
+                 "lease": ahora + timedelta(seconds=JOB_LEASE_SEC), "ahora": ahora},
+            )
+            if res.rowcount != 1:
+                continue
+            # Retomado tras la caída de otro proceso: lo que quedó en vuelo se vuelve a intentar
+            retomados = conn.execute(
+                sa_text("UPDATE facturacion_job_items SET estado = :pendiente WHERE job_id = :id AND estado = :procesando"),
+                {"pendiente": ITEM_PENDIENTE, "procesando": ITEM_PROCESANDO, "id": job_id},
+            ).rowcount
+            fila = conn.execute(
+                sa_text("SELECT max_workers, id_empresa FROM facturacion_jobs WHERE id = :id"), {"id": job_id}
+            ).first()
+        if retomados:
+            logger.warning(f"[JOBS] Job {job_id} retomado: {retomados} boletas quedaron en vuelo y se reintentan")
+        return {"id": job_id, "max_workers": fila[0] if fila else 5, "id_empresa": fila[1] if fila else None}
+    return None
+
+
+def _renovar_lease(job_id: str, dueno: str) -> bool:
+    ahora = _utcnow()
+    with engine.begin() as conn:
+        res = conn.execute(
+            sa_text(
+                "UPDATE facturacion_jobs SET lease_hasta = :lease, updated_at = :ahora "
+                "WHERE id = :id AND dueno = :dueno AND estado = :en_curso"
+            ),
+            {"lease": ahora + timedelta(seconds=JOB_LEASE_SEC), "ahora": ahora, "id": job_id, "dueno": dueno, "en_curso": JOB_EN_CURSO},
+        )
+    return res.rowcount == 1
+
+
+def _soltar_job(job_id: str, dueno: str) -> None:
+    """Libera el lease (apagado ordenado) para que otro worker retome el job sin esperar a que venza."""
+    with engine.begin() as conn:
+        conn.execute(
+            sa_text("UPDATE facturacion_jobs SET lease_hasta = NULL, dueno = NULL WHERE id = :id AND dueno = :dueno"),
+            {"id": job_id, "dueno": dueno},
+        )
+
+
+def _tomar_items_listos(job_id: str, limite: int) -> List[Tuple[int, Dict[str, Any], int]]:
+    """Pasa a PROCESANDO hasta `limite` ítems PENDIENTE vencidos. Devuelve (id, payload, intento)."""
+    ahora = _utcnow()
+    with SessionLocal() as db:
+        items = db.exec(
+            select(FacturacionJobItem)
+            .where(
+                FacturacionJobItem.job_id == job_id,
+                FacturacionJobItem.estado == ITEM_PENDIENTE,
+                FacturacionJobItem.proximo_intento_at <= ahora,
+            )
+            .order_by(FacturacionJobItem.posicion)
+            .limit(limite)
+        ).all()
+        tomados = []
+        for it in items:
+            it.estado = ITEM_PROCESANDO
+            it.intentos = (it.intentos or 0) + 1
+            it.updated_at = ahora
+            db.add(it)
+            tomados.append((it.id, json.loads(it.payload), it.intentos))
+        db.commit()
+        return tomados
+
+
+def _espera_siguiente(job_id: str) -> Optional[float]:
+    """Segundos hasta el próximo reintento programado; None si no queda nada pendiente."""
+    with SessionLocal() as db:
+        proximo = db.exec(
+            select(func.min(FacturacionJobItem.proximo_intento_at))
+            .where(FacturacionJobItem.job_id == job_id, FacturacionJobItem.estado == ITEM_PENDIENTE)
+        ).first()
+    if proximo is None:
+        return None
+    return max(0.0, (proximo - _utcnow()).total_seconds())
+
+
+def _guardar_item(item_id: int, resultado: Dict[str, Any], intento: int) -> str:
+    """Guarda el resultado de una boleta; los fallos recuperables vuelven a PENDIENTE con backoff
+    (solo si el job sigue EN_CURSO: en uno cancelado quedan en ERROR)."""
+    estado = _ESTADO_ITEM.get(metricas.resultado_factura(resultado), ITEM_ERROR)
+    ahora = _utcnow()
+    proximo = ahora
+    sin_payload = {k: v for k, v in resultado.items() if k != "original_data"}
+    with SessionLocal() as db:
+        item = db.get(FacturacionJobItem, item_id)
+        if item is None:
+            return estado
+        if estado == ITEM_ERROR and intento < JOB_MAX_INTENTOS and billige_manage._indices_reintentables([resultado]):
+            job = db.get(FacturacionJob, item.job_id)
+            if job is not None and job.estado == JOB_EN_CURSO:
+                estado = ITEM_PENDIENTE
+                proximo = ahora + timedelta(seconds=JOB_BACKOFF_SEC * (2 ** (intento - 1)))
+                emisor = (resultado.get("original_data") or {}).get("emisor_cuit")
+                metricas.REINTENTOS.inc(nivel="job", emisor=metricas.etiqueta_emisor(emisor))
+        item.estado = estado
+        item.proximo_intento_at = proximo
+        item.resultado = json.dumps(sin_payload, ensure_ascii=False, default=default_json)
+        item.error = resultado.get("error") or resultado.get("error_db")
+        item.updated_at = ahora
+        db.add(item)
+        db.commit()
+    return estado
+
+
+def _finalizar_job(job_id: str, dueno: str) -> bool:
+    """Cierra el job si no quedan ítems por procesar. Los que siguen en PROCESANDO (no se pudo guardar
+    su resultado) vuelven a PENDIENTE y el job sigue abierto."""
+    ahora = _utcnow()
+    with SessionLocal() as db:
+        conteos = _conteos(db, job_id)
+    if conteos.get(ITEM_PENDIENTE):
+        return False
+    with engine.begin() as conn:
+        if conteos.get(ITEM_PROCESANDO):
+            conn.execute(
+                sa_text("UPDATE facturacion_job_items SET estado = :pendiente WHERE job_id = :id AND estado = :procesando"),
+                {"pendiente": ITEM_PENDIENTE, "procesando": ITEM_PROCESANDO, "id": job_id},
+            )
+            return False
+        estado = JOB_COMPLETADO_CON_ERRORES if (conteos.get(ITEM_ERROR) or conteos.get(ITEM_ERROR_DB)) else JOB_COMPLETADO
+        conn.execute(
+            sa_text(
+                "UPDATE facturacion_jobs SET estado = :estado, finished_at = :ahora, updated_at = :ahora, "
+                "lease_hasta = NULL, dueno = NULL WHERE id = :id AND dueno = :dueno AND estado = :en_curso"
+            ),
+            {"estado": estado, "ahora": ahora, "id": job_id, "dueno": dueno, "en_curso": JOB_EN_CURSO},
+        )
+    logger.info(f"[JOBS] Job {job_id} {estado}: {conteos}")
+    return True
+
+
+async def _mantener_lease(job_id: str, dueno: str, perdido: asyncio.Event) -> None:
+    while True:
+        await asyncio.sleep(JOB_LEASE_SEC / 3)
+        try:
+            vigente = await en_hilo(_renovar_lease, job_id, dueno)
+        except Exception as e:
+            logger.warning(f"[JOBS] No se pudo renovar el lease del job {job_id}: {e}")
+            continue
+        if not vigente:
+            # Cancelado, o el lease venció y lo tomó otro proceso
+            perdido.set()
+            return
+
+
+async def _procesar_job(job: Dict[str, Any], dueno: str) -> None:
+    job_id = job["id"]
+    workers = max(1, min(int(job.get("max_workers") or 1), billige_manage._BATCH_MAX_WORKERS))
+    cupo = asyncio.Semaphore(workers)
+    ingreso_locks: Dict[str, asyncio.Lock] = {}
+    contexto_sheets: Optional[Dict[str, Any]] = None
+    perdido = asyncio.Event()
+    latido = asyncio.create_task(_mantener_lease(job_id, dueno, perdido))
+    logger.info(f"[JOBS] Procesando job {job_id} ({workers} boletas en vuelo)")
+
+    async def _una(item_id: int, payload: Dict[str, Any], intento: int) -> None:
+        res = await billige_manage._procesar_factura_async(payload, contexto_sheets, ingreso_locks, cupo)
+        await en_hilo(_guardar_item, item_id, res, intento)
+
+    try:
+        while not (_detener.is_set() or perdido.is_set()):
+            items = await en_hilo(_tomar_items_listos, job_id, workers * 4)
+            if not items:
+                espera = await en_hilo(_espera_siguiente, job_id)
+                if espera is None:
+                    if await en_hilo(_finalizar_job, job_id, dueno):
+                        break
+                    continue
+                try:
+                    await asyncio.wait_for(_detener.wait(), timeout=min(espera, JOBS_INTERVALO_SEC) or 0.05)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if contexto_sheets is None:
+                contexto_sheets = await en_hilo(billige_manage._contexto_sheets_lote, [items[0][1]])
+            for _, payload, _ in items:
+                if payload.get("id") is not None:
+                    ingreso_locks.setdefault(str(payload["id"]), asyncio.Lock())
+            resultados = await asyncio.gather(*(_una(*it) for it in items), return_exceptions=True)
+            for r in resultados:
+                if isinstance(r, Exception):
+                    logger.error(f"[JOBS] Job {job_id}: error guardando un ítem: {r}")
+            notificar_outbox()
+    finally:
+        latido.cancel()
+    if perdido.is_set():
+        logger.warning(f"[JOBS] Job {job_id}: lease perdido (cancelado o tomado por otro worker)")
+    elif _detener.is_set():
+        await en_hilo(_soltar_job, job_id, dueno)
+
+
+# ---------------------------------------------------------------------------
+# Arranque / apagado (tareas en el event loop de la app)
+# ---------------------------------------------------------------------------
+
+_tareas: List[asyncio.Task] = []
+_detener = asyncio.Event()
+_aviso = asyncio.Event()
+
+
+def notificar_jobs() -> None:
+    """Despierta a los workers del proceso (llamar desde el event loop tras crear un job)."""
+    _aviso.set()
+
+
+async def _loop_worker(n: int) -> None:
+    dueno = f"{os.getpid()}:{n}:{uuid.uuid4().hex[:8]}"
+    while not _detener.is_set():
+        job = None
+        try:
+            job = await en_hilo(_reclamar_job, dueno)
+        except Exception as e:
+            logger.error(f"[JOBS] Error reclamando jobs: {e}")
+        if job is not None:
+            try:
+                await _procesar_job(job, dueno)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[JOBS] Error procesando el job {job['id']}: {e}", exc_info=True)
+            continue
+        try:
+            await asyncio.wait_for(_aviso.wait(), timeout=JOBS_INTERVALO_SEC)
+        except asyncio.TimeoutError:
+            pass
+        _aviso.clear()
+
+
+def iniciar_worker_jobs() -> bool:
+    """Arranca (una vez por proceso) los FACTURACION_JOBS_WORKERS loops. Llamar desde el event loop."""
+    if any(not t.done() for t in _tareas):
+        return False
+    if not asegurar_tablas_jobs():
+        return False
+    _detener.clear()
+    _tareas[:] = [asyncio.create_task(_loop_worker(n), name=f"facturacion-jobs-{n}") for n in range(JOBS_WORKERS)]
+    return True
+
+
+async def detener_worker_jobs(timeout: float = 10.0) -> None:
+    """Espera a las boletas en vuelo hasta `timeout`; el resto lo retoma otro worker al vencer el lease."""
+    _detener.set()
+    _aviso.set()
+    if not _tareas:
+        return
+    _, pendientes = await asyncio.wait(_tareas, timeout=timeout)
+    for t in pendientes:
+        t.cancel()
+    _tareas.clear()
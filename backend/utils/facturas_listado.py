@@ -0,0 +1,95 @@
+"""
+Listado de facturas emitidas (facturas_electronicas) para el frontend.
+
+Antes /boletas?tipo=facturadas hacía `SELECT *` con LIMIT/OFFSET: traía el blob raw_response de
+cada fila y las páginas profundas recorrían todo lo anterior. Acá:
+
+- Proyección liviana (COLUMNAS_LISTADO): sin raw_response ni campos de diagnóstico.
+- Paginación por cursor (keyset) sobre (cuit_emisor, id): `id < cursor ORDER BY id DESC`, que
+  resuelve el índice ix_facturas_cuit_emisor_id sin importar la profundidad de la página.
+- Filtros opcionales por rango de fecha_comprobante, tipo_comprobante y anulada.
+"""
+import os
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlmodel import select, desc
+
+from backend.modelos import FacturaElectronica
+
+LIMITE_MAXIMO = int(os.getenv("FACTURAS_LISTADO_MAX", "500"))
+
+COLUMNAS_LISTADO = (
+    "id",
+    "ingreso_id",
+    "cae",
+    "numero_comprobante",
+    "punto_venta",
+    "tipo_comprobante",
+    "fecha_comprobante",
+    "vencimiento_cae",
+    "resultado_afip",
+    "cuit_emisor",
+    "tipo_doc_receptor",
+    "nro_doc_receptor",
+    "importe_total",
+    "importe_neto",
+    "importe_iva",
+    "qr_url_afip",
+    "anulada",
+    "fecha_anulacion",
+    "codigo_nota_credito",
+    "motivo_anulacion",
+)
+
+
+def _a_item(fila) -> Dict[str, Any]:
+    item = dict(zip(COLUMNAS_LISTADO, fila))
+    for k, v in item.items():
+        if isinstance(v, Decimal):
+            item[k] = float(v)
+    return item
+
+
+def listar_facturas(
+    db,
+    cuit_emisor: str,
+    limit: int = 20,
+    cursor: Optional[int] = None,
+    skip: int = 0,
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    tipo_comprobante: Optional[int] = None,
+    anulada: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """Una página de facturas del emisor, de la más nueva a la más vieja.
+
+    `cursor` es el `siguiente_cursor` de la página anterior (el id más chico devuelto). `skip`
+    queda solo por compatibilidad con los listados con OFFSET y se ignora si hay cursor.
+    """
+    limit = max(1, min(int(limit), LIMITE_MAXIMO))
+    columnas = [getattr(FacturaElectronica, c) for c in COLUMNAS_LISTADO]
+    q = select(*columnas).where(FacturaElectronica.cuit_emisor == cuit_emisor)
+    if cursor is not None:
+        q = q.where(FacturaElectronica.id < cursor)
+    if fecha_desde is not None:
+        q = q.where(FacturaElectronica.fecha_comprobante >= fecha_desde)
+    if fecha_hasta is not None:
+        q = q.where(FacturaElectronica.fecha_comprobante <= fecha_hasta)
+    if tipo_comprobante is not None:
+        q = q.where(FacturaElectronica.tipo_comprobante == tipo_comprobante)
+    if anulada is not None:
+        q = q.where(FacturaElectronica.anulada == anulada)
+    q = q.order_by(desc(FacturaElectronica.id)).limit(limit + 1)
+    if cursor is None and skip:
+        q = q.offset(skip)
+
+    filas = db.exec(q).all()
+    hay_mas = len(filas) > limit
+    items: List[Dict[str, Any]] = [_a_item(f) for f in filas[:limit]]
+    return {
+        "items": items,
+        "siguiente_cursor": items[-1]["id"] if hay_mas and items else None,
+        "limit": limit,
+    }
@@ -0,0 +1,249 @@
+"""
+Lecturas de boletas (pestaña INGRESOS) desde el espejo MySQL `ingresos_sheets`.
+
+Los listados de /boletas descargaban y normalizaban la hoja completa de Google Sheets en cada
+request (`TablasHandler.cargar_ingresos()`). El espejo ya guarda cada fila normalizada en
+`data_json`, así que acá se filtra y pagina en SQL (id_empresa / facturacion / fecha indexados) y
+solo se decodifica el JSON de las filas que se devuelven.
+
+El espejo lo mantiene el scheduler de sheets_sync_scheduler: `asegurar_espejo` programa un
+delta-sync respetando el cooldown y, si la empresa todavía no tiene filas, espera el primero.
+"""
+import json
+import logging
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlmodel import select, desc, func
+
+from backend.modelos import IngresoSheets
+from backend.utils.receptor_fields import extraer_receptor_fields
+
+logger = logging.getLogger(__name__)
+
+# Tope de espera del primer sync de una empresa sin filas en el espejo
+ESPERA_PRIMER_SYNC_SEC = 60
+# Filas por tanda cuando hay que aplicar un filtro en Python (fuzzy por repartidor)
+_TANDA = 500
+
+# Estado normalizado (columna ingresos_sheets.estado)
+ESTADO_PENDIENTE = "PENDIENTE"
+ESTADO_FACTURADO = "FACTURADO"
+ESTADO_ANULADO = "ANULADO"
+ESTADO_NO_FACTURAR = "NO_FACTURAR"
+ESTADO_OTRO = "OTRO"
+
+
+def estado_normalizado(facturacion: Any) -> Optional[str]:
+    """Texto libre de la columna Facturacion -> estado canónico (None si está vacío)."""
+    t = str(facturacion or "").strip().lower()
+    if not t:
+        return None
+    if t in ("facturado", "facturada"):
+        return ESTADO_FACTURADO
+    if t in ("anulado", "anulada"):
+        return ESTADO_ANULADO
+    if t.startswith("no falta"):
+        return ESTADO_NO_FACTURAR
+    if "falta" in t and "facturar" in t:
+        return ESTADO_PENDIENTE
+    return ESTADO_OTRO
+
+
+def _a_decimal(valor: Any) -> Optional[Decimal]:
+    if valor is None or valor == "":
+        return None
+    try:
+        if isinstance(valor, str):
+            # Formato argentino: $ 1.234,56
+            valor = valor.strip().replace("$", "").replace(" ", "").replace(".", "").replace(",", ".")
+        d = Decimal(str(valor)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError, TypeError):
+        return None
+    return d if abs(d) < Decimal("1e12") else None
+
+
+def campos_materializados(b: Dict[str, Any]) -> Dict[str, Any]:
+    """Columnas indexables de una fila normalizada de INGRESOS (ver IngresoSheets)."""
+    razon, doc, _ = extraer_receptor_fields(b)
+    repartidor = str(b.get("Repartidor") or b.get("repartidor") or "").strip()
+    doc_digitos = re.sub(r"\D", "", doc or "")
+    return {
+        "repartidor": repartidor[:128] or None,
+        "razon_social": (razon or "")[:255] or None,
+        "cuit": doc_digitos[:20] or None,
+        "total": _a_decimal(b.get("importe_total") if b.get("importe_total") not in (None, "") else b.get("INGRESOS")),
+        "estado": estado_normalizado(b.get("facturacion") or b.get("Facturacion")),
+    }
+
+
+def aplicar_campos_materializados(obj: IngresoSheets, b: Dict[str, Any]) -> None:
+    for k, v in campos_materializados(b).items():
+        setattr(obj, k, v)
+
+
+def rellenar_campos_materializados(db, id_empresa: Optional[int] = None, max_filas: int = 5000) -> int:
+    """Completa las columnas materializadas de filas sincronizadas antes de que existieran.
+
+    Procesa hasta `max_filas` filas con `estado` NULL y datos (lo llama cada sync y la migración).
+    Hace commit por tanda. Devuelve cuántas filas actualizó.
+    """
+    hechas = 0
+    ultimo_id = 0
+    while hechas < max_filas:
+        q = (
+            select(IngresoSheets)
+            .where(IngresoSheets.estado.is_(None))
+            .where(IngresoSheets.facturacion != "")
+            .where(IngresoSheets.id > ultimo_id)
+            .order_by(IngresoSheets.id)
+            .limit(min(_TANDA, max_filas - hechas))
+        )
+        if id_empresa is not None:
+            q = q.where(IngresoSheets.id_empresa == id_empresa)
+        filas = db.exec(q).all()
+        if not filas:
+            break
+        for obj in filas:
+            aplicar_campos_materializados(obj, _a_dict(obj))
+            db.add(obj)
+            ultimo_id = obj.id
+        db.commit()
+        hechas += len(filas)
+    return hechas
+
+
+def asegurar_espejo(db, id_empresa: int, google_sheet_id: Optional[str]) -> None:
+    """Programa un delta-sync (con cooldown). Si el espejo de la empresa está vacío, espera el primero."""
+    from backend.utils.sheets_sync_scheduler import programar_sync
+
+    try:
+        hay_filas = db.exec(
+            select(IngresoSheets.id).where(IngresoSheets.id_empresa == id_empresa).limit(1)
+        ).first() is not None
+        _, fut = programar_sync(id_empresa, google_sheet_id, respetar_cooldown=hay_filas)
+        if not hay_filas and fut is not None:
+            fut.result(timeout=ESPERA_PRIMER_SYNC_SEC)
+    except Exception as e:
+        logger.warning(f"[ESPEJO] No se pudo programar el sync de la empresa {id_empresa}: {e}")
+
+
+def _a_dict(obj: IngresoSheets) -> Dict[str, Any]:
+    try:
+        data = json.loads(obj.data_json or "{}")
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _query(
+    id_empresa: int,
+    solo_no_facturadas: bool = False,
+    fecha: Optional[date] = None,
+    ordenar_por_fecha: bool = False,
+):
+    q = select(IngresoSheets).where(IngresoSheets.id_empresa == id_empresa)
+    if solo_no_facturadas:
+        # estado materializado (ver estado_normalizado): usa ix_ingresos_sheets_empresa_estado_fecha
+        q = q.where(IngresoSheets.estado == ESTADO_PENDIENTE)
+    if fecha is not None:
+        q = q.where(IngresoSheets.fecha == fecha)
+    if ordenar_por_fecha:
+        return q.order_by(desc(IngresoSheets.fecha), desc(IngresoSheets.id))
+    # Orden de la hoja (las filas se insertan en el espejo en el orden de INGRESOS)
+    return q.order_by(IngresoSheets.id)
+
+
+def iterar_boletas(
+    db,
+    id_empresa: int,
+    solo_no_facturadas: bool = False,
+    fecha: Optional[date] = None,
+    ordenar_por_fecha: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """Recorre las boletas del espejo en tandas (sin cargar toda la tabla en memoria)."""
+    q = _query(id_empresa, solo_no_facturadas, fecha, ordenar_por_fecha)
+    offset = 0
+    while True:
+        filas = db.exec(q.offset(offset).limit(_TANDA)).all()
+        for obj in filas:
+            yield _a_dict(obj)
+        if len(filas) < _TANDA:
+            return
+        offset += _TANDA
+
+
+def listar_boletas(
+    db,
+    id_empresa: int,
+    solo_no_facturadas: bool = False,
+    fecha: Optional[date] = None,
+    ordenar_por_fecha: bool = False,
+    skip: int = 0,
+    limit: Optional[int] = None,
+    filtro: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> List[Dict[str, Any]]:
+    """Página de boletas del espejo. Sin `filtro` la paginación es SQL (LIMIT/OFFSET);
+    con `filtro` se recorre en tandas hasta completar la página."""
+    skip = max(0, int(skip or 0))
+    if filtro is None:
+        q = _query(id_empresa, solo_no_facturadas, fecha, ordenar_por_fecha).offset(skip)
+        if limit is not None:
+            q = q.limit(max(0, int(limit)))
+        return [_a_dict(obj) for obj in db.exec(q).all()]
+
+    resultado: List[Dict[str, Any]] = []
+    saltadas = 0
+    for b in iterar_boletas(db, id_empresa, solo_no_facturadas, fecha, ordenar_por_fecha):
+        try:
+            if not filtro(b):
+                continue
+        except Exception:
+            continue
+        if saltadas < skip:
+            saltadas += 1
+            continue
+        resultado.append(b)
+        if limit is not None and len(resultado) >= limit:
+            break
+    return resultado
+
+
+def buscar_boleta(db, id_empresa: int, id_ingreso: str) -> Optional[Dict[str, Any]]:
+    """Boleta por ID Ingresos (índice id_ingreso)."""
+    obj = db.exec(
+        select(IngresoSheets)
+        .where(IngresoSheets.id_empresa == id_empresa)
+        .where(IngresoSheets.id_ingreso == str(id_ingreso).strip())
+        .limit(1)
+    ).first()
+    return _a_dict(obj) if obj is not None else None
+
+
+def buscar_boletas(db, id_empresa: int, ids_ingreso: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Varias boletas por ID Ingresos en una consulta por tanda (IN sobre id_ingreso)."""
+    ids = list(dict.fromkeys(str(i).strip() for i in ids_ingreso if str(i).strip()))
+    resultado: Dict[str, Dict[str, Any]] = {}
+    for pos in range(0, len(ids), _TANDA):
+        filas = db.exec(
+            select(IngresoSheets)
+            .where(IngresoSheets.id_empresa == id_empresa)
+            .where(IngresoSheets.id_ingreso.in_(ids[pos:pos + _TANDA]))
+        ).all()
+        for obj in filas:
+            resultado.setdefault(obj.id_ingreso, _a_dict(obj))
+    return resultado
+
+
+def contar_por_estado(db, id_empresa: int) -> Tuple[int, List[Tuple[str, int]]]:
+    """(total de boletas, [(estado normalizado, cantidad)] de mayor a menor; sin las de estado vacío)."""
+    filas = db.exec(
+        select(IngresoSheets.estado, func.count())
+        .where(IngresoSheets.id_empresa == id_empresa)
+        .group_by(IngresoSheets.estado)
+    ).all()
+    total = sum(int(cantidad) for _, cantidad in filas)
+    conteo = [(estado, int(cantidad)) for estado, cantidad in filas if estado]
+    return total, sorted(conteo, key=lambda x: x[1], reverse=True)
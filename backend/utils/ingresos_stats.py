@@ -0,0 +1,153 @@
+"""
+Estadísticas mensuales de INGRESOS sobre el espejo `ingresos_sheets`.
+
+GET /sheets/stats/mensuales traía fecha + data_json de todas las filas (de todas las empresas) y
+parseaba los importes en Python en cada request. Ahora:
+
+- Los totales salen de un GROUP BY año/mes sobre la columna numérica `total` (ver
+  ingresos_espejo.campos_materializados), siempre filtrado por id_empresa.
+- El resultado se guarda en `ingresos_resumen_mensual`. El sync recalcula solo los meses que
+  tocaron las filas nuevas/modificadas, así el endpoint lee O(meses) y no O(filas).
+"""
+import logging
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlmodel import select, desc, func, or_
+
+from backend.database import engine
+from backend.modelos import IngresoResumenMensual, IngresoSheets
+
+logger = logging.getLogger(__name__)
+
+MESES_DASHBOARD = 12
+
+_tabla_asegurada = False
+
+
+def asegurar_tabla_resumen() -> bool:
+    """Crea ingresos_resumen_mensual si falta (la migración formal está en scripts/)."""
+    global _tabla_asegurada
+    if _tabla_asegurada:
+        return True
+    try:
+        IngresoResumenMensual.__table__.create(bind=engine, checkfirst=True)
+        _tabla_asegurada = True
+    except Exception as e:
+        logger.warning(f"No se pudo asegurar la tabla ingresos_resumen_mensual: {e}")
+    return _tabla_asegurada
+
+
+def periodo_de(fecha: Any) -> Optional[str]:
+    """date/datetime -> 'YYYY-MM' (None si no hay fecha)."""
+    if isinstance(fecha, (date, datetime)):
+        return f"{fecha.year:04d}-{fecha.month:02d}"
+    return None
+
+
+def _rango_periodo(periodo: str):
+    year, month = (int(p) for p in periodo.split("-"))
+    desde = date(year, month, 1)
+    hasta = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return desde, hasta
+
+
+def _agrupar_por_mes(db, id_empresa: int, periodos: Optional[Set[str]] = None) -> Dict[str, Dict[str, Any]]:
+    anio = func.extract("year", IngresoSheets.fecha)
+    mes = func.extract("month", IngresoSheets.fecha)
+    q = (
+        select(anio, mes, func.count(), func.coalesce(func.sum(IngresoSheets.total), 0))
+        .where(IngresoSheets.id_empresa == id_empresa)
+        .where(IngresoSheets.fecha.is_not(None))
+        .group_by(anio, mes)
+    )
+    if periodos:
+        rangos = [_rango_periodo(p) for p in sorted(periodos)]
+        q = q.where(or_(*[(IngresoSheets.fecha >= d) & (IngresoSheets.fecha < h) for d, h in rangos]))
+    resultado: Dict[str, Dict[str, Any]] = {}
+    for y, m, cantidad, total in db.exec(q).all():
+        periodo = f"{int(y):04d}-{int(m):02d}"
+        resultado[periodo] = {"cantidad": int(cantidad), "total": Decimal(str(total or 0)).quantize(Decimal("0.01"))}
+    return resultado
+
+
+def recalcular_resumen_mensual(db, id_empresa: int, periodos: Optional[Iterable[Optional[str]]] = None) -> int:
+    """Recalcula el resumen de la empresa para `periodos` ('YYYY-MM'); None = todos los meses.
+
+    Hace commit. Devuelve cuántos meses escribió o borró.
+    """
+    if not asegurar_tabla_resumen():
+        return 0
+    objetivo: Optional[Set[str]] = None
+    if periodos is not None:
+        objetivo = {p for p in periodos if p}
+        if not objetivo:
+            return 0
+
+    agregados = _agrupar_por_mes(db, id_empresa, objetivo)
+    q = select(IngresoResumenMensual).where(IngresoResumenMensual.id_empresa == id_empresa)
+    if objetivo is not None:
+        q = q.where(IngresoResumenMensual.periodo.in_(sorted(objetivo)))
+    existentes = {r.periodo: r for r in db.exec(q).all()}
+
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    cambios = 0
+    for periodo, agg in agregados.items():
+        fila = existentes.pop(periodo, None)
+        if fila is None:
+            fila = IngresoResumenMensual(id_empresa=id_empresa, periodo=periodo)
+        fila.cantidad = agg["cantidad"]
+        fila.total_ingresos = agg["total"]
+        fila.actualizado_at = ahora
+        db.add(fila)
+        cambios += 1
+    # Meses que quedaron sin filas (fecha corregida en la hoja, filas borradas)
+    for fila in existentes.values():
+        db.delete(fila)
+        cambios += 1
+    db.commit()
+    return cambios
+
+
+def _a_item(fila: IngresoResumenMensual) -> Dict[str, Any]:
+    year, month = fila.periodo.split("-")
+    return {
+        "periodo": fila.periodo,
+        "year": int(year),
+        "month": int(month),
+        "cantidad": int(fila.cantidad or 0),
+        "total_ingresos": float(fila.total_ingresos or 0),
+    }
+
+
+def stats_mensuales(db, id_empresa: int, meses: int = MESES_DASHBOARD) -> List[Dict[str, Any]]:
+    """Últimos `meses` periodos de la empresa, del más reciente al más viejo."""
+    if not asegurar_tabla_resumen():
+        # Sin tabla de resumen: agregación directa (igual se resuelve en SQL)
+        agregados = _agrupar_por_mes(db, id_empresa)
+        return [
+            {
+                "periodo": p,
+                "year": int(p[:4]),
+                "month": int(p[5:]),
+                "cantidad": agregados[p]["cantidad"],
+                "total_ingresos": float(agregados[p]["total"]),
+            }
+            for p in sorted(agregados, reverse=True)[:meses]
+        ]
+
+    def _leer():
+        return db.exec(
+            select(IngresoResumenMensual)
+            .where(IngresoResumenMensual.id_empresa == id_empresa)
+            .order_by(desc(IngresoResumenMensual.periodo))
+            .limit(meses)
+        ).all()
+
+    filas = _leer()
+    if not filas:
+        # Empresa sincronizada antes de existir el resumen: se arma una vez
+        if recalcular_resumen_mensual(db, id_empresa):
+            filas = _leer()
+    return [_a_item(f) for f in filas]
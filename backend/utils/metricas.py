@@ -0,0 +1,283 @@
+"""
+Métricas del pipeline de facturación en formato de texto de Prometheus (GET /metrics).
+
+Hasta ahora los tiempos de cada factura solo quedaban en prints/logs y en los JSON de testing/.
+Acá hay un registro en memoria (sin dependencias: histogramas, contadores y medidores con
+etiquetas) que alimentan billige_manage, afipTools, sheets_outbox y el scheduler de syncs:
+
+- facturacion_etapa_segundos{etapa, emisor, resultado}: histograma por etapa
+  (preparacion, credenciales, afip, qr, db, sheets, total) y CUIT emisor.
+- afip_errores_transitorios_total, facturacion_reintentos_total{nivel}, sheets_cuota_excedida_total
+  (429 de Google) y facturacion_db_insert_fallidos_total.
+- facturas_en_vuelo, y al momento del scrape: cola del scheduler de syncs, pool de hilos
+  bloqueantes y pools de conexiones.
+
+Los valores son del proceso: con varios workers cada uno expone los suyos (ver proceso_info{pid}).
+"""
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+RESULTADO_OK = "ok"
+RESULTADO_ERROR = "error"
+
+
+def _escapar(valor: Any) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: Sequence[str], valores: Sequence[Any], extra: Optional[Tuple[str, str]] = None) -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra is not None:
+        pares.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metrica:
+    tipo = "untyped"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], Any] = {}
+
+    def _clave(self, valores: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(valores.get(e, "")) for e in self.etiquetas)
+
+    def _lineas(self) -> List[str]:
+        raise NotImplementedError
+
+    def exponer(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}", *self._lineas()]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, cantidad: float = 1.0, **etiquetas: Any) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0.0) + cantidad
+
+    def _lineas(self) -> List[str]:
+        with self._lock:
+            series = list(self._series.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, k)} {_numero(v)}" for k, v in series]
+
+
+class Medidor(_Metrica):
+    """Gauge. Con `funcion` el valor se calcula al exponer (devuelve un número o {etiquetas: valor})."""
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (), funcion: Optional[Callable[[], Any]] = None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._funcion = funcion
+
+    def inc(self, cantidad: float = 1.0, **etiquetas: Any) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0.0) + cantidad
+
+    def dec(self, cantidad: float = 1.0, **etiquetas: Any) -> None:
+        self.inc(-cantidad, **etiquetas)
+
+    def _lineas(self) -> List[str]:
+        if self._funcion is not None:
+            try:
+                valor = self._funcion()
+            except Exception:
+                return []
+            series = valor.items() if isinstance(valor, dict) else [((), valor)]
+        else:
+            with self._lock:
+                series = list(self._series.items())
+        return [
+            f"{self.nombre}{_etiquetas(self.etiquetas, k if isinstance(k, tuple) else (k,))} {_numero(v)}"
+            for k, v in series if v is not None
+        ]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (), buckets: Sequence[float] = BUCKETS_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observar(self, valor: float, **etiquetas: Any) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = {"cuentas": [0] * len(self.buckets), "suma": 0.0, "n": 0}
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie["cuentas"][i] += 1
+                    break
+            serie["suma"] += valor
+            serie["n"] += 1
+
+    def _lineas(self) -> List[str]:
+        with self._lock:
+            series = [(k, list(s["cuentas"]), s["suma"], s["n"]) for k, s in self._series.items()]
+        lineas = []
+        for clave, cuentas, suma, n in series:
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets, cuentas):
+                acumulado += cuenta
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, ('le', _numero(limite)))} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {n}")
+        return lineas
+
+
+# ------------------------------------------------------------------------------
+# Registro
+# ------------------------------------------------------------------------------
+
+_registro: List[_Metrica] = []
+
+
+def _registrar(metrica: _Metrica) -> Any:
+    _registro.append(metrica)
+    return metrica
+
+
+ETAPA_SEGUNDOS = _registrar(Histograma(
+    "facturacion_etapa_segundos",
+    "Duración de cada etapa del pipeline de facturación por CUIT emisor y resultado.",
+    ("etapa", "emisor", "resultado"),
+))
+AFIP_ERRORES_TRANSITORIOS = _registrar(Contador(
+    "afip_errores_transitorios_total",
+    "Errores transitorios del microservicio/AFIP (conexión, SSL, timeouts) que disparan reintento.",
+    ("emisor",),
+))
+REINTENTOS = _registrar(Contador(
+    "facturacion_reintentos_total",
+    "Reintentos: nivel=afip (tenacity, por llamada), nivel=lote (FASE 2 del lote) o nivel=job (backoff de /facturador/jobs).",
+    ("nivel", "emisor"),
+))
+SHEETS_CUOTA_EXCEDIDA = _registrar(Contador(
+    "sheets_cuota_excedida_total",
+    "Respuestas 429 / cuota agotada de la API de Google Sheets.",
+    ("origen",),
+))
+DB_INSERT_FALLIDOS = _registrar(Contador(
+    "facturacion_db_insert_fallidos_total",
+    "Facturas autorizadas por AFIP que no se pudieron guardar en la base.",
+    ("emisor",),
+))
+FACTURAS_EN_VUELO = _registrar(Medidor(
+    "facturas_en_vuelo",
+    "Facturas en proceso en este worker (de la preparación al commit).",
+))
+
+
+def _cola_sync() -> Dict[Tuple[str, ...], int]:
+    from backend.utils.sheets_sync_scheduler import estado_scheduler
+    estado = estado_scheduler()
+    return {("en_cola",): estado["en_cola"], ("en_curso",): estado["en_curso"]}
+
+
+def _hilos_bloqueantes() -> Dict[Tuple[str, ...], int]:
+    from backend.utils.pool_bloqueante import estadisticas
+    stats = estadisticas()
+    return {("en_curso",): stats["en_curso"], ("en_espera",): stats["en_espera"]}
+
+
+def _conexiones_db() -> Dict[Tuple[str, ...], Any]:
+    from backend.database import pool_metricas
+    return {
+        (pool, estado): info.get(estado)
+        for pool, info in pool_metricas().items()
+        for estado in ("en_uso", "libres", "overflow")
+    }
+
+
+_registrar(Medidor("sheets_sync_cola", "Syncs de Sheets por estado en el scheduler de este worker.", ("estado",), funcion=_cola_sync))
+_registrar(Medidor("hilos_bloqueantes", "Tareas del pool bloqueante (BD/gspread de endpoints async).", ("estado",), funcion=_hilos_bloqueantes))
+_registrar(Medidor("db_pool_conexiones", "Conexiones de los pools de SQLAlchemy.", ("pool", "estado"), funcion=_conexiones_db))
+
+
+# ------------------------------------------------------------------------------
+# Helpers para instrumentar
+# ------------------------------------------------------------------------------
+
+def etiqueta_emisor(cuit: Any) -> str:
+    """CUIT emisor solo con dígitos (acota la cardinalidad: '20-12345678-9' y '20123456789' son uno)."""
+    return re.sub(r"\D", "", str(cuit or ""))[:11] or "desconocido"
+
+
+class _Cronometro:
+    def __init__(self):
+        self.resultado = RESULTADO_OK
+
+
+@contextmanager
+def cronometrar(etapa: str, emisor: Any = None) -> Iterator[_Cronometro]:
+    """Observa la duración del bloque en facturacion_etapa_segundos.
+
+    El resultado es "error" si el bloque lanza; si no, "ok" o lo que se asigne a `.resultado`.
+    """
+    cron = _Cronometro()
+    inicio = time.perf_counter()
+    try:
+        yield cron
+    except BaseException:
+        cron.resultado = RESULTADO_ERROR
+        raise
+    finally:
+        observar(etapa, emisor, time.perf_counter() - inicio, cron.resultado)
+
+
+def observar(etapa: str, emisor: Any, segundos: float, resultado: str = RESULTADO_OK) -> None:
+    ETAPA_SEGUNDOS.observar(segundos, etapa=etapa, emisor=etiqueta_emisor(emisor), resultado=resultado)
+
+
+@contextmanager
+def en_vuelo() -> Iterator[None]:
+    FACTURAS_EN_VUELO.inc()
+    try:
+        yield
+    finally:
+        FACTURAS_EN_VUELO.dec()
+
+
+def resultado_factura(res: Optional[Dict[str, Any]]) -> str:
+    """Resultado de una factura para la etapa `total`."""
+    if not res or res.get("status") != "SUCCESS":
+        if res and res.get("error") == "Ya facturada":
+            return "duplicada"
+        return RESULTADO_ERROR
+    return RESULTADO_OK if res.get("db_save_status") == "SUCCESS" else "db_error"
+
+
+def es_cuota_sheets(error: Any) -> bool:
+    msg = str(error).lower()
+    return "429" in msg or "quota" in msg or "rate limit" in msg or "resource exhausted" in msg
+
+
+def exposicion() -> str:
+    """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+    lineas: List[str] = []
+    for metrica in _registro:
+        lineas.extend(metrica.exponer())
+    lineas.append("# HELP proceso_info Worker que respondió el scrape.")
+    lineas.append("# TYPE proceso_info gauge")
+    lineas.append(f'proceso_info{{pid="{os.getpid()}"}} 1')
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,260 @@
+"""
+Cliente HTTP compartido para el microservicio de facturación (FACTURACION_API_URL).
+
+Antes cada factura / nota de crédito hacía `requests.post(...)` suelto, pagando un handshake
+TCP + TLS nuevo por comprobante. Este módulo mantiene:
+
+- Un `requests.Session` con pool de conexiones keep-alive (uso síncrono: afipTools, anulación).
+- Un `httpx.AsyncClient` opcional (HTTP/2 si está instalado `h2` y FACTURACION_HTTP2=1) para
+  código async que no quiera bloquear el event loop.
+- Métricas del pool (requests vs conexiones abiertas) para medir cuántos handshakes se ahorran.
+
+Las excepciones de los dos clientes son las de `requests` (apost traduce las de httpx), así la
+clasificación de errores transitorios (tenacity, ConnectionError/Timeout/HTTPError) no cambia.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+try:
+    import h2  # noqa: F401  (solo para saber si httpx puede negociar HTTP/2)
+    _H2_DISPONIBLE = True
+except Exception:
+    _H2_DISPONIBLE = False
+
+from backend import config
+
+logger = logging.getLogger(__name__)
+
+
+class MicroservicioFacturacionClient:
+    """Cliente con pool keep-alive hacia el microservicio de facturación."""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        pool_maxsize: Optional[int] = None,
+    ):
+        self.base_url = base_url or config.FACTURACION_API_URL
+        self.connect_timeout = float(connect_timeout if connect_timeout is not None else config.FACTURACION_HTTP_CONNECT_TIMEOUT)
+        self.read_timeout = float(read_timeout if read_timeout is not None else config.FACTURACION_HTTP_READ_TIMEOUT)
+        self.pool_maxsize = int(pool_maxsize if pool_maxsize is not None else config.FACTURACION_HTTP_POOL_MAXSIZE)
+
+        self._session = requests.Session()
+        # Sin reintentos a nivel urllib3: los reintentos los decide tenacity en billige_manage.
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize, max_retries=0, pool_block=False)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._adapter = adapter
+
+        self._async_client = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "requests": 0,
+            "errores": 0,
+            "latencia_total_ms": 0.0,
+            "latencia_max_ms": 0.0,
+            "async_requests": 0,
+        }
+
+    # ------------------------------------------------------------------ sync
+    def _timeout(self, read_timeout: Optional[float] = None, timeout: Any = None):
+        if timeout is not None:
+            # Compatibilidad con llamadas estilo requests (timeout=20 o (connect, read))
+            if isinstance(timeout, (int, float)):
+                return (self.connect_timeout, float(timeout))
+            return timeout
+        return (self.connect_timeout, float(read_timeout if read_timeout is not None else self.read_timeout))
+
+    def _registrar(self, inicio: float, error: bool, es_async: bool = False) -> None:
+        dur_ms = (time.perf_counter() - inicio) * 1000.0
+        with self._lock:
+            self._stats["async_requests" if es_async else "requests"] += 1
+            self._stats["latencia_total_ms"] += dur_ms
+            if dur_ms > self._stats["latencia_max_ms"]:
+                self._stats["latencia_max_ms"] = dur_ms
+            if error:
+                self._stats["errores"] += 1
+
+    def post(
+        self,
+        url: Optional[str] = None,
+        json: Any = None,
+        timeout: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        read_timeout: Optional[float] = None,
+    ) -> requests.Response:
+        """POST al microservicio reutilizando conexiones. Firma compatible con `requests.post`."""
+        inicio = time.perf_counter()
+        error = False
+        try:
+            return self._session.post(
+                url or self.base_url,
+                json=json,
+                timeout=self._timeout(read_timeout, timeout),
+                headers=headers,
+            )
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._registrar(inicio, error)
+
+    # ----------------------------------------------------------------- async
+    def _get_async_client(self):
+        if httpx is None:
+            raise RuntimeError("httpx no está instalado; no hay cliente async disponible.")
+        if self._async_client is None:
+            usar_http2 = bool(config.FACTURACION_HTTP2 and _H2_DISPONIBLE)
+            if config.FACTURACION_HTTP2 and not _H2_DISPONIBLE:
+                logger.warning("FACTURACION_HTTP2=1 pero falta el paquete 'h2'; se usa HTTP/1.1 keep-alive.")
+            self._async_client = httpx.AsyncClient(
+                http2=usar_http2,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_maxsize,
+                    max_keepalive_connections=self.pool_maxsize,
+                ),
+            )
+        return self._async_client
+
+    async def apost(
+        self,
+        url: Optional[str] = None,
+        json: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        read_timeout: Optional[float] = None,
+    ):
+        """Variante async (httpx). Devuelve `httpx.Response`.
+
+        Sin httpx instalado hace el POST síncrono en el pool bloqueante (no en el event loop).
+        """
+        if httpx is None:
+            from backend.utils.pool_bloqueante import en_hilo
+            return await en_hilo(self.post, url, json, None, headers, read_timeout)
+        client = self._get_async_client()
+        inicio = time.perf_counter()
+        error = False
+        try:
+            kwargs: Dict[str, Any] = {"json": json, "headers": headers}
+            if read_timeout is not None:
+                kwargs["timeout"] = httpx.Timeout(float(read_timeout), connect=self.connect_timeout)
+            return await client.post(url or self.base_url, **kwargs)
+        except httpx.TimeoutException as e:
+            error = True
+            raise requests.exceptions.Timeout(f"{type(e).__name__}: {e}") from e
+        except httpx.TransportError as e:
+            error = True
+            raise requests.exceptions.ConnectionError(f"{type(e).__name__}: {e}") from e
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._registrar(inicio, error, es_async=True)
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            try:
+                await self._async_client.aclose()
+            finally:
+                self._async_client = None
+
+    def close(self) -> None:
+        try:
+            self._session.close()
+        except Exception:
+            pass
+
+    # --------------------------------------------------------------- métricas
+    def metricas(self) -> Dict[str, Any]:
+        """Snapshot de uso del pool síncrono.
+
+        `conexiones_abiertas` cuenta conexiones nuevas (cada una = un handshake TCP/TLS);
+        `handshakes_ahorrados` = requests servidos por una conexión reutilizada.
+        """
+        pools = []
+        total_conn = 0
+        total_req = 0
+        try:
+            for key in list(self._adapter.poolmanager.pools.keys()):
+                pool = self._adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                n_conn = int(getattr(pool, "num_connections", 0) or 0)
+                n_req = int(getattr(pool, "num_requests", 0) or 0)
+                total_conn += n_conn
+                total_req += n_req
+                pools.append({
+                    "host": f"{getattr(pool, 'scheme', '')}://{getattr(pool, 'host', '')}:{getattr(pool, 'port', '')}",
+                    "conexiones_abiertas": n_conn,
+                    "requests": n_req,
+                    "conexiones_libres": pool.pool.qsize() if getattr(pool, "pool", None) is not None else None,
+                })
+        except Exception as e:
+            logger.debug(f"No se pudieron leer métricas del pool: {e}")
+
+        with self._lock:
+            stats = dict(self._stats)
+        total_llamadas = stats["requests"] + stats["async_requests"]
+        stats["latencia_media_ms"] = round(stats["latencia_total_ms"] / total_llamadas, 2) if total_llamadas else None
+        stats["latencia_total_ms"] = round(stats["latencia_total_ms"], 2)
+        stats["latencia_max_ms"] = round(stats["latencia_max_ms"], 2)
+        return {
+            "base_url": self.base_url,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "pool_maxsize": self.pool_maxsize,
+            "http2_async": bool(config.FACTURACION_HTTP2 and _H2_DISPONIBLE),
+            "async_activo": self._async_client is not None,
+            "conexiones_abiertas": total_conn,
+            "requests_pool": total_req,
+            "handshakes_ahorrados": max(0, total_req - total_conn),
+            "pools": pools,
+            **stats,
+        }
+
+
+_client: Optional[MicroservicioFacturacionClient] = None
+_client_lock = threading.Lock()
+
+
+def _descartar_cliente_heredado() -> None:
+    # Tras un fork el hijo arma su propio pool: los sockets keep-alive del padre no se comparten
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_descartar_cliente_heredado)
+
+
+def get_microservicio_client() -> MicroservicioFacturacionClient:
+    """Devuelve el cliente compartido del proceso (se crea en el primer uso)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MicroservicioFacturacionClient()
+    return _client
+
+
+async def cerrar_microservicio_client() -> None:
+    """Cierra el cliente compartido (llamar en el shutdown de la app)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client.close()
+        _client = None
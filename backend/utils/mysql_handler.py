@@ -1,21 +1,93 @@
-import mysql.connector
-from mysql.connector import Error
-from backend import config  # ¡Importa el módulo entero!
+"""
+Conexiones DB-API crudas (cursor con %s) tomadas del pool de SQLAlchemy.
 
+Antes get_db_connection abría una conexión mysql.connector nueva por llamada y ventas_detalle hacía
+pymysql.connect por request: un handshake TCP+auth cada vez y sin tope de conexiones. Ahora las
+dos salen de los pools de backend.database (mismas métricas y límites que las sesiones SQLModel):
+`close()` devuelve la conexión al pool en vez de cerrarla.
+"""
+import logging
+import os
+import threading
 
-def get_db_connection():
-    """Crea y devuelve una conexión a la base de datos usando la configuración central."""
+import pymysql
+from sqlalchemy.engine import URL
+
+from backend import database
+
+logger = logging.getLogger(__name__)
+
+
+class ConexionPool:
+    """Envoltorio con la interfaz que usaban los llamadores de mysql.connector."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, dictionary: bool = False):
+        return self._raw.cursor(pymysql.cursors.DictCursor if dictionary else None)
+
+    def is_connected(self) -> bool:
+        return self._raw is not None
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is not None:
+            self._raw.close()  # vuelve al pool (hace rollback de lo no commiteado)
+            self._raw = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _conexion(eng):
     try:
-        # Ahora los datos de conexión se leen desde config.py
-        conn = mysql.connector.connect(
-            host=config.DB_HOST,
-            user=config.DB_USER,
-            password=config.DB_PASSWORD,
-            database=config.DB_NAME
-        )
-        if conn.is_connected():
-            return conn
-    except Error as e:
-        print(f"Error CRÍTICO al conectar a MySQL: {e}")
-        # En una aplicación real, aquí podrías registrar el error en un log.
-        return None
\ No newline at end of file
+        return ConexionPool(eng.raw_connection())
+    except Exception as e:
+        logger.error(f"Error CRÍTICO al obtener conexión MySQL del pool: {e}")
+        return None
+
+
+def get_db_connection(lectura: bool = False):
+    """Conexión del pool principal (o de la réplica con `lectura=True`). None si la BD no responde."""
+    return _conexion(database.engine_lectura if lectura else database.engine)
+
+
+# Base de ventas del sistema de gestión (otra base, mismo servidor por defecto)
+_engine_ventas = None
+_engine_ventas_lock = threading.Lock()
+
+
+def _get_engine_ventas():
+    global _engine_ventas
+    if _engine_ventas is None:
+        with _engine_ventas_lock:
+            if _engine_ventas is None:
+                url = URL.create(
+                    "mysql+pymysql",
+                    username=os.getenv("VENTAS_DB_USER", "gestion_user"),
+                    password=os.getenv("VENTAS_DB_PASSWORD", "SistemaIMA123."),
+                    host=os.getenv("VENTAS_DB_HOST", "localhost"),
+                    port=int(os.getenv("VENTAS_DB_PORT", "3306")),
+                    database=os.getenv("VENTAS_DB_NAME", "gestion_ima_db"),
+                    query={"charset": "utf8mb4"},
+                )
+                _engine_ventas = database.crear_engine(
+                    "ventas", url,
+                    pool_size=int(os.getenv("VENTAS_DB_POOL_SIZE", "5")),
+                    max_overflow=int(os.getenv("VENTAS_DB_MAX_OVERFLOW", "10")),
+                )
+    return _engine_ventas
+
+
+def get_ventas_connection():
+    """Conexión pooleada a la base de ventas (gestion_ima_db). None si no responde."""
+    return _conexion(_get_engine_ventas())
@@ -0,0 +1,82 @@
+"""
+Pool acotado de hilos para el trabajo bloqueante de los endpoints async (SQLAlchemy, gspread).
+
+Los handlers `async def` de facturación, anulación y sync de Sheets hacían consultas a la BD
+directamente en el event loop: mientras MySQL (o AFIP, detrás) tardaba, uvicorn no atendía
+ningún otro request. Ahora ese trabajo va a `en_hilo(fn, ...)`, que lo corre en un
+ThreadPoolExecutor propio de POOL_BLOQUEANTE_HILOS hilos. Es un pool separado del threadpool de
+Starlette a propósito: un lote grande de facturas no consume los hilos con los que se sirven los
+endpoints `def` del dashboard.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+POOL_BLOQUEANTE_HILOS = max(1, int(os.getenv("POOL_BLOQUEANTE_HILOS", "16")))
+
+T = TypeVar("T")
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"en_curso": 0, "en_espera": 0, "completadas": 0, "errores": 0}
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=POOL_BLOQUEANTE_HILOS, thread_name_prefix="bloqueante")
+    return _pool
+
+
+def _sumar(**deltas: int) -> None:
+    with _stats_lock:
+        for k, v in deltas.items():
+            _stats[k] += v
+
+
+def _ejecutar(ctx: contextvars.Context, fn: Callable[..., T], args, kwargs) -> T:
+    _sumar(en_espera=-1, en_curso=1)
+    error = False
+    try:
+        return ctx.run(fn, *args, **kwargs)
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _sumar(en_curso=-1, completadas=1, errores=int(error))
+
+
+async def en_hilo(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Corre `fn(*args, **kwargs)` en el pool bloqueante y espera el resultado sin bloquear el loop.
+
+    Propaga los contextvars del request (igual que run_in_threadpool) y las excepciones de `fn`.
+    """
+    loop = asyncio.get_running_loop()
+    _sumar(en_espera=1)
+    llamada = functools.partial(_ejecutar, contextvars.copy_context(), fn, args, kwargs)
+    return await loop.run_in_executor(_get_pool(), llamada)
+
+
+def estadisticas() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    return {"max_hilos": POOL_BLOQUEANTE_HILOS, "activo": _pool is not None, **stats}
+
+
+def detener_pool_bloqueante() -> None:
+    """Cierra el pool (shutdown de la app); las tareas en curso terminan."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,118 @@
+"""
+QR de AFIP: armado de la URL y render de la imagen a pedido.
+
+Antes la facturación generaba el PNG del QR en línea (camino crítico de AFIP) y lo guardaba como
+data URL dentro de `raw_response`, varios KB por fila de facturas_electronicas. Ahora:
+
+- Al facturar solo se arma la URL (`url_qr_afip`), que va a la columna `qr_url_afip`.
+- La imagen (PNG/SVG) se genera cuando alguien la pide (GET /comprobantes/{id}/qr, tickets, PDF)
+  detrás de un LRU en memoria: la URL de una factura con CAE no cambia nunca.
+"""
+import base64
+import json
+import logging
+import os
+from datetime import date, datetime
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from .json_utils import default_json
+
+try:
+    import qrcode  # type: ignore
+    import qrcode.image.svg  # type: ignore
+except Exception:  # pragma: no cover
+    qrcode = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "1024"))
+QR_AFIP_BASE = "https://www.afip.gob.ar/fe/qr/?p="
+
+
+def disponible() -> bool:
+    return qrcode is not None
+
+
+def url_qr_afip(afip_data: Dict[str, Any]) -> Optional[str]:
+    """URL del QR según la especificación de AFIP (JSON en base64). None si faltan datos."""
+    try:
+        fecha_val = afip_data.get("fecha_comprobante")
+        if isinstance(fecha_val, str):
+            fecha_str = fecha_val.split("T")[0]
+        elif isinstance(fecha_val, (datetime, date)):
+            fecha_str = fecha_val.strftime("%Y-%m-%d")
+        else:
+            fecha_str = datetime.now().strftime("%Y-%m-%d")
+
+        datos_para_qr = {
+            "ver": 1,
+            "fecha": fecha_str,
+            "cuit": int(afip_data["cuit_emisor"]),
+            "ptoVta": int(afip_data["punto_venta"]),
+            "tipoCmp": int(afip_data["tipo_comprobante"]),
+            "nroCmp": int(afip_data["numero_comprobante"]),
+            "importe": float(afip_data["importe_total"]),
+            "moneda": "PES",
+            "ctz": 1,
+            "tipoDocRec": int(afip_data["tipo_doc_receptor"]),
+            "nroDocRec": int(afip_data["nro_doc_receptor"]),
+            "tipoCodAut": "E",
+            "codAut": int(afip_data["cae"])
+        }
+        json_string = json.dumps(datos_para_qr, default=default_json)
+        return QR_AFIP_BASE + base64.b64encode(json_string.encode("utf-8")).decode("utf-8")
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Error armando URL de QR: faltan datos del comprobante. Error: {e}")
+        return None
+
+
+def _qr(contenido: str, border: int):
+    qr = qrcode.QRCode(border=border, error_correction=qrcode.constants.ERROR_CORRECT_L)
+    qr.add_data(contenido)
+    qr.make(fit=True)
+    return qr
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_png(contenido: str, box_size: int = 10, border: int = 4) -> bytes:
+    """PNG del QR (cacheado). Lanza RuntimeError si qrcode no está instalado."""
+    if qrcode is None:
+        raise RuntimeError("qrcode no está instalado")
+    qr = _qr(contenido, border)
+    qr.box_size = box_size
+    buffer = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_svg(contenido: str, border: int = 4) -> bytes:
+    """SVG del QR (cacheado, vectorial: no depende del tamaño)."""
+    if qrcode is None:
+        raise RuntimeError("qrcode no está instalado")
+    buffer = BytesIO()
+    _qr(contenido, border).make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    return buffer.getvalue()
+
+
+def qr_data_url(contenido: str) -> Optional[str]:
+    """PNG como data URL para incrustar en HTML (None sin qrcode)."""
+    if qrcode is None or not contenido:
+        return None
+    try:
+        return "data:image/png;base64," + base64.b64encode(qr_png(contenido, 4, 1)).decode("ascii")
+    except Exception as e:
+        logger.warning(f"No se pudo generar el QR: {e}")
+        return None
+
+
+def estadisticas() -> Dict[str, Any]:
+    png, svg = qr_png.cache_info(), qr_svg.cache_info()
+    return {
+        "disponible": disponible(),
+        "max_entradas": QR_CACHE_SIZE,
+        "png": png._asdict(),
+        "svg": svg._asdict(),
+    }
@@ -0,0 +1,174 @@
+"""
+Caché en disco de comprobantes ya renderizados (imagen del ticket / PDF).
+
+Reimprimir el mismo comprobante en el mostrador es muy común y una factura con CAE no cambia,
+pero cada pedido volvía a armar el HTML y pasar por WeasyPrint + Pillow o redibujar el canvas de
+ReportLab. Acá se guarda el resultado bajo una clave derivada de
+(id de factura, CAE, formato, versión de plantilla): la reimpresión pasa a ser una lectura de archivo.
+
+- Archivos `<factura_id>_<sha1 de la clave>.<formato>` en RENDER_CACHE_DIR (compartido entre workers).
+- Tope de tamaño (RENDER_CACHE_MAX_MB) con desalojo LRU: cada hit renueva el mtime y al pasar el
+  tope se borran los más viejos.
+- `invalidar_factura` borra todas las variantes de una factura (se llama al anularla).
+- Cambiar la versión de plantilla del renderer invalida todo lo anterior sin borrar nada a mano.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_HABILITADA = os.getenv("RENDER_CACHE", "1").strip().lower() not in ("0", "false", "no")
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "facturacion_render_cache")
+RENDER_CACHE_MAX_BYTES = int(float(os.getenv("RENDER_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+_lock = threading.Lock()
+_bytes_en_disco: Optional[int] = None
+_metricas = {"hits": 0, "misses": 0, "guardados": 0, "desalojados": 0, "invalidados": 0}
+
+
+def _nombre(factura_id: Any, cae: Any, formato: str, version: str) -> Optional[str]:
+    fid = "" if factura_id is None else str(factura_id).strip()
+    cae_s = str(cae or "").strip()
+    # Sin id o sin CAE el comprobante todavía puede cambiar: no se cachea
+    if not fid or not cae_s or not fid.replace("-", "").isalnum():
+        return None
+    formato = formato.lower().lstrip(".")
+    clave = hashlib.sha1(f"{fid}|{cae_s}|{formato}|{version}".encode("utf-8")).hexdigest()
+    return f"{fid}_{clave}.{formato}"
+
+
+def _escanear() -> int:
+    total = 0
+    try:
+        with os.scandir(RENDER_CACHE_DIR) as it:
+            for e in it:
+                if e.is_file() and not e.name.endswith(".tmp"):
+                    total += e.stat().st_size
+    except FileNotFoundError:
+        pass
+    return total
+
+
+def obtener(factura_id: Any, cae: Any, formato: str, version: str) -> Optional[bytes]:
+    """Bytes cacheados del render, o None si no está (o la caché está deshabilitada)."""
+    if not RENDER_CACHE_HABILITADA:
+        return None
+    nombre = _nombre(factura_id, cae, formato, version)
+    if nombre is None:
+        return None
+    ruta = os.path.join(RENDER_CACHE_DIR, nombre)
+    try:
+        with open(ruta, "rb") as f:
+            datos = f.read()
+        os.utime(ruta, None)  # LRU: el mtime marca el último uso
+    except FileNotFoundError:
+        with _lock:
+            _metricas["misses"] += 1
+        return None
+    except OSError as e:
+        logger.warning(f"[RENDER_CACHE] No se pudo leer {nombre}: {e}")
+        return None
+    with _lock:
+        _metricas["hits"] += 1
+    return datos
+
+
+def guardar(factura_id: Any, cae: Any, formato: str, version: str, datos: bytes) -> bool:
+    """Guarda el render (escritura atómica) y desaloja los más viejos si se pasa del tope."""
+    global _bytes_en_disco
+    if not RENDER_CACHE_HABILITADA or not datos or len(datos) > RENDER_CACHE_MAX_BYTES:
+        return False
+    nombre = _nombre(factura_id, cae, formato, version)
+    if nombre is None:
+        return False
+    ruta = os.path.join(RENDER_CACHE_DIR, nombre)
+    try:
+        os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+    except OSError as e:
+        logger.warning(f"[RENDER_CACHE] No se pudo guardar {nombre}: {e}")
+        return False
+    with _lock:
+        _metricas["guardados"] += 1
+        if _bytes_en_disco is None:
+            _bytes_en_disco = _escanear()
+        else:
+            _bytes_en_disco += len(datos)
+        excedido = _bytes_en_disco > RENDER_CACHE_MAX_BYTES
+    if excedido:
+        _desalojar()
+    return True
+
+
+def _desalojar() -> None:
+    """Borra por mtime ascendente hasta quedar en el 90% del tope (otros workers escriben en el mismo dir)."""
+    global _bytes_en_disco
+    with _lock:
+        archivos = []
+        try:
+            with os.scandir(RENDER_CACHE_DIR) as it:
+                for e in it:
+                    if e.is_file() and not e.name.endswith(".tmp"):
+                        st = e.stat()
+                        archivos.append((st.st_mtime, st.st_size, e.path))
+        except FileNotFoundError:
+            _bytes_en_disco = 0
+            return
+        total = sum(a[1] for a in archivos)
+        objetivo = int(RENDER_CACHE_MAX_BYTES * 0.9)
+        for _, tam, ruta in sorted(archivos):
+            if total <= objetivo:
+                break
+            try:
+                os.remove(ruta)
+                total -= tam
+                _metricas["desalojados"] += 1
+            except OSError:
+                pass
+        _bytes_en_disco = total
+
+
+def invalidar_factura(factura_id: Any) -> int:
+    """Borra todos los renders de la factura (todas las versiones y formatos). Devuelve cuántos borró."""
+    global _bytes_en_disco
+    fid = "" if factura_id is None else str(factura_id).strip()
+    if not fid:
+        return 0
+    prefijo = f"{fid}_"
+    borrados = 0
+    try:
+        with os.scandir(RENDER_CACHE_DIR) as it:
+            for e in it:
+                if e.name.startswith(prefijo) and e.is_file():
+                    tam = e.stat().st_size
+                    try:
+                        os.remove(e.path)
+                    except OSError:
+                        continue
+                    borrados += 1
+                    with _lock:
+                        if _bytes_en_disco is not None:
+                            _bytes_en_disco = max(0, _bytes_en_disco - tam)
+    except FileNotFoundError:
+        return 0
+    with _lock:
+        _metricas["invalidados"] += borrados
+    return borrados
+
+
+def estadisticas() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "habilitada": RENDER_CACHE_HABILITADA,
+            "directorio": RENDER_CACHE_DIR,
+            "max_bytes": RENDER_CACHE_MAX_BYTES,
+            "bytes_en_disco": _bytes_en_disco,
+            **_metricas,
+        }
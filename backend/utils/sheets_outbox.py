@@ -0,0 +1,339 @@
+"""
+Outbox durable para las marcas "Facturado" / "Anulada" en Google Sheets.
+
+Flujo:
+1. La facturación / anulación llama a `actualizar_espejo_ingreso` + `encolar_marca_sheets` con la
+   MISMA sesión que guarda la factura: el espejo IngresoSheets queda actualizado al instante y la
+   marca pendiente sobrevive a reinicios o a cuotas (429) de Google.
+2. Un worker en segundo plano (`iniciar_worker_outbox`, arrancado en main.py) toma las filas
+   pendientes, las agrupa por hoja y las envía con un único batch_update por hoja
+   (TablasHandler.iniciar_lote_escrituras / confirmar_lote_escrituras).
+3. Si falla, la fila vuelve a PENDIENTE con backoff exponencial; tras SHEETS_OUTBOX_MAX_INTENTOS
+   queda en ERROR para revisión manual.
+
+El "reclamo" de filas es un UPDATE condicional por id, así que varios procesos (uvicorn/gunicorn con
+varios workers) pueden drenar la misma tabla sin enviar dos veces la misma marca.
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text as sa_text
+from sqlmodel import select
+
+from backend.database import SessionLocal, engine
+from backend.modelos import IngresoSheets, SheetsOutbox
+from backend.utils import metricas, tenant_context
+from backend.utils.ingresos_espejo import estado_normalizado
+
+logger = logging.getLogger(__name__)
+
+ACCION_FACTURADO = "FACTURADO"
+ACCION_ANULADO = "ANULADO"
+
+ESTADO_PENDIENTE = "PENDIENTE"
+ESTADO_PROCESANDO = "PROCESANDO"
+ESTADO_ENVIADO = "ENVIADO"
+ESTADO_ERROR = "ERROR"
+
+# Texto que se escribe en IngresoSheets.facturacion para cada acción
+_ESTADO_ESPEJO = {ACCION_FACTURADO: "Facturado", ACCION_ANULADO: "Anulada"}
+
+OUTBOX_INTERVALO_SEC = float(os.getenv("SHEETS_OUTBOX_INTERVALO_SEC", "5"))
+OUTBOX_LOTE_MAX = int(os.getenv("SHEETS_OUTBOX_LOTE_MAX", "200"))
+OUTBOX_MAX_INTENTOS = int(os.getenv("SHEETS_OUTBOX_MAX_INTENTOS", "12"))
+OUTBOX_BACKOFF_BASE_SEC = float(os.getenv("SHEETS_OUTBOX_BACKOFF_BASE_SEC", "10"))
+OUTBOX_BACKOFF_MAX_SEC = float(os.getenv("SHEETS_OUTBOX_BACKOFF_MAX_SEC", "1800"))
+# Si un proceso muere con filas en PROCESANDO, otro las retoma pasado este tiempo
+OUTBOX_LEASE_SEC = float(os.getenv("SHEETS_OUTBOX_LEASE_SEC", "120"))
+# Pausa corta tras un aviso para juntar las marcas de un lote en un solo batch_update
+OUTBOX_DEBOUNCE_SEC = float(os.getenv("SHEETS_OUTBOX_DEBOUNCE_SEC", "1.0"))
+
+
+def _utcnow() -> datetime:
+    # MySQL DATETIME sin zona: guardamos UTC naive
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def asegurar_tabla_outbox() -> bool:
+    """Crea la tabla sheets_outbox si no existe (la migración formal está en scripts/migrate_add_sheets_outbox.py)."""
+    try:
+        SheetsOutbox.__table__.create(bind=engine, checkfirst=True)
+        return True
+    except Exception as e:
+        logger.warning(f"[OUTBOX] No se pudo asegurar la tabla sheets_outbox: {e}")
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Escritura (dentro de la transacción del llamador)
+# ---------------------------------------------------------------------------
+
+def actualizar_espejo_ingreso(db, id_ingreso: str, accion: str, id_empresa: Optional[int] = None) -> bool:
+    """Actualiza IngresoSheets (columna y data_json) en la sesión dada, sin commit."""
+    estado = _ESTADO_ESPEJO.get(accion, accion)
+    stmt = select(IngresoSheets).where(IngresoSheets.id_ingreso == str(id_ingreso))
+    if id_empresa is not None:
+        stmt = stmt.where(IngresoSheets.id_empresa == id_empresa)
+    ingreso_obj = db.exec(stmt).first()
+    if not ingreso_obj:
+        return False
+    ingreso_obj.facturacion = estado
+    ingreso_obj.estado = estado_normalizado(estado)
+    # Actualizar el JSON interno también
+    try:
+        data = json.loads(ingreso_obj.data_json)
+        # Actualizar tanto 'facturacion' como 'Facturacion' por si acaso
+        if 'facturacion' in data:
+            data['facturacion'] = estado
+        if 'Facturacion' in data:
+            data['Facturacion'] = estado
+        ingreso_obj.data_json = json.dumps(data, ensure_ascii=False)
+    except Exception:
+        pass
+    db.add(ingreso_obj)
+    return True
+
+
+def encolar_marca_sheets(
+    db,
+    id_ingreso: str,
+    accion: str,
+    google_sheet_id: Optional[str],
+    id_empresa: Optional[int] = None,
+    factura_id: Optional[int] = None,
+) -> Optional[SheetsOutbox]:
+    """Agrega la marca pendiente a la sesión dada (sin commit). Devuelve la fila o None si no hay hoja."""
+    if not google_sheet_id or not id_ingreso:
+        return None
+    row = SheetsOutbox(
+        id_empresa=id_empresa,
+        google_sheet_id=str(google_sheet_id),
+        id_ingreso=str(id_ingreso).strip(),
+        accion=accion,
+        factura_id=factura_id,
+    )
+    db.add(row)
+    return row
+
+
+# ---------------------------------------------------------------------------
+# Drenado
+# ---------------------------------------------------------------------------
+
+def _backoff(intentos: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_BACKOFF_BASE_SEC * (2 ** max(0, intentos - 1)), OUTBOX_BACKOFF_MAX_SEC))
+
+
+def _reclamar_pendientes(db, max_items: int) -> List[Dict[str, Any]]:
+    ahora = _utcnow()
+    candidatos = db.exec(
+        select(SheetsOutbox)
+        .where(
+            SheetsOutbox.estado.in_((ESTADO_PENDIENTE, ESTADO_PROCESANDO)),
+            SheetsOutbox.proximo_intento_at <= ahora,
+        )
+        .order_by(SheetsOutbox.id)
+        .limit(max_items)
+    ).all()
+    datos = [
+        {"id": r.id, "google_sheet_id": r.google_sheet_id, "id_ingreso": r.id_ingreso,
+         "accion": r.accion, "intentos": r.intentos or 0, "id_empresa": r.id_empresa}
+        for r in candidatos
+    ]
+    if not datos:
+        return []
+    lease = ahora + timedelta(seconds=OUTBOX_LEASE_SEC)
+    reclamados = []
+    for d in datos:
+        res = db.execute(
+            sa_text(
+                "UPDATE sheets_outbox SET estado = :procesando, proximo_intento_at = :lease, updated_at = :ahora "
+                "WHERE id = :id AND estado IN (:pendiente, :procesando) AND proximo_intento_at <= :ahora"
+            ),
+            {"procesando": ESTADO_PROCESANDO, "pendiente": ESTADO_PENDIENTE, "lease": lease, "ahora": ahora, "id": d["id"]},
+        )
+        if res.rowcount == 1:
+            reclamados.append(d)
+    db.commit()
+    return reclamados
+
+
+def _enviar_grupo(google_sheet_id: str, filas: List[Dict[str, Any]]) -> Dict[int, Optional[str]]:
+    """Envía las marcas de una hoja. Devuelve {outbox_id: None si OK | mensaje de error}."""
+    from backend.utils.tablasHandler import TablasHandler
+
+    resultado: Dict[int, Optional[str]] = {}
+    # Coalescer: por id_ingreso vale la última acción encolada (filas vienen ordenadas por id)
+    ultima_accion: Dict[str, str] = {}
+    for f in filas:
+        ultima_accion[f["id_ingreso"]] = f["accion"]
+
+    try:
+        handler = TablasHandler(google_sheet_id=google_sheet_id)
+        if not handler.client:
+            raise RuntimeError("Cliente de Google Sheets no disponible")
+        handler.iniciar_lote_escrituras()
+        marcados: Dict[str, Optional[str]] = {}
+        for id_ingreso, accion in ultima_accion.items():
+            if accion == ACCION_ANULADO:
+                ok = handler.marcar_boleta_anulada(id_ingreso)
+            else:
+                ok = handler.marcar_boleta_facturada(id_ingreso)
+            marcados[id_ingreso] = None if ok else "Boleta no encontrada o no se pudo marcar en INGRESOS"
+        confirmados = handler.confirmar_lote_escrituras()
+        for id_ingreso, err in list(marcados.items()):
+            if err is None and not confirmados.get(id_ingreso, False):
+                marcados[id_ingreso] = "Falló el batch_update de INGRESOS"
+    except Exception as e:
+        msg = f"{type(e).__name__}: {e}"
+        if metricas.es_cuota_sheets(e):
+            metricas.SHEETS_CUOTA_EXCEDIDA.inc(origen="outbox")
+        logger.warning(f"[OUTBOX] Hoja …{google_sheet_id[:8]}: error enviando {len(filas)} marcas: {msg[:240]}")
+        return {f["id"]: msg for f in filas}
+
+    for f in filas:
+        resultado[f["id"]] = marcados.get(f["id_ingreso"])
+    return resultado
+
+
+def drenar_outbox(max_items: Optional[int] = None) -> Dict[str, int]:
+    """Procesa una tanda de marcas pendientes. Devuelve contadores (enviados / reintentar / error)."""
+    stats = {"reclamados": 0, "enviados": 0, "reintentar": 0, "error": 0}
+    db = SessionLocal()
+    try:
+        filas = _reclamar_pendientes(db, max_items or OUTBOX_LOTE_MAX)
+        stats["reclamados"] = len(filas)
+        if not filas:
+            return stats
+
+        por_hoja: Dict[str, List[Dict[str, Any]]] = {}
+        for f in filas:
+            por_hoja.setdefault(f["google_sheet_id"], []).append(f)
+
+        for sheet_id, grupo in por_hoja.items():
+            ctx = tenant_context.obtener_contexto(grupo[0]["id_empresa"], db)
+            with metricas.cronometrar("sheets", ctx.cuit if ctx else None) as cron:
+                resultado = _enviar_grupo(sheet_id, grupo)
+                if any(err is not None for err in resultado.values()):
+                    cron.resultado = metricas.RESULTADO_ERROR
+            ahora = _utcnow()
+            for f in grupo:
+                row = db.get(SheetsOutbox, f["id"])
+                if row is None:
+                    continue
+                err = resultado.get(f["id"])
+                row.updated_at = ahora
+                if err is None:
+                    row.estado = ESTADO_ENVIADO
+                    row.ultimo_error = None
+                    stats["enviados"] += 1
+                else:
+                    row.intentos = (row.intentos or 0) + 1
+                    row.ultimo_error = err[:2000]
+                    if row.intentos >= OUTBOX_MAX_INTENTOS:
+                        row.estado = ESTADO_ERROR
+                        stats["error"] += 1
+                        logger.error(f"[OUTBOX] {row.accion} {row.id_ingreso} descartado tras {row.intentos} intentos: {err[:240]}")
+                    else:
+                        row.estado = ESTADO_PENDIENTE
+                        row.proximo_intento_at = ahora + _backoff(row.intentos)
+                        stats["reintentar"] += 1
+                db.add(row)
+            db.commit()
+        logger.info(f"[OUTBOX] Tanda procesada: {stats}")
+        return stats
+    except Exception as e:
+        try:
+            db.rollback()
+        except Exception:
+            pass
+        logger.error(f"[OUTBOX] Error drenando outbox: {e}", exc_info=True)
+        return stats
+    finally:
+        db.close()
+
+
+def resumen_outbox(id_empresa: Optional[int] = None) -> Dict[str, Any]:
+    """Cantidad de marcas por estado y la más antigua pendiente (para monitoreo)."""
+    db = SessionLocal()
+    try:
+        filtro = "WHERE id_empresa = :emp" if id_empresa is not None else ""
+        params = {"emp": id_empresa} if id_empresa is not None else {}
+        rows = db.execute(sa_text(f"SELECT estado, COUNT(*) FROM sheets_outbox {filtro} GROUP BY estado"), params).all()
+        pendiente_mas_vieja = db.execute(
+            sa_text(
+                "SELECT MIN(created_at) FROM sheets_outbox WHERE estado IN ('PENDIENTE','PROCESANDO')"
+                + (" AND id_empresa = :emp" if id_empresa is not None else "")
+            ),
+            params,
+        ).scalar()
+        return {
+            "por_estado": {str(r[0]): int(r[1]) for r in rows},
+            "pendiente_mas_antigua": (
+                pendiente_mas_vieja.isoformat() if isinstance(pendiente_mas_vieja, datetime) else pendiente_mas_vieja
+            ),
+            "worker_activo": bool(_worker_thread and _worker_thread.is_alive()),
+        }
+    finally:
+        db.close()
+
+
+# ---------------------------------------------------------------------------
+# Worker en segundo plano
+# ---------------------------------------------------------------------------
+
+_worker_thread: Optional[threading.Thread] = None
+_worker_stop = threading.Event()
+_worker_despertar = threading.Event()
+
+
+def notificar_outbox() -> None:
+    """Despierta al worker (p.ej. al terminar un lote) para no esperar al próximo intervalo."""
+    _worker_despertar.set()
+
+
+def _loop_worker(intervalo: float) -> None:
+    logger.info(f"[OUTBOX] Worker iniciado (intervalo={intervalo}s)")
+    while not _worker_stop.is_set():
+        despertado = _worker_despertar.wait(intervalo)
+        if _worker_stop.is_set():
+            break
+        if despertado:
+            # Juntar las marcas que siguen llegando del mismo lote
+            _worker_stop.wait(OUTBOX_DEBOUNCE_SEC)
+            _worker_despertar.clear()
+        try:
+            # Drenar mientras haya trabajo completo por tanda
+            while not _worker_stop.is_set():
+                stats = drenar_outbox()
+                if stats["reclamados"] < OUTBOX_LOTE_MAX:
+                    break
+        except Exception as e:
+            logger.error(f"[OUTBOX] Error en worker: {e}")
+    logger.info("[OUTBOX] Worker detenido")
+
+
+def iniciar_worker_outbox(intervalo: Optional[float] = None) -> bool:
+    """Arranca (una vez por proceso) el hilo que drena la outbox."""
+    global _worker_thread
+    if _worker_thread and _worker_thread.is_alive():
+        return False
+    if not asegurar_tabla_outbox():
+        return False
+    _worker_stop.clear()
+    _worker_thread = threading.Thread(
+        target=_loop_worker, args=(intervalo or OUTBOX_INTERVALO_SEC,), name="sheets-outbox", daemon=True
+    )
+    _worker_thread.start()
+    return True
+
+
+def detener_worker_outbox(timeout: float = 10.0) -> None:
+    _worker_stop.set()
+    _worker_despertar.set()
+    if _worker_thread:
+        _worker_thread.join(timeout)
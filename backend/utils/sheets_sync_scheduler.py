@@ -0,0 +1,255 @@
+"""
+Planificador de sincronizaciones Google Sheets -> ingresos_sheets por empresa.
+
+Reemplaza al flag global `_sync_in_progress` de sheets_boletas (un sync de la empresa 1 hacía
+saltear en silencio el de la empresa 7, no era thread-safe ni servía con varios workers):
+
+- Pool acotado de hilos (SHEETS_SYNC_MAX_WORKERS): varias empresas sincronizan a la vez.
+- Un solo sync por empresa: pedidos repetidos mientras hay uno en cola / en curso se unen a ese.
+- Lock por empresa entre procesos: GET_LOCK de MySQL (en otros motores, solo lock del proceso).
+- Cooldown por empresa (SHEETS_SYNC_COOLDOWN_SEC) para los syncs automáticos, compartido entre
+  workers con un lease de utils/coordinacion (si no, cada worker sincronizaba por su cuenta).
+- Métricas por empresa (cola, duración, filas procesadas) para GET /sheets/sync/estado.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text as sa_text
+
+from backend.database import engine
+from backend.utils import coordinacion, metricas
+
+logger = logging.getLogger(__name__)
+
+SYNC_MAX_WORKERS = int(os.getenv("SHEETS_SYNC_MAX_WORKERS", "3"))
+SYNC_COOLDOWN_SEC = float(os.getenv("SHEETS_SYNC_COOLDOWN_SEC", "300"))
+
+ESTADO_PROGRAMADO = "PROGRAMADO"
+ESTADO_YA_PROGRAMADO = "YA_PROGRAMADO"
+ESTADO_COOLDOWN = "COOLDOWN"
+
+_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_empresas: Dict[int, Dict[str, Any]] = {}
+_locks_empresa: Dict[int, threading.Lock] = {}
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=max(1, SYNC_MAX_WORKERS), thread_name_prefix="sheets-sync")
+    return _pool
+
+
+def _estado_empresa(id_empresa: int) -> Dict[str, Any]:
+    st = _empresas.get(id_empresa)
+    if st is None:
+        st = {
+            "future": None,
+            "full_sync": False,
+            "en_cola": False,
+            "en_curso": False,
+            "programado_en": None,
+            "ultimo_inicio": None,
+            "ultimo_fin": None,
+            "ultima_duracion_ms": None,
+            "ultimo_resultado": None,
+            "ultimo_error": None,
+            "total_syncs": 0,
+            "total_omitidos_por_lock": 0,
+        }
+        _empresas[id_empresa] = st
+    return st
+
+
+class _LockSyncEmpresa:
+    """Lock no bloqueante por empresa: del proceso + GET_LOCK de MySQL si corresponde."""
+
+    def __init__(self, id_empresa: int):
+        self.id_empresa = id_empresa
+        self.nombre = f"facturacion_sheets_sync_{id_empresa}"
+        self._conn = None
+        self._local = None
+        self.adquirido = False
+
+    def __enter__(self):
+        with _lock:
+            self._local = _locks_empresa.setdefault(self.id_empresa, threading.Lock())
+        if not self._local.acquire(blocking=False):
+            return self
+        if engine.dialect.name == "mysql":
+            try:
+                self._conn = engine.connect()
+                res = self._conn.execute(sa_text("SELECT GET_LOCK(:n, 0)"), {"n": self.nombre}).scalar()
+                if res != 1:
+                    self._cerrar_conn()
+                    self._local.release()
+                    return self
+            except Exception as e:
+                # Sin BD para el lock: seguimos solo con el lock del proceso
+                logger.warning(f"[SYNC] GET_LOCK no disponible para empresa {self.id_empresa}: {e}")
+                self._cerrar_conn()
+        self.adquirido = True
+        return self
+
+    def _cerrar_conn(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.adquirido:
+            return False
+        if self._conn is not None:
+            try:
+                self._conn.execute(sa_text("SELECT RELEASE_LOCK(:n)"), {"n": self.nombre})
+            except Exception:
+                pass
+            self._cerrar_conn()
+        self._local.release()
+        return False
+
+
+def _ejecutar_sync(id_empresa: int, google_sheet_id: Optional[str], full_sync: bool) -> Dict[str, Any]:
+    from backend.app.blueprints.sheets_boletas import _sync_sheets_to_db
+
+    with _lock:
+        st = _estado_empresa(id_empresa)
+        st["en_cola"] = False
+        st["en_curso"] = True
+        st["ultimo_inicio"] = datetime.now(timezone.utc)
+
+    inicio = time.perf_counter()
+    resultado: Dict[str, Any] = {}
+    error: Optional[str] = None
+    try:
+        with _LockSyncEmpresa(id_empresa) as lk:
+            if not lk.adquirido:
+                resultado = {"estado": "OCUPADO", "detalle": "Otro proceso está sincronizando esta empresa"}
+                logger.info(f"⏭️ DB-Sync Empresa {id_empresa}: otro proceso tiene el lock. Saltando.")
+            else:
+                resultado = _sync_sheets_to_db(full_sync, id_empresa, google_sheet_id) or {}
+        return resultado
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if metricas.es_cuota_sheets(e):
+            metricas.SHEETS_CUOTA_EXCEDIDA.inc(origen="sync")
+        logger.error(f"❌ DB-Sync Empresa {id_empresa}: {error}", exc_info=True)
+        resultado = {"estado": "ERROR", "detalle": error}
+        return resultado
+    finally:
+        dur_ms = round((time.perf_counter() - inicio) * 1000.0, 1)
+        with _lock:
+            st = _estado_empresa(id_empresa)
+            st["en_curso"] = False
+            st["ultimo_fin"] = datetime.now(timezone.utc)
+            st["ultima_duracion_ms"] = dur_ms
+            st["ultimo_resultado"] = resultado
+            st["ultimo_error"] = error or resultado.get("error")
+            if resultado.get("estado") == "OCUPADO":
+                st["total_omitidos_por_lock"] += 1
+            else:
+                st["total_syncs"] += 1
+
+
+def programar_sync(
+    id_empresa: int,
+    google_sheet_id: Optional[str],
+    full_sync: bool = False,
+    respetar_cooldown: bool = True,
+) -> Tuple[str, Optional[Future]]:
+    """Encola un sync para la empresa. Devuelve (PROGRAMADO | YA_PROGRAMADO | COOLDOWN, future)."""
+    with _lock:
+        st = _estado_empresa(id_empresa)
+        fut = st["future"]
+        if fut is not None and not fut.done():
+            return ESTADO_YA_PROGRAMADO, fut
+        if respetar_cooldown and st["ultimo_fin"] is not None:
+            transcurrido = (datetime.now(timezone.utc) - st["ultimo_fin"]).total_seconds()
+            if transcurrido < SYNC_COOLDOWN_SEC:
+                return ESTADO_COOLDOWN, None
+    # El lease no se libera: marca "hubo un sync automático" para todos los workers hasta que vence
+    if respetar_cooldown and SYNC_COOLDOWN_SEC > 0:
+        if coordinacion.tomar_lease(f"sheets_sync_cooldown:{id_empresa}", SYNC_COOLDOWN_SEC) is None:
+            return ESTADO_COOLDOWN, None
+    with _lock:
+        fut = st["future"]
+        if fut is not None and not fut.done():
+            return ESTADO_YA_PROGRAMADO, fut
+        st["en_cola"] = True
+        st["full_sync"] = bool(full_sync)
+        st["programado_en"] = datetime.now(timezone.utc)
+        fut = _get_pool().submit(_ejecutar_sync, id_empresa, google_sheet_id, bool(full_sync))
+        st["future"] = fut
+        return ESTADO_PROGRAMADO, fut
+
+
+async def sincronizar_y_esperar(
+    id_empresa: int,
+    google_sheet_id: Optional[str],
+    full_sync: bool = False,
+) -> Dict[str, Any]:
+    """Sync a pedido (ignora el cooldown) esperando el resultado sin bloquear el event loop."""
+    estado, fut = programar_sync(id_empresa, google_sheet_id, full_sync=full_sync, respetar_cooldown=False)
+    if estado == ESTADO_YA_PROGRAMADO:
+        with _lock:
+            en_marcha_full = _estado_empresa(id_empresa)["full_sync"]
+        if full_sync and not en_marcha_full:
+            # Hay un incremental en marcha: esperarlo y luego correr el completo
+            await asyncio.wrap_future(fut)
+            estado, fut = programar_sync(id_empresa, google_sheet_id, full_sync=True, respetar_cooldown=False)
+    return await asyncio.wrap_future(fut)
+
+
+def estado_scheduler(id_empresa: Optional[int] = None) -> Dict[str, Any]:
+    """Snapshot para monitoreo: cola, syncs en curso y métricas del último sync por empresa."""
+    def _iso(v):
+        return v.isoformat() if isinstance(v, datetime) else v
+
+    with _lock:
+        empresas = {}
+        for emp, st in _empresas.items():
+            if id_empresa is not None and emp != id_empresa:
+                continue
+            res = st["ultimo_resultado"] or {}
+            empresas[emp] = {
+                "en_cola": st["en_cola"],
+                "en_curso": st["en_curso"],
+                "full_sync": st["full_sync"],
+                "programado_en": _iso(st["programado_en"]),
+                "ultimo_inicio": _iso(st["ultimo_inicio"]),
+                "ultimo_fin": _iso(st["ultimo_fin"]),
+                "ultima_duracion_ms": st["ultima_duracion_ms"],
+                "ultimo_modo": res.get("modo") or res.get("estado"),
+                "filas_leidas": res.get("filas_leidas"),
+                "filas_nuevas": res.get("nuevos"),
+                "filas_actualizadas": res.get("actualizados"),
+                "ultimo_error": st["ultimo_error"],
+                "total_syncs": st["total_syncs"],
+                "total_omitidos_por_lock": st["total_omitidos_por_lock"],
+            }
+        return {
+            "max_workers": SYNC_MAX_WORKERS,
+            "cooldown_sec": SYNC_COOLDOWN_SEC,
+            "en_cola": sum(1 for st in _empresas.values() if st["en_cola"]),
+            "en_curso": sum(1 for st in _empresas.values() if st["en_curso"]),
+            "empresas": empresas,
+        }
+
+
+def detener_scheduler() -> None:
+    """Cierra el pool (shutdown de la app). Los syncs en curso terminan; los encolados se descartan."""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
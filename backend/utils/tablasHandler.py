@@ -16,17 +16,113 @@ from datetime import datetime
 from backend.config import GOOGLE_SHEET_ID, CREDENTIALS_FILE_PATH
 import csv
 import io
+import threading
+import time
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file', 'https://www.googleapis.com/auth/drive']
+# Cliente gspread del proceso (uno por worker; se crea en el primer uso).
 gspread_client: Optional[object] = None
 
+
+def _descartar_cliente_heredado() -> None:
+    # Tras un fork (gunicorn --preload) el hijo no comparte la sesión HTTP/token del padre
+    global gspread_client
+    gspread_client = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_descartar_cliente_heredado)
+
 datos_clientes: List[Dict] = []
 
+# Vigencia del índice ID Ingresos -> fila. Pasado este tiempo se vuelve a descargar la hoja
+# (cubre reordenamientos / borrados hechos a mano en INGRESOS).
+INDICE_INGRESOS_TTL_SEC = float(os.getenv('SHEETS_INDICE_TTL_SEC', '120'))
+
+
+def normalizar_fila_ingresos(row: dict) -> dict:
+    """Agrega claves canónicas (id_ingreso, fecha, facturacion, importe_total, ...) a una fila de INGRESOS."""
+    new = dict(row)
+    for k, v in list(row.items()):
+        key_compact = k.lower().replace(' ', '').replace('_', '')
+
+        # Repartidor (emisor/operador que llevó la boleta)
+        if key_compact in ('repartidor', 'repartidornombre', 'nombredelempleado'):
+            # preferir no sobreescribir si ya existe una clave canónica
+            if not new.get('repartidor'):
+                new['repartidor'] = v
+                # also provide capitalized variant for older code that expects 'Repartidor'
+                if not new.get('Repartidor'):
+                    new['Repartidor'] = v
+
+        # Razón social / nombre del receptor (cliente)
+        if key_compact in ('razonsocial', 'razonsocialreceptor', 'razonsocialcliente', 'nombre', 'nombrecliente', 'nombre_razonsocial'):
+            if not new.get('razon_social'):
+                new['razon_social'] = v
+                if not new.get('Razon Social'):
+                    new['Razon Social'] = v
+
+        # Fecha en formatos variados
+        if key_compact in ('fecha', 'fechadeingreso', 'date'):
+            if not new.get('fecha'):
+                new['fecha'] = v
+                if not new.get('Fecha'):
+                    new['Fecha'] = v
+
+        # ID Ingresos
+        if key_compact in ('idingresos', 'id', 'id_ingreso'):
+            if not new.get('id_ingreso'):
+                new['id_ingreso'] = v
+                if not new.get('ID Ingresos'):
+                    new['ID Ingresos'] = v
+
+        # Estado de facturación: consolidar en 'facturacion'
+        if key_compact in ('facturacion', 'estadofacturacion', 'estado'):
+            # Preferir mantener valor original pero en minúsculas para facilitar comparación
+            try:
+                val = str(v).strip()
+            except Exception:
+                val = str(v) if v is not None else ''
+            if val and not new.get('facturacion'):
+                new['facturacion'] = val
+                # Mantener también la forma original si existía otra capitalización
+                if 'Facturacion' not in new:
+                    new['Facturacion'] = val
+
+        # Total / importe
+        if key_compact in ('ingresos', 'total', 'importe', 'importetotal', 'totalapagar'):
+            if not new.get('importe_total'):
+                # Intentar parsear como número flotante
+                try:
+                    if isinstance(v, str):
+                        s = v.strip().replace('$', '').replace(' ', '')
+                        s = s.replace('.', '').replace(',', '.')
+                        new['importe_total'] = float(s)
+                    else:
+                        new['importe_total'] = float(v)
+                except (ValueError, TypeError) as e:
+                    new['importe_total'] = v  # mantener original si falla
+
+    return new
+
 
 class TablasHandler:
     def __init__(self, google_sheet_id=None):
         self.google_sheet_id = google_sheet_id or GOOGLE_SHEET_ID
         self.client = self._init_client()
+        # Índice de INGRESOS y escrituras pendientes (ver marcar_boleta_facturada)
+        self._worksheet = None
+        self._indice_lock = threading.RLock()
+        self._indice_filas: Optional[Dict[str, int]] = None
+        self._indice_construido_en = 0.0
+        self._filas: Dict[int, list] = {}
+        self._ultima_fila = 0
+        self._headers: List[str] = []
+        self._id_col: Optional[int] = None
+        self._fact_col: Optional[int] = None
+        self._total_col: Optional[int] = None
+        self._lote_activo = False
+        self._pendientes: List[Dict[str, Any]] = []
 
     def _init_client(self) -> Optional[object]:
         global gspread_client
@@ -68,69 +164,6 @@ class TablasHandler:
                 all_values = worksheet.get_all_values()
                 headers = all_values[0] if all_values else []
                 rows = all_values[1:] if len(all_values) > 1 else []
-                def normalize_row(row: dict) -> dict:
-                    new = dict(row)
-                    for k, v in list(row.items()):
-                        key_compact = k.lower().replace(' ', '').replace('_', '')
-
-                        # Repartidor (emisor/operador que llevó la boleta)
-                        if key_compact in ('repartidor', 'repartidornombre', 'nombredelempleado'):
-                            # preferir no sobreescribir si ya existe una clave canónica
-                            if not new.get('repartidor'):
-                                new['repartidor'] = v
-                                # also provide capitalized variant for older code that expects 'Repartidor'
-                                if not new.get('Repartidor'):
-                                    new['Repartidor'] = v
-
-                        # Razón social / nombre del receptor (cliente)
-                        if key_compact in ('razonsocial', 'razonsocialreceptor', 'razonsocialcliente', 'nombre', 'nombrecliente', 'nombre_razonsocial'):
-                            if not new.get('razon_social'):
-                                new['razon_social'] = v
-                                if not new.get('Razon Social'):
-                                    new['Razon Social'] = v
-
-                        # Fecha en formatos variados
-                        if key_compact in ('fecha', 'fechadeingreso', 'date'):
-                            if not new.get('fecha'):
-                                new['fecha'] = v
-                                if not new.get('Fecha'):
-                                    new['Fecha'] = v
-
-                        # ID Ingresos
-                        if key_compact in ('idingresos', 'id', 'id_ingreso'):
-                            if not new.get('id_ingreso'):
-                                new['id_ingreso'] = v
-                                if not new.get('ID Ingresos'):
-                                    new['ID Ingresos'] = v
-
-                        # Estado de facturación: consolidar en 'facturacion'
-                        if key_compact in ('facturacion', 'estadofacturacion', 'estado'):
-                            # Preferir mantener valor original pero en minúsculas para facilitar comparación
-                            try:
-                                val = str(v).strip()
-                            except Exception:
-                                val = str(v) if v is not None else ''
-                            if val and not new.get('facturacion'):
-                                new['facturacion'] = val
-                                # Mantener también la forma original si existía otra capitalización
-                                if 'Facturacion' not in new:
-                                    new['Facturacion'] = val
-
-                        # Total / importe
-                        if key_compact in ('ingresos', 'total', 'importe', 'importetotal', 'totalapagar'):
-                            if not new.get('importe_total'):
-                                # Intentar parsear como número flotante
-                                try:
-                                    if isinstance(v, str):
-                                        s = v.strip().replace('$', '').replace(' ', '')
-                                        s = s.replace('.', '').replace(',', '.')
-                                        new['importe_total'] = float(s)
-                                    else:
-                                        new['importe_total'] = float(v)
-                                except (ValueError, TypeError) as e:
-                                    new['importe_total'] = v  # mantener original si falla
-
-                    return new
 
                 records: List[Dict[str, Any]] = []
                 for r in rows:
@@ -140,7 +173,7 @@ class TablasHandler:
                     for i, h in enumerate(headers):
                         if i < len(r):
                             d[h] = r[i]
-                    records.append(normalize_row(d))
+                    records.append(normalizar_fila_ingresos(d))
                 return records
             except gspread.exceptions.WorksheetNotFound:
                 print("❌ ERROR: La hoja de cálculo no tiene una pestaña llamada 'INGRESOS'.")
@@ -229,78 +262,206 @@ class TablasHandler:
 
 
 
-    def marcar_boleta_facturada(self, id_ingreso: str): 
+    # ------------------------------------------------------------------
+    # Índice ID Ingresos -> número de fila y escrituras agrupadas
+    # ------------------------------------------------------------------
+    # Antes cada marca (facturada / anulada / verificación) descargaba INGRESOS completo con
+    # get_all_values() y hacía update_cell sueltos: un lote de N boletas = N descargas (429).
+    # Ahora el handler descarga la hoja una vez, arma el índice, y si un ID no está solo lee
+    # las filas agregadas al final. En modo lote las escrituras se acumulan y se envían con
+    # un único batch_update en confirmar_lote_escrituras().
+
+    def _get_worksheet_ingresos(self):
+        if self._worksheet is None:
+            sheet = self.client.open_by_key(self.google_sheet_id)
+            self._worksheet = sheet.worksheet("INGRESOS")
+        return self._worksheet
+
+    @staticmethod
+    def _col_letra(col: int) -> str:
+        """Columna 1-based -> letras (p.ej. 28 -> 'AB')."""
+        letras = ""
+        while col > 0:
+            col, resto = divmod(col - 1, 26)
+            letras = chr(65 + resto) + letras
+        return letras
+
+    @classmethod
+    def _a1(cls, row: int, col: int) -> str:
+        """(fila, columna) 1-based -> notación A1 (p.ej. (2, 28) -> 'AB2')."""
+        return f"{cls._col_letra(col)}{row}"
+
+    def invalidar_indice(self):
+        """Fuerza la reconstrucción del índice en el próximo uso (p.ej. si se reordenó la hoja)."""
+        with self._indice_lock:
+            self._indice_filas = None
+            self._filas = {}
+
+    def _construir_indice(self):
+        worksheet = self._get_worksheet_ingresos()
+        all_values = worksheet.get_all_values()
+        headers = all_values[0] if all_values else []
+        id_col = fact_col = total_col = None
+        for i, h in enumerate(headers):
+            h_lower = h.lower().replace(' ', '').replace('_', '')
+            # Usar FIRST MATCH para evitar solapamientos si hay columnas repetidas
+            if h_lower == "idingresos" and id_col is None:
+                id_col = i
+            if h_lower == "facturacion" and fact_col is None:
+                fact_col = i
+            if h_lower in ('ingresos', 'total', 'importe', 'importetotal', 'totalapagar') and total_col is None:
+                total_col = i
+        self._headers = headers
+        self._id_col, self._fact_col, self._total_col = id_col, fact_col, total_col
+        self._indice_filas = {}
+        self._filas = {}
+        self._ultima_fila = len(all_values)
+        if id_col is not None:
+            for row_idx, row in enumerate(all_values[1:], start=2):
+                self._registrar_fila(row_idx, row)
+        self._indice_construido_en = time.monotonic()
+        print(f"[SHEETS] Índice INGRESOS construido: {len(self._indice_filas)} IDs, {self._ultima_fila} filas")
+
+    def _registrar_fila(self, row_idx: int, row: list):
+        if self._id_col is None or self._id_col >= len(row):
+            return
+        key = str(row[self._id_col]).strip()
+        if key and key not in self._indice_filas:
+            self._indice_filas[key] = row_idx
+        self._filas[row_idx] = list(row)
+
+    def _leer_filas_nuevas(self):
+        """Lee solo las filas agregadas después de la última fila conocida (refresco incremental)."""
+        if not self._headers:
+            return
+        worksheet = self._get_worksheet_ingresos()
+        inicio = self._ultima_fila + 1
+        rango = f"A{inicio}:{self._col_letra(len(self._headers))}"
+        nuevas = worksheet.get_values(rango) or []
+        for offset, row in enumerate(nuevas):
+            self._registrar_fila(inicio + offset, row)
+        if nuevas:
+            self._ultima_fila = inicio + len(nuevas) - 1
+            print(f"[SHEETS] Índice INGRESOS: +{len(nuevas)} filas nuevas (hasta fila {self._ultima_fila})")
+
+    def _buscar_fila(self, id_ingreso: str) -> Tuple[Optional[int], Optional[list]]:
+        """Devuelve (número de fila 1-based, valores cacheados) para un ID, o (None, None)."""
+        key = str(id_ingreso).strip()
+        with self._indice_lock:
+            vencido = (
+                self._indice_filas is None
+                or (time.monotonic() - self._indice_construido_en) > INDICE_INGRESOS_TTL_SEC
+            )
+            if vencido:
+                self._construir_indice()
+            if self._id_col is None or self._fact_col is None:
+                print(f"❌ Columnas 'ID Ingresos' o 'facturacion' no encontradas. Headers: {self._headers}")
+                return None, None
+            row_idx = self._indice_filas.get(key)
+            if row_idx is None:
+                self._leer_filas_nuevas()
+                row_idx = self._indice_filas.get(key)
+            if row_idx is None:
+                return None, None
+            return row_idx, self._filas.get(row_idx)
+
+    def _escribir(self, updates: List[Dict[str, Any]]):
+        """Envía las celdas ya (un batch_update) o las acumula si hay un lote abierto."""
+        if not updates:
+            return
+        with self._indice_lock:
+            if self._lote_activo:
+                self._pendientes.extend(updates)
+                return
+        payload = [{'range': u['range'], 'values': u['values']} for u in updates]
+        self._get_worksheet_ingresos().batch_update(payload, value_input_option='USER_ENTERED')
+
+    def _set_cache(self, row_idx: int, col: int, valor: str):
+        fila = self._filas.get(row_idx)
+        if fila is not None:
+            while len(fila) <= col:
+                fila.append('')
+            fila[col] = valor
+
+    def iniciar_lote_escrituras(self):
+        """A partir de acá las marcas en INGRESOS se acumulan hasta confirmar_lote_escrituras()."""
+        with self._indice_lock:
+            self._lote_activo = True
+            self._pendientes = []
+
+    def confirmar_lote_escrituras(self) -> Dict[str, bool]:
+        """Envía todas las escrituras acumuladas en un único batch_update.
+        Devuelve {id_ingreso: ok} para los IDs incluidos en el lote."""
+        with self._indice_lock:
+            pendientes = self._pendientes
+            self._pendientes = []
+            self._lote_activo = False
+        ids = {}
+        for u in pendientes:
+            if u.get('_id_ingreso') is not None:
+                ids[u['_id_ingreso']] = True
+        if not pendientes:
+            return ids
+        payload = [{'range': u['range'], 'values': u['values']} for u in pendientes]
+        try:
+            self._get_worksheet_ingresos().batch_update(payload, value_input_option='USER_ENTERED')
+            print(f"✅ [SHEETS] Lote confirmado: {len(payload)} celdas en un batch_update ({len(ids)} boletas)")
+        except Exception as e:
+            print(f"❌ Error en batch_update de INGRESOS: {type(e).__name__} - {e}")
+            # El caché local ya no refleja la hoja: reconstruir en el próximo uso
+            self.invalidar_indice()
+            ids = {k: False for k in ids}
+        return ids
+
+    def marcar_boleta_facturada(self, id_ingreso: str):
         if not self.client:
             print("Cliente de Google Sheets no disponible.")
             return None
 
         try:
-            sheet = self.client.open_by_key(self.google_sheet_id)
-            worksheet = sheet.worksheet("INGRESOS")
-
-            # Traer todas las filas como listas (incluye encabezados)
-            all_values = worksheet.get_all_values()
-            headers = all_values[0]
-
-            # Buscar índices de columnas relevantes
-            id_col_index = None
-            fact_col_index = None
-            total_col_index = None
-            
-            print(f"DEBUG Headers: {headers}")
-
-            for i, h in enumerate(headers):
-                h_lower = h.lower().replace(' ', '').replace('_', '')
-                
-                # Usar FIRST MATCH para evitar solapamientos si hay columnas repetidas
-                if h_lower == "idingresos" and id_col_index is None:
-                    id_col_index = i
-                    print(f"DEBUG: ID Column found at {i} ({h})")
-                
-                if h_lower == "facturacion" and fact_col_index is None:
-                    fact_col_index = i
-                    print(f"DEBUG: Facturacion Column found at {i} ({h})")
-                
-                if h_lower in ('ingresos', 'total', 'importe', 'importetotal', 'totalapagar') and total_col_index is None:
-                    total_col_index = i
-            
-            if id_col_index is None or fact_col_index is None:
-                print(f"❌ Columnas 'ID Ingresos' o 'facturacion' no encontradas. Headers: {headers}")
+            row_idx, row = self._buscar_fila(id_ingreso)
+            if row_idx is None:
+                if self._id_col is not None and self._fact_col is not None:
+                    print(f"⚠️ No se encontró boleta con ID {id_ingreso} en INGRESOS ({len(self._indice_filas or {})} IDs indexados).")
                 return False
+            row = row or []
+            fact_col, total_col = self._fact_col, self._total_col
+            actual = row[fact_col] if fact_col < len(row) else ''
+            print(f"Found row {row_idx} for ID {id_ingreso}, current fact value: '{actual}', updating to 'Facturado'")
 
-            # Buscar la fila por ID
-            for row_idx, row in enumerate(all_values[1:], start=2):  # start=2 porque empieza después del header
-                if str(row[id_col_index]).strip() == str(id_ingreso).strip():
-                    print(f"Found row {row_idx} for ID {id_ingreso}, current fact value: '{row[fact_col_index]}', updating to 'Facturado'")
-                    
-                    # Marcar como facturada
-                    result = worksheet.update_cell(row_idx, fact_col_index + 1, "Facturado")
-                    print(f"Update result: {result}, ✅ Boleta {id_ingreso} marcada como facturada en fila {row_idx}")
-                    
-                    # Normalizar el total si se encontró la columna
-                    if total_col_index is not None and total_col_index < len(row):
-                        valor_original = row[total_col_index].strip() if row[total_col_index] else ''
-                        if valor_original:
-                            try:
-                                # Aplicar la misma lógica de parsing que en normalize_row
-                                s = valor_original.replace('$', '').replace(' ', '')
-                                s = s.replace('.', '').replace(',', '.')
-                                valor_normalizado = float(s)
-                                
-                                # Formatear de vuelta a string con formato argentino (coma decimal, punto miles)
-                                valor_formateado = f"{valor_normalizado:,.2f}".replace(',', 'temp').replace('.', ',').replace('temp', '.')
-                                
-                                if valor_original != valor_formateado:
-                                    worksheet.update_cell(row_idx, total_col_index + 1, valor_formateado)
-                                    print(f"✅ Total normalizado en fila {row_idx}: '{valor_original}' -> '{valor_formateado}'")
-                            
-                            except (ValueError, TypeError) as e:
-                                print(f"⚠️ Error normalizando total en fila {row_idx}: '{valor_original}' - {e}")
-                    
-                    return True
-
-            print(f"⚠️ No se encontró boleta con ID {id_ingreso} en las filas. Headers: {headers[:5]}... IDs sample: {[r[id_col_index] for r in all_values[1:][:5]]}")
-            return False
+            updates: List[Dict[str, Any]] = [{
+                'range': self._a1(row_idx, fact_col + 1),
+                'values': [["Facturado"]],
+                '_id_ingreso': str(id_ingreso).strip(),
+            }]
+
+            # Normalizar el total si se encontró la columna
+            if total_col is not None and total_col < len(row):
+                valor_original = row[total_col].strip() if row[total_col] else ''
+                if valor_original:
+                    try:
+                        # Aplicar la misma lógica de parsing que en normalize_row
+                        s = valor_original.replace('$', '').replace(' ', '')
+                        s = s.replace('.', '').replace(',', '.')
+                        valor_normalizado = float(s)
+
+                        # Formatear de vuelta a string con formato argentino (coma decimal, punto miles)
+                        valor_formateado = f"{valor_normalizado:,.2f}".replace(',', 'temp').replace('.', ',').replace('temp', '.')
+
+                        if valor_original != valor_formateado:
+                            updates.append({
+                                'range': self._a1(row_idx, total_col + 1),
+                                'values': [[valor_formateado]],
+                            })
+                            print(f"✅ Total normalizado en fila {row_idx}: '{valor_original}' -> '{valor_formateado}'")
+                            self._set_cache(row_idx, total_col, valor_formateado)
+                    except (ValueError, TypeError) as e:
+                        print(f"⚠️ Error normalizando total en fila {row_idx}: '{valor_original}' - {e}")
+
+            self._escribir(updates)
+            self._set_cache(row_idx, fact_col, "Facturado")
+            print(f"✅ Boleta {id_ingreso} marcada como facturada en fila {row_idx}" + (" (pendiente de lote)" if self._lote_activo else ""))
+            return True
 
         except Exception as e:
             print(f"❌ Error al actualizar boleta: {type(e).__name__} - {e}")
@@ -311,25 +472,16 @@ class TablasHandler:
             print("Cliente de Google Sheets no disponible.")
             return None
         try:
-            sheet = self.client.open_by_key(self.google_sheet_id)
-            worksheet = sheet.worksheet("INGRESOS")
-            all_values = worksheet.get_all_values()
-            headers = all_values[0]
-            id_col_index = None
-            fact_col_index = None
-            for i, h in enumerate(headers):
-                h_lower = h.lower().replace(' ', '').replace('_', '')
-                if h_lower == "idingresos":
-                    id_col_index = i
-                if h_lower == "facturacion":
-                    fact_col_index = i
-            if id_col_index is None or fact_col_index is None:
+            row_idx, _row = self._buscar_fila(id_ingreso)
+            if row_idx is None:
                 return False
-            for row_idx, row in enumerate(all_values[1:], start=2):
-                if str(row[id_col_index]).strip() == str(id_ingreso).strip():
-                    worksheet.update_cell(row_idx, fact_col_index + 1, "Anulada")
-                    return True
-            return False
+            self._escribir([{
+                'range': self._a1(row_idx, self._fact_col + 1),
+                'values': [["Anulada"]],
+                '_id_ingreso': str(id_ingreso).strip(),
+            }])
+            self._set_cache(row_idx, self._fact_col, "Anulada")
+            return True
         except Exception as e:
             print(f"❌ Error al actualizar boleta: {type(e).__name__} - {e}")
             return False
@@ -338,24 +490,10 @@ class TablasHandler:
         if not self.client:
             return None
         try:
-            sheet = self.client.open_by_key(self.google_sheet_id)
-            worksheet = sheet.worksheet("INGRESOS")
-            all_values = worksheet.get_all_values()
-            headers = all_values[0] if all_values else []
-            id_col_index = None
-            fact_col_index = None
-            for i, h in enumerate(headers):
-                hl = h.lower().replace(' ', '').replace('_', '')
-                if hl == 'idingresos':
-                    id_col_index = i
-                if hl == 'facturacion':
-                    fact_col_index = i
-            if id_col_index is None or fact_col_index is None:
+            row_idx, row = self._buscar_fila(id_ingreso)
+            if row_idx is None or row is None:
                 return None
-            for row in all_values[1:]:
-                if str(row[id_col_index]).strip() == str(id_ingreso).strip():
-                    return str(row[fact_col_index]).strip()
-            return None
+            return str(row[self._fact_col]).strip() if self._fact_col < len(row) else ''
         except Exception:
             return None
 
@@ -363,3 +501,35 @@ class TablasHandler:
         global gspread_client
         gspread_client = None
         self.client = self._init_client()
+        self._worksheet = None
+        self.invalidar_indice()
+
+    # ------------------------------------------------------------------
+    # Lecturas por rango para el delta-sync (sheets_boletas._sync_sheets_to_db)
+    # ------------------------------------------------------------------
+
+    def ultima_modificacion_ingresos(self) -> Optional[str]:
+        """lastUpdateTime del spreadsheet (metadato de Drive; no consume lecturas de la API de Sheets)."""
+        if not self.client:
+            return None
+        try:
+            worksheet = self._get_worksheet_ingresos()
+            valor = worksheet.spreadsheet.get_lastUpdateTime()
+            return str(valor) if valor else None
+        except Exception as e:
+            print(f"[SHEETS] No se pudo leer lastUpdateTime: {type(e).__name__} - {e}")
+            return None
+
+    def leer_ingresos_desde(self, desde_fila: int) -> Tuple[List[str], List[Tuple[int, list]]]:
+        """Encabezados y filas crudas de INGRESOS desde `desde_fila` (1-based) hasta el final.
+
+        Una sola llamada (batch_get de la fila 1 + el rango pedido). Devuelve
+        (headers, [(número de fila, valores)]).
+        """
+        worksheet = self._get_worksheet_ingresos()
+        desde = max(2, int(desde_fila))
+        hasta = max(desde, int(getattr(worksheet, 'row_count', 0) or 0))
+        rangos = worksheet.batch_get(['1:1', f'{desde}:{hasta}'])
+        headers = list(rangos[0][0]) if rangos and rangos[0] else []
+        cuerpo = rangos[1] if len(rangos) > 1 else []
+        return headers, [(desde + i, list(r)) for i, r in enumerate(cuerpo)]
@@ -0,0 +1,199 @@
+"""
+Contexto de empresa (tenant): Empresa + ConfiguracionEmpresa resueltos en una sola consulta.
+
+La cadena usuario → Empresa → ConfiguracionEmpresa → google_sheet_id / cuit / desglose 77 /
+punto de venta se resolvía por separado en cada handler y en el pipeline de facturación (2 a 4
+consultas por camino, y en boletas una sesión que nunca se cerraba). Acá se carga todo con un
+LEFT JOIN y se cachea por proceso en un ContextoEmpresa inmutable:
+
+- `obtener_contexto(id_empresa)` y `contexto_por_cuit(cuit)` (CUIT con o sin guiones).
+- `contexto_usuario_actual` como dependencia de FastAPI.
+- `invalidar(id_empresa)` lo llama admin_empresa al editar; los otros workers se enteran por
+  utils/coordinacion y descartan su caché en COORDINACION_POLL_SEC (sin esperar el TTL).
+"""
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException
+from sqlmodel import select, or_
+
+from backend.modelos import ConfiguracionEmpresa, Empresa, Usuario
+from backend.security import obtener_usuario_actual
+from backend.utils import coordinacion
+
+logger = logging.getLogger(__name__)
+
+TENANT_CONTEXT_TTL = float(os.getenv("TENANT_CONTEXT_TTL", "300"))
+
+# Hotfix Swing Jugos: empresa sin link_google_sheets cargado
+SHEET_HOTFIX = {"20364237740": "1yNrBzxXga0TpFOpMcAQw6xvQ2dSa0TC9P7F88eOLveM"}
+
+
+@dataclass(frozen=True)
+class ContextoEmpresa:
+    id_empresa: int
+    cuit: Optional[str]
+    nombre_legal: Optional[str]
+    nombre_fantasia: Optional[str]
+    activa: bool
+    tiene_configuracion: bool
+    cuit_configuracion: Optional[str]
+    link_google_sheets: Optional[str]
+    google_sheet_id: Optional[str]
+    nombre_negocio: Optional[str]
+    aplicar_desglose_77: bool
+    detalle_empresa_text: Optional[str]
+    afip_condicion_iva: Optional[str]
+    punto_venta: Optional[int]
+
+
+def extraer_sheet_id(link: Optional[str]) -> Optional[str]:
+    """ID de Google Sheets desde un link completo (…/d/<id>/…) o el ID pelado."""
+    link = (link or "").strip()
+    if not link:
+        return None
+    match = re.search(r"/d/([a-zA-Z0-9-_]+)", link)
+    if match:
+        return match.group(1)
+    return link if "/" not in link else None
+
+
+def _digitos(cuit: Any) -> str:
+    return "".join(ch for ch in str(cuit or "") if ch.isdigit())[:11]
+
+
+def _armar(empresa: Empresa, conf: Optional[ConfiguracionEmpresa]) -> ContextoEmpresa:
+    link = (conf.link_google_sheets or "").strip() if conf else ""
+    sheet_id = extraer_sheet_id(link) or SHEET_HOTFIX.get(_digitos(empresa.cuit))
+    return ContextoEmpresa(
+        id_empresa=empresa.id,
+        cuit=empresa.cuit,
+        nombre_legal=empresa.nombre_legal,
+        nombre_fantasia=empresa.nombre_fantasia,
+        activa=bool(empresa.activa),
+        tiene_configuracion=conf is not None,
+        cuit_configuracion=conf.cuit if conf else None,
+        link_google_sheets=link or None,
+        google_sheet_id=sheet_id,
+        nombre_negocio=conf.nombre_negocio if conf else None,
+        aplicar_desglose_77=bool(conf.aplicar_desglose_77) if conf else False,
+        detalle_empresa_text=conf.detalle_empresa_text if conf else None,
+        afip_condicion_iva=conf.afip_condicion_iva if conf else None,
+        punto_venta=conf.afip_punto_venta_predeterminado if conf else None,
+    )
+
+
+_lock = threading.Lock()
+_por_id: Dict[int, Tuple[float, Optional[ContextoEmpresa]]] = {}
+_por_cuit: Dict[str, Tuple[float, Optional[int]]] = {}
+_vigilante = coordinacion.VigilanteCache("tenant_context")
+
+
+def _vigente(entrada) -> bool:
+    return entrada is not None and entrada[0] > time.monotonic()
+
+
+def _descartar_si_invalidado_en_otro_worker() -> None:
+    if _vigilante.cambio():
+        with _lock:
+            _por_id.clear()
+            _por_cuit.clear()
+
+
+def _consulta():
+    return select(Empresa, ConfiguracionEmpresa).outerjoin(
+        ConfiguracionEmpresa, ConfiguracionEmpresa.id_empresa == Empresa.id
+    )
+
+
+def _con_sesion(db, fn):
+    if db is not None:
+        return fn(db)
+    from backend.database import SessionLocal
+    with SessionLocal() as sesion:
+        return fn(sesion)
+
+
+def _guardar(ctx: Optional[ContextoEmpresa], id_empresa: Optional[int] = None) -> None:
+    vence = time.monotonic() + TENANT_CONTEXT_TTL
+    with _lock:
+        if ctx is not None:
+            _por_id[ctx.id_empresa] = (vence, ctx)
+            for cuit in (ctx.cuit, ctx.cuit_configuracion):
+                if _digitos(cuit):
+                    _por_cuit[_digitos(cuit)] = (vence, ctx.id_empresa)
+        elif id_empresa is not None:
+            _por_id[id_empresa] = (vence, None)
+
+
+def obtener_contexto(id_empresa: Optional[int], db=None) -> Optional[ContextoEmpresa]:
+    """Contexto de la empresa (cacheado). None si la empresa no existe."""
+    if id_empresa is None:
+        return None
+    _descartar_si_invalidado_en_otro_worker()
+    entrada = _por_id.get(id_empresa)
+    if _vigente(entrada):
+        return entrada[1]
+    fila = _con_sesion(db, lambda s: s.exec(_consulta().where(Empresa.id == id_empresa)).first())
+    ctx = _armar(*fila) if fila else None
+    _guardar(ctx, id_empresa)
+    return ctx
+
+
+def contexto_por_cuit(cuit: Any, db=None) -> Optional[ContextoEmpresa]:
+    """Contexto de la empresa dueña del CUIT (de Empresa o de su ConfiguracionEmpresa)."""
+    needle = _digitos(cuit)
+    if not needle:
+        return None
+    _descartar_si_invalidado_en_otro_worker()
+    entrada = _por_cuit.get(needle)
+    if _vigente(entrada):
+        return obtener_contexto(entrada[1], db) if entrada[1] is not None else None
+
+    def _buscar(s):
+        raw = str(cuit).strip()
+        variantes = list(dict.fromkeys(v for v in (raw, needle) if v))
+        fila = s.exec(_consulta().where(or_(
+            Empresa.cuit.in_(variantes), ConfiguracionEmpresa.cuit.in_(variantes)
+        ))).first()
+        if fila:
+            return fila
+        # La BD a veces guarda el CUIT con guiones: comparar solo dígitos
+        for emp, conf in s.exec(_consulta()).all():
+            if _digitos(emp.cuit) == needle or (conf is not None and _digitos(conf.cuit) == needle):
+                return emp, conf
+        return None
+
+    fila = _con_sesion(db, _buscar)
+    ctx = _armar(*fila) if fila else None
+    if ctx is not None:
+        _guardar(ctx)
+    with _lock:
+        _por_cuit[needle] = (time.monotonic() + TENANT_CONTEXT_TTL, ctx.id_empresa if ctx else None)
+    return ctx
+
+
+def invalidar(id_empresa: Optional[int] = None) -> None:
+    """Descarta el contexto de la empresa (y sus CUIT) o todo el caché si id_empresa es None."""
+    coordinacion.publicar_invalidacion("tenant_context")
+    with _lock:
+        if id_empresa is None:
+            _por_id.clear()
+            _por_cuit.clear()
+            return
+        _por_id.pop(id_empresa, None)
+        for k in [k for k, v in _por_cuit.items() if v[1] == id_empresa or v[1] is None]:
+            del _por_cuit[k]
+
+
+def contexto_usuario_actual(usuario: Usuario = Depends(obtener_usuario_actual)) -> ContextoEmpresa:
+    """Dependencia FastAPI: contexto de la empresa del usuario autenticado."""
+    ctx = obtener_contexto(usuario.id_empresa)
+    if ctx is None:
+        raise HTTPException(status_code=404, detail="Empresa del usuario no encontrada")
+    return ctx
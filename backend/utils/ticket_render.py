@@ -0,0 +1,440 @@
+"""
+Render del ticket térmico (58mm) y pool de procesos para renders en lote.
+
+Dos motores sobre los mismos datos (`boletas.datos_ticket`):
+- raster (por defecto): dibuja el layout fijo del ticket directo con Pillow. Fuentes, logo y
+  QR se cargan una vez por proceso; no hay layout HTML/CSS.
+- weasyprint: arma el HTML desde una plantilla precompilada (TICKET_HTML) y lo rasteriza con
+  WeasyPrint. Queda como fallback si Pillow no está o el raster falla
+  (TICKET_RENDER_ENGINE=weasyprint lo fuerza).
+
+Vive fuera de boletas.py para que los procesos del pool solo importen Pillow/WeasyPrint y no toda
+la app (BD, gspread, routers). El render es CPU-bound, así que los lotes
+(/impresion/pack-imagenes) renderizan en procesos aparte (TICKET_RENDER_PROCESOS).
+Benchmark: backend/scripts/bench_ticket_render.py.
+"""
+import base64
+import html as _html
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from string import Template
+from typing import Any, Dict, List, Optional
+
+try:
+    from weasyprint import HTML  # type: ignore
+except Exception:
+    HTML = None  # type: ignore
+
+try:
+    from PIL import Image, ImageDraw, ImageFont  # type: ignore
+except Exception:
+    Image = None  # type: ignore
+    ImageDraw = None  # type: ignore
+    ImageFont = None  # type: ignore
+
+from backend.utils import qr_render
+
+logger = logging.getLogger(__name__)
+
+TICKET_RENDER_PROCESOS = int(os.getenv("TICKET_RENDER_PROCESOS", str(min(4, os.cpu_count() or 1))))
+TICKET_RENDER_ENGINE = os.getenv("TICKET_RENDER_ENGINE", "raster").strip().lower()
+TICKET_LOGO_PATH = os.getenv("TICKET_LOGO_PATH", "")
+
+# Ancho imprimible de una térmica de 58mm a 203 dpi
+ANCHO_PX = 384
+MARGEN_PX = 8
+
+_FUENTES = {
+    False: ("DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "arial.ttf", "Arial.ttf"),
+    True: ("DejaVuSans-Bold.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", "arialbd.ttf", "Arial Bold.ttf"),
+}
+
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def formatear_numero(value: Any) -> str:
+    """Formato argentino (punto miles, coma decimal) sin tocar el locale del proceso."""
+    if isinstance(value, (int, float)):
+        entero, dec = "{:.2f}".format(value).split('.')
+        signo = '-' if entero.startswith('-') else ''
+        entero = entero.lstrip('-')
+        rev = entero[::-1]
+        con_puntos = '.'.join(rev[i:i + 3] for i in range(0, len(rev), 3))[::-1]
+        return f"{signo}{con_puntos},{dec}"
+    return str(value)
+
+
+# ===================== Motor HTML (WeasyPrint) =====================
+
+TICKET_HTML = Template("""<!doctype html>
+<html>
+<head>
+    <meta charset='utf-8'/>
+    <title>Comprobante $titulo</title>
+    <style>
+        body { font-family: Arial, Helvetica, sans-serif; padding:8px; color:#111; font-size:12px }
+        .card { border:0; padding:0; max-width:320px; margin:0 auto }
+        .header { text-align:center }
+        .small { color:#666; font-size:0.9em }
+        .meta { margin-top:8px; font-size:11px }
+        .totals { margin-top:10px; font-weight:bold }
+        table.items td, table.items th { border-bottom:1px solid #eee; padding:4px 0 }
+        .qr { margin-top:10px; text-align:center }
+        .leyendas { margin-top:8px; font-size:10px; color:#333 }
+        pre { white-space:pre-wrap; background:#f8f8f8; padding:8px; border-radius:6px; font-size:10px }
+    </style>
+</head>
+<body>
+    <div class='card'>
+        <div class='header'>
+            <div style='font-weight:bold'>$emisor_razon</div>
+            <div class='small'>CUIT: $emisor_cuit · $emisor_iva</div>
+            <div class='small'>$emisor_domicilio</div>
+            <hr/>
+            <h3 style='margin:4px 0'>$tipo_label</h3>
+            <div class='small'>$encabezado</div>
+            <div class='small'>Fecha: $fecha</div>
+        </div>
+
+        <div class='meta'>
+            $receptor_html
+        </div>
+
+        $items_html
+
+        <div class='totals'>
+            <div>Total: $total</div>
+            <div class='small'>CAE: $cae $cae_vto</div>
+            <div class='small'>CUIT Emisor: $emisor_cuit</div>
+        </div>
+
+        <div class='qr'>
+            $qr_html
+        </div>
+
+    $mismatch_html
+    <div class='leyendas'>
+            $leyendas
+        </div>
+
+        <hr/>
+        <pre>$raw_response</pre>
+    </div>
+</body>
+</html>
+""")
+
+
+def html_ticket(datos: Dict[str, Any]) -> str:
+    """HTML imprimible del ticket a partir de `boletas.datos_ticket`."""
+    def esc(v: Any) -> str:
+        return _html.escape(str(v)) if v is not None else ''
+
+    if datos.get("consumidor_final"):
+        receptor_html = "<div><strong>Cliente Final</strong></div>"
+    else:
+        receptor_html = (
+            f"<div><strong>Receptor:</strong> {esc(datos.get('receptor_nombre'))}</div>\n            "
+            f"<div class='small'>Doc: {esc(datos.get('receptor_doc'))} · Cond. IVA: {esc(datos.get('receptor_iva'))}</div>"
+        )
+
+    items_html = ''
+    if datos.get("items"):
+        filas = ''.join(
+            f"<tr><td>{esc(it['descripcion'])}</td><td style='text-align:right'>{esc(it['cantidad'])}</td>"
+            f"<td style='text-align:right'>{esc(it['precio'])}</td><td style='text-align:right'>{esc(it['subtotal'])}</td></tr>"
+            for it in datos["items"]
+        )
+        items_html = (
+            "<table style='width:100%; border-collapse:collapse; margin-top:8px'><thead><tr>"
+            "<th style='text-align:left'>Descripción</th><th style='text-align:right'>Cant.</th>"
+            "<th style='text-align:right'>P.Unit</th><th style='text-align:right'>Subtotal</th></tr></thead>"
+            f"<tbody>{filas}</tbody></table>"
+        )
+    elif datos.get("detalle_text"):
+        items_html = f"<div style='margin-top:8px'>{esc(datos['detalle_text'])}</div>"
+
+    qr = datos.get("qr")
+    qr_html = ''
+    if qr:
+        if str(qr).startswith('data:'):
+            qr_html = f"<div style='margin-top:12px'><img src='{esc(qr)}' alt='QR' style='max-width:220px'/></div>"
+        else:
+            # Facturas nuevas guardan solo la URL de AFIP: la imagen se genera acá (cacheada)
+            img = qr_render.qr_data_url(str(qr))
+            if img:
+                qr_html = f"<div style='margin-top:12px'><img src='{img}' alt='QR' style='max-width:220px'/></div>"
+            else:
+                qr_html = f"<div style='margin-top:12px'><a href='{esc(qr)}' target='_blank' rel='noopener noreferrer'>Ver QR</a></div>"
+
+    mismatch_html = ''
+    if datos.get("mismatch"):
+        mismatch_html = f"<div style='margin-top:6px;color:#b00;font-size:10px'><strong>Advertencia:</strong> {esc(datos['mismatch'])}</div>"
+
+    return TICKET_HTML.substitute(
+        titulo=esc(datos.get("nro_comprobante")),
+        emisor_razon=esc(datos.get("emisor_razon")),
+        emisor_cuit=esc(datos.get("emisor_cuit")),
+        emisor_iva=esc(datos.get("emisor_iva")),
+        emisor_domicilio=esc(datos.get("emisor_domicilio")),
+        tipo_label=esc(datos.get("tipo_label")),
+        encabezado=esc(datos.get("encabezado")),
+        fecha=esc(datos.get("fecha")),
+        receptor_html=receptor_html,
+        items_html=items_html,
+        total=esc(datos.get("total")),
+        cae=esc(datos.get("cae")),
+        cae_vto=f"(Vto: {esc(datos['cae_vto'])})" if datos.get("cae_vto") else '',
+        qr_html=qr_html,
+        mismatch_html=mismatch_html,
+        leyendas='<br/>'.join(esc(l) for l in datos.get("leyendas") or []),
+        raw_response=esc(json.dumps(datos.get("raw_response") or {}, indent=2, ensure_ascii=False)),
+    )
+
+
+def render_ticket_image(html: str, formato: str = 'jpg') -> bytes:
+    """HTML -> imagen con WeasyPrint (motor de fallback)."""
+    if HTML is None:
+        raise RuntimeError('WeasyPrint no disponible en el entorno')
+    formato_l = formato.lower()
+    if formato_l not in ('jpg', 'jpeg', 'png'):
+        formato_l = 'jpg'
+    png_buf = BytesIO()
+    HTML(string=html, base_url=os.getcwd()).write_png(png_buf)
+    png_buf.seek(0)
+    if formato_l == 'png' or Image is None:
+        return png_buf.getvalue()
+    with Image.open(png_buf) as im:
+        return _codificar(im, 'jpg')
+
+
+# ===================== Motor raster (Pillow) =====================
+
+@lru_cache(maxsize=16)
+def _fuente(tam: int, negrita: bool = False):
+    for nombre in _FUENTES[negrita]:
+        try:
+            return ImageFont.truetype(nombre, tam)
+        except OSError:
+            continue
+    return ImageFont.load_default(tam)
+
+
+@lru_cache(maxsize=4)
+def _logo(ruta: str):
+    """Logo reescalado al ancho útil, en escala de grises (None si no hay)."""
+    if not ruta or not os.path.exists(ruta):
+        return None
+    try:
+        with Image.open(ruta) as im:
+            im = im.convert("L")
+            ancho = min(im.width, ANCHO_PX - 2 * MARGEN_PX, 240)
+            alto = max(1, int(im.height * ancho / im.width))
+            return im.resize((ancho, alto))
+    except Exception as e:
+        logger.warning(f"[TICKET] No se pudo cargar el logo {ruta}: {e}")
+        return None
+
+
+@lru_cache(maxsize=256)
+def _imagen_qr(contenido: str, lado: int):
+    """QR listo para pegar: data: URL de imagen o texto/URL a codificar con qrcode."""
+    im = None
+    if contenido.startswith('data:image'):
+        try:
+            im = Image.open(BytesIO(base64.b64decode(contenido.split(',', 1)[1]))).convert("L")
+        except Exception:
+            im = None
+    elif qr_render.disponible() and not contenido.startswith('data:'):
+        im = Image.open(BytesIO(qr_render.qr_png(contenido, 4, 1))).convert("L")
+    if im is None:
+        return None
+    return im.resize((lado, lado), Image.NEAREST)
+
+
+class _Lienzo:
+    """Lista de operaciones de dibujo; la altura final se conoce al terminar el layout."""
+
+    def __init__(self):
+        self.ops: List[tuple] = []
+        self.y = MARGEN_PX
+        self._medidor = ImageDraw.Draw(Image.new("L", (1, 1)))
+
+    def texto(self, texto: str, tam: int = 16, negrita: bool = False, centrado: bool = False, derecha: bool = False):
+        fuente = _fuente(tam, negrita)
+        for linea in self._cortar(str(texto), fuente):
+            ancho = self._medidor.textlength(linea, font=fuente)
+            x = MARGEN_PX
+            if centrado:
+                x = (ANCHO_PX - ancho) / 2
+            elif derecha:
+                x = ANCHO_PX - MARGEN_PX - ancho
+            self.ops.append(("t", (x, self.y), linea, fuente))
+            self.y += int(tam * 1.3)
+
+    def _cortar(self, texto: str, fuente) -> List[str]:
+        """Corte por palabras midiendo el ancho real (las palabras más largas que el ticket se parten)."""
+        util = ANCHO_PX - 2 * MARGEN_PX
+        medir = lambda t: self._medidor.textlength(t, font=fuente)
+        lineas: List[str] = []
+        actual = ''
+        for palabra in texto.split():
+            candidata = f"{actual} {palabra}" if actual else palabra
+            if medir(candidata) <= util:
+                actual = candidata
+                continue
+            if actual:
+                lineas.append(actual)
+            while medir(palabra) > util:
+                corte = len(palabra) - 1
+                while corte > 1 and medir(palabra[:corte]) > util:
+                    corte -= 1
+                lineas.append(palabra[:corte])
+                palabra = palabra[corte:]
+            actual = palabra
+        lineas.append(actual)
+        return lineas
+
+    def columnas(self, izq: str, der: str, tam: int = 14, negrita: bool = False):
+        fuente = _fuente(tam, negrita)
+        ancho_der = self._medidor.textlength(der, font=fuente)
+        self.ops.append(("t", (MARGEN_PX, self.y), izq, fuente))
+        self.ops.append(("t", (ANCHO_PX - MARGEN_PX - ancho_der, self.y), der, fuente))
+        self.y += int(tam * 1.3)
+
+    def separador(self):
+        self.y += 4
+        self.ops.append(("l", [(MARGEN_PX, self.y), (ANCHO_PX - MARGEN_PX, self.y)]))
+        self.y += 6
+
+    def imagen(self, im):
+        self.ops.append(("i", im, ((ANCHO_PX - im.width) // 2, self.y)))
+        self.y += im.height + 6
+
+    def espacio(self, px: int):
+        self.y += px
+
+    def dibujar(self):
+        im = Image.new("L", (ANCHO_PX, self.y + MARGEN_PX), 255)
+        d = ImageDraw.Draw(im)
+        for op in self.ops:
+            if op[0] == "t":
+                d.text(op[1], op[2], font=op[3], fill=0)
+            elif op[0] == "l":
+                d.line(op[1], fill=0, width=1)
+            else:
+                im.paste(op[1], op[2])
+        return im
+
+
+def _codificar(im, formato: str) -> bytes:
+    out = BytesIO()
+    if formato.lower() == 'png':
+        im.save(out, format='PNG', optimize=False)
+    else:
+        im.convert('RGB').save(out, format='JPEG', quality=90, optimize=True)
+    return out.getvalue()
+
+
+def render_ticket_raster(datos: Dict[str, Any], formato: str = 'jpg') -> bytes:
+    """Dibuja el ticket directo con Pillow (mismo contenido que TICKET_HTML, sin layout CSS)."""
+    if Image is None:
+        raise RuntimeError('Pillow no disponible en el entorno')
+    c = _Lienzo()
+    logo = _logo(TICKET_LOGO_PATH)
+    if logo is not None:
+        c.imagen(logo)
+    if datos.get("emisor_razon"):
+        c.texto(datos["emisor_razon"], 18, negrita=True, centrado=True)
+    c.texto(" · ".join(x for x in (f"CUIT: {datos.get('emisor_cuit') or ''}", datos.get('emisor_iva')) if x), 14, centrado=True)
+    if datos.get("emisor_domicilio"):
+        c.texto(datos["emisor_domicilio"], 14, centrado=True)
+    c.separador()
+    c.texto(datos.get("tipo_label") or '', 22, negrita=True, centrado=True)
+    if datos.get("encabezado"):
+        c.texto(datos["encabezado"], 14, centrado=True)
+    c.texto(f"Fecha: {datos.get('fecha') or ''}", 14, centrado=True)
+    c.separador()
+
+    if datos.get("consumidor_final"):
+        c.texto("Cliente Final", 15, negrita=True)
+    else:
+        c.texto(f"Receptor: {datos.get('receptor_nombre') or ''}", 15, negrita=True)
+        c.texto(f"Doc: {datos.get('receptor_doc') or ''} · Cond. IVA: {datos.get('receptor_iva') or ''}", 13)
+
+    if datos.get("items"):
+        c.espacio(4)
+        for it in datos["items"]:
+            c.texto(it['descripcion'], 14)
+            c.columnas(f"{it['cantidad']} x {it['precio']}", str(it['subtotal']), 14)
+    elif datos.get("detalle_text"):
+        c.espacio(4)
+        c.texto(datos["detalle_text"], 14)
+
+    c.separador()
+    c.columnas("TOTAL", f"$ {datos.get('total') or ''}", 20, negrita=True)
+    cae = f"CAE: {datos.get('cae') or ''}"
+    if datos.get("cae_vto"):
+        cae += f" (Vto: {datos['cae_vto']})"
+    c.texto(cae, 14)
+    c.texto(f"CUIT Emisor: {datos.get('emisor_cuit') or ''}", 14)
+
+    if datos.get("qr"):
+        qr = _imagen_qr(str(datos["qr"]), 200)
+        if qr is not None:
+            c.espacio(6)
+            c.imagen(qr)
+            c.texto("Verificá en QR.AFIP.GOB.AR", 12, centrado=True)
+
+    if datos.get("mismatch"):
+        c.espacio(4)
+        c.texto(f"Advertencia: {datos['mismatch']}", 13, negrita=True)
+    c.espacio(4)
+    for leyenda in datos.get("leyendas") or []:
+        c.texto(leyenda, 13, centrado=True)
+    return _codificar(c.dibujar(), formato)
+
+
+def render_ticket(datos: Dict[str, Any], formato: str = 'jpg') -> bytes:
+    """Imagen del ticket con el motor configurado; WeasyPrint si el raster no está disponible o falla."""
+    if TICKET_RENDER_ENGINE != "weasyprint" and Image is not None:
+        try:
+            return render_ticket_raster(datos, formato)
+        except Exception as e:
+            if HTML is None:
+                raise
+            logger.warning(f"[TICKET] Render raster falló, usando WeasyPrint: {e}")
+    return render_ticket_image(html_ticket(datos), formato)
+
+
+def motor_activo() -> str:
+    return "raster" if TICKET_RENDER_ENGINE != "weasyprint" and Image is not None else "weasyprint"
+
+
+# ===================== Pool de procesos =====================
+
+def get_pool_render() -> ProcessPoolExecutor:
+    """Pool de procesos compartido (spawn: los hijos no heredan hilos ni conexiones de la app)."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, TICKET_RENDER_PROCESOS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def detener_pool_render() -> None:
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
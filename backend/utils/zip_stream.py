@@ -0,0 +1,31 @@
+"""
+Destino no seekable para zipfile: permite transmitir un ZIP por partes (StreamingResponse).
+
+zipfile detecta que no puede hacer seek y escribe cada entrada con data descriptor, así que el
+generador puede entregar los bytes de cada entrada apenas se agregan (ver `vaciar`).
+"""
+from typing import List
+
+
+class ZipStream:
+    """Guarda lo que escribe zipfile hasta que el generador lo entrega."""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+        self._pos = 0
+
+    def write(self, datos) -> int:
+        self._partes.append(bytes(datos))
+        self._pos += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
@@ -40,5 +40,19 @@ export STRICT_AFIP_CREDENTIALS=0
 HOST="${BACKEND_HOST:-127.0.0.1}"
 PORT="${BACKEND_PORT:-8012}"
 
+# Procesos de uvicorn (WEB_CONCURRENCY; por defecto 1). Con más de uno, los leases y las
+# invalidaciones de caché van por MySQL (COORDINACION_BACKEND=bd, utils/coordinacion.py) y los
+# pools son por worker: MySQL debe aceptar WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+WORKERS="${WEB_CONCURRENCY:-1}"
+export WEB_CONCURRENCY="$WORKERS"
+
+if [ "$WORKERS" -gt 1 ]; then
+  if [ "${COORDINACION_BACKEND:-bd}" = "local" ]; then
+    echo "[BACKEND] WEB_CONCURRENCY=$WORKERS requiere COORDINACION_BACKEND=bd"; exit 1
+  fi
+  echo "[BACKEND] Iniciando uvicorn en $HOST:$PORT con $WORKERS workers"
+  exec "$VENV_DIR/bin/python" -u -m uvicorn backend.main:app --host "$HOST" --port "$PORT" --workers "$WORKERS"
+fi
+
 echo "[BACKEND] Iniciando uvicorn en $HOST:$PORT"
 exec "$VENV_DIR/bin/python" -u -m uvicorn backend.main:app --host "$HOST" --port "$PORT"